@@ -23,4 +23,9 @@ if __name__ == "__main__":
         port = int(os.environ.get("PORT", "5000"))
     except Exception:
         port = 5000
+    # No separate worker under the dev server: run queued jobs on a thread instead
+    # (only in the reloader child, so jobs are not picked up twice).
+    if _env_flag("CMS_JOBS_WORKER", default=True) and (not DEBUG_ENABLED or os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
+        from cms_app.jobs.services import start_worker_thread
+        start_worker_thread(app)
     app.run(host="127.0.0.1", port=port, debug=DEBUG_ENABLED, use_reloader=DEBUG_ENABLED)
@@ -3,6 +3,7 @@ import secrets
 import time
 import uuid
 import sqlite3
+import click
 from flask import Flask, session, request, url_for, flash, redirect, current_app, render_template, g, has_request_context
 from flask_login import LoginManager, current_user
 from flask_sqlalchemy import SQLAlchemy
@@ -12,7 +13,6 @@ from sqlalchemy import inspect
 from sqlalchemy import select, or_
 from werkzeug.exceptions import RequestEntityTooLarge
 from functools import wraps
-from flask_migrate import Migrate
 from datetime import timedelta
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -23,7 +23,6 @@ from flask_limiter.errors import RateLimitExceeded
 # Global extensions
 db = SQLAlchemy()
 login_manager = LoginManager()
-migrate = Migrate()
 def _rate_key():
     try:
         ip = (request.headers.get("X-Forwarded-For") or request.remote_addr or "local")
@@ -42,6 +41,8 @@ _sql_query_metrics_registered = False
 
 def create_app():
     app = Flask(__name__)
+    from .routing import url_rule_class
+    app.url_rule_class = url_rule_class
     app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret-key")
     debug_flag = (os.environ.get("FLASK_DEBUG") or "").strip().lower() in {"1", "true", "yes", "on"}
     try:
@@ -77,6 +78,13 @@ def create_app():
     app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_CONTENT_LENGTH", str(32 * 1024 * 1024)))
     # CSRF token TTL (seconds)
     app.config["CSRF_TOKEN_TTL"] = int(os.environ.get("CSRF_TOKEN_TTL", "7200"))
+    # Background jobs (see cms_app/jobs): worker poll interval, stale-run cutoff and artifact lifetime (seconds)
+    app.config["JOBS_POLL_INTERVAL"] = float(os.environ.get("CMS_JOBS_POLL_INTERVAL", "2"))
+    app.config["JOBS_STALE_AFTER"] = int(os.environ.get("CMS_JOBS_STALE_AFTER", str(30 * 60)))
+    app.config["JOBS_ARTIFACT_TTL"] = int(os.environ.get("CMS_JOBS_ARTIFACT_TTL", str(24 * 3600)))
+    app.config["JOBS_ARTIFACT_DIR"] = os.environ.get("CMS_JOBS_ARTIFACT_DIR") or os.path.join(app.instance_path, "job_artifacts")
+    # Student list: seconds a filtered total count may be reused across page loads
+    app.config["STUDENTS_COUNT_CACHE_TTL"] = int(os.environ.get("CMS_STUDENTS_COUNT_CACHE_TTL", "60"))
     # UI hints toggle: set INFO_HINTS_ENABLED=false to hide soft guidance text globally
     app.config["INFO_HINTS_ENABLED"] = (os.environ.get("INFO_HINTS_ENABLED", "false").lower() == "true")
 
@@ -88,6 +96,26 @@ def create_app():
     app.config["MAIL_FROM"] = os.environ.get("MAIL_FROM", os.environ.get("MAIL_USER", "noreply@example.com"))
     app.config["MAIL_USE_TLS"] = (os.environ.get("MAIL_USE_TLS", "true").lower() == "true")
     app.config["MAIL_USE_SSL"] = (os.environ.get("MAIL_USE_SSL", "false").lower() == "true")
+    # Outbound mail is queued in email_outbox and sent by the job worker over pooled connections
+    app.config["MAIL_POOL_SIZE"] = int(os.environ.get("MAIL_POOL_SIZE", "2"))
+    app.config["MAIL_POOL_IDLE_TIMEOUT"] = int(os.environ.get("MAIL_POOL_IDLE_TIMEOUT", "60"))
+    app.config["MAIL_TIMEOUT"] = float(os.environ.get("MAIL_TIMEOUT", "20"))
+    app.config["MAIL_BATCH_SIZE"] = int(os.environ.get("MAIL_BATCH_SIZE", "50"))
+    app.config["MAIL_RATE_PER_SECOND"] = float(os.environ.get("MAIL_RATE_PER_SECOND", "5"))
+    app.config["MAIL_MAX_ATTEMPTS"] = int(os.environ.get("MAIL_MAX_ATTEMPTS", "5"))
+    # Seconds a queued message is still worth sending, per category; older ones are dropped unsent
+    app.config["MAIL_MAX_AGE"] = {"password_2fa": int(os.environ.get("MAIL_OTP_MAX_AGE", "600"))}
+    # Inbox badge: seconds a per-user unread counter lives before it is recounted (see inbox_counters)
+    app.config["INBOX_COUNTER_TTL"] = int(os.environ.get("CMS_INBOX_COUNTER_TTL", "3600"))
+    # Request scope: seconds a trust's program/division id lists are shared across requests (see scope)
+    app.config["SCOPE_CACHE_TTL"] = int(os.environ.get("CMS_SCOPE_CACHE_TTL", "60"))
+    # Report results: upper bound on how long a tagged result lives; writes invalidate it sooner (see result_cache)
+    app.config["RESULT_CACHE_TTL"] = int(os.environ.get("CMS_RESULT_CACHE_TTL", "600"))
+    # N+1 detection: statement shapes repeated more often than this in one request are flagged (see query_budget)
+    app.config["QUERY_REPEAT_THRESHOLD"] = int(os.environ.get("CMS_QUERY_REPEAT_THRESHOLD", "10"))
+    # What a view's @query_budget does when exceeded: "log", "raise" (tests, staging) or "off"
+    app.config["QUERY_BUDGET_MODE"] = os.environ.get("CMS_QUERY_BUDGET", "log")
+    app.config["QUERY_HOTSPOTS_MAX"] = int(os.environ.get("CMS_QUERY_HOTSPOTS_MAX", "200"))
 
     # Database configuration: use DATABASE_URL if provided, else sqlite file
     database_url = os.environ.get("DATABASE_URL")
@@ -176,12 +204,25 @@ def create_app():
                 g._db_time_ms = float(getattr(g, "_db_time_ms", 0.0) or 0.0) + float(elapsed_ms)
             except Exception:
                 pass
+            try:
+                from .index_advisor import record_statement
+                record_statement(statement, parameters, elapsed_ms, executemany)
+            except Exception:
+                pass
+            try:
+                from .query_budget import record_statement as record_shape
+                record_shape(statement, executemany)
+            except Exception:
+                pass
 
         _sql_query_metrics_registered = True
 
     app.config.setdefault("RATELIMIT_STORAGE_URI", "memory://")
     db.init_app(app)
-    migrate.init_app(app, db)
+    # Flask-Migrate brings in alembic, mako and pygments; only the `flask db` commands need it
+    if click.get_current_context(silent=True) is not None or os.environ.get("CMS_INIT_MIGRATE"):
+        from flask_migrate import Migrate
+        Migrate(app, db)
     try:
         limiter.init_app(app)
     except Exception:
@@ -193,12 +234,28 @@ def create_app():
             cache.app = app
     except Exception:
         pass
+    from . import program_mediums
+    program_mediums.init_app(app)
+    from . import downloads
+    downloads.init_app(app)
+    from . import layout_cache
+    layout_cache.init_app(app)
+    from . import metrics
+    metrics.init_app(app)
+    from . import query_budget
+    from . import request_profiler
+    request_profiler.init_app(app)
     # Auth: Flask-Login
     login_manager.init_app(app)
     login_manager.login_view = "main.login"
 
     # Import models so they are registered with SQLAlchemy
     from . import models  # noqa: F401
+    from . import student_search  # noqa: F401  (registers the search index DDL hooks)
+    from . import announcement_inbox  # noqa: F401  (registers the inbox fan-out hooks)
+    from . import inbox_counters  # noqa: F401  (registers the unread-counter hooks)
+    from . import scope  # noqa: F401  (registers the scope invalidation hooks)
+    from . import result_cache  # noqa: F401  (registers the result cache invalidation hooks)
 
     @app.before_request
     def _request_perf_start():
@@ -206,6 +263,13 @@ def create_app():
             g._req_start = time.perf_counter()
             g._db_queries = 0
             g._db_time_ms = 0.0
+            g._slow_statements = []
+            g._query_shapes = {}
+            g._query_sites = {}
+        except Exception:
+            pass
+        try:
+            request_profiler.start_request(app)
         except Exception:
             pass
 
@@ -242,6 +306,20 @@ def create_app():
             response.headers.setdefault("X-DB-Queries", str(q))
         except Exception:
             pass
+        try:
+            metrics.observe_request(request.endpoint, request.method, getattr(response, "status_code", None), total_ms, q, db_ms)
+        except Exception:
+            pass
+        try:
+            request_profiler.finish_request(app, request.endpoint, total_ms, threshold_ms)
+        except Exception:
+            pass
+        try:
+            query_budget.finish_request(app, response)
+        except query_budget.QueryBudgetExceeded:
+            raise
+        except Exception:
+            pass
         if total_ms < float(threshold_ms):
             return response
         try:
@@ -257,6 +335,20 @@ def create_app():
             )
         except Exception:
             pass
+        try:
+            from .index_advisor import record_slow_request
+            record_slow_request(
+                app,
+                request.method,
+                request.path,
+                request.endpoint,
+                getattr(response, "status_code", None),
+                total_ms,
+                db_ms,
+                q,
+            )
+        except Exception:
+            pass
         return response
 
     @app.after_request
@@ -303,20 +395,6 @@ def create_app():
         except Exception:
             return ""
 
-    def _cached_value(key, loader, timeout=60):
-        try:
-            cached = cache.get(key)
-        except Exception:
-            cached = None
-        if cached is not None:
-            return cached
-        value = loader()
-        try:
-            cache.set(key, value, timeout=timeout)
-        except Exception:
-            pass
-        return value
-
     def _maintenance_mode_enabled():
         from .models import SystemConfig
 
@@ -327,7 +405,7 @@ def create_app():
             except Exception:
                 return 0
 
-        return bool(_cached_value("__maintenance_mode__", _load, timeout=15))
+        return bool(layout_cache.cached("maintenance", "enabled", _load, timeout=15))
 
     def _trust_access_snapshot(trust_id):
         try:
@@ -351,7 +429,7 @@ def create_app():
             except Exception:
                 return {}
 
-        return _cached_value(f"trust_access_{trust_id}", _load, timeout=30)
+        return layout_cache.cached("trust_access", trust_id, _load, timeout=30)
 
     def _program_theme_context(program_id):
         try:
@@ -373,7 +451,7 @@ def create_app():
             except Exception:
                 return {}
 
-        return _cached_value(f"ui_program_theme_{program_id}", _load, timeout=300)
+        return layout_cache.cached("program_theme", program_id, _load, timeout=300)
 
     def _user_identity_context(user_id, role, fallback_username):
         try:
@@ -416,7 +494,7 @@ def create_app():
             }
 
         if role_key in {"faculty", "student"} and user_id:
-            return _cached_value(f"user_identity_{role_key}_{user_id}", _load, timeout=120)
+            return layout_cache.cached("user_identity", f"{role_key}_{user_id}", _load, timeout=120)
         return _load()
 
     def _active_system_messages_context(role, effective_trust_id, is_super_admin):
@@ -427,7 +505,7 @@ def create_app():
                 trust_key = int(effective_trust_id)
             except Exception:
                 trust_key = "global"
-        cache_key = f"layout_system_messages_{'super' if is_super_admin else role_key}_{trust_key}"
+        cache_key = f"{'super' if is_super_admin else role_key}_{trust_key}"
 
         def _load():
             from datetime import datetime, timezone
@@ -473,7 +551,7 @@ def create_app():
                 for row in rows
             ]
 
-        return _cached_value(cache_key, _load, timeout=30)
+        return layout_cache.cached("system_messages", cache_key, _load, timeout=30)
 
     def _cache_backend_status():
         if app.config.get("CACHE_TYPE") != "RedisCache":
@@ -721,13 +799,17 @@ def create_app():
         def _fetch_trust_row(trust_id):
             if not trust_id:
                 return None
-            row = db.session.execute(
-                select(
-                    Trust.trust_id.label("trust_id"),
-                    Trust.trust_name.label("trust_name"),
-                ).where(Trust.trust_id == trust_id)
-            ).mappings().first()
-            return dict(row) if row else None
+
+            def _load():
+                row = db.session.execute(
+                    select(
+                        Trust.trust_id.label("trust_id"),
+                        Trust.trust_name.label("trust_name"),
+                    ).where(Trust.trust_id == trust_id)
+                ).mappings().first()
+                return dict(row) if row else None
+
+            return layout_cache.cached("trusts", f"row_{trust_id}", _load, timeout=300)
 
         def _fetch_institute_row(institute_id):
             if not institute_id:
@@ -758,15 +840,18 @@ def create_app():
             ]
 
         def _list_trust_rows():
-            return [
-                dict(row)
-                for row in db.session.execute(
-                    select(
-                        Trust.trust_id.label("trust_id"),
-                        Trust.trust_name.label("trust_name"),
-                    ).order_by(Trust.trust_name.asc())
-                ).mappings().all()
-            ]
+            def _load():
+                return [
+                    dict(row)
+                    for row in db.session.execute(
+                        select(
+                            Trust.trust_id.label("trust_id"),
+                            Trust.trust_name.label("trust_name"),
+                        ).order_by(Trust.trust_name.asc())
+                    ).mappings().all()
+                ]
+
+            return layout_cache.cached("trusts", "all", _load, timeout=300)
 
         active_trust_id = session.get("active_trust_id")
         active_trust_obj = None
@@ -1024,6 +1109,9 @@ def create_app():
     from .super_admin import super_admin as super_admin_bp
     app.register_blueprint(super_admin_bp, url_prefix="/super-admin")
 
+    from .jobs import jobs_bp
+    app.register_blueprint(jobs_bp)
+
     @app.errorhandler(RequestEntityTooLarge)
     def handle_large_upload(e):
         try:
@@ -1275,9 +1363,56 @@ def create_app():
                         """
                     )
 
+            # 14. Secondary indexes declared on models (create_all skips existing tables)
+            for table in db.metadata.sorted_tables:
+                for index in table.indexes:
+                    try:
+                        index.create(bind=db.engine, checkfirst=True)
+                    except Exception:
+                        pass
+
+            # 15. Backfill attendance rollups once (tables are new and empty)
+            try:
+                from .models import Attendance, AttendanceSessionRollup
+                has_rollups = db.session.execute(select(AttendanceSessionRollup.session_id).limit(1)).first()
+                has_attendance = db.session.execute(select(Attendance.attendance_id).limit(1)).first()
+                if has_attendance and not has_rollups:
+                    from .attendance_rollups import rebuild
+                    rebuild()
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+
+            # 16. Backfill student fee balances once (table is new and empty)
+            try:
+                from .models import FeePayment, StudentFeeBalance
+                has_balances = db.session.execute(select(StudentFeeBalance.balance_id).limit(1)).first()
+                has_payments = db.session.execute(select(FeePayment.payment_id).limit(1)).first()
+                if has_payments and not has_balances:
+                    from .fee_balances import rebuild as rebuild_fee_balances
+                    rebuild_fee_balances()
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+
+            # 17. Backfill announcement inboxes once (table is new and empty)
+            try:
+                from .models import Announcement, AnnouncementInbox
+                has_inbox = db.session.execute(select(AnnouncementInbox.inbox_id).limit(1)).first()
+                has_announcements = db.session.execute(select(Announcement.announcement_id).limit(1)).first()
+                if has_announcements and not has_inbox:
+                    from .announcement_inbox import rebuild as rebuild_announcement_inbox
+                    rebuild_announcement_inbox()
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+
         except Exception:
             # Best-effort; skip if migration fails
             pass
+        # Columns may have been added above; drop any reflections taken before the sync.
+        from . import schema_registry
+        schema_registry.invalidate(engine=db.engine)
 
     return app
 
@@ -0,0 +1,314 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, delete, event, exists, func, insert, inspect, or_, select, update
+
+from . import db
+from .jobs.services import periodic_task
+from .models import (
+    Announcement,
+    AnnouncementAudience,
+    AnnouncementDismissal,
+    AnnouncementInbox,
+    AnnouncementRecipient,
+    Student,
+    User,
+)
+
+
+# Fan-out-on-write inbox for announcements. Who an announcement is addressed to
+# (trust, program, audience roles, personal recipients) is resolved once, when
+# it is created, edited or restored, into announcement_inbox rows; the inbox,
+# badge, dashboard and notice board then read a user's rows with one indexed
+# join instead of loading recent announcements and filtering them per request.
+# Activity and the display window are still checked at read time, so expiring
+# or deactivating an announcement needs no upkeep.
+#
+# Users whose role, program or trust changes, or whose student record gets
+# linked, are re-resolved from mapper events; bulk account creation calls
+# refresh_users(); a periodic sweep re-resolves active announcements as a
+# safety net. Read state mirrors announcement_dismissals, which stays the
+# durable record of "read/dismissed" used to seed re-resolved rows. Fan-out
+# and read changes also report exact deltas to the badge's unread counters
+# (see inbox_counters).
+
+# Roles that see every program's announcements of their trust
+ALL_PROGRAM_ROLES = ("admin", "clerk")
+# Roles that see personal (recipient-targeted) announcements addressed to students
+RECIPIENT_STAFF_ROLES = ("principal", "clerk")
+
+# Announcements show from 12h before start_at until 12h after end_at
+WINDOW_SLACK = timedelta(hours=12)
+
+
+def _role():
+    return func.lower(func.trim(func.coalesce(User.role, "")))
+
+
+def _addressed():
+    """SQL condition: ``Announcement`` is addressed to ``User`` (both correlated)."""
+    role = _role()
+    aid = Announcement.announcement_id
+    has_recipients = exists().where(AnnouncementRecipient.announcement_id_fk == aid)
+    is_recipient = exists().where(
+        AnnouncementRecipient.announcement_id_fk == aid,
+        AnnouncementRecipient.student_id_fk == Student.enrollment_no,
+        Student.user_id_fk == User.user_id,
+    )
+    has_audience = exists().where(AnnouncementAudience.announcement_id_fk == aid)
+    in_audience = exists().where(AnnouncementAudience.announcement_id_fk == aid, func.lower(AnnouncementAudience.role) == role)
+    return and_(
+        or_(
+            User.is_super_admin == True,
+            Announcement.trust_id_fk == User.trust_id_fk,
+            and_(Announcement.trust_id_fk.is_(None), User.trust_id_fk.is_(None)),
+        ),
+        or_(role.in_(ALL_PROGRAM_ROLES), Announcement.program_id_fk.is_(None), Announcement.program_id_fk == User.program_id_fk),
+        or_(
+            and_(has_recipients, or_(role.in_(RECIPIENT_STAFF_ROLES), and_(role == "student", is_recipient))),
+            and_(~has_recipients, or_(~has_audience, in_audience)),
+        ),
+    )
+
+
+def _sync(bind, announcement_ids=None, user_ids=None, prune=True):
+    """Re-resolve inbox rows for the given announcements and/or users (None = all).
+
+    With ``prune=False`` rows are only added, never removed.
+    """
+    I = AnnouncementInbox
+    scope_i, scope_pairs = [], []
+    if announcement_ids is not None:
+        scope_i.append(I.announcement_id_fk.in_(announcement_ids))
+        scope_pairs.append(Announcement.announcement_id.in_(announcement_ids))
+    if user_ids is not None:
+        scope_i.append(I.user_id_fk.in_(user_ids))
+        scope_pairs.append(User.user_id.in_(user_ids))
+
+    still_addressed = exists(
+        select(Announcement.announcement_id).where(
+            Announcement.announcement_id == I.announcement_id_fk,
+            User.user_id == I.user_id_fk,
+            _addressed(),
+        )
+    )
+    if prune:
+        bind.execute(delete(I).where(*scope_i, ~still_addressed).execution_options(synchronize_session=False))
+
+    dismissed = exists().where(
+        AnnouncementDismissal.announcement_id_fk == Announcement.announcement_id,
+        AnnouncementDismissal.user_id_fk == User.user_id,
+    )
+    missing = select(
+        Announcement.announcement_id,
+        User.user_id,
+        case((dismissed, True), else_=False),
+    ).where(
+        *scope_pairs,
+        _addressed(),
+        ~exists().where(I.announcement_id_fk == Announcement.announcement_id, I.user_id_fk == User.user_id),
+    )
+    result = bind.execute(insert(I).from_select(["announcement_id_fk", "user_id_fk", "is_read"], missing))
+    return result.rowcount or 0
+
+
+def _adjust_counters(user_ids, delta):
+    # Imported late: inbox_counters builds on this module
+    from .inbox_counters import adjust
+
+    adjust(user_ids, delta)
+
+
+def _is_current(announcement_id):
+    q = select(Announcement.announcement_id).where(Announcement.announcement_id == announcement_id)
+    return db.session.execute(_in_window(q, datetime.now())).first() is not None
+
+
+def _unread_users(announcement_id):
+    I = AnnouncementInbox
+    q = select(I.user_id_fk).where(I.announcement_id_fk == announcement_id, I.is_read == False)
+    return set(db.session.execute(q).scalars())
+
+
+def fan_out(announcement_id):
+    """Resolve an announcement's audience into inbox rows; the caller commits."""
+    db.session.flush()
+    if not _is_current(announcement_id):
+        return _sync(db.session, announcement_ids=[announcement_id])
+    before = _unread_users(announcement_id)
+    added = _sync(db.session, announcement_ids=[announcement_id])
+    after = _unread_users(announcement_id)
+    _adjust_counters(after - before, 1)
+    _adjust_counters(before - after, -1)
+    return added
+
+
+def refresh_users(user_ids, prune=True):
+    """Re-resolve every announcement for the given users; the caller commits."""
+    user_ids = sorted({int(u) for u in (user_ids or []) if u})
+    added = 0
+    for i in range(0, len(user_ids), 500):
+        added += _sync(db.session, user_ids=user_ids[i : i + 500], prune=prune)
+    return added
+
+
+def rebuild(active_only=False):
+    """Re-resolve all announcements (or only active ones); the caller commits."""
+    ids = None
+    if active_only:
+        ids = select(Announcement.announcement_id).where(Announcement.is_active == True)
+    return _sync(db.session, announcement_ids=ids)
+
+
+@periodic_task("announcement_inbox", 60 * 60)
+def _reconcile_active():
+    rebuild(active_only=True)
+    db.session.commit()
+
+
+def _watch(attrs):
+    def _changed(target):
+        state = inspect(target)
+        return any(state.attrs[a].history.has_changes() for a in attrs)
+    return _changed
+
+
+_user_changed = _watch(("role", "program_id_fk", "trust_id_fk", "is_super_admin"))
+_student_changed = _watch(("user_id_fk",))
+
+
+@event.listens_for(User, "after_insert")
+def _user_inserted(mapper, connection, target):
+    _sync(connection, user_ids=[target.user_id])
+
+
+@event.listens_for(User, "after_update")
+def _user_updated(mapper, connection, target):
+    if _user_changed(target):
+        _sync(connection, user_ids=[target.user_id])
+
+
+@event.listens_for(Student, "after_insert")
+@event.listens_for(Student, "after_update")
+def _student_written(mapper, connection, target):
+    if not _student_changed(target):
+        return
+    history = inspect(target).attrs.user_id_fk.history
+    user_ids = [u for u in list(history.added or ()) + list(history.deleted or ()) if u]
+    if user_ids:
+        _sync(connection, user_ids=user_ids)
+
+
+def _in_window(q, now):
+    return q.where(
+        Announcement.is_active == True,
+        or_(Announcement.start_at.is_(None), Announcement.start_at <= now + WINDOW_SLACK),
+        or_(Announcement.end_at.is_(None), Announcement.end_at >= now - WINDOW_SLACK),
+    )
+
+
+def _trust_scope(q, trust_id):
+    if trust_id:
+        return q.where(Announcement.trust_id_fk == trust_id)
+    return q.where(Announcement.trust_id_fk.is_(None))
+
+
+def user_announcements(user_id, trust_id=None, now=None, unread_only=False, current_only=True):
+    """``select(Announcement, is_read)`` for the announcements addressed to a user.
+
+    ``trust_id`` is the trust being viewed (a super admin's active trust);
+    ``current_only`` keeps active announcements inside their display window.
+    """
+    I = AnnouncementInbox
+    q = select(Announcement, I.is_read).join(
+        I, and_(I.announcement_id_fk == Announcement.announcement_id, I.user_id_fk == user_id)
+    )
+    q = _trust_scope(q, trust_id)
+    if current_only:
+        q = _in_window(q, now or datetime.now())
+    if unread_only:
+        q = q.where(I.is_read == False)
+    return q
+
+
+def public_announcements(now=None, current_only=True):
+    """Announcements for anonymous visitors: global, untargeted and not program-specific."""
+    q = select(Announcement).where(
+        Announcement.trust_id_fk.is_(None),
+        Announcement.program_id_fk.is_(None),
+        ~exists().where(AnnouncementAudience.announcement_id_fk == Announcement.announcement_id),
+        ~exists().where(AnnouncementRecipient.announcement_id_fk == Announcement.announcement_id),
+    )
+    if current_only:
+        q = _in_window(q, now or datetime.now())
+    return q
+
+
+def unread_count(user_id, trust_id=None, now=None):
+    I = AnnouncementInbox
+    q = select(func.count()).select_from(I).join(Announcement, Announcement.announcement_id == I.announcement_id_fk)
+    q = q.where(I.user_id_fk == user_id, I.is_read == False)
+    q = _in_window(_trust_scope(q, trust_id), now or datetime.now())
+    return int(db.session.scalar(q) or 0)
+
+
+def set_read(user_id, announcement_ids, read=True):
+    """Mark announcements read (dismissed) or unread for a user; the caller commits."""
+    announcement_ids = sorted({int(a) for a in (announcement_ids or [])})
+    if not user_id or not announcement_ids:
+        return
+    I = AnnouncementInbox
+    flipped = db.session.execute(
+        _in_window(
+            select(I.announcement_id_fk)
+            .join(Announcement, Announcement.announcement_id == I.announcement_id_fk)
+            .where(I.user_id_fk == user_id, I.announcement_id_fk.in_(announcement_ids), I.is_read == (not read)),
+            datetime.now(),
+        )
+    ).scalars().all()
+    db.session.execute(
+        update(I)
+        .where(I.user_id_fk == user_id, I.announcement_id_fk.in_(announcement_ids))
+        .values(is_read=read, read_at=(datetime.now() if read else None))
+        .execution_options(synchronize_session=False)
+    )
+    if read:
+        have = set(
+            db.session.execute(
+                select(AnnouncementDismissal.announcement_id_fk).where(
+                    AnnouncementDismissal.user_id_fk == user_id,
+                    AnnouncementDismissal.announcement_id_fk.in_(announcement_ids),
+                )
+            ).scalars()
+        )
+        for aid in announcement_ids:
+            if aid not in have:
+                db.session.add(AnnouncementDismissal(announcement_id_fk=aid, user_id_fk=user_id))
+    else:
+        db.session.execute(
+            delete(AnnouncementDismissal)
+            .where(AnnouncementDismissal.user_id_fk == user_id, AnnouncementDismissal.announcement_id_fk.in_(announcement_ids))
+            .execution_options(synchronize_session=False)
+        )
+    if flipped:
+        _adjust_counters([user_id], -len(flipped) if read else len(flipped))
+
+
+def mark_all_read(user_id, trust_id=None, now=None):
+    """Mark every current unread announcement of a user read; the caller commits."""
+    q = user_announcements(user_id, trust_id, now, unread_only=True).with_only_columns(Announcement.announcement_id)
+    ids = db.session.execute(q).scalars().all()
+    set_read(user_id, ids, read=True)
+    return len(ids)
+
+
+def inbox_counts(user_id, trust_id=None, now=None):
+    """``(total, unread)`` current announcements for a user, in one query."""
+    I = AnnouncementInbox
+    q = (
+        select(func.count(), func.sum(case((I.is_read == False, 1), else_=0)))
+        .select_from(I)
+        .join(Announcement, Announcement.announcement_id == I.announcement_id_fk)
+        .where(I.user_id_fk == user_id)
+    )
+    total, unread = db.session.execute(_in_window(_trust_scope(q, trust_id), now or datetime.now())).first() or (0, 0)
+    return int(total or 0), int(unread or 0)
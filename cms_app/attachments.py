@@ -0,0 +1,204 @@
+import hashlib
+import mimetypes
+import os
+import tempfile
+
+from flask import current_app
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+from werkzeug.utils import secure_filename
+
+from . import db
+from .models import Attachment
+
+
+# Attachment manifest and content-addressed storage for announcement and
+# subject material uploads. Every upload gets an ``attachments`` row (name,
+# size, sha256, mime type, owner, uploader) written in the same transaction as
+# its owner, and the bytes are stored once per content hash under
+# static/cas/<aa>/<sha256>.<ext>, so the same PDF uploaded to several subjects
+# takes the space of one file. Listing attachments and enforcing the per-subject
+# storage quota are indexed queries on the manifest; nothing walks the upload
+# directories (which sit on slow network storage in production).
+#
+# Deleting a manifest row removes the blob after commit once no other row
+# references it. Files uploaded before the manifest existed stay where they are
+# and are registered by cms_app/scripts/backfill_attachments.py.
+
+CAS_DIR = "cas"
+_RELEASED = "attachments_released"
+_CHUNK = 1024 * 1024
+
+
+def _static_root():
+    return current_app.static_folder or os.path.join(current_app.root_path, "static")
+
+
+def _abs(storage_path):
+    return os.path.join(_static_root(), *storage_path.split("/"))
+
+
+def _extension(file_name):
+    ext = file_name.rsplit(".", 1)[-1].lower() if "." in file_name else ""
+    return ext if ext.isalnum() else ""
+
+
+def blob_path(sha256, ext=""):
+    """Storage path (relative to static) of the blob with this content hash."""
+    name = f"{sha256}.{ext}" if ext else sha256
+    return f"{CAS_DIR}/{sha256[:2]}/{name}"
+
+
+def _hash_file(path):
+    digest, size = hashlib.sha256(), 0
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(_CHUNK), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _write_blob(stream, ext):
+    """Copy ``stream`` into the store; returns ``(sha256, size, storage_path)``.
+
+    The upload is hashed while it is spooled to a temp file next to the store,
+    then moved into place, or dropped if a blob with that hash already exists.
+    """
+    tmp_dir = os.path.join(_static_root(), CAS_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest, size = hashlib.sha256(), 0
+    fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: stream.read(_CHUNK), b""):
+                digest.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+        sha = digest.hexdigest()
+        rel = blob_path(sha, ext)
+        dest = _abs(rel)
+        if os.path.exists(dest):
+            os.remove(tmp)
+        else:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(tmp, dest)
+        return sha, size, rel
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def store(file, owner_type, owner_id, subject_id=None, user_id=None):
+    """Save an uploaded ``FileStorage`` and add its manifest row; the caller commits.
+
+    Uploading a file with the same name to the same owner replaces the earlier one.
+    """
+    file_name = secure_filename(file.filename or "")
+    try:
+        file.stream.seek(0)
+    except Exception:
+        pass
+    sha, size, rel = _write_blob(file.stream, _extension(file_name))
+    row = Attachment(
+        owner_type=owner_type,
+        owner_id=owner_id,
+        subject_id_fk=subject_id,
+        file_name=file_name,
+        size_bytes=size,
+        sha256=sha,
+        mime_type=(mimetypes.guess_type(file_name)[0] or getattr(file, "mimetype", None)),
+        storage_path=rel,
+        uploaded_by_user_id_fk=user_id,
+    )
+    db.session.add(row)
+    replaced = db.session.execute(
+        select(Attachment).where(
+            Attachment.owner_type == owner_type,
+            Attachment.owner_id == owner_id,
+            Attachment.file_name == file_name,
+        )
+    ).scalars().all()
+    release([r for r in replaced if r is not row])
+    return row
+
+
+def register(storage_path, owner_type, owner_id, subject_id=None, user_id=None, file_name=None):
+    """Add a manifest row for a file already under static (left in place); the caller commits."""
+    sha, size = _hash_file(_abs(storage_path))
+    file_name = file_name or storage_path.rsplit("/", 1)[-1]
+    row = Attachment(
+        owner_type=owner_type,
+        owner_id=owner_id,
+        subject_id_fk=subject_id,
+        file_name=file_name,
+        size_bytes=size,
+        sha256=sha,
+        mime_type=mimetypes.guess_type(file_name)[0],
+        storage_path=storage_path,
+        uploaded_by_user_id_fk=user_id,
+    )
+    db.session.add(row)
+    return row
+
+
+def release(rows):
+    """Delete manifest rows; files no other row references are removed after commit."""
+    paths = set()
+    for row in rows:
+        paths.add(row.storage_path)
+        db.session.delete(row)
+    if not paths:
+        return
+    db.session.flush()
+    still_used = set(db.session.execute(select(Attachment.storage_path).where(Attachment.storage_path.in_(paths))).scalars())
+    db.session.info.setdefault(_RELEASED, set()).update(paths - still_used)
+
+
+def for_owners(owner_type, owner_ids):
+    """``{owner_id: [Attachment, ...]}`` (by file name) for many owners in one query."""
+    owner_ids = list({int(i) for i in owner_ids or ()})
+    grouped = {i: [] for i in owner_ids}
+    if not owner_ids:
+        return grouped
+    rows = db.session.execute(
+        select(Attachment)
+        .where(Attachment.owner_type == owner_type, Attachment.owner_id.in_(owner_ids))
+        .order_by(Attachment.owner_id, Attachment.file_name)
+    ).scalars()
+    for row in rows:
+        grouped[row.owner_id].append(row)
+    return grouped
+
+
+def find(owner_type, owner_id, file_name):
+    return db.session.execute(
+        select(Attachment).filter_by(owner_type=owner_type, owner_id=owner_id, file_name=file_name)
+    ).scalars().first()
+
+
+def subject_storage_bytes(subject_id):
+    """Bytes of material uploads charged to a subject (an index-only sum)."""
+    q = select(func.coalesce(func.sum(Attachment.size_bytes), 0)).where(Attachment.subject_id_fk == subject_id)
+    return int(db.session.scalar(q) or 0)
+
+
+def absolute_path(row):
+    return _abs(row.storage_path)
+
+
+@event.listens_for(Session, "after_commit")
+def _remove_released(session):
+    paths = session.info.pop(_RELEASED, None)
+    for rel in paths or ():
+        try:
+            os.remove(_abs(rel))
+        except Exception:
+            pass
+
+
+@event.listens_for(Session, "after_rollback")
+def _keep_released(session):
+    session.info.pop(_RELEASED, None)
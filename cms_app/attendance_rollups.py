@@ -0,0 +1,344 @@
+from datetime import date, timedelta
+
+from sqlalchemy import and_, case, delete, func, insert, literal, or_, select
+
+from . import db
+from .models import (
+    Attendance,
+    AttendanceSessionRollup,
+    AttendanceStudentRollup,
+    Institute,
+    Program,
+    Subject,
+)
+from .result_cache import invalidate as invalidate_results
+
+
+# Rollups are refreshed per key from the raw attendance rows rather than by
+# applying deltas, so re-marking a period (P -> A) or moving a student between
+# divisions can never leave the counters out of step with the source table.
+
+
+def academic_year_for(day):
+    """Academic year label (e.g. ``2025-26``) for a date; years start in June."""
+    start_year = day.year if day.month >= 6 else (day.year - 1)
+    return f"{start_year}-{str(start_year + 1)[-2:]}"
+
+
+def academic_year_bounds(academic_year):
+    start_year = int(str(academic_year).split("-", 1)[0])
+    return date(start_year, 6, 1), date(start_year + 1, 5, 31)
+
+
+def _status_sums():
+    status = func.upper(Attendance.status)
+    return (
+        func.sum(case((status == "P", 1), else_=0)).label("present"),
+        func.sum(case((status == "A", 1), else_=0)).label("absent"),
+        func.sum(case((status == "L", 1), else_=0)).label("late"),
+        func.count(Attendance.attendance_id).label("total"),
+    )
+
+
+class RollupTracker:
+    """Collects the session/student keys touched while writing attendance rows.
+
+    Call :meth:`add` for each ``Attendance`` row before and after changing it,
+    then :meth:`flush` inside the same transaction before committing.
+    """
+
+    def __init__(self):
+        self.session_keys = set()
+        self.student_keys = set()
+
+    def add(self, att):
+        if att is None or not att.date_marked or not att.subject_id_fk:
+            return
+        self.session_keys.add((att.date_marked, att.subject_id_fk))
+        if att.student_id_fk:
+            self.student_keys.add((att.student_id_fk, att.subject_id_fk, academic_year_for(att.date_marked)))
+
+    def flush(self):
+        db.session.flush()
+        refresh_sessions(self.session_keys)
+        refresh_students(self.student_keys)
+        self.session_keys = set()
+        self.student_keys = set()
+
+
+def refresh_sessions(keys):
+    """Recompute session rollups for the given ``(date, subject_id)`` pairs."""
+    keys = {(d, sid) for (d, sid) in (keys or []) if d and sid}
+    if not keys:
+        return 0
+    key_filter = or_(*[and_(Attendance.date_marked == d, Attendance.subject_id_fk == sid) for d, sid in keys])
+    rows = db.session.execute(
+        select(
+            Attendance.date_marked,
+            Attendance.subject_id_fk,
+            Attendance.division_id_fk,
+            Attendance.period_no,
+            func.max(Attendance.semester).label("semester"),
+            *_status_sums(),
+        )
+        .where(key_filter)
+        .group_by(Attendance.date_marked, Attendance.subject_id_fk, Attendance.division_id_fk, Attendance.period_no)
+    ).all()
+    db.session.execute(
+        delete(AttendanceSessionRollup)
+        .where(or_(*[
+            and_(AttendanceSessionRollup.date_marked == d, AttendanceSessionRollup.subject_id_fk == sid)
+            for d, sid in keys
+        ]))
+        .execution_options(synchronize_session=False)
+    )
+    if rows:
+        db.session.execute(
+            insert(AttendanceSessionRollup),
+            [
+                {
+                    "date_marked": r.date_marked,
+                    "subject_id_fk": r.subject_id_fk,
+                    "division_id_fk": r.division_id_fk,
+                    "period_no": r.period_no,
+                    "semester": r.semester,
+                    "present_count": int(r.present or 0),
+                    "absent_count": int(r.absent or 0),
+                    "late_count": int(r.late or 0),
+                    "total_count": int(r.total or 0),
+                }
+                for r in rows
+            ],
+        )
+    return len(rows)
+
+
+def refresh_students(keys):
+    """Recompute student counters for ``(student_id, subject_id, academic_year)`` keys."""
+    grouped = {}
+    for student_id, subject_id, academic_year in (keys or []):
+        if student_id and subject_id and academic_year:
+            grouped.setdefault((subject_id, academic_year), set()).add(student_id)
+    written = 0
+    for (subject_id, academic_year), student_ids in grouped.items():
+        start, end = academic_year_bounds(academic_year)
+        student_ids = sorted(student_ids)
+        rows = db.session.execute(
+            select(
+                Attendance.student_id_fk,
+                func.max(Attendance.date_marked).label("last_marked"),
+                *_status_sums(),
+            )
+            .where(
+                Attendance.subject_id_fk == subject_id,
+                Attendance.student_id_fk.in_(student_ids),
+                Attendance.date_marked >= start,
+                Attendance.date_marked <= end,
+            )
+            .group_by(Attendance.student_id_fk)
+        ).all()
+        db.session.execute(
+            delete(AttendanceStudentRollup)
+            .where(
+                AttendanceStudentRollup.subject_id_fk == subject_id,
+                AttendanceStudentRollup.academic_year == academic_year,
+                AttendanceStudentRollup.student_id_fk.in_(student_ids),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if rows:
+            db.session.execute(
+                insert(AttendanceStudentRollup),
+                [
+                    {
+                        "student_id_fk": r.student_id_fk,
+                        "subject_id_fk": subject_id,
+                        "academic_year": academic_year,
+                        "present_count": int(r.present or 0),
+                        "absent_count": int(r.absent or 0),
+                        "late_count": int(r.late or 0),
+                        "total_count": int(r.total or 0),
+                        "last_marked": r.last_marked,
+                    }
+                    for r in rows
+                ],
+            )
+        written += len(rows)
+    return written
+
+
+def delete_student_attendance(student_ids):
+    """Delete attendance for the given students and keep the rollups in step.
+
+    Returns the number of attendance rows deleted; the caller commits.
+    """
+    student_ids = list(student_ids or [])
+    if not student_ids:
+        return 0
+    keys = set(
+        db.session.execute(
+            select(Attendance.date_marked, Attendance.subject_id_fk)
+            .where(Attendance.student_id_fk.in_(student_ids))
+            .distinct()
+        ).all()
+    )
+    deleted = db.session.execute(
+        delete(Attendance).where(Attendance.student_id_fk.in_(student_ids)).execution_options(synchronize_session=False)
+    ).rowcount or 0
+    db.session.execute(
+        delete(AttendanceStudentRollup)
+        .where(AttendanceStudentRollup.student_id_fk.in_(student_ids))
+        .execution_options(synchronize_session=False)
+    )
+    refresh_sessions(keys)
+    return deleted
+
+
+def rebuild(start=None, end=None):
+    """Rebuild both rollup tables from ``attendance`` (optionally for a date window).
+
+    Without a window every rollup row is dropped first. Student counters are
+    always rebuilt for whole academic years so the counters stay complete.
+    Runs as set-based INSERT ... SELECT statements; the caller commits.
+    """
+    invalidate_results("attendance")
+    if start is None and end is None:
+        db.session.execute(delete(AttendanceSessionRollup))
+        db.session.execute(delete(AttendanceStudentRollup))
+    bounds = db.session.execute(select(func.min(Attendance.date_marked), func.max(Attendance.date_marked))).first()
+    first_day, last_day = (bounds or (None, None))
+    if not first_day:
+        return {"sessions": 0, "students": 0}
+    start = max(start or first_day, first_day)
+    end = min(end or last_day, last_day)
+
+    db.session.execute(
+        delete(AttendanceSessionRollup).where(
+            AttendanceSessionRollup.date_marked >= start, AttendanceSessionRollup.date_marked <= end
+        )
+    )
+    sessions_sel = (
+        select(
+            Attendance.date_marked,
+            Attendance.subject_id_fk,
+            Attendance.division_id_fk,
+            Attendance.period_no,
+            func.max(Attendance.semester),
+            *_status_sums(),
+        )
+        .where(
+            Attendance.date_marked >= start,
+            Attendance.date_marked <= end,
+            Attendance.subject_id_fk.isnot(None),
+        )
+        .group_by(Attendance.date_marked, Attendance.subject_id_fk, Attendance.division_id_fk, Attendance.period_no)
+    )
+    db.session.execute(
+        insert(AttendanceSessionRollup).from_select(
+            [
+                "date_marked",
+                "subject_id_fk",
+                "division_id_fk",
+                "period_no",
+                "semester",
+                "present_count",
+                "absent_count",
+                "late_count",
+                "total_count",
+            ],
+            sessions_sel,
+        )
+    )
+    sessions = db.session.scalar(
+        select(func.count()).select_from(AttendanceSessionRollup).where(
+            AttendanceSessionRollup.date_marked >= start, AttendanceSessionRollup.date_marked <= end
+        )
+    )
+
+    students = 0
+    year = academic_year_for(start)
+    while True:
+        ay_start, ay_end = academic_year_bounds(year)
+        if ay_start > end:
+            break
+        db.session.execute(delete(AttendanceStudentRollup).where(AttendanceStudentRollup.academic_year == year))
+        students_sel = (
+            select(
+                Attendance.student_id_fk,
+                Attendance.subject_id_fk,
+                literal(year),
+                *_status_sums(),
+                func.max(Attendance.date_marked),
+            )
+            .where(
+                Attendance.date_marked >= ay_start,
+                Attendance.date_marked <= ay_end,
+                Attendance.student_id_fk.isnot(None),
+                Attendance.subject_id_fk.isnot(None),
+            )
+            .group_by(Attendance.student_id_fk, Attendance.subject_id_fk)
+        )
+        db.session.execute(
+            insert(AttendanceStudentRollup).from_select(
+                [
+                    "student_id_fk",
+                    "subject_id_fk",
+                    "academic_year",
+                    "present_count",
+                    "absent_count",
+                    "late_count",
+                    "total_count",
+                    "last_marked",
+                ],
+                students_sel,
+            )
+        )
+        students += db.session.scalar(
+            select(func.count()).select_from(AttendanceStudentRollup).where(AttendanceStudentRollup.academic_year == year)
+        ) or 0
+        year = academic_year_for(ay_end + timedelta(days=1))
+    return {"sessions": int(sessions or 0), "students": int(students)}
+
+
+def session_query(*columns, subject_ids=None, semester=None, division_id=None, trust_id=None, start=None, end=None):
+    """``select(*columns)`` over session rollups with the usual dashboard filters applied."""
+    q = select(*columns).select_from(AttendanceSessionRollup)
+    if subject_ids:
+        q = q.where(AttendanceSessionRollup.subject_id_fk.in_(list(subject_ids)))
+    elif trust_id:
+        q = (
+            q.join(Subject, AttendanceSessionRollup.subject_id_fk == Subject.subject_id)
+            .join(Program, Subject.program_id_fk == Program.program_id)
+            .join(Institute, Program.institute_id_fk == Institute.institute_id)
+            .where(Institute.trust_id_fk == trust_id)
+        )
+    if start is not None:
+        q = q.where(AttendanceSessionRollup.date_marked >= start)
+    if end is not None:
+        q = q.where(AttendanceSessionRollup.date_marked <= end)
+    if semester:
+        q = q.where(AttendanceSessionRollup.semester == semester)
+    if division_id:
+        q = q.where(AttendanceSessionRollup.division_id_fk == division_id)
+    return q
+
+
+def daily_totals(start, end, **filters):
+    """``{date: {"P", "A", "L", "total"}}`` for the date window."""
+    R = AttendanceSessionRollup
+    rows = db.session.execute(
+        session_query(
+            R.date_marked,
+            func.sum(R.present_count),
+            func.sum(R.absent_count),
+            func.sum(R.late_count),
+            func.sum(R.total_count),
+            start=start,
+            end=end,
+            **filters,
+        ).group_by(R.date_marked)
+    ).all()
+    return {
+        d: {"P": int(p or 0), "A": int(a or 0), "L": int(l or 0), "total": int(t or 0)}
+        for d, p, a, l, t in rows
+    }
@@ -0,0 +1,171 @@
+import atexit
+import mimetypes
+import os
+import posixpath
+import threading
+import time
+from urllib.parse import quote
+
+from flask import Response, abort, current_app, request, send_file
+from sqlalchemy import insert
+
+from . import db
+from .models import SubjectMaterialLog, utc_now
+
+
+# Download gateway for protected files (study materials, announcement
+# attachments, payment proofs). Routes check access themselves and then call
+# serve(), which hands the transfer to the front proxy so a gunicorn worker is
+# not tied up streaming a large PDF:
+#
+#   DOWNLOAD_OFFLOAD=x-accel-redirect   nginx; DOWNLOAD_ACCEL_PREFIX names an
+#                                       internal location aliased to static/:
+#       location /protected/ { internal; alias /srv/cms/cms_app/static/; }
+#   DOWNLOAD_OFFLOAD=x-sendfile         Apache mod_xsendfile / lighttpd
+#   (unset)                             Python streams the file itself, with
+#                                       Range, ETag and If-None-Match support
+#
+# The directories behind the gateway are not served by the static route any
+# more (PROTECTED_STATIC_PREFIXES); the proxy should deny them too.
+#
+# Material downloads are logged to subject_material_logs in batches: rows are
+# buffered per process and written in one INSERT once DOWNLOAD_LOG_BATCH rows
+# are waiting or DOWNLOAD_LOG_INTERVAL seconds have passed (and at exit).
+
+PROTECTED_STATIC_PREFIXES = ("materials/", "cas/", "uploads/payment_proofs/")
+
+
+def init_app(app):
+    app.config.setdefault("DOWNLOAD_OFFLOAD", (os.environ.get("CMS_DOWNLOAD_OFFLOAD") or "").strip().lower())
+    app.config.setdefault("DOWNLOAD_ACCEL_PREFIX", os.environ.get("CMS_DOWNLOAD_ACCEL_PREFIX", "/protected/"))
+    app.config.setdefault("DOWNLOAD_MAX_AGE", int(os.environ.get("CMS_DOWNLOAD_MAX_AGE", "3600")))
+    app.config.setdefault("DOWNLOAD_LOG_BATCH", int(os.environ.get("CMS_DOWNLOAD_LOG_BATCH", "50")))
+    app.config.setdefault("DOWNLOAD_LOG_INTERVAL", float(os.environ.get("CMS_DOWNLOAD_LOG_INTERVAL", "30")))
+    app.config.setdefault("PROTECTED_STATIC_PREFIXES", PROTECTED_STATIC_PREFIXES)
+
+    @app.before_request
+    def _guard_protected_static():
+        if request.endpoint != "static":
+            return None
+        filename = ((request.view_args or {}).get("filename") or "").replace("\\", "/")
+        # Match what send_from_directory will open: "./materials", "//materials",
+        # "x/../materials" and "Materials" (case-insensitive filesystems) included
+        filename = posixpath.normpath("/" + filename).lstrip("/").lower()
+        prefixes = tuple(prefix.lower() for prefix in app.config["PROTECTED_STATIC_PREFIXES"])
+        if filename.startswith(prefixes):
+            abort(404)
+        return None
+
+    atexit.register(_flush_at_exit, app)
+
+
+def _resolve(storage_path):
+    root = os.path.abspath(current_app.static_folder or os.path.join(current_app.root_path, "static"))
+    path = os.path.abspath(os.path.join(root, *storage_path.replace("\\", "/").split("/")))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        abort(404)
+    return path
+
+
+def serve(storage_path, download_name=None, mimetype=None, etag=None, as_attachment=False):
+    """Send a file stored under static/ once the caller has authorised the request.
+
+    ``etag`` should be a content hash when one is known (attachments' sha256);
+    otherwise one is derived from the file's mtime and size.
+    """
+    path = _resolve(storage_path)
+    download_name = download_name or os.path.basename(path)
+    mimetype = mimetype or mimetypes.guess_type(download_name)[0] or "application/octet-stream"
+    max_age = int(current_app.config.get("DOWNLOAD_MAX_AGE", 3600))
+    mode = current_app.config.get("DOWNLOAD_OFFLOAD") or ""
+
+    if mode in ("x-accel-redirect", "x-sendfile"):
+        resp = Response(status=200, mimetype=mimetype)
+        if mode == "x-accel-redirect":
+            prefix = current_app.config.get("DOWNLOAD_ACCEL_PREFIX") or "/protected/"
+            resp.headers["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + quote(storage_path.replace("\\", "/").lstrip("/"))
+        else:
+            resp.headers["X-Sendfile"] = path
+        disposition = "attachment" if as_attachment else "inline"
+        resp.headers["Content-Disposition"] = f"{disposition}; filename*=UTF-8''{quote(download_name)}"
+        if etag:
+            resp.set_etag(etag)
+    else:
+        resp = send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            conditional=True,
+            etag=(etag or True),
+            max_age=max_age,
+        )
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    resp.cache_control.max_age = max_age
+    return resp
+
+
+class _DownloadLog:
+    def __init__(self):
+        self.rows = []
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+
+    def add(self, row, batch, interval):
+        with self.lock:
+            self.rows.append(row)
+            due = len(self.rows) >= batch or (time.monotonic() - self.last_flush) >= interval
+            if not due:
+                return []
+            rows, self.rows = self.rows, []
+            self.last_flush = time.monotonic()
+            return rows
+
+    def drain(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+            self.last_flush = time.monotonic()
+            return rows
+
+
+_log = _DownloadLog()
+
+
+def _write(rows):
+    if not rows:
+        return 0
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(insert(SubjectMaterialLog.__table__), rows)
+    except Exception:
+        current_app.logger.warning("Failed to write %d material download log rows", len(rows), exc_info=True)
+        return 0
+    return len(rows)
+
+
+def record_download(material_id, user_id=None, role=None):
+    """Buffer a ``download`` log row for a material; writes happen in batches."""
+    row = {
+        "material_id_fk": material_id,
+        "action": "download",
+        "actor_user_id_fk": user_id,
+        "actor_role": role,
+        "meta_json": None,
+        "at": utc_now(),
+    }
+    cfg = current_app.config
+    _write(_log.add(row, int(cfg.get("DOWNLOAD_LOG_BATCH", 50)), float(cfg.get("DOWNLOAD_LOG_INTERVAL", 30))))
+
+
+def flush_downloads():
+    """Write any buffered download rows now; returns how many were written."""
+    return _write(_log.drain())
+
+
+def _flush_at_exit(app):
+    try:
+        with app.app_context():
+            flush_downloads()
+    except Exception:
+        pass
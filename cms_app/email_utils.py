@@ -1,50 +1,413 @@
+import logging
 import smtplib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
 from email.message import EmailMessage
+
 from flask import current_app
+from sqlalchemy import func, or_, select, update
+
+from . import db
+from .jobs.services import periodic_task
+from .models import EmailOutbox
+
+log = logging.getLogger(__name__)
+
+# Outbound mail goes through the email_outbox table: requests only insert a row,
+# and the job worker (see jobs.services.periodic_task) sends due rows in batches
+# over pooled, already-authenticated SMTP connections, rate limited, with
+# retry/backoff. A slow or unreachable relay therefore never holds up a request.
+
+STATUS_QUEUED = "queued"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+# Rows left in "sending" this long (worker died mid-batch) are queued again
+_STALE_SENDING = 10 * 60
+
+
+def _now():
+    # Stored naive-UTC, like background_jobs
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 
+def _retry_delay(attempt):
+    return min(60 * (2 ** max(0, attempt - 1)), 60 * 60)
 
-def send_email(subject: str, to_address: str, text_body: str, html_body: str = None) -> bool:
-    """Send an email using SMTP settings from Flask app config.
 
-    Expected config keys:
-      MAIL_HOST, MAIL_PORT, MAIL_USER, MAIL_PASSWORD, MAIL_FROM,
-      MAIL_USE_TLS (default True), MAIL_USE_SSL (default False)
+def _settings(cfg):
+    return (
+        cfg.get("MAIL_HOST"),
+        int(cfg.get("MAIL_PORT", 587)),
+        cfg.get("MAIL_USER"),
+        cfg.get("MAIL_PASSWORD"),
+        bool(cfg.get("MAIL_USE_TLS", True)),
+        bool(cfg.get("MAIL_USE_SSL", False)),
+        float(cfg.get("MAIL_TIMEOUT", 20)),
+    )
+
+
+class SMTPPool:
+    """Open, authenticated SMTP connections reused across messages.
+
+    Connections are keyed by the mail settings, so changing them gets fresh
+    connections. One that sat idle for a while is checked with NOOP before
+    reuse, and one idle longer than ``idle_timeout`` is closed.
     """
-    cfg = current_app.config
-    host = cfg.get("MAIL_HOST")
-    port = int(cfg.get("MAIL_PORT", 587))
-    user = cfg.get("MAIL_USER")
-    password = cfg.get("MAIL_PASSWORD")
-    mail_from = cfg.get("MAIL_FROM") or user or "noreply@example.com"
-    use_tls = bool(cfg.get("MAIL_USE_TLS", True))
-    use_ssl = bool(cfg.get("MAIL_USE_SSL", False))
-
-    if not host:
-        current_app.logger.warning("MAIL_HOST not configured; skipping email send.")
-        return False
 
+    NOOP_AFTER = 10.0
+
+    def __init__(self, size=2, idle_timeout=60):
+        self.size = max(1, int(size))
+        self.idle_timeout = float(idle_timeout)
+        self._idle = []  # [(settings, server, last_used)]
+        self._lock = threading.Lock()
+
+    def _connect(self, settings):
+        host, port, user, password, use_tls, use_ssl, timeout = settings
+        if use_ssl:
+            server = smtplib.SMTP_SSL(host, port, timeout=timeout)
+        else:
+            server = smtplib.SMTP(host, port, timeout=timeout)
+            if use_tls:
+                server.starttls()
+        try:
+            if user and password:
+                server.login(user, password)
+        except Exception:
+            self._close(server)
+            raise
+        return server
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def acquire(self, settings):
+        """An open connection for ``settings``: a pooled one if still usable, else a new one."""
+        while True:
+            with self._lock:
+                found = None
+                for i, (key, server, last_used) in enumerate(self._idle):
+                    if key == settings:
+                        found = self._idle.pop(i)
+                        break
+            if found is None:
+                return self._connect(settings)
+            _key, server, last_used = found
+            idle = time.monotonic() - last_used
+            if idle > self.idle_timeout:
+                self._close(server)
+                continue
+            if idle > self.NOOP_AFTER:
+                try:
+                    if server.noop()[0] != 250:
+                        raise smtplib.SMTPException("NOOP failed")
+                except Exception:
+                    self._close(server)
+                    continue
+            return server
+
+    def release(self, settings, server, reusable=True):
+        """Return a connection to the pool (or close it when broken or the pool is full)."""
+        if reusable:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append((settings, server, time.monotonic()))
+                    return
+        self._close(server)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _key, server, _last in idle:
+            self._close(server)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def smtp_pool():
+    """The per-process pool, sized from MAIL_POOL_SIZE / MAIL_POOL_IDLE_TIMEOUT."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            cfg = current_app.config
+            _pool = SMTPPool(cfg.get("MAIL_POOL_SIZE", 2), cfg.get("MAIL_POOL_IDLE_TIMEOUT", 60))
+        return _pool
+
+
+def build_message(row, mail_from):
     msg = EmailMessage()
-    msg["Subject"] = subject
+    msg["Subject"] = row.subject
     msg["From"] = mail_from
-    msg["To"] = to_address
-    msg.set_content(text_body)
-    if html_body:
-        msg.add_alternative(html_body, subtype="html")
+    msg["To"] = row.to_address
+    msg.set_content(row.text_body or "")
+    if row.html_body:
+        msg.add_alternative(row.html_body, subtype="html")
+    return msg
+
 
+def queue_email(subject, to_address, text_body, html_body=None, category=None, user=None, trust_id=None, max_attempts=None):
+    """Add a message to the outbox; the caller commits. Returns the ``EmailOutbox`` row."""
+    row = EmailOutbox(
+        to_address=(to_address or "").strip()[:255],
+        subject=(subject or "")[:255],
+        text_body=text_body,
+        html_body=html_body,
+        category=category[:32] if category else None,
+        status=STATUS_QUEUED,
+        attempts=0,
+        max_attempts=int(max_attempts or current_app.config.get("MAIL_MAX_ATTEMPTS", 5) or 1),
+        created_by_user_id_fk=getattr(user, "user_id", None),
+        trust_id_fk=trust_id,
+    )
+    db.session.add(row)
+    return row
+
+
+def send_email(subject: str, to_address: str, text_body: str, html_body: str = None, category: str = None, user=None, trust_id=None) -> bool:
+    """Queue an email for the outbox sender; the caller commits.
+
+    The row is flushed so a bad message fails here, but it only becomes
+    visible to the sender with the caller's transaction. Returns False (and
+    queues nothing) when MAIL_HOST is not configured or there is no
+    recipient, so callers can fall back to another channel. Delivery happens
+    in the job worker; see :func:`deliver_pending`.
+    """
+    if not current_app.config.get("MAIL_HOST"):
+        current_app.logger.warning("MAIL_HOST not configured; skipping email send.")
+        return False
+    if not (to_address or "").strip():
+        return False
     try:
-        if use_ssl:
-            with smtplib.SMTP_SSL(host, port) as server:
-                if user and password:
-                    server.login(user, password)
-                server.send_message(msg)
-        else:
-            with smtplib.SMTP(host, port) as server:
-                if use_tls:
-                    server.starttls()
-                if user and password:
-                    server.login(user, password)
-                server.send_message(msg)
+        queue_email(subject, to_address, text_body, html_body, category=category, user=user, trust_id=trust_id)
+        db.session.flush()
         return True
     except Exception as e:
-        current_app.logger.error(f"Failed to send email to {to_address}: {e}")
-        return False
\ No newline at end of file
+        current_app.logger.error(f"Failed to queue email to {to_address}: {e}")
+        return False
+
+
+def _is_permanent(exc):
+    """5xx replies for this message (bad recipient, rejected content) are not retried."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _msg in (exc.recipients or {}).values()]
+        return bool(codes) and all(500 <= int(code) < 600 for code in codes)
+    if isinstance(exc, smtplib.SMTPAuthenticationError):
+        return False
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 500 <= int(exc.smtp_code or 0) < 600
+    return False
+
+
+def _connection_broken(exc):
+    # Per-message refusals leave the session usable; anything else drops it
+    return not isinstance(exc, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError))
+
+
+def requeue_stale_sending(stale_after_seconds=_STALE_SENDING):
+    cutoff = _now() - timedelta(seconds=stale_after_seconds)
+    res = db.session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.status == STATUS_SENDING, or_(EmailOutbox.locked_at.is_(None), EmailOutbox.locked_at < cutoff))
+        .values(status=STATUS_QUEUED, locked_by=None, locked_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return res.rowcount or 0
+
+
+def expire_queued(max_age=None):
+    """Fail queued messages older than their category's max age (e.g. one-time codes)."""
+    max_age = current_app.config.get("MAIL_MAX_AGE") if max_age is None else max_age
+    now = _now()
+    expired = 0
+    for category, seconds in (max_age or {}).items():
+        if not seconds:
+            continue
+        res = db.session.execute(
+            update(EmailOutbox)
+            .where(
+                EmailOutbox.status == STATUS_QUEUED,
+                EmailOutbox.category == category,
+                EmailOutbox.created_at < now - timedelta(seconds=int(seconds)),
+            )
+            .values(status=STATUS_FAILED, last_error="Expired before delivery", next_attempt_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        expired += res.rowcount or 0
+    if expired:
+        db.session.commit()
+    return expired
+
+
+def _claim_batch(limit):
+    now = _now()
+    ids = db.session.execute(
+        select(EmailOutbox.email_id)
+        .where(EmailOutbox.status == STATUS_QUEUED)
+        .where(or_(EmailOutbox.next_attempt_at.is_(None), EmailOutbox.next_attempt_at <= now))
+        .order_by(EmailOutbox.email_id.asc())
+        .limit(limit)
+    ).scalars().all()
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    db.session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.email_id.in_(ids), EmailOutbox.status == STATUS_QUEUED)
+        .values(status=STATUS_SENDING, locked_by=token, locked_at=now, attempts=func.coalesce(EmailOutbox.attempts, 0) + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return db.session.execute(
+        select(EmailOutbox).where(EmailOutbox.locked_by == token, EmailOutbox.status == STATUS_SENDING).order_by(EmailOutbox.email_id.asc())
+    ).scalars().all()
+
+
+def _finish(email_id, **values):
+    db.session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.email_id == email_id)
+        .values(locked_by=None, locked_at=None, **values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def _release(email_ids):
+    """Hand claimed rows back untouched (the batch stopped before reaching them)."""
+    if not email_ids:
+        return
+    db.session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.email_id.in_(email_ids), EmailOutbox.status == STATUS_SENDING)
+        .values(status=STATUS_QUEUED, locked_by=None, locked_at=None, attempts=EmailOutbox.attempts - 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def deliver_pending(limit=None):
+    """Send one batch of due outbox rows; returns ``{"sent", "retrying", "failed"}``.
+
+    Messages go out over one pooled connection at no more than
+    MAIL_RATE_PER_SECOND. A message refused with a 5xx reply fails outright;
+    other errors are retried with backoff up to its ``max_attempts``. When the
+    relay itself is unreachable the rest of the batch is put back untouched.
+    Messages past their category's MAIL_MAX_AGE are not sent and count as
+    failed.
+    """
+    cfg = current_app.config
+    counts = {"sent": 0, "retrying": 0, "failed": 0}
+    settings = _settings(cfg)
+    if not settings[0]:
+        return counts
+    counts["failed"] += expire_queued()
+    rows = _claim_batch(int(limit or cfg.get("MAIL_BATCH_SIZE", 50) or 50))
+    if not rows:
+        return counts
+    mail_from = cfg.get("MAIL_FROM") or settings[2] or "noreply@example.com"
+    rate = float(cfg.get("MAIL_RATE_PER_SECOND", 0) or 0)
+    interval = (1.0 / rate) if rate > 0 else 0.0
+    pool = smtp_pool()
+    server = None
+    last_sent = None
+    pending = [r.email_id for r in rows]
+    try:
+        for row in rows:
+            if last_sent is not None and interval:
+                wait = interval - (time.monotonic() - last_sent)
+                if wait > 0:
+                    time.sleep(wait)
+            error = None
+            try:
+                if server is None:
+                    server = pool.acquire(settings)
+                server.send_message(build_message(row, mail_from))
+            except Exception as e:
+                error = e
+            last_sent = time.monotonic()
+            pending.remove(row.email_id)
+            if error is None:
+                _finish(row.email_id, status=STATUS_SENT, sent_at=_now(), last_error=None)
+                counts["sent"] += 1
+                continue
+            message = f"{type(error).__name__}: {error}"[:2000]
+            attempts = int(row.attempts or 0)
+            if _is_permanent(error) or attempts >= int(row.max_attempts or 1):
+                _finish(row.email_id, status=STATUS_FAILED, last_error=message)
+                counts["failed"] += 1
+            else:
+                _finish(row.email_id, status=STATUS_QUEUED, last_error=message, next_attempt_at=_now() + timedelta(seconds=_retry_delay(attempts)))
+                counts["retrying"] += 1
+            log.warning("email %s to %s not sent (attempt %s): %s", row.email_id, row.to_address, attempts, message)
+            if server is not None and not _connection_broken(error):
+                try:
+                    server.rset()
+                    continue
+                except Exception:
+                    pass
+            if server is not None:
+                pool.release(settings, server, reusable=False)
+                server = None
+            if not isinstance(error, smtplib.SMTPResponseException) or isinstance(error, smtplib.SMTPAuthenticationError):
+                # Relay unreachable or login refused: stop here, the rest waits for the next run
+                break
+    finally:
+        if server is not None:
+            pool.release(settings, server)
+        _release(pending)
+    return counts
+
+
+@periodic_task("email_outbox", 2)
+def _drain_outbox():
+    requeue_stale_sending()
+    deliver_pending()
+
+
+def email_status(email_id):
+    row = db.session.get(EmailOutbox, email_id)
+    if row is None:
+        return None
+    return {
+        "email_id": row.email_id,
+        "to_address": row.to_address,
+        "subject": row.subject,
+        "category": row.category,
+        "status": row.status,
+        "attempts": int(row.attempts or 0),
+        "max_attempts": int(row.max_attempts or 0),
+        "last_error": row.last_error,
+        "next_attempt_at": row.next_attempt_at.isoformat() if row.next_attempt_at else None,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "sent_at": row.sent_at.isoformat() if row.sent_at else None,
+    }
+
+
+def outbox_status(recent=10):
+    """Counts per status, age of the oldest queued message and the latest failures."""
+    by_status = {s: 0 for s in (STATUS_QUEUED, STATUS_SENDING, STATUS_SENT, STATUS_FAILED)}
+    for status, count in db.session.execute(select(EmailOutbox.status, func.count()).group_by(EmailOutbox.status)).all():
+        by_status[str(status or "")] = int(count or 0)
+    oldest = db.session.scalar(select(func.min(EmailOutbox.created_at)).where(EmailOutbox.status == STATUS_QUEUED))
+    failures = db.session.execute(
+        select(EmailOutbox).where(EmailOutbox.status == STATUS_FAILED).order_by(EmailOutbox.email_id.desc()).limit(recent)
+    ).scalars().all()
+    return {
+        "by_status": by_status,
+        "oldest_queued_at": oldest,
+        "recent_failures": [email_status(r.email_id) for r in failures],
+    }
@@ -1,24 +1,21 @@
-from flask import render_template, request, flash, redirect, url_for, session
+from flask import render_template, request, flash, redirect, url_for
 import json
 from flask_login import login_required, current_user
 from sqlalchemy import select, func, and_, or_, case, cast
 from . import exams_bp
 from .. import db, csrf_required
+from ..api_utils import api_success, api_error
 from ..models import ExamScheme, StudentSemesterResult, ExamMark, Student, Program, Subject, StudentSubjectEnrollment, SubjectType, CreditStructure, CourseAssignment, DataAuditLog, Division
 from ..main.routes import academic_year_options, current_academic_year, _program_dropdown_context
 from ..decorators import role_required
-from .services import resolve_exam_limits, calculate_exam_results
+from .services import resolve_exam_limits, ingest_marks
+from ..jobs.services import enqueue
+from ..query_budget import query_budget
+from ..scope import current_scope
 from datetime import datetime, timedelta
 
 def _effective_trust_id():
-    if not getattr(current_user, "is_authenticated", False):
-        return None
-    if getattr(current_user, "is_super_admin", False):
-        try:
-            return int(session.get("active_trust_id") or 0) or None
-        except Exception:
-            return None
-    return getattr(current_user, "trust_id_fk", None)
+    return current_scope().trust_id
 
 def _require_exam_view_access():
     role = (getattr(current_user, "role", "") or "").strip().lower()
@@ -30,10 +27,10 @@ def _require_exam_view_access():
         return redirect(url_for("main.dashboard"))
     return None
 
-def _require_exam_edit_access(scheme: ExamScheme, subject_id: int = None):
+def _can_edit_exam_subject(scheme: ExamScheme, subject_id: int = None) -> bool:
     role = (getattr(current_user, "role", "") or "").strip().lower()
     if getattr(current_user, "is_super_admin", False) or role in ("admin", "principal", "clerk"):
-        return None
+        return True
     if role == "faculty" and subject_id:
         try:
             uid = getattr(current_user, "user_id", None)
@@ -46,9 +43,14 @@ def _require_exam_edit_access(scheme: ExamScheme, subject_id: int = None):
                 q = q.where(or_(CourseAssignment.academic_year == scheme.academic_year, CourseAssignment.academic_year.is_(None)))
             row = db.session.execute(q.limit(1)).scalars().first()
             if row:
-                return None
+                return True
         except Exception:
             pass
+    return False
+
+def _require_exam_edit_access(scheme: ExamScheme, subject_id: int = None):
+    if _can_edit_exam_subject(scheme, subject_id):
+        return None
     try:
         flash("You do not have permission to enter marks for this subject.", "danger")
     except Exception:
@@ -76,28 +78,21 @@ def _is_scheme_locked(scheme: ExamScheme) -> bool:
     except Exception:
         return True
 
-def _mark_is_pass(scheme: ExamScheme, internal: float, external: float, total: float, is_absent: bool) -> bool:
-    if is_absent:
+def _track_flips(scheme: ExamScheme) -> bool:
+    """Pass/fail flips are audited while a frozen scheme is temporarily unlocked."""
+    if not getattr(scheme, "is_frozen", False):
         return False
-    if getattr(scheme, "min_internal_marks", None) is not None:
-        try:
-            if internal is None or float(internal) < float(scheme.min_internal_marks or 0):
-                return False
-        except Exception:
-            return False
-    if getattr(scheme, "min_external_marks", None) is not None:
-        try:
-            if external is None or float(external) < float(scheme.min_external_marks or 0):
-                return False
-        except Exception:
-            return False
-    if getattr(scheme, "min_total_marks", None) is not None:
-        try:
-            if total is None or float(total) < float(scheme.min_total_marks or 0):
-                return False
-        except Exception:
-            return False
-    return True
+    try:
+        return not _is_scheme_locked(scheme)
+    except Exception:
+        return False
+
+def _audit_actor():
+    return {
+        "user_id": getattr(current_user, "user_id", None),
+        "role": (getattr(current_user, "role", "") or "").strip().lower(),
+        "trust_id": _effective_trust_id(),
+    }
 
 @exams_bp.route("/academics/exams/<int:scheme_id>/calculate", methods=["POST"])
 @login_required
@@ -110,21 +105,22 @@ def calculate_results(scheme_id):
     if rv_admin:
         return rv_admin
     """
-    Triggers result calculation for an exam scheme.
-    Computes Grades, SGPA, and updates StudentSemesterResult.
+    Queues result calculation for an exam scheme.
+    Computes Grades, SGPA, and updates StudentSemesterResult in the job worker.
     """
-    success, message, count = calculate_exam_results(scheme_id)
-    
-    if success:
-        flash(message, "success")
-    else:
-        # If failure was due to "not found" or "no marks", message might be warning level
-        if "not found" in message.lower() or "no marks" in message.lower():
-            flash(message, "warning")
-        else:
-            flash(f"Error calculating results: {message}", "danger")
-            
-    return redirect(url_for("exams.result_view", scheme_id=scheme_id))
+    scheme = db.session.get(ExamScheme, scheme_id)
+    if not scheme:
+        flash("Exam scheme not found.", "warning")
+        return redirect(url_for("exams.dashboard"))
+    job = enqueue(
+        "exam_results",
+        {"scheme_id": scheme.scheme_id},
+        label=f"Calculate results: {scheme.name}",
+        user=current_user,
+        trust_id=_effective_trust_id(),
+        return_url=url_for("exams.result_view", scheme_id=scheme.scheme_id),
+    )
+    return redirect(url_for("jobs.job_status", job_id=job.job_id))
 
 # --- EXAM MODULE ROUTES ---
 
@@ -141,24 +137,12 @@ def dashboard():
     # Filter logic (program)
     ctx = _program_dropdown_context(request.args.get("program_id"), include_admin_all=True, prefer_user_program_default=True)
     selected_program_id = ctx.get("selected_program_id")
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     
     q = select(ExamScheme).order_by(ExamScheme.created_at.desc())
     
     if effective_trust_id:
-        try:
-            from ..models import Institute
-            q = q.join(Program, ExamScheme.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
-        except Exception:
-            pass
+        q = q.filter(ExamScheme.program_id_fk.in_(current_scope().program_ids))
 
     if selected_program_id:
         q = q.filter(ExamScheme.program_id_fk == selected_program_id)
@@ -298,6 +282,7 @@ def marks_entry(scheme_id):
 @exams_bp.route("/academics/exams/<int:scheme_id>/save-marks", methods=["POST"])
 @login_required
 @csrf_required
+@query_budget(queries=12, repeats=5)
 def save_marks(scheme_id):
     rv = _require_exam_view_access()
     if rv:
@@ -319,168 +304,152 @@ def save_marks(scheme_id):
     if rv2:
         return rv2
         
-    subject = db.session.get(Subject, int(subject_id))
-    
-    # Resolve limits for validation
-    limits = resolve_exam_limits(scheme, subject)
-    
-    updates = 0
-    inserts = 0
-    errors = []
-    
-    student_ids = request.form.getlist("student_ids")
-    changed_students = 0
-    
-    flips = 0
-    for enrollment in student_ids:
-        internal_raw = request.form.get(f"internal_{enrollment}")
-        external_raw = request.form.get(f"external_{enrollment}")
-        absent_raw = request.form.get(f"absent_{enrollment}")
-        
-        is_absent = (absent_raw == "on")
-        
-        internal = None
-        if internal_raw and internal_raw.strip():
+    def _float_or_none(raw):
+        if raw and raw.strip():
             try:
-                internal = float(internal_raw)
-            except:
-                pass
-            
-        external = None
-        if external_raw and external_raw.strip():
-            try:
-                external = float(external_raw)
+                return float(raw)
             except:
                 pass
-            
-        # Find existing mark or create
-        mark = db.session.execute(
-            select(ExamMark).filter_by(
-                scheme_id_fk=scheme_id, 
-                subject_id_fk=subject.subject_id, 
-                student_id_fk=enrollment
-            )
-        ).scalars().first()
-        
-        old_internal = None
-        old_external = None
-        old_total = None
-        old_absent = False
-        old_pass = None
-
-        if mark:
-            old_internal = mark.internal_marks
-            old_external = mark.external_marks
-            old_total = mark.total_marks
-            old_absent = bool(mark.is_absent)
-            old_pass = _mark_is_pass(scheme, old_internal, old_external, old_total, old_absent)
-
-        if not mark:
-            # Only create if there is some data to save
-            if internal is None and external is None and not is_absent:
-                continue
-
-            mark = ExamMark(
-                scheme_id_fk=scheme_id,
-                subject_id_fk=subject.subject_id,
-                student_id_fk=enrollment,
-                semester=scheme.semester,
-                academic_year=scheme.academic_year,
-                attempt_no=1 
-            )
-            db.session.add(mark)
-            inserts += 1
-        else:
-            updates += 1
-            
-        mark.internal_marks = internal
-        mark.external_marks = external
-        mark.is_absent = is_absent
-        
-        # Calculate Total
-        total = 0
-        if internal is not None:
-            total += internal
-        if external is not None:
-            total += external
-        mark.total_marks = total
+        return None
 
-        changed_students += 1
+    entries = []
+    for enrollment in request.form.getlist("student_ids"):
+        entries.append({
+            "student_id": enrollment,
+            "internal": _float_or_none(request.form.get(f"internal_{enrollment}")),
+            "external": _float_or_none(request.form.get(f"external_{enrollment}")),
+            "is_absent": (request.form.get(f"absent_{enrollment}") == "on"),
+        })
 
-        if getattr(scheme, "is_frozen", False):
-            try:
-                unlocked = not _is_scheme_locked(scheme)
-            except Exception:
-                unlocked = False
-            if unlocked:
-                new_pass = _mark_is_pass(scheme, internal, external, total, is_absent)
-                if old_pass is not None and new_pass != old_pass:
-                    flips += 1
-                    try:
-                        db.session.add(
-                            DataAuditLog(
-                                action="exam_pass_fail_flip",
-                                actor_user_id_fk=getattr(current_user, "user_id", None),
-                                actor_role=(getattr(current_user, "role", "") or "").strip().lower(),
-                                trust_id_fk=_effective_trust_id(),
-                                program_id_fk=getattr(scheme, "program_id_fk", None),
-                                semester=getattr(scheme, "semester", None),
-                                selection_json=json.dumps(
-                                    {"scheme_id": scheme_id, "subject_id": int(subject_id), "student_id": enrollment}
-                                ),
-                                counts_json=json.dumps(
-                                    {
-                                        "old_pass": bool(old_pass),
-                                        "new_pass": bool(new_pass),
-                                        "old_total": old_total,
-                                        "new_total": total,
-                                        "unlock_until": (scheme.unlock_until.isoformat() if getattr(scheme, "unlock_until", None) else None),
-                                        "unlock_reason": (scheme.unlock_reason or ""),
-                                    }
-                                ),
-                            )
-                        )
-                    except Exception:
-                        pass
-        
     try:
-        try:
-            db.session.add(
-                DataAuditLog(
-                    action="exam_marks_save",
-                    actor_user_id_fk=getattr(current_user, "user_id", None),
-                    actor_role=(getattr(current_user, "role", "") or "").strip().lower(),
-                    trust_id_fk=_effective_trust_id(),
-                    program_id_fk=getattr(scheme, "program_id_fk", None),
-                    semester=getattr(scheme, "semester", None),
-                    selection_json=json.dumps({"scheme_id": scheme_id, "subject_id": int(subject_id)}),
-                    counts_json=json.dumps(
-                        {
-                            "inserts": inserts,
-                            "updates": updates,
-                            "changed_students": changed_students,
-                            "is_frozen": bool(getattr(scheme, "is_frozen", False)),
-                            "unlock_until": (scheme.unlock_until.isoformat() if getattr(scheme, "unlock_until", None) else None),
-                            "flips_flagged": flips,
-                        }
-                    ),
-                )
-            )
-        except Exception:
-            pass
-        if flips:
-            db.session.flush()
+        stats = ingest_marks(scheme, int(subject_id), entries, actor=_audit_actor(), track_flips=_track_flips(scheme))
         db.session.commit()
-        if flips:
-            flash(f"Marks saved. ({inserts} added, {updates} updated). Flips flagged: {flips}", "warning")
+        if stats["conflicts"]:
+            flash(f"Skipped {len(stats['conflicts'])} student(s) whose marks for this attempt belong to another exam: {', '.join(stats['conflicts'])}", "warning")
+        if stats["flips"]:
+            flash(f"Marks saved. ({stats['inserts']} added, {stats['updates']} updated). Flips flagged: {stats['flips']}", "warning")
         else:
-            flash(f"Marks saved. ({inserts} added, {updates} updated)", "success")
+            flash(f"Marks saved. ({stats['inserts']} added, {stats['updates']} updated)", "success")
     except Exception as e:
         db.session.rollback()
         flash(f"Error saving marks: {str(e)}", "danger")
     
     return redirect(url_for("exams.marks_entry", scheme_id=scheme_id, subject_id=subject_id))
 
+def _parse_upload_mark(raw, label, limit, errors, enrollment):
+    if raw is None or (isinstance(raw, str) and not raw.strip()):
+        return None
+    try:
+        value = float(raw)
+    except (TypeError, ValueError):
+        errors.append({"student_id": enrollment, "error": f"{label} is not a number"})
+        return None
+    if value < 0 or (limit is not None and value > float(limit)):
+        errors.append({"student_id": enrollment, "error": f"{label} must be between 0 and {limit}"})
+        return None
+    return value
+
+@exams_bp.route("/api/exams/<int:scheme_id>/marks", methods=["POST"])
+@login_required
+@csrf_required
+def api_upload_marks(scheme_id):
+    """Upload a whole marks sheet for one subject.
+
+    Accepts JSON ``{"subject_id": 1, "marks": [{"student_id", "internal",
+    "external", "absent"}]}``, a bare JSON list of marks with ``?subject_id=``,
+    or a multipart CSV ``file`` (columns
+    ``enrollment_no``, ``internal``, ``external``, ``absent``) with
+    ``subject_id`` as a form field. Rows with errors are skipped and reported.
+    """
+    role = (getattr(current_user, "role", "") or "").strip().lower()
+    if not (getattr(current_user, "is_super_admin", False) or role in ("admin", "principal", "clerk", "faculty")):
+        return api_error("forbidden", "You do not have permission to access Exams.", 403)
+    scheme = db.session.get(ExamScheme, scheme_id)
+    if not scheme:
+        return api_error("not_found", "Exam not found.", 404)
+    scope = current_scope()
+    if scope.trust_id and not scope.has_program(scheme.program_id_fk):
+        return api_error("not_found", "Exam not found.", 404)
+    if scope.principal_program_id and scheme.program_id_fk != scope.principal_program_id:
+        return api_error("forbidden", "You do not have permission to enter marks for this program.", 403)
+    if _is_scheme_locked(scheme):
+        return api_error("locked", "This scheme is frozen. Ask Admin/Principal to unlock with reason.", 409)
+
+    payload = request.get_json(silent=True) if request.is_json else None
+    if request.is_json and not isinstance(payload, (dict, list)):
+        return api_error("invalid", "Send a JSON object with subject_id and marks.", 400)
+    if isinstance(payload, list):
+        # A bare list of marks, with subject_id in the query string
+        subject_raw = request.args.get("subject_id")
+        raw_rows = payload
+    elif payload is not None:
+        subject_raw = payload.get("subject_id")
+        raw_rows = payload.get("marks") or []
+    else:
+        subject_raw = request.form.get("subject_id")
+        file = request.files.get("file")
+        if not file:
+            return api_error("invalid", "Send JSON or a CSV file.", 400)
+        import csv
+        import io
+        try:
+            reader = csv.DictReader(io.StringIO(file.stream.read().decode("utf-8-sig"), newline=None))
+            raw_rows = [{(k or "").strip().lower(): v for k, v in row.items()} for row in reader]
+        except Exception:
+            return api_error("invalid", "Could not read CSV file.", 400)
+    try:
+        subject_id = int(subject_raw)
+    except (TypeError, ValueError):
+        return api_error("invalid", "subject_id is required.", 400)
+    subject = db.session.get(Subject, subject_id)
+    if not subject or subject.program_id_fk != scheme.program_id_fk:
+        return api_error("not_found", "Subject not found.", 404)
+    if not _can_edit_exam_subject(scheme, subject_id):
+        return api_error("forbidden", "You do not have permission to enter marks for this subject.", 403)
+    if not isinstance(raw_rows, list):
+        return api_error("invalid", "marks must be a list.", 400)
+
+    limits = resolve_exam_limits(scheme, subject)
+    errors = []
+    entries = []
+    for row in raw_rows:
+        if not isinstance(row, dict):
+            continue
+        enrollment = str(row.get("student_id") or row.get("enrollment_no") or row.get("enrollmentno") or "").strip()
+        if not enrollment:
+            continue
+        absent_raw = row.get("absent", row.get("is_absent"))
+        is_absent = absent_raw is True or str(absent_raw or "").strip().lower() in ("1", "true", "yes", "y", "ab", "on")
+        before = len(errors)
+        internal = _parse_upload_mark(row.get("internal"), "internal", limits.get("max_internal"), errors, enrollment)
+        external = _parse_upload_mark(row.get("external"), "external", limits.get("max_external"), errors, enrollment)
+        if len(errors) == before:
+            entries.append({"student_id": enrollment, "internal": internal, "external": external, "is_absent": is_absent})
+
+    if entries:
+        known = set(
+            db.session.execute(
+                select(Student.enrollment_no).filter(
+                    Student.enrollment_no.in_({e["student_id"] for e in entries}),
+                    Student.program_id_fk == scheme.program_id_fk,
+                )
+            ).scalars().all()
+        )
+        for e in entries:
+            if e["student_id"] not in known:
+                errors.append({"student_id": e["student_id"], "error": "unknown student"})
+        entries = [e for e in entries if e["student_id"] in known]
+
+    try:
+        stats = ingest_marks(scheme, subject_id, entries, actor=_audit_actor(), track_flips=_track_flips(scheme))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return api_error("save_failed", str(e), 500)
+    errors.extend({"student_id": e, "error": "marks saved under another exam"} for e in stats["conflicts"])
+    stats["errors"] = errors
+    return api_success(stats, {"scheme_id": scheme_id, "subject_id": subject_id, "received": len(raw_rows)})
+
 @exams_bp.route("/academics/exams/<int:scheme_id>/result", methods=["GET"])
 @login_required
 def result_view(scheme_id):
@@ -1,40 +1,31 @@
 import json
+from bisect import bisect_right
+
 from sqlalchemy import select
 from .. import db
-from ..models import ExamScheme, StudentSemesterResult, ExamMark, Subject, CreditStructure, SubjectType
+from ..jobs.services import job_handler
+from ..models import ExamScheme, StudentSemesterResult, ExamMark, Subject, CreditStructure, SubjectType, DataAuditLog, utc_now
+from ..result_cache import invalidate as invalidate_results
 
-def resolve_exam_limits(scheme, subject):
-    """
-    Resolves max/min marks for a subject based on scheme rules.
-    Priority: Credit-based rules > Global scheme limits.
-    """
+def parse_credit_rules(scheme):
+    """Parsed ``scheme.credit_rules_json`` (list of rule dicts), or ``[]``."""
+    if not scheme.credit_rules_json:
+        return []
+    try:
+        rules = json.loads(scheme.credit_rules_json)
+    except Exception as e:
+        print(f"Error resolving exam rules: {e}")
+        return []
+    return rules if isinstance(rules, list) else []
+
+
+def _limits_for(scheme, rules, credits, type_name):
     limits = {
         "max_internal": scheme.max_internal_marks,
         "max_external": scheme.max_external_marks,
         "max_total": scheme.max_total_marks
     }
-    
-    if not scheme.credit_rules_json:
-        return limits
-        
     try:
-        rules = json.loads(scheme.credit_rules_json)
-        if not rules:
-            return limits
-            
-        # Get subject credit and type
-        credits = 0
-        if subject.credit_structure:
-             credits = subject.credit_structure.total_credits
-        else:
-             cs = db.session.execute(select(CreditStructure).filter_by(subject_id_fk=subject.subject_id)).scalars().first()
-             if cs: credits = cs.total_credits
-             
-        # Get type
-        type_code_real = "All"
-        st = db.session.execute(select(SubjectType).filter_by(type_id=subject.subject_type_id_fk)).scalars().first()
-        if st: type_code_real = st.type_name
-        
         # Match rule: 1. Exact match (credit + type), 2. Fallback (credit + 'All')
         matched_rule = None
         fallback_rule = None
@@ -44,7 +35,7 @@ def resolve_exam_limits(scheme, subject):
              r_type = r.get("type", "All")
              
              if r_credit == credits:
-                 if r_type == type_code_real:
+                 if r_type == type_name:
                      matched_rule = r
                      break
                  if r_type == "All":
@@ -60,9 +51,63 @@ def resolve_exam_limits(scheme, subject):
                  limits["min_total"] = float(final_rule.get("min_tot", 0))
     except Exception as e:
         print(f"Error resolving exam rules: {e}")
-        
     return limits
 
+
+def subject_credit_map(subject_ids):
+    """``{subject_id: total_credits}`` in one query (0 when no credit structure)."""
+    subject_ids = [sid for sid in set(subject_ids or []) if sid]
+    credit_map = {sid: 0 for sid in subject_ids}
+    if subject_ids:
+        rows = db.session.execute(
+            select(CreditStructure.subject_id_fk, CreditStructure.total_credits)
+            .filter(CreditStructure.subject_id_fk.in_(subject_ids))
+            .order_by(CreditStructure.structure_id.asc())
+        ).all()
+        seen = set()
+        for sid, credits in rows:
+            if sid in seen:
+                continue
+            seen.add(sid)
+            credit_map[sid] = credits or 0
+    return credit_map
+
+
+def build_limits_table(scheme, subjects, credit_map=None):
+    """Per-subject limits for a scheme: ``{subject_id: limits}``.
+
+    Credit rules are parsed once and subject types/credits are fetched in
+    bulk, so this costs at most two queries regardless of subject count.
+    """
+    subjects = list(subjects or [])
+    rules = parse_credit_rules(scheme)
+    if credit_map is None:
+        credit_map = subject_credit_map([s.subject_id for s in subjects]) if rules else {}
+    type_names = {}
+    if rules:
+        type_ids = {s.subject_type_id_fk for s in subjects if s.subject_type_id_fk}
+        if type_ids:
+            type_names = dict(
+                db.session.execute(
+                    select(SubjectType.type_id, SubjectType.type_name).filter(SubjectType.type_id.in_(type_ids))
+                ).all()
+            )
+    table = {}
+    for s in subjects:
+        if rules:
+            table[s.subject_id] = _limits_for(scheme, rules, credit_map.get(s.subject_id, 0), type_names.get(s.subject_type_id_fk, "All"))
+        else:
+            table[s.subject_id] = _limits_for(scheme, [], 0, "All")
+    return table
+
+
+def resolve_exam_limits(scheme, subject):
+    """
+    Resolves max/min marks for a subject based on scheme rules.
+    Priority: Credit-based rules > Global scheme limits.
+    """
+    return build_limits_table(scheme, [subject])[subject.subject_id]
+
 def get_grade_point(marks_obtained, max_marks, grading_scheme=None):
     """
     Calculates Grade Point and Letter based on marks.
@@ -91,132 +136,405 @@ def get_grade_point(marks_obtained, max_marks, grading_scheme=None):
     elif percentage >= 40: return 5.0, "C"
     else: return 0.0, "F"
 
+DEFAULT_GRADE_BANDS = [
+    {"min": 90, "grade": "O", "gp": 10},
+    {"min": 80, "grade": "A+", "gp": 9},
+    {"min": 70, "grade": "A", "gp": 8},
+    {"min": 60, "grade": "B+", "gp": 7},
+    {"min": 50, "grade": "B", "gp": 6},
+    {"min": 40, "grade": "C", "gp": 5},
+]
+
+
+class GradeTable:
+    """Grade bands compiled for bisect lookups (same rules as ``get_grade_point``).
+
+    Bands are matched on ``percentage >= min``; a percentage below every
+    custom band falls back to the default 10-point scale, and below that
+    to ``(0.0, "F")``.
+    """
+
+    def __init__(self, grading_scheme=None):
+        self.custom = self._compile(grading_scheme or [])
+        self.default = self._compile(DEFAULT_GRADE_BANDS)
+
+    @staticmethod
+    def _compile(bands):
+        # Highest-min-first order wins on ties, matching the linear scan.
+        by_min = {}
+        for band in sorted(bands, key=lambda x: x.get("min", 0), reverse=True):
+            by_min.setdefault(band.get("min", 0), band)
+        mins = sorted(by_min)
+        return mins, [(float(by_min[m].get("gp", 0)), by_min[m].get("grade", "F")) for m in mins]
+
+    @staticmethod
+    def _find(compiled, percentage):
+        mins, grades = compiled
+        idx = bisect_right(mins, percentage) - 1
+        return grades[idx] if idx >= 0 else None
+
+    def lookup(self, percentage):
+        return self._find(self.custom, percentage) or self._find(self.default, percentage) or (0.0, "F")
+
+    def grade_many(self, obtained, max_marks):
+        """Grade points/letters for parallel lists of obtained and max marks."""
+        points = []
+        letters = []
+        for got, out_of in zip(obtained, max_marks):
+            if out_of <= 0:
+                gp, letter = 0.0, "F"
+            else:
+                gp, letter = self.lookup((got / out_of) * 100)
+            points.append(gp)
+            letters.append(letter)
+        return points, letters
+
+
+def _grading_bands(scheme):
+    if scheme.grading_scheme_json:
+        try:
+            grading_data = json.loads(scheme.grading_scheme_json)
+            if isinstance(grading_data, dict) and "bands" in grading_data:
+                return sorted(grading_data["bands"], key=lambda x: x["min"], reverse=True)
+        except:
+            pass
+    return None
+
+
 def calculate_exam_results(scheme_id):
     """
     Calculates results for an exam scheme.
     Computes Grades, SGPA, and updates StudentSemesterResult.
     Returns: (success: bool, message: str, count: int)
+
+    Everything is computed from column arrays first; the only writes are two
+    bulk statements at the end, so the write transaction stays short.
     """
     scheme = db.session.get(ExamScheme, scheme_id)
     if not scheme:
         return False, "Exam scheme not found.", 0
-        
-    # Parse grading scheme
-    grading_scheme = None
-    if scheme.grading_scheme_json:
-        try:
-            grading_data = json.loads(scheme.grading_scheme_json)
-            if isinstance(grading_data, dict) and "bands" in grading_data:
-                grading_scheme = sorted(grading_data["bands"], key=lambda x: x["min"], reverse=True)
-        except:
-            pass
-            
-    # Fetch all students with marks in this scheme
-    marks = db.session.execute(
-        select(ExamMark).filter_by(scheme_id_fk=scheme_id)
-    ).scalars().all()
-    
-    if not marks:
+
+    grades = GradeTable(_grading_bands(scheme))
+
+    # Column arrays for every mark in the scheme
+    rows = db.session.execute(
+        select(
+            ExamMark.exam_mark_id,
+            ExamMark.student_id_fk,
+            ExamMark.subject_id_fk,
+            ExamMark.total_marks,
+            ExamMark.is_absent,
+        ).filter_by(scheme_id_fk=scheme_id)
+    ).all()
+    if not rows:
         return False, "No marks found to process.", 0
-        
-    # Group marks by Student
-    student_marks = {}
-    subject_ids = set()
-    for m in marks:
-        if m.student_id_fk not in student_marks:
-            student_marks[m.student_id_fk] = []
-        student_marks[m.student_id_fk].append(m)
-        subject_ids.add(m.subject_id_fk)
-        
-    # Fetch Subjects and Credits
+    mark_ids, student_ids, subject_ids, totals, absents = (list(col) for col in zip(*rows))
+
     subjects = db.session.execute(
-        select(Subject).filter(Subject.subject_id.in_(subject_ids))
+        select(Subject).filter(Subject.subject_id.in_(set(subject_ids)))
     ).scalars().all()
-    
-    subject_map = {s.subject_id: s for s in subjects}
-    
-    # Fetch Credit Structures
-    credit_map = {}
-    for s in subjects:
-        c = 0
-        if s.credit_structure:
-            c = s.credit_structure.total_credits
-        else:
-            # Fallback check
-            cs = db.session.execute(select(CreditStructure).filter_by(subject_id_fk=s.subject_id)).scalars().first()
-            if cs: c = cs.total_credits
-        credit_map[s.subject_id] = c
-        
-    processed_count = 0
-    
+    credit_map = subject_credit_map([s.subject_id for s in subjects])
+    limits = build_limits_table(scheme, subjects, credit_map)
+    max_by_subject = {}
+    for sid, lim in limits.items():
+        max_tot = lim.get("max_total", 100)
+        max_by_subject[sid] = 100 if max_tot is None else max_tot
+
+    # Marks for subjects that no longer exist are left untouched
+    keep = [i for i, sid in enumerate(subject_ids) if sid in max_by_subject]
+    obtained = [0 if absents[i] else (totals[i] or 0) for i in keep]
+    out_of = [max_by_subject[subject_ids[i]] for i in keep]
+    points, letters = grades.grade_many(obtained, out_of)
+
+    # SGPA accumulation per student
+    per_student = {}
+    for i, gp, letter in zip(keep, points, letters):
+        acc = per_student.setdefault(student_ids[i], [0, 0, 0.0])  # registered, earned, points
+        credits = credit_map.get(subject_ids[i], 0) or 0
+        if credits > 0:
+            acc[0] += credits
+            if not absents[i]:
+                acc[2] += gp * credits
+                if letter != "F":
+                    acc[1] += credits
+    for sid in set(student_ids):
+        per_student.setdefault(sid, [0, 0, 0.0])
+
+    mark_updates = [
+        {"exam_mark_id": mark_ids[i], "grade_point": gp, "grade_letter": letter}
+        for i, gp, letter in zip(keep, points, letters)
+    ]
+
     try:
-        for student_id, s_marks in student_marks.items():
-            total_credits = 0
-            total_points = 0
-            total_registered_credits = 0
-            
-            # 1. Update individual Subject Grades
-            for m in s_marks:
-                subject = subject_map.get(m.subject_id_fk)
-                if not subject: continue
-                
-                # Determine Max Marks for this subject (using rule logic or defaults)
-                limits = resolve_exam_limits(scheme, subject)
-                max_tot = limits.get("max_total", 100)
-                
-                # Calculate Grade
-                obtained = m.total_marks or 0
-                if m.is_absent:
-                    obtained = 0
-                    
-                gp, letter = get_grade_point(obtained, max_tot, grading_scheme)
-                
-                # Update Mark Record
-                m.grade_point = gp
-                m.grade_letter = letter
-                
-                # SGPA Calculation Accumulation
-                credits = credit_map.get(m.subject_id_fk, 0)
-                if credits > 0:
-                    total_registered_credits += credits
-                    if not m.is_absent: 
-                        total_points += (gp * credits)
-                        if letter != "F":
-                            total_credits += credits # Credits Earned
-            
-            # 2. Calculate SGPA
-            sgpa = 0.0
-            if total_registered_credits > 0:
-                sgpa = total_points / total_registered_credits
-                
-            # 3. Update/Create StudentSemesterResult
-            result = db.session.execute(
-                select(StudentSemesterResult).filter_by(
-                    student_id_fk=student_id,
-                    scheme_id_fk=scheme_id
-                )
-            ).scalars().first()
-            
-            if not result:
-                result = StudentSemesterResult(
-                    student_id_fk=student_id,
-                    program_id_fk=scheme.program_id_fk,
-                    scheme_id_fk=scheme_id,
-                    semester=scheme.semester,
-                    academic_year=scheme.academic_year,
-                    attempt_no=1 
-                )
-                db.session.add(result)
-                
-            result.total_credits_registered = total_registered_credits
-            result.total_credits_earned = total_credits
-            result.sgpa = round(sgpa, 2)
-            
-            processed_count += 1
-            
+        existing = {}
+        for result_id, student_id in db.session.execute(
+            select(StudentSemesterResult.result_id, StudentSemesterResult.student_id_fk)
+            .filter_by(scheme_id_fk=scheme_id)
+            .order_by(StudentSemesterResult.result_id.asc())
+        ).all():
+            existing.setdefault(student_id, result_id)
+
+        result_updates = []
+        result_inserts = []
+        for student_id, (registered, earned, total_points) in per_student.items():
+            values = {
+                "total_credits_registered": registered,
+                "total_credits_earned": earned,
+                "sgpa": round((total_points / registered) if registered > 0 else 0.0, 2),
+            }
+            if student_id in existing:
+                values["result_id"] = existing[student_id]
+                result_updates.append(values)
+            else:
+                values.update({
+                    "student_id_fk": student_id,
+                    "program_id_fk": scheme.program_id_fk,
+                    "scheme_id_fk": scheme_id,
+                    "semester": scheme.semester,
+                    "academic_year": scheme.academic_year,
+                    "attempt_no": 1,
+                })
+                result_inserts.append(values)
+
+        if mark_updates:
+            db.session.bulk_update_mappings(ExamMark, mark_updates)
+        if result_updates:
+            db.session.bulk_update_mappings(StudentSemesterResult, result_updates)
+        if result_inserts:
+            db.session.bulk_insert_mappings(StudentSemesterResult, result_inserts)
+        invalidate_results("exams", program_id=scheme.program_id_fk, semester=scheme.semester)
         db.session.commit()
+        processed_count = len(per_student)
         return True, f"Results calculated for {processed_count} students.", processed_count
         
     except Exception as e:
         db.session.rollback()
         return False, str(e), 0
+
+
+@job_handler("exam_results", max_attempts=2)
+def _exam_results_job(ctx, scheme_id):
+    ctx.progress(5, "Calculating results")
+    success, message, count = calculate_exam_results(scheme_id)
+    if not success:
+        if "not found" in message.lower() or "no marks" in message.lower():
+            return {"message": message, "warnings": [message], "count": 0}
+        raise RuntimeError(message)
+    return {"message": message, "count": count}
+
+
+def mark_is_pass(scheme, internal, external, total, is_absent):
+    if is_absent:
+        return False
+    if getattr(scheme, "min_internal_marks", None) is not None:
+        try:
+            if internal is None or float(internal) < float(scheme.min_internal_marks or 0):
+                return False
+        except Exception:
+            return False
+    if getattr(scheme, "min_external_marks", None) is not None:
+        try:
+            if external is None or float(external) < float(scheme.min_external_marks or 0):
+                return False
+        except Exception:
+            return False
+    if getattr(scheme, "min_total_marks", None) is not None:
+        try:
+            if total is None or float(total) < float(scheme.min_total_marks or 0):
+                return False
+        except Exception:
+            return False
+    return True
+
+
+_MARK_KEY = ["student_id_fk", "subject_id_fk", "semester", "academic_year", "attempt_no"]
+
+
+def _upsert_new_marks(rows):
+    """Insert new marks; a concurrent row on ``uq_exam_mark_attempt`` is updated instead.
+
+    Only a row saved under the same scheme is overwritten; one that belongs to
+    another scheme is left untouched (``ingest_marks`` reports those up front).
+    """
+    dialect = db.engine.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(ExamMark.__table__).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=_MARK_KEY,
+            set_={
+                "internal_marks": stmt.excluded.internal_marks,
+                "external_marks": stmt.excluded.external_marks,
+                "total_marks": stmt.excluded.total_marks,
+                "is_absent": stmt.excluded.is_absent,
+                "updated_at": utc_now(),
+            },
+            where=ExamMark.__table__.c.scheme_id_fk == stmt.excluded.scheme_id_fk,
+        )
+        db.session.execute(stmt)
+    else:
+        db.session.bulk_insert_mappings(ExamMark, rows)
+
+
+def ingest_marks(scheme, subject_id, entries, actor=None, track_flips=False):
+    """Bulk save marks for one (scheme, subject).
+
+    ``entries`` is an iterable of dicts with ``student_id``, ``internal``,
+    ``external`` and ``is_absent``. Existing marks are prefetched in one
+    query and diffed in memory; updates go out as one executemany and new
+    rows as one INSERT ... ON CONFLICT. When ``track_flips`` is set (scheme
+    frozen but temporarily unlocked) pass/fail changes are written to
+    ``DataAuditLog``. ``actor`` carries ``user_id``, ``role`` and
+    ``trust_id`` for the audit rows. The caller commits.
+
+    Students whose attempt already has marks under another scheme are skipped
+    and listed in ``conflicts``.
+
+    Returns ``{"inserts", "updates", "changed_students", "flips", "conflicts"}``.
+    """
+    actor = actor or {}
+    subject_id = int(subject_id)
+    entries = [e for e in (entries or []) if e.get("student_id")]
+    student_ids = list(dict.fromkeys(e["student_id"] for e in entries))
+
+    existing = {}
+    if student_ids:
+        for row in db.session.execute(
+            select(
+                ExamMark.exam_mark_id,
+                ExamMark.student_id_fk,
+                ExamMark.internal_marks,
+                ExamMark.external_marks,
+                ExamMark.total_marks,
+                ExamMark.is_absent,
+            )
+            .filter(
+                ExamMark.scheme_id_fk == scheme.scheme_id,
+                ExamMark.subject_id_fk == subject_id,
+                ExamMark.student_id_fk.in_(student_ids),
+            )
+            .order_by(ExamMark.exam_mark_id.asc())
+        ).all():
+            existing.setdefault(row.student_id_fk, row)
+
+    taken = set()
+    if student_ids:
+        taken = set(
+            db.session.execute(
+                select(ExamMark.student_id_fk).filter(
+                    ExamMark.scheme_id_fk != scheme.scheme_id,
+                    ExamMark.subject_id_fk == subject_id,
+                    ExamMark.semester == scheme.semester,
+                    ExamMark.academic_year == scheme.academic_year,
+                    ExamMark.attempt_no == 1,
+                    ExamMark.student_id_fk.in_(student_ids),
+                )
+            ).scalars().all()
+        )
+
+    updates = []
+    inserts = {}
+    conflicts = []
+    flip_logs = []
+    now = utc_now()
+    for e in entries:
+        enrollment = e["student_id"]
+        internal = e.get("internal")
+        external = e.get("external")
+        is_absent = bool(e.get("is_absent"))
+        total = (internal or 0) + (external or 0)
+        old = existing.get(enrollment)
+        if old is None:
+            # Only create if there is some data to save
+            if internal is None and external is None and not is_absent:
+                continue
+            if enrollment in taken:
+                if enrollment not in conflicts:
+                    conflicts.append(enrollment)
+                continue
+            inserts[enrollment] = {
+                "scheme_id_fk": scheme.scheme_id,
+                "subject_id_fk": subject_id,
+                "student_id_fk": enrollment,
+                "semester": scheme.semester,
+                "academic_year": scheme.academic_year,
+                "attempt_no": 1,
+                "internal_marks": internal,
+                "external_marks": external,
+                "total_marks": total,
+                "is_absent": is_absent,
+                "created_at": now,
+            }
+            continue
+        updates.append({
+            "exam_mark_id": old.exam_mark_id,
+            "internal_marks": internal,
+            "external_marks": external,
+            "total_marks": total,
+            "is_absent": is_absent,
+        })
+        if track_flips:
+            old_pass = mark_is_pass(scheme, old.internal_marks, old.external_marks, old.total_marks, bool(old.is_absent))
+            new_pass = mark_is_pass(scheme, internal, external, total, is_absent)
+            if new_pass != old_pass:
+                flip_logs.append({
+                    "action": "exam_pass_fail_flip",
+                    "actor_user_id_fk": actor.get("user_id"),
+                    "actor_role": actor.get("role"),
+                    "trust_id_fk": actor.get("trust_id"),
+                    "program_id_fk": getattr(scheme, "program_id_fk", None),
+                    "semester": getattr(scheme, "semester", None),
+                    "selection_json": json.dumps({"scheme_id": scheme.scheme_id, "subject_id": subject_id, "student_id": enrollment}),
+                    "counts_json": json.dumps({
+                        "old_pass": bool(old_pass),
+                        "new_pass": bool(new_pass),
+                        "old_total": old.total_marks,
+                        "new_total": total,
+                        "unlock_until": (scheme.unlock_until.isoformat() if getattr(scheme, "unlock_until", None) else None),
+                        "unlock_reason": (scheme.unlock_reason or ""),
+                    }),
+                    "created_at": now,
+                })
+
+    if updates:
+        db.session.bulk_update_mappings(ExamMark, updates)
+    if inserts:
+        _upsert_new_marks(list(inserts.values()))
+    if flip_logs:
+        db.session.bulk_insert_mappings(DataAuditLog, flip_logs)
+    if updates or inserts:
+        invalidate_results("exams", program_id=getattr(scheme, "program_id_fk", None), semester=getattr(scheme, "semester", None))
+
+    stats = {
+        "inserts": len(inserts),
+        "updates": len(updates),
+        "changed_students": len(inserts) + len(updates),
+        "flips": len(flip_logs),
+        "conflicts": conflicts,
+    }
+    db.session.add(
+        DataAuditLog(
+            action="exam_marks_save",
+            actor_user_id_fk=actor.get("user_id"),
+            actor_role=actor.get("role"),
+            trust_id_fk=actor.get("trust_id"),
+            program_id_fk=getattr(scheme, "program_id_fk", None),
+            semester=getattr(scheme, "semester", None),
+            selection_json=json.dumps({"scheme_id": scheme.scheme_id, "subject_id": subject_id}),
+            counts_json=json.dumps(
+                {
+                    "inserts": stats["inserts"],
+                    "updates": stats["updates"],
+                    "changed_students": stats["changed_students"],
+                    "is_frozen": bool(getattr(scheme, "is_frozen", False)),
+                    "unlock_until": (scheme.unlock_until.isoformat() if getattr(scheme, "unlock_until", None) else None),
+                    "flips_flagged": stats["flips"],
+                    "conflicts": len(conflicts),
+                }
+            ),
+        )
+    )
+    return stats
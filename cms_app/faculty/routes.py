@@ -1,7 +1,7 @@
 from flask import render_template, flash, redirect, url_for, request
 from flask_login import login_required, current_user
 from .. import db
-from ..models import Faculty, CourseAssignment, Subject, Division, Program, TimetableSlot, TimetableSettings, Attendance, Student
+from ..models import Faculty, CourseAssignment, Subject, Division, Program, TimetableSlot, TimetableSettings, Attendance, AttendanceSessionRollup, Student
 from ..decorators import role_required
 from . import faculty_bp
 from sqlalchemy import and_, func, case, distinct, select, or_
@@ -87,7 +87,7 @@ def dashboard():
     }
     
     # Build list of (subject_id, division_id) for filtering
-    assigned_pairs = [(a.CourseAssignment.subject_id_fk, a.CourseAssignment.division_id_fk) for a in assignments]
+    assigned_pairs = [(assign.subject_id_fk, assign.division_id_fk) for assign, _, _, _ in assignments]
     
     if assigned_pairs:
         # Define date ranges
@@ -95,46 +95,26 @@ def dashboard():
         start_of_week = today - timedelta(days=today.weekday()) # Monday
         start_of_month = today.replace(day=1)
         
-        # Base query: distinct lectures (date, period, subject, division)
-        # We filter by the assigned subject/division pairs
+        # Session rollups hold one row per lecture (date, period, subject, division)
+        # for the assigned subject/division pairs, so the counts are plain aggregates.
         conditions = [
             and_(
-                Attendance.subject_id_fk == sid,
-                Attendance.division_id_fk == did
+                AttendanceSessionRollup.subject_id_fk == sid,
+                AttendanceSessionRollup.division_id_fk == did
             ) for sid, did in assigned_pairs
         ]
         
         if conditions:
-            base_q = db.session.query(
-                Attendance.date_marked, 
-                Attendance.period_no, 
-                Attendance.subject_id_fk, 
-                Attendance.division_id_fk
-            ).filter(or_(*conditions)).group_by(
-                Attendance.date_marked, 
-                Attendance.period_no, 
-                Attendance.subject_id_fk, 
-                Attendance.division_id_fk
-            )
-            
-            # Fetch all unique lectures for these assignments
-            # Note: This might be heavy if history is huge, but for a single faculty it's okay.
-            # Optimization: We can do 3 separate count queries or fetch all distinct dates and process in python.
-            # Let's fetch all relevant unique lectures (date only matters for week/month check)
-            
-            all_lectures = base_q.all()
-            
-            for l_date, l_period, l_sub, l_div in all_lectures:
-                # Total
-                lecture_stats["total"] += 1
-                
-                # Week
-                if l_date >= start_of_week:
-                    lecture_stats["week"] += 1
-                    
-                # Month
-                if l_date >= start_of_month:
-                    lecture_stats["month"] += 1
+            total, week, month = db.session.execute(
+                select(
+                    func.count(),
+                    func.sum(case((AttendanceSessionRollup.date_marked >= start_of_week, 1), else_=0)),
+                    func.sum(case((AttendanceSessionRollup.date_marked >= start_of_month, 1), else_=0)),
+                ).select_from(AttendanceSessionRollup).filter(or_(*conditions))
+            ).one()
+            lecture_stats["total"] = int(total or 0)
+            lecture_stats["week"] = int(week or 0)
+            lecture_stats["month"] = int(month or 0)
 
     # 4. Identify At-Risk Students (< 60% Attendance)
     at_risk_students = []
@@ -145,11 +125,15 @@ def dashboard():
         # Query: Student ID, Subject ID, Total Lectures, Present Count
         
         # 1. Total Lectures per Subject-Division (Denominator)
-        # We already have 'all_lectures'. Let's organize it by (subject_id, division_id) -> count
-        subject_div_counts = {}
-        for l_date, l_period, l_sub, l_div in all_lectures:
-            key = (l_sub, l_div)
-            subject_div_counts[key] = subject_div_counts.get(key, 0) + 1
+        # One session rollup row per lecture, so a grouped count gives (subject_id, division_id) -> count
+        subject_div_counts = {
+            (l_sub, l_div): int(cnt or 0)
+            for l_sub, l_div, cnt in db.session.execute(
+                select(AttendanceSessionRollup.subject_id_fk, AttendanceSessionRollup.division_id_fk, func.count())
+                .filter(or_(*conditions))
+                .group_by(AttendanceSessionRollup.subject_id_fk, AttendanceSessionRollup.division_id_fk)
+            ).all()
+        }
             
         # 2. Student Attendance Counts (Numerator)
         # Query: Student, Subject, Division, Count(Present)
@@ -235,11 +219,9 @@ def dashboard():
                             "total": total_lectures
                         })
         div_info = {}
-        for a in assignments:
-            div_id = a.Division.division_id
+        for _, _, div, prog in assignments:
+            div_id = div.division_id
             if div_id not in div_info:
-                prog = a.Program
-                div = a.Division
                 div_info[div_id] = {
                     "program_code": prog.program_code or prog.program_name,
                     "semester": div.semester,
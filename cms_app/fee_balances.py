@@ -0,0 +1,176 @@
+from sqlalchemy import case, delete, func, insert, select
+
+from . import db
+from .models import FeePayment, Institute, Program, StudentFeeBalance
+from .result_cache import invalidate as invalidate_results
+
+
+# Student fee balances are refreshed per student from the raw fee_payments rows
+# (like the attendance rollups) rather than by applying deltas, so verifying,
+# rejecting or re-tagging a payment can never leave the totals out of step.
+# Due amounts are not stored: they come from FeeStructure with one grouped query
+# per program (see fee_ledger), so structure edits and freezes need no upkeep.
+
+_COLUMNS = [
+    "enrollment_no",
+    "program_id_fk",
+    "semester",
+    "medium_tag",
+    "verified_total",
+    "submitted_total",
+    "verified_count",
+    "submitted_count",
+    "rejected_count",
+    "last_payment_at",
+]
+
+
+def _aggregate_select(*criteria):
+    status = func.lower(func.coalesce(FeePayment.status, ""))
+    medium = func.coalesce(FeePayment.medium_tag, "")
+    return (
+        select(
+            FeePayment.enrollment_no,
+            FeePayment.program_id_fk,
+            FeePayment.semester,
+            medium,
+            func.sum(case((status == "verified", FeePayment.amount), else_=0.0)),
+            func.sum(case((status == "submitted", FeePayment.amount), else_=0.0)),
+            func.count(case((status == "verified", 1))),
+            func.count(case((status == "submitted", 1))),
+            func.count(case((status == "rejected", 1))),
+            func.max(FeePayment.created_at),
+        )
+        .where(
+            FeePayment.enrollment_no.isnot(None),
+            FeePayment.program_id_fk.isnot(None),
+            FeePayment.semester.isnot(None),
+            *criteria,
+        )
+        .group_by(FeePayment.enrollment_no, FeePayment.program_id_fk, FeePayment.semester, medium)
+    )
+
+
+class BalanceTracker:
+    """Collects the students whose payments were written in this transaction.
+
+    Call :meth:`add` for each ``FeePayment`` before and after changing it, then
+    :meth:`flush` inside the same transaction before committing.
+    """
+
+    def __init__(self):
+        self.enrollments = set()
+
+    def add(self, payment):
+        if payment is not None and payment.enrollment_no:
+            self.enrollments.add(payment.enrollment_no)
+
+    def flush(self):
+        db.session.flush()
+        refresh_students(self.enrollments)
+        self.enrollments = set()
+
+
+def refresh_students(enrollment_nos):
+    """Recompute every balance row of the given students; the caller commits."""
+    enrollment_nos = sorted({e for e in (enrollment_nos or []) if e})
+    if not enrollment_nos:
+        return 0
+    db.session.execute(
+        delete(StudentFeeBalance)
+        .where(StudentFeeBalance.enrollment_no.in_(enrollment_nos))
+        .execution_options(synchronize_session=False)
+    )
+    result = db.session.execute(
+        insert(StudentFeeBalance).from_select(_COLUMNS, _aggregate_select(FeePayment.enrollment_no.in_(enrollment_nos)))
+    )
+    return result.rowcount or 0
+
+
+def rebuild(program_id=None):
+    """Rebuild balances from ``fee_payments`` (optionally for one program); the caller commits."""
+    stmt = delete(StudentFeeBalance)
+    criteria = []
+    if program_id:
+        stmt = stmt.where(StudentFeeBalance.program_id_fk == program_id)
+        criteria.append(FeePayment.program_id_fk == program_id)
+    db.session.execute(stmt.execution_options(synchronize_session=False))
+    db.session.execute(insert(StudentFeeBalance).from_select(_COLUMNS, _aggregate_select(*criteria)))
+    invalidate_results("fees", program_id=program_id)
+    q = select(func.count()).select_from(StudentFeeBalance)
+    if program_id:
+        q = q.where(StudentFeeBalance.program_id_fk == program_id)
+    return int(db.session.scalar(q) or 0)
+
+
+def _amount_drift(a, b):
+    return abs(float(a or 0.0) - float(b or 0.0)) > 0.005
+
+
+def find_drift(program_id=None):
+    """Compare stored balances with fresh aggregates of ``fee_payments``.
+
+    Returns ``[{"key": (enrollment, program, semester, medium), "kind":
+    "missing" | "stale" | "orphan"}, ...]``.
+    """
+    criteria = [FeePayment.program_id_fk == program_id] if program_id else []
+    expected = {tuple(r[:4]): r[4:] for r in db.session.execute(_aggregate_select(*criteria)).all()}
+    q = select(*[getattr(StudentFeeBalance, c) for c in _COLUMNS])
+    if program_id:
+        q = q.where(StudentFeeBalance.program_id_fk == program_id)
+    stored = {tuple(r[:4]): r[4:] for r in db.session.execute(q).all()}
+
+    drift = []
+    for key, fresh in expected.items():
+        have = stored.get(key)
+        if have is None:
+            drift.append({"key": key, "kind": "missing"})
+        elif (
+            _amount_drift(have[0], fresh[0])
+            or _amount_drift(have[1], fresh[1])
+            or tuple(int(v or 0) for v in have[2:5]) != tuple(int(v or 0) for v in fresh[2:5])
+        ):
+            drift.append({"key": key, "kind": "stale"})
+    for key in stored:
+        if key not in expected:
+            drift.append({"key": key, "kind": "orphan"})
+    return drift
+
+
+def reconcile(program_id=None, repair=True):
+    """Report (and by default repair) balance drift; the caller commits.
+
+    Returns ``{"checked", "drift", "by_kind", "sample", "repaired"}``.
+    """
+    drift = find_drift(program_id)
+    by_kind = {}
+    for d in drift:
+        by_kind[d["kind"]] = by_kind.get(d["kind"], 0) + 1
+    repaired = 0
+    if repair and drift:
+        refresh_students({d["key"][0] for d in drift})
+        repaired = len(drift)
+    q = select(func.count()).select_from(StudentFeeBalance)
+    if program_id:
+        q = q.where(StudentFeeBalance.program_id_fk == program_id)
+    return {
+        "checked": int(db.session.scalar(q) or 0),
+        "drift": len(drift),
+        "by_kind": by_kind,
+        "sample": [list(d["key"]) + [d["kind"]] for d in drift[:20]],
+        "repaired": repaired,
+    }
+
+
+def status_counts(trust_id=None):
+    """``(submitted_count, rejected_count)`` across balances, optionally for one trust."""
+    q = select(func.sum(StudentFeeBalance.submitted_count), func.sum(StudentFeeBalance.rejected_count))
+    if trust_id:
+        q = (
+            q.join(Program, StudentFeeBalance.program_id_fk == Program.program_id)
+            .join(Institute, Program.institute_id_fk == Institute.institute_id)
+            .where(Institute.trust_id_fk == trust_id)
+        )
+    submitted, rejected = db.session.execute(q).first() or (0, 0)
+    return int(submitted or 0), int(rejected or 0)
+
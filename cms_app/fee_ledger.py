@@ -0,0 +1,179 @@
+from sqlalchemy import func, or_, select
+
+from . import db
+from .models import FeeStructure, FeesRecord, Student, StudentFeeBalance
+
+
+# Set-based fee ledger shared by the fee reports. Every figure comes from a
+# handful of grouped queries per report (structure sums, payment totals per
+# student from the student_fee_balance projection, FeesRecord fallbacks) instead
+# of per-student lookups; classification into full/partial/none buckets is then
+# a single pass in Python.
+
+BUCKETS = ("full", "partial", "none")
+
+# Paid amounts within this of the due amount count as fully paid
+TOLERANCE = 0.01
+
+
+def classify(due, paid):
+    """Bucket for a student owing ``due`` who has paid ``paid``."""
+    if due > 0.0:
+        if paid >= due - TOLERANCE:
+            return "full"
+        return "partial" if paid > 0.0 else "none"
+    return "partial" if paid > 0.0 else "none"
+
+
+def structure_sums(program_id, semester=None, active_only=False):
+    """``(common_sum, {medium_tag: sum})`` of the program's fee components.
+
+    Components without a medium apply to everyone; ``semester`` also matches
+    components with no semester.
+    """
+    q = select(FeeStructure.medium_tag, func.sum(FeeStructure.amount)).group_by(FeeStructure.medium_tag)
+    if program_id:
+        q = q.where(FeeStructure.program_id_fk == program_id)
+    if semester is not None:
+        q = q.where(or_(FeeStructure.semester == semester, FeeStructure.semester.is_(None)))
+    if active_only:
+        q = q.where(FeeStructure.is_active == True)
+    common_sum = 0.0
+    medium_sums = {}
+    for medium_tag, total in db.session.execute(q).all():
+        mt = (medium_tag or "").strip()
+        if mt:
+            medium_sums[mt] = medium_sums.get(mt, 0.0) + float(total or 0.0)
+        else:
+            common_sum += float(total or 0.0)
+    return common_sum, medium_sums
+
+
+def payment_totals(program_id=None, semester=None, medium=None, include_untagged=False):
+    """Per-student payment aggregates from the ``student_fee_balance`` projection.
+
+    Returns ``{enrollment_no: {"verified", "submitted", "submitted_count",
+    "rejected_count"}}``. ``include_untagged`` also counts payments without a
+    medium when ``medium`` is given. Status matching is case-insensitive.
+    """
+    B = StudentFeeBalance
+    q = select(
+        B.enrollment_no,
+        func.sum(B.verified_total),
+        func.sum(B.submitted_total),
+        func.sum(B.submitted_count),
+        func.sum(B.rejected_count),
+    ).group_by(B.enrollment_no)
+    if program_id:
+        q = q.where(B.program_id_fk == program_id)
+    if semester:
+        q = q.where(B.semester == semester)
+    if medium:
+        cond = B.medium_tag == medium
+        q = q.where(or_(cond, B.medium_tag == "") if include_untagged else cond)
+    return {
+        enr: {
+            "verified": float(verified or 0.0),
+            "submitted": float(submitted or 0.0),
+            "submitted_count": int(submitted_count or 0),
+            "rejected_count": int(rejected_count or 0),
+        }
+        for enr, verified, submitted, submitted_count, rejected_count in db.session.execute(q).all()
+    }
+
+
+def record_dues(enrollments, semester=None):
+    """``{enrollment_no: amount_due}`` from each student's first FeesRecord.
+
+    ``enrollments`` is a column or subquery of enrollment numbers to restrict to.
+    """
+    q = select(FeesRecord.student_id_fk, FeesRecord.amount_due).where(FeesRecord.student_id_fk.in_(enrollments)).order_by(FeesRecord.fee_id)
+    if semester:
+        q = q.where(FeesRecord.semester == semester)
+    dues = {}
+    for enr, amount_due in db.session.execute(q).all():
+        if enr not in dues:
+            dues[enr] = float(amount_due or 0.0)
+    return dues
+
+
+def program_ledger(student_stmt, program_id, semester=None, medium=None, include_submitted=False):
+    """Due, paid and bucket for every student selected by ``student_stmt``.
+
+    ``student_stmt`` must select an ``enrollment_no`` column (and may carry
+    ``medium_tag``). A student's due is the common components plus those for
+    their medium, falling back to ``FeesRecord.amount_due`` when that is zero;
+    paid is verified payments, plus submitted ones with ``include_submitted``.
+    Returns a dict with ``common_sum``, ``medium_sums``, ``due_base`` (the due
+    shown for the filtered medium), ``entries`` in ``student_stmt`` order and
+    per-bucket ``totals``.
+    """
+    rows = db.session.execute(student_stmt).mappings().all()
+    common_sum, medium_sums = structure_sums(program_id, semester)
+    payments = payment_totals(program_id, semester, medium, include_untagged=True)
+
+    dues = {}
+    for row in rows:
+        enr = row.get("enrollment_no")
+        if enr:
+            dues[enr] = common_sum + medium_sums.get((row.get("medium_tag") or "").strip(), 0.0)
+    fallback = {}
+    if any(d <= 0.0 for d in dues.values()):
+        fallback = record_dues(select(student_stmt.subquery().c.enrollment_no), semester)
+
+    entries = []
+    totals = {b: {"count": 0, "paid_sum": 0.0, "due_sum": 0.0} for b in BUCKETS}
+    for row in rows:
+        enr = row.get("enrollment_no")
+        if not enr:
+            continue
+        pay = payments.get(enr) or {}
+        paid = pay.get("verified", 0.0) + (pay.get("submitted", 0.0) if include_submitted else 0.0)
+        due = dues[enr]
+        if due <= 0.0 and fallback.get(enr, 0.0) > 0.0:
+            due = fallback[enr]
+        bucket = classify(due, paid)
+        outstanding = max(due - paid, 0.0)
+        entries.append({"enrollment_no": enr, "row": row, "paid": paid, "due_total": due, "outstanding": outstanding, "bucket": bucket})
+        totals[bucket]["count"] += 1
+        totals[bucket]["paid_sum"] += paid
+        totals[bucket]["due_sum"] += outstanding
+    return {
+        "common_sum": common_sum,
+        "medium_sums": medium_sums,
+        "due_base": common_sum + (medium_sums.get(medium, 0.0) if medium else 0.0),
+        "entries": entries,
+        "totals": totals,
+    }
+
+
+def payment_status_summary(payment_query):
+    """``(count, amount, {status: count})`` for a ``select(FeePayment)`` in one query."""
+    sub = payment_query.subquery()
+    by_status = {}
+    count = 0
+    amount = 0.0
+    for status, c, total in db.session.execute(
+        select(sub.c.status, func.count(), func.sum(sub.c.amount)).group_by(sub.c.status)
+    ).all():
+        by_status[str(status or "")] = int(c or 0)
+        count += int(c or 0)
+        amount += float(total or 0.0)
+    return count, amount, by_status
+
+
+def collected_by_program(trust_id, start_date, end_date, program_ids=None):
+    """``{program_id: FeesRecord.amount_paid total}`` for payments in the date range."""
+    q = (
+        select(Student.program_id_fk, func.sum(FeesRecord.amount_paid))
+        .join(Student, Student.enrollment_no == FeesRecord.student_id_fk)
+        .where(
+            Student.trust_id_fk == trust_id,
+            FeesRecord.date_paid >= start_date,
+            FeesRecord.date_paid <= end_date,
+        )
+        .group_by(Student.program_id_fk)
+    )
+    if program_ids is not None:
+        q = q.where(Student.program_id_fk.in_(program_ids))
+    return {pid: float(total or 0.0) for pid, total in db.session.execute(q).all()}
@@ -0,0 +1,167 @@
+from contextlib import contextmanager
+from datetime import datetime
+
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+from sqlalchemy import select
+
+from . import db
+
+
+# Shared plumbing for the Excel importers in scripts/. Workbooks are opened
+# read-only so rows stream from the sheet XML instead of building the full cell
+# DOM, rows are handled in fixed-size chunks against prefetched lookup maps, and
+# each chunk is committed (or flushed, for dry runs) before the next is read, so
+# memory and per-row cost stay flat on large university dumps.
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def _xls_value(book, cell):
+    import xlrd
+
+    if cell.ctype == xlrd.XL_CELL_DATE:
+        try:
+            return xlrd.xldate_as_datetime(cell.value, book.datemode)
+        except Exception:
+            return cell.value
+    if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+        return None
+    return cell.value
+
+
+class SheetReader:
+    """Streams one worksheet as ``(row_number, values)`` tuples.
+
+    ``headers`` holds the first row, ``total`` the number of data rows when the
+    file records its dimensions (``None`` otherwise).
+    """
+
+    def __init__(self, rows, headers, total=None, title=None):
+        self._rows = rows
+        self.headers = headers
+        self.total = total
+        self.title = title
+
+    def __iter__(self):
+        return self._rows
+
+
+def _xlsx_sheet(ws):
+    rows = ws.iter_rows(values_only=True)
+    headers = [v if v is not None else "" for v in (next(rows, None) or ())]
+    total = None
+    try:
+        if ws.max_row:
+            total = max(0, int(ws.max_row) - 1)
+    except Exception:
+        total = None
+    return SheetReader(enumerate(rows, start=2), headers, total=total, title=ws.title)
+
+
+def _xls_sheet(book, sheet):
+    def rows():
+        for r in range(1, sheet.nrows):
+            yield r + 1, tuple(_xls_value(book, c) for c in sheet.row(r))
+
+    headers = [sheet.cell_value(0, c) for c in range(sheet.ncols)] if sheet.nrows else []
+    return SheetReader(rows(), headers, total=max(0, sheet.nrows - 1), title=sheet.name)
+
+
+@contextmanager
+def open_workbook(path):
+    """Yield the worksheets of ``path`` as a list of :class:`SheetReader`.
+
+    ``.xlsx``/``.xlsm`` files go through openpyxl in read-only mode; legacy
+    ``.xls`` files fall back to xlrd (loaded on demand). Sheets are only parsed
+    as their rows are consumed.
+    """
+    try:
+        wb = load_workbook(filename=path, read_only=True, data_only=True)
+    except InvalidFileException:
+        import xlrd
+
+        book = xlrd.open_workbook(path, on_demand=True)
+        try:
+            yield [_xls_sheet(book, book.sheet_by_index(i)) for i in range(book.nsheets)]
+        finally:
+            book.release_resources()
+        return
+    try:
+        yield [_xlsx_sheet(ws) for ws in wb.worksheets]
+    finally:
+        wb.close()
+
+
+@contextmanager
+def open_sheet(path):
+    """Like :func:`open_workbook` but yields only the first (active) sheet."""
+    with open_workbook(path) as sheets:
+        if not sheets:
+            raise ValueError("Workbook has no sheets.")
+        yield sheets[0]
+
+
+def row_dict(values, colmap):
+    """Map a row tuple to ``{field: value}`` using a ``{column_index: field}`` map."""
+    return {key: (values[idx] if idx < len(values) else None) for idx, key in colmap.items()}
+
+
+def iter_chunks(iterable, size=DEFAULT_CHUNK_SIZE):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def process_in_chunks(rows, handle_chunk, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False, total=None, progress=None):
+    """Feed ``rows`` to ``handle_chunk(chunk)`` in chunks, committing after each.
+
+    Dry runs flush instead so the caller can roll the whole import back.
+    ``progress(done, total)`` is called after every chunk. Returns the row count.
+    """
+    done = 0
+    for chunk in iter_chunks(rows, chunk_size):
+        handle_chunk(chunk)
+        if dry_run:
+            db.session.flush()
+        else:
+            db.session.commit()
+        done += len(chunk)
+        if progress is not None:
+            progress(done, total)
+    return done
+
+
+def prefetch_in(column, keys, *criteria, chunk_size=DEFAULT_CHUNK_SIZE):
+    """``{key: entity}`` for the entities whose ``column`` is in ``keys``.
+
+    Looks up in IN-batches of ``chunk_size``; ``criteria`` are extra WHERE clauses.
+    """
+    entity = column.class_
+    keys = [k for k in dict.fromkeys(keys) if k is not None and k != ""]
+    found = {}
+    for chunk in iter_chunks(keys, chunk_size):
+        q = select(entity).where(column.in_(chunk))
+        for crit in criteria:
+            q = q.where(crit)
+        for obj in db.session.execute(q).scalars():
+            found.setdefault(getattr(obj, column.key), obj)
+    return found
+
+
+def parse_date(value):
+    """Date from a datetime cell or a common ``d/m/Y``-style string."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%m/%d/%Y"):
+            try:
+                return datetime.strptime(value.strip(), fmt).date()
+            except Exception:
+                pass
+    return None
@@ -0,0 +1,403 @@
+import logging
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, event, exists, func, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from . import cache, db
+from .announcement_inbox import WINDOW_SLACK, unread_count as announcement_unread_count
+from .jobs.services import periodic_task
+from .models import Announcement, AnnouncementInbox, Notification, Student, SystemMessage, SystemMessageRead, User
+
+
+# Per-user unread counters behind the inbox badge. The badge used to recount
+# system messages, announcements and notifications on every page render (with
+# a 15 second cache); now each user has one cached integer that is counted once
+# and then kept current by the writes that change it:
+#
+#   * notifications, system messages and read receipts are picked up from the
+#     session after each flush (so every write path is covered, including the
+#     bulk notification senders and the super admin broadcast pages);
+#   * announcement fan-out and read/unread go through announcement_inbox,
+#     which reports exact deltas here;
+#   * anything that changes who sees what (editing or deactivating an
+#     announcement or system message, a user's role/program/trust, linking a
+#     student record) drops the affected counters so they are recounted.
+#
+# Changes are collected per transaction and only touch the cache after the
+# commit. Only counters that already exist are adjusted; a missing one is
+# recounted on the next page. Announcements and system messages entering or
+# leaving their display window are handled by a periodic reconciler, and every
+# counter expires after INBOX_COUNTER_TTL so any other drift is bounded.
+#
+# Super admins switch between trusts, so their badge is counted per trust with
+# a short TTL instead of being maintained.
+
+log = logging.getLogger(__name__)
+
+SCOPED_TTL = 15
+_PENDING = "inbox_counters"
+_RECONCILED_KEY = "inbox_unread_reconciled_at"
+
+_USER_FIELDS = ("role", "program_id_fk", "trust_id_fk", "is_super_admin")
+_ANNOUNCEMENT_FIELDS = ("is_active", "start_at", "end_at", "trust_id_fk", "program_id_fk")
+_MESSAGE_FIELDS = ("is_active", "start_date", "end_date", "target_role", "target_trust_id")
+
+# Increment a counter only if it exists; a negative result means it drifted, so drop it
+_INCR_EXISTING = """
+if redis.call('exists', KEYS[1]) == 0 then return nil end
+local v = redis.call('incrby', KEYS[1], ARGV[1])
+if v < 0 then redis.call('del', KEYS[1]) end
+return v
+"""
+
+
+def counter_key(user_id):
+    return f"inbox_unread_{user_id}"
+
+
+def _ttl():
+    try:
+        return int(current_app.config.get("INBOX_COUNTER_TTL", 3600))
+    except Exception:
+        return 3600
+
+
+def _naive(value):
+    if value is not None and value.tzinfo is not None:
+        return value.replace(tzinfo=None)
+    return value
+
+
+def _role_of(user):
+    return (getattr(user, "role", "") or "").strip().lower()
+
+
+def _user_role():
+    return func.lower(func.trim(func.coalesce(User.role, "")))
+
+
+def _not_super_admin():
+    return or_(User.is_super_admin.is_(None), User.is_super_admin == False)
+
+
+def _visible_messages(role, trust_id, now):
+    """Conditions for the system messages shown to a role within a trust."""
+    if role:
+        target = or_(SystemMessage.target_role == "all", SystemMessage.target_role == role)
+    else:
+        target = SystemMessage.target_role == "all"
+    if trust_id:
+        trust = or_(SystemMessage.target_trust_id.is_(None), SystemMessage.target_trust_id == trust_id)
+    else:
+        trust = SystemMessage.target_trust_id.is_(None)
+    return and_(
+        SystemMessage.is_active.is_(True),
+        target,
+        trust,
+        or_(SystemMessage.start_date.is_(None), SystemMessage.start_date <= now),
+        or_(SystemMessage.end_date.is_(None), SystemMessage.end_date >= now),
+    )
+
+
+def _message_current(msg, now):
+    start, end = _naive(msg.start_date), _naive(msg.end_date)
+    return bool(msg.is_active) and (start is None or start <= now) and (end is None or end >= now)
+
+
+def _message_shown(msg, role, trust_id, now):
+    """Python twin of ``_visible_messages`` for one message and user."""
+    if not _message_current(msg, now):
+        return False
+    if not (msg.target_role == "all" or (role and msg.target_role == role)):
+        return False
+    return msg.target_trust_id is None or bool(trust_id and msg.target_trust_id == trust_id)
+
+
+def recount(user, trust_id=None, now=None):
+    """Count a user's unread announcements, system messages and notifications."""
+    now = now or datetime.now()
+    user_id = user.user_id
+    role = _role_of(user)
+    total = 0
+    try:
+        total += announcement_unread_count(user_id, trust_id, now)
+    except Exception:
+        pass
+    try:
+        total += db.session.scalar(
+            select(func.count()).select_from(SystemMessage).where(
+                _visible_messages(role, trust_id, now),
+                ~exists().where(SystemMessageRead.message_id_fk == SystemMessage.message_id, SystemMessageRead.user_id_fk == user_id),
+            )
+        ) or 0
+    except Exception:
+        pass
+    if role == "student":
+        try:
+            total += db.session.scalar(
+                select(func.count())
+                .select_from(Notification)
+                .join(Student, Student.enrollment_no == Notification.student_id_fk)
+                .where(Student.user_id_fk == user_id, Notification.is_read == False)
+            ) or 0
+        except Exception:
+            pass
+    return int(total)
+
+
+def badge_count(user, trust_id=None, refresh=False):
+    """Unread count for the badge: the cached counter, counted on a miss."""
+    if getattr(user, "is_super_admin", False):
+        key, ttl = f"{counter_key(user.user_id)}_t{trust_id or 0}", SCOPED_TTL
+    else:
+        key, ttl, trust_id = counter_key(user.user_id), _ttl(), getattr(user, "trust_id_fk", None)
+    if not refresh:
+        try:
+            value = cache.get(key)
+        except Exception:
+            value = None
+        if value is not None:
+            return int(value)
+    value = recount(user, trust_id)
+    try:
+        cache.set(key, value, timeout=ttl)
+    except Exception:
+        pass
+    return value
+
+
+def _pending(session):
+    return session.info.setdefault(_PENDING, {"deltas": Counter(), "stale": set()})
+
+
+def adjust(user_ids, delta, session=None):
+    """Add ``delta`` to the users' counters once the current transaction commits."""
+    deltas = _pending(session or db.session())["deltas"]
+    for user_id in user_ids or ():
+        if user_id:
+            deltas[int(user_id)] += delta
+
+
+def invalidate(user_ids, session=None):
+    """Drop the users' counters once the current transaction commits."""
+    _pending(session or db.session())["stale"].update(int(u) for u in (user_ids or ()) if u)
+
+
+def _bump_all(deltas):
+    backend = cache.cache
+    client = getattr(backend, "_write_client", None)
+    if client is not None:
+        prefix = getattr(backend, "key_prefix", "") or ""
+        pipe = client.pipeline(transaction=False)
+        for user_id, delta in deltas.items():
+            pipe.eval(_INCR_EXISTING, 1, prefix + counter_key(user_id), int(delta))
+        pipe.execute()
+        return
+    ttl = _ttl()
+    for user_id, delta in deltas.items():
+        key = counter_key(user_id)
+        value = cache.get(key)
+        if value is None:
+            continue
+        value = int(value) + delta
+        if value < 0:
+            cache.delete(key)
+        else:
+            cache.set(key, value, timeout=ttl)
+
+
+def _apply(deltas, stale):
+    deltas = {u: d for u, d in deltas.items() if d and u not in stale}
+    try:
+        if deltas:
+            _bump_all(deltas)
+        if stale:
+            cache.delete_many(*[counter_key(u) for u in stale])
+    except Exception:
+        log.warning("inbox counter update failed", exc_info=True)
+
+
+def _users_for_targets(session, roles, trust_ids):
+    """Non-super-admin users a system message with these targets can reach."""
+    roles = {r for r in roles if r}
+    if not roles:
+        return set()
+    q = select(User.user_id).where(_not_super_admin())
+    if "all" not in roles:
+        q = q.where(_user_role().in_(roles))
+    if None not in trust_ids:
+        q = q.where(User.trust_id_fk.in_(trust_ids))
+    return set(session.execute(q).scalars())
+
+
+def _inbox_users(session, announcement_ids):
+    if not announcement_ids:
+        return set()
+    q = select(AnnouncementInbox.user_id_fk).where(AnnouncementInbox.announcement_id_fk.in_(announcement_ids)).distinct()
+    return set(session.execute(q).scalars())
+
+
+def _changed(obj, fields):
+    attrs = inspect(obj).attrs
+    return any(attrs[f].history.has_changes() for f in fields)
+
+
+def _values(obj, field):
+    """Current and previous values of an attribute."""
+    values = set(inspect(obj).attrs[field].history.deleted or ())
+    values.add(getattr(obj, field))
+    return values
+
+
+@event.listens_for(Session, "after_flush")
+def _collect(session, flush_context):
+    now = datetime.now()
+    deltas, stale = Counter(), set()
+    notifications = Counter()  # enrollment_no -> delta
+    recount_students = set()  # enrollment_no
+    reads = []  # (user_id, message_id, delta)
+    announcements = set()
+    targets = []  # (roles, trust_ids, delta or None to invalidate)
+
+    for obj in session.new:
+        if isinstance(obj, Notification):
+            if not obj.is_read:
+                notifications[obj.student_id_fk] += 1
+        elif isinstance(obj, SystemMessageRead):
+            reads.append((obj.user_id_fk, obj.message_id_fk, -1))
+        elif isinstance(obj, SystemMessage):
+            if _message_current(obj, now):
+                targets.append(({obj.target_role}, {obj.target_trust_id}, 1))
+        elif isinstance(obj, Student):
+            if obj.user_id_fk:
+                stale.add(obj.user_id_fk)
+
+    for obj in session.dirty:
+        if isinstance(obj, Notification):
+            history = inspect(obj).attrs.is_read.history
+            if history.has_changes() and bool(history.deleted and history.deleted[0]) != bool(obj.is_read):
+                notifications[obj.student_id_fk] += -1 if obj.is_read else 1
+        elif isinstance(obj, Announcement):
+            if _changed(obj, _ANNOUNCEMENT_FIELDS):
+                announcements.add(obj.announcement_id)
+        elif isinstance(obj, SystemMessage):
+            if _changed(obj, _MESSAGE_FIELDS):
+                targets.append((_values(obj, "target_role"), _values(obj, "target_trust_id"), None))
+        elif isinstance(obj, User):
+            if _changed(obj, _USER_FIELDS):
+                stale.add(obj.user_id)
+        elif isinstance(obj, Student):
+            if _changed(obj, ("user_id_fk",)):
+                stale.update(u for u in _values(obj, "user_id_fk") if u)
+
+    for obj in session.deleted:
+        if isinstance(obj, Notification):
+            recount_students.add(obj.student_id_fk)  # read state may be unloaded
+        elif isinstance(obj, SystemMessageRead):
+            reads.append((obj.user_id_fk, obj.message_id_fk, 1))
+        elif isinstance(obj, Announcement):
+            announcements.add(obj.announcement_id)
+        elif isinstance(obj, SystemMessage):
+            targets.append(({obj.target_role}, {obj.target_trust_id}, None))
+
+    if not (stale or notifications or recount_students or reads or announcements or targets):
+        return
+
+    if notifications or recount_students:
+        rows = session.execute(
+            select(Student.enrollment_no, Student.user_id_fk)
+            .join(User, User.user_id == Student.user_id_fk)
+            .where(Student.enrollment_no.in_(set(notifications) | recount_students), _user_role() == "student")
+        ).all()
+        for enrollment_no, user_id in rows:
+            if enrollment_no in recount_students:
+                stale.add(user_id)
+            else:
+                deltas[user_id] += notifications[enrollment_no]
+
+    if reads:
+        messages = {
+            m.message_id: m
+            for m in session.execute(select(SystemMessage).where(SystemMessage.message_id.in_({r[1] for r in reads}))).scalars()
+        }
+        users = {
+            u.user_id: u
+            for u in session.execute(
+                select(User.user_id, User.role, User.trust_id_fk).where(User.user_id.in_({r[0] for r in reads}), _not_super_admin())
+            )
+        }
+        for user_id, message_id, delta in reads:
+            user, msg = users.get(user_id), messages.get(message_id)
+            if user and msg and _message_shown(msg, _role_of(user), user.trust_id_fk, now):
+                deltas[user_id] += delta
+
+    for roles, trust_ids, delta in targets:
+        user_ids = _users_for_targets(session, roles, trust_ids)
+        if delta is None:
+            stale.update(user_ids)
+        else:
+            for user_id in user_ids:
+                deltas[user_id] += delta
+
+    stale.update(_inbox_users(session, announcements))
+
+    pending = _pending(session)
+    pending["deltas"].update(deltas)
+    pending["stale"].update(stale)
+
+
+@event.listens_for(Session, "after_commit")
+def _flush_counters(session):
+    pending = session.info.pop(_PENDING, None)
+    if pending:
+        _apply(pending["deltas"], pending["stale"])
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_counters(session):
+    session.info.pop(_PENDING, None)
+
+
+def window_changes(since, now):
+    """Users whose badge changed because something entered or left its display window."""
+    user_ids = set(
+        db.session.execute(
+            select(AnnouncementInbox.user_id_fk)
+            .join(Announcement, Announcement.announcement_id == AnnouncementInbox.announcement_id_fk)
+            .where(
+                Announcement.is_active == True,
+                or_(
+                    and_(Announcement.start_at > since + WINDOW_SLACK, Announcement.start_at <= now + WINDOW_SLACK),
+                    and_(Announcement.end_at >= since - WINDOW_SLACK, Announcement.end_at < now - WINDOW_SLACK),
+                ),
+            )
+            .distinct()
+        ).scalars()
+    )
+    messages = db.session.execute(
+        select(SystemMessage.target_role, SystemMessage.target_trust_id).where(
+            SystemMessage.is_active.is_(True),
+            or_(
+                and_(SystemMessage.start_date > since, SystemMessage.start_date <= now),
+                and_(SystemMessage.end_date >= since, SystemMessage.end_date < now),
+            ),
+        )
+    ).all()
+    for target_role, target_trust_id in messages:
+        user_ids |= _users_for_targets(db.session, {target_role}, {target_trust_id})
+    return user_ids
+
+
+@periodic_task("inbox_counters", 60)
+def _reconcile_windows():
+    now = datetime.now()
+    last = cache.get(_RECONCILED_KEY)
+    cache.set(_RECONCILED_KEY, now.timestamp(), timeout=0)
+    if last is None:
+        return
+    stale = window_changes(datetime.fromtimestamp(float(last)), now)
+    if stale:
+        _apply({}, stale)
@@ -0,0 +1,149 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+from flask import g
+
+from . import db
+
+
+# Per-request: how many of the slowest statements to keep for later EXPLAIN.
+_STATEMENTS_PER_REQUEST = 5
+
+_lock = threading.Lock()
+# Tie-breaker for equal timings, so the heap never falls through to comparing
+# the SQL strings or parameter dicts.
+_sequence = itertools.count()
+
+
+def _max_samples():
+    try:
+        return max(1, int(os.environ.get("CMS_SLOW_REQUEST_SAMPLES", "50")))
+    except Exception:
+        return 50
+
+
+def _sample_store(app):
+    store = app.extensions.get("slow_request_samples")
+    if store is None:
+        with _lock:
+            store = app.extensions.get("slow_request_samples")
+            if store is None:
+                store = deque(maxlen=_max_samples())
+                app.extensions["slow_request_samples"] = store
+    return store
+
+
+def record_statement(statement, parameters, elapsed_ms, executemany=False):
+    """Remember the statement if it is one of the slowest seen in this request."""
+    if executemany:
+        return
+    try:
+        heap = g._slow_statements
+    except AttributeError:
+        heap = g._slow_statements = []
+    except Exception:
+        return
+    item = (float(elapsed_ms), next(_sequence), statement, parameters)
+    if len(heap) < _STATEMENTS_PER_REQUEST:
+        heapq.heappush(heap, item)
+    elif item[0] > heap[0][0]:
+        heapq.heapreplace(heap, item)
+
+
+def record_slow_request(app, method, path, endpoint, status, total_ms, db_ms, db_queries):
+    """Called alongside the ``slow_request`` log line; keeps a bounded sample."""
+    statements = sorted(getattr(g, "_slow_statements", None) or [], reverse=True)
+    _sample_store(app).append(
+        {
+            "at": time.time(),
+            "method": method,
+            "path": path,
+            "endpoint": endpoint or "",
+            "status": status,
+            "total_ms": round(float(total_ms), 1),
+            "db_ms": round(float(db_ms), 1),
+            "db_queries": int(db_queries or 0),
+            "statements": [
+                {"elapsed_ms": round(ms, 2), "sql": sql, "parameters": params}
+                for (ms, _, sql, params) in statements
+            ],
+        }
+    )
+
+
+def slowest_endpoints(app, limit=10):
+    """Worst recorded sample per endpoint, slowest first."""
+    worst = {}
+    for sample in list(_sample_store(app)):
+        key = sample.get("endpoint") or sample.get("path")
+        prev = worst.get(key)
+        if prev is None or sample["total_ms"] > prev["total_ms"]:
+            worst[key] = dict(sample, hits=(prev or {}).get("hits", 0) + 1)
+        else:
+            prev["hits"] = prev.get("hits", 0) + 1
+    return sorted(worst.values(), key=lambda s: s["total_ms"], reverse=True)[:limit]
+
+
+def _full_scan_tables(dialect, plan_lines):
+    tables = []
+    for line in plan_lines:
+        text = (line or "").strip()
+        if dialect == "sqlite":
+            # "SCAN attendance" / "SCAN TABLE attendance" without an index is a full scan.
+            if text.startswith("SCAN ") and " USING " not in text:
+                parts = text.split()
+                name = parts[2] if len(parts) > 2 and parts[1] == "TABLE" else parts[1]
+                tables.append(name)
+        elif "Seq Scan on " in text:
+            tables.append(text.split("Seq Scan on ", 1)[1].split()[0])
+    return tables
+
+
+def explain(statement, parameters=None):
+    """Return ``(plan_lines, full_scan_tables)`` for a SELECT statement.
+
+    Uses EXPLAIN QUERY PLAN on SQLite and EXPLAIN elsewhere; neither runs the query.
+    """
+    sql = (statement or "").strip()
+    if not sql.lower().startswith(("select", "with")):
+        return [], []
+    dialect = db.engine.dialect.name
+    prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+    with db.engine.connect() as conn:
+        if parameters:
+            rows = conn.exec_driver_sql(prefix + sql, parameters).fetchall()
+        else:
+            rows = conn.exec_driver_sql(prefix + sql).fetchall()
+    if dialect == "sqlite":
+        plan = [str(row[-1]) for row in rows]
+    else:
+        plan = [str(row[0]) for row in rows]
+    return plan, _full_scan_tables(dialect, plan)
+
+
+def advise(app, limit=10):
+    """EXPLAIN the captured statements of the slowest endpoints and flag full scans."""
+    report = []
+    for sample in slowest_endpoints(app, limit=limit):
+        findings = []
+        for stmt in sample.get("statements") or []:
+            try:
+                plan, scans = explain(stmt["sql"], stmt.get("parameters"))
+                error = None
+            except Exception as e:
+                plan, scans, error = [], [], str(e)
+            findings.append(
+                {
+                    "sql": stmt["sql"],
+                    "elapsed_ms": stmt["elapsed_ms"],
+                    "plan": plan,
+                    "full_scans": scans,
+                    "error": error,
+                }
+            )
+        report.append(dict(sample, findings=findings, full_scans=sorted({t for f in findings for t in f["full_scans"]})))
+    return report
@@ -0,0 +1,99 @@
+import os
+
+from flask import abort, flash, redirect, render_template, send_file, url_for
+from flask_login import current_user, login_required
+from sqlalchemy import select
+
+from . import jobs_bp
+from .. import db, csrf_required
+from ..api_utils import api_error, api_success
+from ..models import BackgroundJob
+from .services import (
+    FINISHED_STATUSES,
+    STATUS_SUCCEEDED,
+    cancel_job,
+    handler_for,
+    job_result,
+    job_to_dict,
+    mark_artifact_downloaded,
+)
+
+
+def _can_view(job):
+    if getattr(current_user, "is_super_admin", False):
+        return True
+    return job.created_by_user_id_fk is not None and job.created_by_user_id_fk == getattr(current_user, "user_id", None)
+
+
+def _get_job_or_404(job_id):
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None or not _can_view(job):
+        abort(404)
+    return job
+
+
+@jobs_bp.route("/jobs", methods=["GET"])
+@login_required
+def jobs_list():
+    q = select(BackgroundJob).order_by(BackgroundJob.job_id.desc()).limit(50)
+    if not getattr(current_user, "is_super_admin", False):
+        q = q.where(BackgroundJob.created_by_user_id_fk == getattr(current_user, "user_id", None))
+    jobs = db.session.execute(q).scalars().all()
+    return render_template("jobs/list.html", jobs=jobs)
+
+
+@jobs_bp.route("/jobs/<int:job_id>", methods=["GET"])
+@login_required
+def job_status(job_id):
+    job = _get_job_or_404(job_id)
+    if job.status == STATUS_SUCCEEDED:
+        spec = handler_for(job.kind) or {}
+        if spec.get("result_template"):
+            return render_template(spec["result_template"], report=job_result(job), programs=[], job=job)
+    return render_template("jobs/status.html", job=job, result=job_result(job), finished=(job.status in FINISHED_STATUSES))
+
+
+@jobs_bp.route("/jobs/<int:job_id>/cancel", methods=["POST"])
+@login_required
+@csrf_required
+def job_cancel(job_id):
+    job = _get_job_or_404(job_id)
+    if cancel_job(job.job_id):
+        flash("Cancellation requested.", "warning")
+    else:
+        flash("Job has already finished.", "info")
+    return redirect(url_for("jobs.job_status", job_id=job.job_id))
+
+
+@jobs_bp.route("/jobs/<int:job_id>/download", methods=["GET"])
+@login_required
+def job_download(job_id):
+    job = _get_job_or_404(job_id)
+    path = job.artifact_path
+    if job.status != STATUS_SUCCEEDED or not path or not os.path.exists(path):
+        flash("This download is no longer available.", "warning")
+        return redirect(url_for("jobs.job_status", job_id=job.job_id))
+    mark_artifact_downloaded(job.job_id)
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+
+
+@jobs_bp.route("/api/jobs/<int:job_id>", methods=["GET"])
+@login_required
+def api_job_status(job_id):
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None or not _can_view(job):
+        return api_error("not_found", "Job not found", 404)
+    return api_success(job_to_dict(job))
+
+
+@jobs_bp.route("/api/jobs/<int:job_id>/cancel", methods=["POST"])
+@login_required
+@csrf_required
+def api_job_cancel(job_id):
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None or not _can_view(job):
+        return api_error("not_found", "Job not found", 404)
+    if not cancel_job(job.job_id):
+        return api_error("conflict", "Job has already finished", 409)
+    db.session.refresh(job)
+    return api_success(job_to_dict(job))
@@ -0,0 +1,424 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import or_, select, update
+
+from .. import db
+from ..models import BackgroundJob
+
+log = logging.getLogger(__name__)
+
+# Jobs live in the ``background_jobs`` table, so the web workers and the job
+# worker (cms_app/scripts/run_jobs_worker.py) only share the database. A worker
+# claims a row with a conditional UPDATE on ``status``; two workers polling the
+# same table can never both start the same job.
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+
+_HANDLERS = {}
+_PERIODIC = {}
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler once a cancel request has been seen."""
+
+
+def job_handler(kind, result_template=None, max_attempts=3):
+    """Register ``fn(ctx, **payload)`` as the handler for ``kind``.
+
+    ``result_template`` is rendered (with ``report=<result>``) on the job page
+    once the job succeeds; without one the generic status page is shown.
+    """
+    def _register(fn):
+        _HANDLERS[kind] = {"fn": fn, "result_template": result_template, "max_attempts": max_attempts}
+        return fn
+    return _register
+
+
+def handler_for(kind):
+    return _HANDLERS.get(kind)
+
+
+def periodic_task(name, interval_seconds):
+    """Register ``fn()`` to run from the worker loop at most once per interval.
+
+    Used for queues that live outside ``background_jobs`` (e.g. the email
+    outbox); ``fn`` runs in an app context and commits its own work.
+    """
+    def _register(fn):
+        _PERIODIC[name] = {"fn": fn, "interval": float(interval_seconds)}
+        return fn
+    return _register
+
+
+def run_periodic(last_run, force=False):
+    """Run the periodic tasks that are due; ``last_run`` maps name -> monotonic time."""
+    ran = 0
+    for name, spec in list(_PERIODIC.items()):
+        now = time.monotonic()
+        if not force and (now - last_run.get(name, 0.0)) < spec["interval"]:
+            continue
+        last_run[name] = now
+        try:
+            spec["fn"]()
+            ran += 1
+        except Exception:
+            db.session.rollback()
+            log.exception("periodic task %s failed", name)
+    return ran
+
+
+def _now():
+    # Stored naive-UTC so comparisons behave the same on SQLite and Postgres.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _loads(raw):
+    try:
+        value = json.loads(raw or "{}")
+    except Exception:
+        return {}
+    return value if isinstance(value, dict) else {}
+
+
+def job_payload(job):
+    return _loads(job.payload_json)
+
+
+def job_result(job):
+    return _loads(job.result_json)
+
+
+def job_to_dict(job):
+    return {
+        "job_id": job.job_id,
+        "kind": job.kind,
+        "label": job.label,
+        "status": job.status,
+        "progress": int(job.progress or 0),
+        "progress_message": job.progress_message,
+        "attempts": int(job.attempts or 0),
+        "max_attempts": int(job.max_attempts or 0),
+        "cancel_requested": bool(job.cancel_requested),
+        "error": job.error,
+        "result": job_result(job) if job.status == STATUS_SUCCEEDED else None,
+        "has_artifact": bool(job.artifact_path),
+        "return_url": job.return_url,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def enqueue(kind, payload=None, label=None, user=None, trust_id=None, return_url=None, max_attempts=None, delay_seconds=None):
+    """Persist a queued job and commit; the caller's pending changes are committed with it."""
+    spec = _HANDLERS.get(kind)
+    if spec is None:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = BackgroundJob(
+        kind=kind,
+        label=(label or kind)[:255],
+        status=STATUS_QUEUED,
+        payload_json=json.dumps(payload or {}, default=str),
+        progress=0,
+        attempts=0,
+        max_attempts=int(max_attempts or spec["max_attempts"] or 1),
+        cancel_requested=False,
+        created_by_user_id_fk=getattr(user, "user_id", None),
+        trust_id_fk=trust_id,
+        return_url=return_url,
+        run_after=(_now() + timedelta(seconds=delay_seconds)) if delay_seconds else None,
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def cancel_job(job_id):
+    """Cancel a queued job outright, or flag a running one for its handler to stop.
+
+    Returns True when the job was cancelled or flagged.
+    """
+    now = _now()
+    res = db.session.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.job_id == job_id, BackgroundJob.status == STATUS_QUEUED)
+        .values(status=STATUS_CANCELLED, cancel_requested=True, finished_at=now, progress_message="Cancelled before start")
+        .execution_options(synchronize_session=False)
+    )
+    if not res.rowcount:
+        res = db.session.execute(
+            update(BackgroundJob)
+            .where(BackgroundJob.job_id == job_id, BackgroundJob.status == STATUS_RUNNING)
+            .values(cancel_requested=True)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    return bool(res.rowcount)
+
+
+def mark_artifact_downloaded(job_id):
+    db.session.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.job_id == job_id)
+        .values(artifact_downloaded_at=_now())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+class JobContext:
+    """Handed to every handler: progress reporting, cancellation and artifacts.
+
+    Progress is written on its own connection so it is visible while the
+    handler's transaction is still open. On SQLite that write waits for any
+    open write transaction, so report progress between units of work (after a
+    commit or before the first write), not in the middle of one.
+    """
+
+    def __init__(self, job):
+        self.job_id = job.job_id
+        self.kind = job.kind
+        self.attempt = int(job.attempts or 0)
+        self.user_id = job.created_by_user_id_fk
+        self.trust_id = job.trust_id_fk
+        self.artifact_path = None
+
+    def progress(self, percent=None, message=None):
+        values = {"heartbeat_at": _now()}
+        if percent is not None:
+            values["progress"] = max(0, min(100, int(percent)))
+        if message is not None:
+            values["progress_message"] = str(message)[:255]
+        table = BackgroundJob.__table__
+        cancelled = False
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.update().where(table.c.job_id == self.job_id).values(**values))
+                cancelled = bool(conn.execute(select(table.c.cancel_requested).where(table.c.job_id == self.job_id)).scalar())
+        except Exception:
+            log.warning("job %s: progress update failed", self.job_id, exc_info=True)
+        if cancelled:
+            raise JobCancelled()
+
+    def check_cancelled(self):
+        self.progress()
+
+    def artifact_dir(self):
+        from flask import current_app
+        path = current_app.config.get("JOBS_ARTIFACT_DIR") or os.path.join(current_app.instance_path, "job_artifacts")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+
+def _finish(job_id, status, result=None, error=None, artifact_path=None, message=None):
+    values = {"status": status, "finished_at": _now(), "locked_by": None}
+    if status == STATUS_SUCCEEDED:
+        values["progress"] = 100
+        values["result_json"] = json.dumps(result if isinstance(result, dict) else {"value": result}, default=str)
+        values["error"] = None
+    if error is not None:
+        values["error"] = error
+    if artifact_path:
+        values["artifact_path"] = artifact_path
+    if message is not None:
+        values["progress_message"] = message[:255]
+    db.session.execute(
+        update(BackgroundJob).where(BackgroundJob.job_id == job_id).values(**values).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def _retry_delay(attempt):
+    return min(30 * (2 ** max(0, attempt - 1)), 15 * 60)
+
+
+def claim(job_id, worker_id):
+    now = _now()
+    res = db.session.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.job_id == job_id, BackgroundJob.status == STATUS_QUEUED)
+        .values(
+            status=STATUS_RUNNING,
+            locked_by=worker_id,
+            started_at=now,
+            heartbeat_at=now,
+            attempts=BackgroundJob.attempts + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return res.rowcount == 1
+
+
+def execute(job_id):
+    """Run a job already claimed by this worker and record its outcome."""
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None:
+        return
+    db.session.refresh(job)
+    spec = _HANDLERS.get(job.kind)
+    if spec is None:
+        _finish(job_id, STATUS_FAILED, error=f"No handler registered for job kind '{job.kind}'.")
+        return
+    ctx = JobContext(job)
+    payload = job_payload(job)
+    try:
+        result = spec["fn"](ctx, **payload)
+        db.session.commit()
+    except JobCancelled:
+        db.session.rollback()
+        _finish(job_id, STATUS_CANCELLED, artifact_path=ctx.artifact_path, message="Cancelled")
+        return
+    except Exception as e:
+        db.session.rollback()
+        log.exception("job %s (%s) failed on attempt %s", job_id, ctx.kind, ctx.attempt)
+        error = f"{type(e).__name__}: {e}"
+        max_attempts = int(job.max_attempts or 1)
+        if ctx.attempt < max_attempts:
+            db.session.execute(
+                update(BackgroundJob)
+                .where(BackgroundJob.job_id == job_id)
+                .values(
+                    status=STATUS_QUEUED,
+                    error=error,
+                    locked_by=None,
+                    run_after=_now() + timedelta(seconds=_retry_delay(ctx.attempt)),
+                    progress_message=f"Retrying after attempt {ctx.attempt} of {max_attempts} failed",
+                )
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+        else:
+            _finish(job_id, STATUS_FAILED, error=error)
+        return
+    _finish(job_id, STATUS_SUCCEEDED, result=result, artifact_path=ctx.artifact_path, message="Done")
+
+
+def _due_job_ids(limit=10):
+    now = _now()
+    q = (
+        select(BackgroundJob.job_id)
+        .where(BackgroundJob.status == STATUS_QUEUED)
+        .where(or_(BackgroundJob.run_after.is_(None), BackgroundJob.run_after <= now))
+        .order_by(BackgroundJob.job_id.asc())
+        .limit(limit)
+    )
+    return [jid for (jid,) in db.session.execute(q).all()]
+
+
+def run_one(worker_id):
+    """Claim and run the oldest due job. Returns its id, or None when idle."""
+    for job_id in _due_job_ids():
+        if claim(job_id, worker_id):
+            execute(job_id)
+            return job_id
+    return None
+
+
+def run_pending(worker_id="inline", limit=None):
+    """Run due jobs in this process until none are left; returns how many ran."""
+    ran = 0
+    while limit is None or ran < limit:
+        if run_one(worker_id) is None:
+            break
+        ran += 1
+    return ran
+
+
+def requeue_stale(stale_after_seconds):
+    """Recover jobs whose worker died mid-run (no heartbeat within the window)."""
+    cutoff = _now() - timedelta(seconds=stale_after_seconds)
+    stale = db.session.execute(
+        select(BackgroundJob.job_id, BackgroundJob.attempts, BackgroundJob.max_attempts)
+        .where(BackgroundJob.status == STATUS_RUNNING)
+        .where(or_(BackgroundJob.heartbeat_at.is_(None), BackgroundJob.heartbeat_at < cutoff))
+    ).all()
+    for job_id, attempts, max_attempts in stale:
+        retry = int(attempts or 0) < int(max_attempts or 1)
+        db.session.execute(
+            update(BackgroundJob)
+            .where(BackgroundJob.job_id == job_id, BackgroundJob.status == STATUS_RUNNING)
+            .values(
+                status=(STATUS_QUEUED if retry else STATUS_FAILED),
+                locked_by=None,
+                error="Worker stopped responding",
+                finished_at=(None if retry else _now()),
+            )
+            .execution_options(synchronize_session=False)
+        )
+    if stale:
+        db.session.commit()
+    return len(stale)
+
+
+def expire_artifacts(ttl_seconds):
+    """Delete artifact files of jobs that finished more than ``ttl_seconds`` ago."""
+    cutoff = _now() - timedelta(seconds=ttl_seconds)
+    rows = db.session.execute(
+        select(BackgroundJob.job_id, BackgroundJob.artifact_path)
+        .where(BackgroundJob.artifact_path.isnot(None))
+        .where(BackgroundJob.finished_at < cutoff)
+    ).all()
+    for job_id, path in rows:
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+        except Exception:
+            continue
+        db.session.execute(
+            update(BackgroundJob).where(BackgroundJob.job_id == job_id).values(artifact_path=None).execution_options(synchronize_session=False)
+        )
+    if rows:
+        db.session.commit()
+    return len(rows)
+
+
+def run_worker(app, worker_id=None, stop_event=None):
+    """Poll for jobs until ``stop_event`` is set (forever when it is None)."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    poll = float(app.config.get("JOBS_POLL_INTERVAL", 2.0))
+    stale_after = int(app.config.get("JOBS_STALE_AFTER", 30 * 60))
+    artifact_ttl = int(app.config.get("JOBS_ARTIFACT_TTL", 24 * 3600))
+    last_sweep = 0.0
+    last_periodic = {}
+    log.info("job worker %s started", worker_id)
+    while not (stop_event is not None and stop_event.is_set()):
+        ran = None
+        with app.app_context():
+            try:
+                if (time.monotonic() - last_sweep) > 60:
+                    requeue_stale(stale_after)
+                    expire_artifacts(artifact_ttl)
+                    last_sweep = time.monotonic()
+                run_periodic(last_periodic)
+                ran = run_one(worker_id)
+            except Exception:
+                db.session.rollback()
+                log.exception("job worker %s: poll failed", worker_id)
+            finally:
+                db.session.remove()
+        if ran is None:
+            if stop_event is not None:
+                stop_event.wait(poll)
+            else:
+                time.sleep(poll)
+    log.info("job worker %s stopped", worker_id)
+
+
+def start_worker_thread(app):
+    """Run a worker inside this process (dev server without a separate worker)."""
+    stop_event = threading.Event()
+    thread = threading.Thread(target=run_worker, args=(app,), kwargs={"worker_id": f"{socket.gethostname()}:{os.getpid()}:thread", "stop_event": stop_event}, daemon=True, name="cms-job-worker")
+    thread.start()
+    return thread, stop_event
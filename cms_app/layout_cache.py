@@ -0,0 +1,367 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import cache
+from .models import Faculty, Program, Student, SystemConfig, SystemMessage, Trust
+
+
+# Two-tier cache for the small lookups made on every page before the view runs
+# (maintenance flag, trust suspension, program theme, user identity, active
+# system messages, the super admin trust switcher). With RedisCache each of
+# those was a network round trip per request; now they are answered from a
+# bounded LRU in the worker first:
+#
+#   1. in-process LRU    LAYOUT_CACHE_SIZE entries, each with its own expiry
+#   2. shared cache      Flask-Caching (Redis in production)
+#   3. loader            the database
+#
+# Entries belong to a group ("trust_access", "system_messages", ...). Writes to
+# the underlying rows are picked up from the session and, after the commit,
+# either drop single keys or bump the group's generation (part of every shared
+# key), then publish the change on LAYOUT_CACHE_CHANNEL. Every worker runs a
+# listener thread that drops the matching local entries, so suspending a trust
+# or switching on maintenance mode takes effect everywhere at once.
+#
+# While the listener is not connected (Redis down, or just starting) local
+# entries live at most LAYOUT_CACHE_LOCAL_TTL seconds and the generation is
+# re-read on every local miss, so a missed message costs a few seconds of
+# staleness at most. Without Redis both tiers live in the process and no
+# messages are needed.
+
+log = logging.getLogger(__name__)
+
+_PENDING = "layout_cache_pending"
+_GEN_PREFIX = "lc_gen:"
+
+
+class LocalLRU:
+    """Thread-safe LRU of ``key -> value`` where every entry expires on its own."""
+
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """``(True, value)`` for a live entry, ``(False, None)`` otherwise."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] <= now:
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[1]
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def drop(self, keys=(), groups=()):
+        groups = tuple(f"{g}:" for g in groups)
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+            if groups:
+                for key in [k for k in self.entries if k.startswith(groups)]:
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+_local = LocalLRU()
+_generations = {}
+_counts = Counter()
+_counts_lock = threading.Lock()
+_listener = {"pid": None, "node": None, "connected": False}
+
+
+def init_app(app):
+    app.config.setdefault("LAYOUT_CACHE_SIZE", int(os.environ.get("CMS_LAYOUT_CACHE_SIZE", "2048")))
+    app.config.setdefault("LAYOUT_CACHE_LOCAL_TTL", float(os.environ.get("CMS_LAYOUT_CACHE_LOCAL_TTL", "5")))
+    app.config.setdefault("LAYOUT_CACHE_CHANNEL", os.environ.get("CMS_LAYOUT_CACHE_CHANNEL", "cms:layout_cache"))
+    _local.maxsize = max(1, int(app.config["LAYOUT_CACHE_SIZE"]))
+
+
+def _count(name, n=1):
+    with _counts_lock:
+        _counts[name] += n
+
+
+def _redis_client():
+    return getattr(getattr(cache, "cache", None), "_write_client", None)
+
+
+def _node():
+    """Id of this process; listeners ignore their own messages."""
+    if _listener["pid"] != os.getpid():
+        # Forked worker: the parent's thread and generations are not ours
+        _listener.update(pid=os.getpid(), node=uuid.uuid4().hex, connected=False, thread=None)
+        _generations.clear()
+        _local.clear()
+    return _listener["node"]
+
+
+# -- generations -------------------------------------------------------------
+
+def _generation(group, refresh=False):
+    if refresh or group not in _generations:
+        try:
+            _generations[group] = int(cache.get(_GEN_PREFIX + group) or 0)
+        except Exception:
+            _generations.setdefault(group, 0)
+    return _generations[group]
+
+
+def _shared_key(group, key):
+    return f"lc:{group}:g{_generation(group)}:{key}"
+
+
+# -- reads -------------------------------------------------------------------
+
+def cached(group, key, loader, timeout=60):
+    """Value of ``key`` in ``group`` from the LRU, the shared cache or ``loader()``.
+
+    ``None`` is never cached; ``timeout`` bounds both tiers.
+    """
+    _node()
+    _ensure_listener()
+    local_key = f"{group}:{key}"
+    found, value = _local.get(local_key)
+    if found:
+        _count("local_hits")
+        return value
+
+    redis_client = _redis_client()
+    trusted = redis_client is None or _listener["connected"]
+    local_ttl = timeout if trusted else min(timeout, float(current_app.config.get("LAYOUT_CACHE_LOCAL_TTL", 5)))
+    if redis_client is not None and not trusted:
+        # A bump may have been missed while the listener was away
+        _generation(group, refresh=True)
+    shared_key = _shared_key(group, key)
+    try:
+        value = cache.get(shared_key)
+    except Exception:
+        value = None
+    if value is not None:
+        _count("shared_hits")
+        _local.set(local_key, value, local_ttl)
+        return value
+
+    _count("misses")
+    value = loader()
+    if value is not None:
+        try:
+            cache.set(shared_key, value, timeout=timeout)
+        except Exception:
+            pass
+        _local.set(local_key, value, local_ttl)
+    return value
+
+
+# -- invalidation ------------------------------------------------------------
+
+def invalidate(group, keys=None):
+    """Drop ``keys`` of ``group`` (the whole group when ``keys`` is None) everywhere, now."""
+    node = _node()
+    message = {"node": node, "group": group}
+    if keys is None:
+        try:
+            gen = int(cache.get(_GEN_PREFIX + group) or 0) + 1
+            cache.set(_GEN_PREFIX + group, gen, timeout=0)
+        except Exception:
+            gen = _generations.get(group, 0) + 1
+        _generations[group] = gen
+        message["gen"] = gen
+        _local.drop(groups=(group,))
+    else:
+        keys = sorted({str(k) for k in keys})
+        try:
+            cache.delete_many(*[_shared_key(group, k) for k in keys])
+        except Exception:
+            pass
+        message["keys"] = keys
+        _local.drop(keys=[f"{group}:{k}" for k in keys])
+    _count("invalidations")
+    _publish(message)
+
+
+def _publish(message):
+    client = _redis_client()
+    if client is None:
+        return
+    try:
+        client.publish(current_app.config.get("LAYOUT_CACHE_CHANNEL", "cms:layout_cache"), json.dumps(message))
+    except Exception:
+        log.warning("Failed to publish layout cache invalidation %s", message, exc_info=True)
+
+
+def _receive(data):
+    try:
+        message = json.loads(data)
+    except Exception:
+        return
+    if message.get("node") == _listener["node"]:
+        return
+    group = message.get("group")
+    if not group:
+        return
+    _count("received")
+    if "gen" in message:
+        _generations[group] = int(message["gen"])
+        _local.drop(groups=(group,))
+    else:
+        _local.drop(keys=[f"{group}:{k}" for k in message.get("keys") or ()])
+
+
+def _listen(client, channel):
+    while True:
+        pubsub = None
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(channel)
+            # Anything published before we were subscribed is unknown
+            _local.clear()
+            _generations.clear()
+            _listener["connected"] = True
+            for message in pubsub.listen():
+                if message.get("type") == "message":
+                    _receive(message.get("data"))
+        except Exception:
+            log.warning("Layout cache listener disconnected; retrying", exc_info=True)
+        finally:
+            _listener["connected"] = False
+            try:
+                if pubsub is not None:
+                    pubsub.close()
+            except Exception:
+                pass
+        time.sleep(5)
+
+
+def _ensure_listener():
+    client = _redis_client()
+    if client is None:
+        return
+    thread = _listener.get("thread")
+    if thread is not None and thread.is_alive():
+        return
+    channel = current_app.config.get("LAYOUT_CACHE_CHANNEL", "cms:layout_cache")
+    thread = threading.Thread(target=_listen, args=(client, channel), name="layout-cache-listener", daemon=True)
+    _listener["thread"] = thread
+    thread.start()
+
+
+# -- picking up writes -------------------------------------------------------
+
+def _changes(obj):
+    """``(group, key or None)`` pairs a write to ``obj`` invalidates."""
+    if isinstance(obj, SystemConfig):
+        return [("maintenance", None)] if obj.config_key == "maintenance_mode" else []
+    if isinstance(obj, SystemMessage):
+        return [("system_messages", None)]
+    if isinstance(obj, Trust):
+        return [("trust_access", obj.trust_id), ("trusts", None)]
+    if isinstance(obj, Program):
+        return [("program_theme", obj.program_id)]
+    if isinstance(obj, Faculty):
+        return [("user_identity", f"faculty_{obj.user_id_fk}")] if obj.user_id_fk else []
+    if isinstance(obj, Student):
+        return [("user_identity", f"student_{obj.user_id_fk}")] if obj.user_id_fk else []
+    return []
+
+
+@event.listens_for(Session, "after_flush")
+def _collect(session, flush_context):
+    found = None
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        for change in _changes(obj):
+            if found is None:
+                found = session.info.setdefault(_PENDING, set())
+            found.add(change)
+
+
+# Bulk and Core statements (reflected tables included) carry no objects, so they
+# drop the whole groups their table feeds
+_TABLE_GROUPS = {
+    SystemConfig.__table__.name: ("maintenance",),
+    SystemMessage.__table__.name: ("system_messages",),
+    Trust.__table__.name: ("trust_access", "trusts"),
+    Program.__table__.name: ("program_theme",),
+    Faculty.__table__.name: ("user_identity",),
+    Student.__table__.name: ("user_identity",),
+}
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bulk_statement(state):
+    if state.is_select or not (state.is_update or state.is_delete or state.is_insert):
+        return
+    model = getattr(state.bind_mapper, "class_", None)
+    table = model.__table__ if model is not None else getattr(state.statement, "table", None)
+    groups = _TABLE_GROUPS.get(getattr(table, "name", None), ())
+    if groups:
+        state.session.info.setdefault(_PENDING, set()).update((group, None) for group in groups)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply(session):
+    pending = session.info.pop(_PENDING, None)
+    if not pending:
+        return
+    whole = {group for group, key in pending if key is None}
+    keys = {}
+    for group, key in pending:
+        if group not in whole:
+            keys.setdefault(group, set()).add(key)
+    try:
+        for group in sorted(whole):
+            invalidate(group)
+        for group, group_keys in sorted(keys.items()):
+            invalidate(group, group_keys)
+    except Exception:
+        log.warning("Failed to invalidate layout cache groups %s", sorted(whole | set(keys)), exc_info=True)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop(_PENDING, None)
+
+
+def stats():
+    """Hit/miss counters of this process."""
+    with _counts_lock:
+        counts = dict(_counts)
+    lookups = sum(counts.get(k, 0) for k in ("local_hits", "shared_hits", "misses"))
+    return {
+        "size": len(_local),
+        "maxsize": _local.maxsize,
+        "listener": ("n/a" if _redis_client() is None else ("connected" if _listener["connected"] else "disconnected")),
+        "local_hits": counts.get("local_hits", 0),
+        "shared_hits": counts.get("shared_hits", 0),
+        "misses": counts.get("misses", 0),
+        "invalidations": counts.get("invalidations", 0),
+        "received": counts.get("received", 0),
+        "hit_ratio": (round(100.0 * (counts.get("local_hits", 0) + counts.get("shared_hits", 0)) / lookups, 1) if lookups else None),
+    }
@@ -0,0 +1,177 @@
+import argparse
+import base64
+import email
+import socketserver
+import threading
+from email import policy
+
+
+# Local stand-in SMTP server for tests and development: accepts every message
+# (no STARTTLS, any AUTH PLAIN/LOGIN credentials) and keeps it in memory. It
+# counts connections and logins so tests can check that the outbox sender
+# reuses its pooled connections, and ``reject`` lets a test have chosen
+# recipients refused with a given reply code.
+#
+#   python -m cms_app.mail_sink --port 1025
+#   MAIL_HOST=127.0.0.1 MAIL_PORT=1025 MAIL_USE_TLS=false python app.py
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write((line + "\r\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def _readline(self):
+        raw = self.rfile.readline()
+        if not raw:
+            return None
+        return raw.decode("utf-8", "replace").rstrip("\r\n")
+
+    def _read_data(self):
+        lines = []
+        while True:
+            line = self._readline()
+            if line is None or line == ".":
+                return "\r\n".join(lines) + "\r\n"
+            lines.append(line[1:] if line.startswith("..") else line)
+
+    def handle(self):
+        sink = self.server.sink
+        sink._count("connections")
+        self._reply("220 mail-sink ESMTP ready")
+        mail_from, rcpt_tos = None, []
+        while True:
+            line = self._readline()
+            if line is None:
+                return
+            verb, _, arg = line.partition(" ")
+            verb = verb.upper()
+            if verb == "EHLO":
+                self._reply("250-mail-sink")
+                self._reply("250-AUTH PLAIN LOGIN")
+                self._reply("250 8BITMIME")
+            elif verb == "HELO":
+                self._reply("250 mail-sink")
+            elif verb == "AUTH":
+                mech, _, initial = arg.partition(" ")
+                if mech.upper() == "LOGIN":
+                    self._reply("334 " + base64.b64encode(b"Username:").decode())
+                    self._readline()
+                    self._reply("334 " + base64.b64encode(b"Password:").decode())
+                    self._readline()
+                elif not initial:
+                    self._reply("334 ")
+                    self._readline()
+                sink._count("logins")
+                self._reply("235 2.7.0 Authentication successful")
+            elif verb == "MAIL":
+                mail_from, rcpt_tos = arg.split(":", 1)[-1].strip().strip("<>"), []
+                self._reply("250 OK")
+            elif verb == "RCPT":
+                rcpt = arg.split(":", 1)[-1].strip().strip("<>")
+                refused = sink.reject.get(rcpt.lower())
+                if refused:
+                    self._reply(f"{refused[0]} {refused[1]}")
+                else:
+                    rcpt_tos.append(rcpt)
+                    self._reply("250 OK")
+            elif verb == "DATA":
+                if not rcpt_tos:
+                    self._reply("554 No valid recipients")
+                    continue
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                data = self._read_data()
+                sink._store(mail_from, rcpt_tos, data)
+                mail_from, rcpt_tos = None, []
+                self._reply("250 OK: queued")
+            elif verb == "RSET":
+                mail_from, rcpt_tos = None, []
+                self._reply("250 OK")
+            elif verb == "NOOP":
+                self._reply("250 OK")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class MailSink:
+    """In-memory SMTP server on a background thread.
+
+    ``messages`` holds ``{"mail_from", "rcpt_tos", "data", "message"}`` dicts;
+    ``connections`` and ``logins`` count sessions and AUTH exchanges.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.messages = []
+        self.connections = 0
+        self.logins = 0
+        self.reject = {}  # recipient -> (code, text)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _store(self, mail_from, rcpt_tos, data):
+        with self._lock:
+            self.messages.append({
+                "mail_from": mail_from,
+                "rcpt_tos": list(rcpt_tos),
+                "data": data,
+                "message": email.message_from_string(data, policy=policy.default),
+            })
+
+    def start(self):
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.sink = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True, name="mail-sink")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local SMTP sink that prints received messages.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    args = parser.parse_args()
+
+    class _PrintingSink(MailSink):
+        def _store(self, mail_from, rcpt_tos, data):
+            super()._store(mail_from, rcpt_tos, data)
+            msg = self.messages[-1]["message"]
+            print(f"--- from {mail_from} to {', '.join(rcpt_tos)}: {msg['Subject']}", flush=True)
+
+    sink = _PrintingSink(args.host, args.port).start()
+    print(f"mail sink listening on {sink.host}:{sink.port}", flush=True)
+    try:
+        sink._thread.join()
+    except KeyboardInterrupt:
+        sink.stop()
+
+
+if __name__ == "__main__":
+    main()
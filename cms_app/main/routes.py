@@ -1,18 +1,39 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, Response, session, send_file, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, Response, session, send_file, jsonify, abort
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
 import os
 import csv
-from sqlalchemy import or_, select, and_, cast, Integer, false, update, MetaData, Table, inspect as sa_inspect
+from sqlalchemy import or_, select, and_, cast, Integer, false, update
 from sqlalchemy.orm import selectinload
-from ..models import Student, Program, Division, Attendance, Grade, StudentCreditLog, FeesRecord, FeePayment, Subject, Faculty, SubjectType, CreditStructure, CourseAssignment, StudentSubjectEnrollment, User, Announcement, AnnouncementAudience, AnnouncementDismissal, AnnouncementRecipient, PasswordChangeLog, SubjectMaterial, SubjectMaterialLog, FeeStructure, ProgramBankDetails, SemesterCoordinator, StudentSemesterResult, Trust, Institute, TimetableSettings, SystemMessage, SystemMessageRead, Notification
-from .. import db, csrf_required, limiter, cache
+from ..models import Student, Program, Division, Attendance, Grade, StudentCreditLog, FeesRecord, FeePayment, Subject, Faculty, SubjectType, CreditStructure, CourseAssignment, StudentSubjectEnrollment, User, Announcement, AnnouncementAudience, AnnouncementDismissal, AnnouncementInbox, AnnouncementRecipient, PasswordChangeLog, SubjectMaterial, SubjectMaterialLog, Attachment, FeeStructure, ProgramBankDetails, SemesterCoordinator, StudentSemesterResult, Trust, Institute, TimetableSettings, SystemMessage, SystemMessageRead, Notification
+from .. import db, csrf_required, limiter, cache, schema_registry
 from sqlalchemy import func
+from ..announcement_inbox import (
+    fan_out as fan_out_announcement,
+    inbox_counts as announcement_inbox_counts,
+    mark_all_read as mark_all_announcements_read,
+    public_announcements,
+    set_read as set_announcement_read,
+    user_announcements,
+)
 from ..api_utils import api_success, api_error
+from ..attachments import find as find_attachment, for_owners as attachments_for, release as release_attachments, store as store_attachment, subject_storage_bytes
 from werkzeug.security import check_password_hash, generate_password_hash
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from functools import wraps
-from ..email_utils import send_email
+from ..downloads import record_download, serve as serve_download
+from ..email_utils import outbox_status, send_email
+from ..inbox_counters import badge_count as inbox_badge_count
+from ..jobs.services import enqueue, job_handler
+from ..pagination import cached_count, keyset_page
+from ..fee_balances import BalanceTracker, status_counts as fee_status_counts
+from ..fee_ledger import classify as classify_fee_bucket, collected_by_program, payment_status_summary, payment_totals, program_ledger
+from ..program_mediums import default_medium_for, program_mediums
+from ..metrics import summary as metrics_summary
+from ..query_budget import query_budget
+from ..result_cache import cached_result, stats as result_cache_stats
+from ..scope import current_scope, division_ids_for, program_ids_for, reset_scope
+from ..student_search import apply_search as apply_student_search
 
 from datetime import datetime, timedelta, timezone
 import math
@@ -81,30 +102,11 @@ def _list_trust_rows():
 
 
 def _table_columns_present(table_name):
-    cache_key = f"main_table_columns:{table_name}"
-    try:
-        cached = cache.get(cache_key)
-    except Exception:
-        cached = None
-    if cached:
-        try:
-            return set(cached)
-        except Exception:
-            pass
-    try:
-        cols = {c["name"] for c in sa_inspect(db.engine).get_columns(table_name)}
-    except Exception:
-        cols = set()
-    try:
-        cache.set(cache_key, sorted(cols), timeout=300)
-    except Exception:
-        pass
-    return cols
+    return schema_registry.table_columns(table_name)
 
 
 def _reflected_table(table_name):
-    metadata = MetaData()
-    return Table(table_name, metadata, autoload_with=db.engine)
+    return schema_registry.reflected_table(table_name)
 
 
 _STUDENT_FIELD_NAMES = [
@@ -507,14 +509,7 @@ def role_required(*roles):
 
 
 def _effective_trust_id():
-    if not getattr(current_user, "is_authenticated", False):
-        return None
-    if getattr(current_user, "is_super_admin", False):
-        try:
-            return int(session.get("active_trust_id") or 0) or None
-        except Exception:
-            return None
-    return getattr(current_user, "trust_id_fk", None)
+    return current_scope().trust_id
 
 
 def _dashboard_cache_bypass():
@@ -957,26 +952,11 @@ def _user_is_student_enrolled(subject_id: int, academic_year: str) -> bool:
 
 # Reusable helper: build program dropdown options and resolve selected program
 def _program_dropdown_context(q_program_raw: str = None, *, include_admin_all: bool = True, default_program_name: str = None, exclude_names: list = None, warn_unmapped: bool = True, fallback_to_first: bool = True, prefer_user_program_default: bool = True):
-    role = (getattr(current_user, "role", "") or "").strip().lower()
-    # Base list: all programs ordered by name
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
-
-    program_q = select(Program).order_by(Program.program_name.asc())
-    if effective_trust_id:
-        try:
-            from ..models import Institute
-            program_q = program_q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
-        except Exception:
-            program_q = program_q.where(false())
-    program_list = db.session.execute(program_q).scalars().all()
+    scope = current_scope()
+    role = scope.role
+    # Base list: the trust's programs ordered by name (loaded once per request)
+    effective_trust_id = scope.trust_id
+    program_list = scope.programs()
     # Optional exclusions by display name
     try:
         if exclude_names:
@@ -988,10 +968,7 @@ def _program_dropdown_context(q_program_raw: str = None, *, include_admin_all: b
     selected_program_id = None
     if role in ("principal", "clerk"):
         # Principals/Clerks: restrict to their mapped program only
-        try:
-            pid = int(getattr(current_user, "program_id_fk", None) or 0) or None
-        except Exception:
-            pid = None
+        pid = scope.principal_program_id
         if pid is not None:
             program_list = [p for p in program_list if p.program_id == pid]
             selected_program_id = pid
@@ -1220,21 +1197,12 @@ def fees_entry():
                 pass
     else:
         # Admin: Apply Trust Scope
-        effective_trust_id = None
         is_super = getattr(current_user, "is_super_admin", False)
-        if is_super:
-            try:
-                # Check for impersonated trust
-                if "active_trust_id" in session:
-                     effective_trust_id = int(session["active_trust_id"])
-            except:
-                pass
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+        effective_trust_id = current_scope().trust_id
 
         q_prog = select(Program).order_by(Program.program_name.asc())
         if effective_trust_id:
-             q_prog = q_prog.join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
+             q_prog = q_prog.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
         
         programs = db.session.execute(q_prog).scalars().all()
     program_id_raw = (request.values.get("program_id") or "").strip()
@@ -1754,7 +1722,8 @@ def fees_receipt_semester():
 # Program/Semester-wise paid vs unpaid listing (visible to all authenticated users)
 @main_bp.route("/fees/payment-status", methods=["GET"])
 @login_required
-@cache.cached(timeout=60, key_prefix=lambda: f"fees_status_{getattr(current_user, 'user_id', 'anon')}_{request.full_path}", unless=lambda: session.get("_flashes"))
+@query_budget(queries=15, repeats=5)
+@cached_result("fees_payment_status", ("fees", "students"), per_user=True, unless=lambda: session.get("_flashes"))
 def fees_payment_status():
     try:
         if current_app.config.get("FEES_DISABLED", False):
@@ -1843,58 +1812,23 @@ def fees_payment_status():
                     by_slug[slug] = candidate
         required_total = sum(i.get("amount", 0.0) for i in by_slug.values())
 
-    # Aggregate verified payments per student for the selected scope
-    from sqlalchemy import func
-    verified_q = select(FeePayment.enrollment_no, func.sum(FeePayment.amount)).group_by(FeePayment.enrollment_no)
-    if selected_program:
-        verified_q = verified_q.filter(FeePayment.program_id_fk == selected_program.program_id)
-    if semester:
-        verified_q = verified_q.filter(FeePayment.semester == semester)
-    if show_medium and medium:
-        verified_q = verified_q.filter(FeePayment.medium_tag == medium)
-    verified_q = verified_q.filter((FeePayment.status or "").ilike("verified"))
-    verified_sums = {
-        enr: float(total or 0.0)
-        for (enr, total) in db.session.execute(verified_q).all()
-    }
-
-    # Existence of submitted (pending) payments for badge display / quick verification link
-    submitted_q = select(FeePayment.enrollment_no).distinct()
-    if selected_program:
-        submitted_q = submitted_q.filter(FeePayment.program_id_fk == selected_program.program_id)
-    if semester:
-        submitted_q = submitted_q.filter(FeePayment.semester == semester)
-    if show_medium and medium:
-        submitted_q = submitted_q.filter(FeePayment.medium_tag == medium)
-    submitted_q = submitted_q.filter((FeePayment.status or "").ilike("submitted"))
-    submitted_map = {enr: True for (enr,) in db.session.execute(submitted_q).all()}
-
-    # Existence of rejected payments for rejected filter/badge
-    rejected_q = select(FeePayment.enrollment_no).distinct()
-    if selected_program:
-        rejected_q = rejected_q.filter(FeePayment.program_id_fk == selected_program.program_id)
-    if semester:
-        rejected_q = rejected_q.filter(FeePayment.semester == semester)
-    if show_medium and medium:
-        rejected_q = rejected_q.filter(FeePayment.medium_tag == medium)
-    rejected_q = rejected_q.filter((FeePayment.status or "").ilike("rejected"))
-    rejected_map = {enr: True for (enr,) in db.session.execute(rejected_q).all()}
+    # Verified totals and submitted/rejected flags per student for the selected scope
+    payments = payment_totals(
+        selected_program.program_id if selected_program else None,
+        semester,
+        medium if show_medium else None,
+    )
 
     # Build rows with status classification
     rows = []
     counts = {"paid": 0, "partial": 0, "unpaid": 0, "pending": 0}
+    status_labels = {"full": ("Paid", "paid"), "partial": ("Partially Paid", "partial"), "none": ("Unpaid", "unpaid")}
     for s in students_all:
-        vt = verified_sums.get(s.enrollment_no, 0.0)
-        has_submitted = bool(submitted_map.get(s.enrollment_no))
-        if vt >= (required_total or 0.0) and required_total > 0:
-            status = "Paid"
-            counts["paid"] += 1
-        elif vt > 0.0 and vt < (required_total or float("inf")):
-            status = "Partially Paid"
-            counts["partial"] += 1
-        else:
-            status = "Unpaid"
-            counts["unpaid"] += 1
+        pay = payments.get(s.enrollment_no) or {}
+        vt = pay.get("verified", 0.0)
+        has_submitted = bool(pay.get("submitted_count"))
+        status, count_key = status_labels[classify_fee_bucket(required_total or 0.0, vt)]
+        counts[count_key] += 1
         if has_submitted and status != "Paid":
             counts["pending"] += 1
         rows.append({
@@ -1903,7 +1837,7 @@ def fees_payment_status():
             "required_total": round(required_total or 0.0, 2),
             "status": status,
             "has_submitted": has_submitted,
-            "has_rejected": bool(rejected_map.get(s.enrollment_no)),
+            "has_rejected": bool(pay.get("rejected_count")),
         })
 
     # Optional CSV export
@@ -2201,6 +2135,9 @@ def fees_payment_mark_paid(enrollment_no):
     )
     try:
         db.session.add(fp)
+        balances = BalanceTracker()
+        balances.add(fp)
+        balances.flush()
         db.session.commit()
         # Persistent notification for the student (dashboard only; email handled later)
         try:
@@ -2231,6 +2168,19 @@ def fees_payment_mark_paid(enrollment_no):
         flash("Failed to record payment. Please try again.", "danger")
     return redirect(url_for("main.fees_payment", enrollment_no=enrollment_no, semester=semester, medium=(medium or "")))
 
+@main_bp.route("/fees/payments/<int:payment_id>/proof")
+@login_required
+def fee_payment_proof(payment_id: int):
+    # Proofs are visible to fee staff in the payment's trust and to the paying student
+    payment = db.session.get(FeePayment, payment_id)
+    if not payment or not payment.proof_image_path or not _fee_payment_accessible(payment):
+        abort(404)
+    if not _user_is_admin_or_principal_or_clerk():
+        s = db.session.execute(select(Student.enrollment_no).filter_by(user_id_fk=current_user.user_id)).first()
+        if not s or s.enrollment_no != payment.enrollment_no:
+            abort(403)
+    return serve_download(payment.proof_image_path)
+
 # Verification queue listing for Admin/Clerk
 @main_bp.route("/fees/payments/queue", methods=["GET"])
 @login_required
@@ -2303,6 +2253,9 @@ def fees_payment_verify(payment_id):
         fp.verified_by_fk = getattr(current_user, "user_id", None)
         fp.payer_name = payer_name
         fp.bank_credit_at = bank_credit_at
+        balances = BalanceTracker()
+        balances.add(fp)
+        balances.flush()
         db.session.commit()
         # Dashboard notification (persistent)
         try:
@@ -2339,9 +2292,10 @@ def fees_payment_verify(payment_id):
             if to:
                 subj = "Payment Verified"
                 txt = f"Your payment (UTR: {fp.utr}) has been verified."
-                send_email(subj, to, txt)
+                send_email(subj, to, txt, category="fee_verified")
+                db.session.commit()
         except Exception:
-            pass
+            db.session.rollback()
         flash("Payment verified.", "success")
     except Exception:
         db.session.rollback()
@@ -2370,6 +2324,9 @@ def fees_payment_reject(payment_id):
         fp.verified_at = None
         fp.verified_by_fk = getattr(current_user, "user_id", None)
         fp.remarks = remarks or None
+        balances = BalanceTracker()
+        balances.add(fp)
+        balances.flush()
         db.session.commit()
         # Dashboard notification (persistent)
         try:
@@ -2406,15 +2363,50 @@ def fees_payment_reject(payment_id):
             if to:
                 subj = "Payment Rejected"
                 txt = f"Your payment (UTR: {fp.utr}) was rejected. Remarks: {remarks}"
-                send_email(subj, to, txt)
+                send_email(subj, to, txt, category="fee_rejected")
+                db.session.commit()
         except Exception:
-            pass
+            db.session.rollback()
         flash("Payment rejected.", "success")
     except Exception:
         db.session.rollback()
         flash("Failed to reject payment.", "danger")
     return redirect(url_for("main.fees_payments_queue"))
 
+@job_handler("fee_balance_reconcile", max_attempts=1)
+def _fee_balance_reconcile_job(ctx, program_id=None, repair=True):
+    from ..fee_balances import reconcile
+    ctx.progress(10, "Comparing balances with fee payments")
+    report = reconcile(program_id=program_id, repair=repair)
+    db.session.commit()
+    if not report["drift"]:
+        report["message"] = f"Checked {report['checked']} balance rows; no drift found."
+    else:
+        kinds = ", ".join(f"{k}: {v}" for k, v in sorted(report["by_kind"].items()))
+        action = "repaired" if report["repaired"] else "found"
+        report["message"] = f"Drift {action} in {report['drift']} balance rows ({kinds})."
+    return report
+
+
+# Rebuild/verify the student_fee_balance projection against fee_payments (Admin)
+@main_bp.route("/fees/balances/reconcile", methods=["POST"])
+@login_required
+@role_required("admin")
+@csrf_required
+def fees_balances_reconcile():
+    program_id_raw = (request.form.get("program_id") or "").strip()
+    program_id = int(program_id_raw) if program_id_raw.isdigit() else None
+    repair = (request.form.get("repair") or "1").strip().lower() in ("1", "true", "yes")
+    job = enqueue(
+        "fee_balance_reconcile",
+        {"program_id": program_id, "repair": repair},
+        label="Reconcile fee balances",
+        user=current_user,
+        trust_id=_effective_trust_id(),
+        return_url=url_for("main.fees_payment_status", program_id=program_id or ""),
+    )
+    return redirect(url_for("jobs.job_status", job_id=job.job_id))
+
 @main_bp.route("/materials")
 @login_required
 def materials_hub():
@@ -2607,6 +2599,27 @@ def subject_materials(subject_id: int):
             pass
     return render_template("subject_materials.html", subject=subject, materials=materials, role=role, can_manage=can_manage, owners=owners)
 
+@main_bp.route("/materials/<int:material_id>/download")
+@login_required
+def subject_material_download(material_id: int):
+    # Same visibility rules as the subject materials page; the transfer itself goes through the download gateway
+    material = db.session.get(SubjectMaterial, material_id)
+    if not material or material.kind != "file" or not material.file_path:
+        abort(404)
+    role = (getattr(current_user, "role", "") or "").strip().lower()
+    if role == "faculty" and not (_user_is_admin_or_principal() or _user_is_faculty_assigned(material.subject_id_fk)):
+        abort(403)
+    if role == "student":
+        if not (material.is_published and not material.is_flagged):
+            abort(404)
+        if not _user_is_student_enrolled(material.subject_id_fk, current_academic_year()):
+            abort(403)
+    stored = next((r for r in attachments_for("material", [material_id])[material_id] if r.storage_path == material.file_path), None)
+    record_download(material_id, getattr(current_user, "user_id", None), role)
+    if stored:
+        return serve_download(stored.storage_path, download_name=stored.file_name, mimetype=stored.mime_type, etag=stored.sha256)
+    return serve_download(material.file_path)
+
 # --- Materials create/edit/delete + moderation actions ---
 def _allowed_file(filename: str) -> bool:
     try:
@@ -2615,19 +2628,10 @@ def _allowed_file(filename: str) -> bool:
         return False
 
 def _subject_storage_bytes(subject_id: int) -> int:
-    total = 0
     try:
-        root = os.path.join(current_app.root_path, "static", "materials", str(subject_id))
-        for dirpath, _dirnames, filenames in os.walk(root):
-            for fn in filenames:
-                fp = os.path.join(dirpath, fn)
-                try:
-                    total += os.path.getsize(fp)
-                except Exception:
-                    continue
+        return subject_storage_bytes(subject_id)
     except Exception:
         return 0
-    return total
 
 def _quota_limits():
     # Quotas can be tuned via env vars; sensible defaults
@@ -2711,11 +2715,8 @@ def subject_material_new(subject_id: int):
                         flash("Subject storage quota exceeded. Upload a smaller file or remove old items.", "warning")
                         db.session.rollback()
                         return render_template("materials_new.html", subject=subject)
-                    root = os.path.join(current_app.root_path, "static", "materials", str(subject_id), str(material.material_id))
-                    os.makedirs(root, exist_ok=True)
-                    dest = os.path.join(root, filename)
-                    file.save(dest)
-                    material.file_path = os.path.relpath(dest, os.path.join(current_app.root_path, "static")).replace("\\", "/")
+                    stored = store_attachment(file, "material", material.material_id, subject_id=subject_id, user_id=current_user.user_id)
+                    material.file_path = stored.storage_path
         except Exception:
             flash("Failed to save file.", "danger")
             db.session.rollback()
@@ -2782,11 +2783,8 @@ def subject_material_edit(material_id: int):
                         flash("Subject storage quota exceeded. Upload a smaller file or remove old items.", "warning")
                         db.session.rollback()
                         return render_template("materials_edit.html", subject=subject, material=material)
-                    root = os.path.join(current_app.root_path, "static", "materials", str(material.subject_id_fk), str(material.material_id))
-                    os.makedirs(root, exist_ok=True)
-                    dest = os.path.join(root, filename)
-                    file.save(dest)
-                    material.file_path = os.path.relpath(dest, os.path.join(current_app.root_path, "static")).replace("\\", "/")
+                    stored = store_attachment(file, "material", material.material_id, subject_id=material.subject_id_fk, user_id=current_user.user_id)
+                    material.file_path = stored.storage_path
             else:
                 material.file_path = None
         except Exception:
@@ -2817,6 +2815,7 @@ def subject_material_delete(material_id: int):
         return redirect(url_for("main.subject_materials", subject_id=material.subject_id_fk))
 
     db.session.add(SubjectMaterialLog(material_id_fk=material.material_id, action="delete", actor_user_id_fk=current_user.user_id, actor_role=role, meta_json=None))
+    release_attachments(attachments_for("material", [material.material_id])[material.material_id])
     db.session.delete(material)
     db.session.commit()
     flash("Material deleted.", "success")
@@ -3134,114 +3133,12 @@ def inject_inbox_badge():
     if not user_id:
         return {"inbox_unread_count": 0}
 
-    role = (getattr(current_user, "role", "") or "").strip().lower()
-    effective_trust_id = _effective_trust_id()
-    cache_key = (
-        f"inbox_badge_{user_id}_{effective_trust_id or 0}_{role}_{getattr(current_user, 'program_id_fk', None) or 0}"
-    )
-    if not session.get("_flashes"):
-        try:
-            cached_count = cache.get(cache_key)
-        except Exception:
-            cached_count = None
-        if cached_count is not None:
-            return {"inbox_unread_count": int(cached_count)}
-
-    now = datetime.now()
-    student_enrollment_no = None
-    if role == "student":
-        try:
-            student_row = db.session.execute(select(Student.enrollment_no).filter_by(user_id_fk=user_id)).first()
-            if student_row:
-                student_enrollment_no = student_row.enrollment_no
-        except Exception:
-            student_enrollment_no = None
-
-    system_unread = 0
-    try:
-        sm_q = select(SystemMessage.message_id).where(SystemMessage.is_active.is_(True))
-        if role:
-            sm_q = sm_q.where(or_(SystemMessage.target_role == "all", SystemMessage.target_role == role))
-        else:
-            sm_q = sm_q.where(SystemMessage.target_role == "all")
-        if effective_trust_id:
-            sm_q = sm_q.where(or_(SystemMessage.target_trust_id == None, SystemMessage.target_trust_id == effective_trust_id))
-        else:
-            sm_q = sm_q.where(SystemMessage.target_trust_id == None)
-        sm_q = sm_q.where(or_(SystemMessage.start_date == None, SystemMessage.start_date <= now))
-        sm_q = sm_q.where(or_(SystemMessage.end_date == None, SystemMessage.end_date >= now))
-        msg_ids = db.session.execute(sm_q.limit(80)).scalars().all()
-        read_ids = set(db.session.execute(select(SystemMessageRead.message_id_fk).filter_by(user_id_fk=user_id)).scalars().all())
-        system_unread = sum(1 for mid in msg_ids if mid not in read_ids)
-    except Exception:
-        system_unread = 0
-
-    ann_unread = 0
     try:
-        ann_q = (
-            select(Announcement)
-            .options(selectinload(Announcement.audiences), selectinload(Announcement.recipients))
-            .filter(Announcement.is_active == True)
-        )
-        if effective_trust_id:
-            ann_q = ann_q.filter(Announcement.trust_id_fk == effective_trust_id)
-        else:
-            ann_q = ann_q.filter(Announcement.trust_id_fk == None)
-        ann_q = ann_q.filter(or_(Announcement.start_at == None, Announcement.start_at <= (now + timedelta(hours=12))))
-        ann_q = ann_q.filter(or_(Announcement.end_at == None, Announcement.end_at >= (now - timedelta(hours=12))))
-        if role not in ("admin", "clerk"):
-            pid = getattr(current_user, "program_id_fk", None)
-            if pid:
-                ann_q = ann_q.filter(or_(Announcement.program_id_fk == None, Announcement.program_id_fk == pid))
-            else:
-                ann_q = ann_q.filter(Announcement.program_id_fk == None)
-        rows = db.session.execute(ann_q.order_by(Announcement.created_at.desc()).limit(120)).scalars().all()
-
-        dismissed = set(db.session.execute(select(AnnouncementDismissal.announcement_id_fk).filter_by(user_id_fk=user_id)).scalars().all())
-
-        for a in rows:
-            include = False
-            recips = []
-            try:
-                recips = [r.student_id_fk for r in (a.recipients or [])]
-            except Exception:
-                recips = []
-            if recips:
-                if role in ("principal", "clerk"):
-                    include = True
-                elif role == "student" and student_enrollment_no and student_enrollment_no in recips:
-                    include = True
-            else:
-                try:
-                    aud = [au.role for au in (a.audiences or [])]
-                except Exception:
-                    aud = []
-                include = (not aud) or (role in aud)
-
-            if include and (a.announcement_id not in dismissed):
-                ann_unread += 1
+        # Super admins' per-trust badge is still a short-TTL count; refresh it right after an action
+        refresh = bool(getattr(current_user, "is_super_admin", False) and session.get("_flashes"))
+        return {"inbox_unread_count": inbox_badge_count(current_user, _effective_trust_id(), refresh=refresh)}
     except Exception:
-        ann_unread = 0
-
-    notif_unread = 0
-    if student_enrollment_no:
-        try:
-            notif_unread = db.session.scalar(
-                select(func.count()).select_from(Notification).where(
-                    Notification.student_id_fk == student_enrollment_no,
-                    Notification.is_read == False,
-                )
-            ) or 0
-        except Exception:
-            notif_unread = 0
-
-    unread_count = int(ann_unread + system_unread + notif_unread)
-    if not session.get("_flashes"):
-        try:
-            cache.set(cache_key, unread_count, timeout=15)
-        except Exception:
-            pass
-    return {"inbox_unread_count": unread_count}
+        return {"inbox_unread_count": 0}
 
 @main_bp.route("/set-trust-context/<int:trust_id>")
 @login_required
@@ -3255,6 +3152,7 @@ def set_trust_context(trust_id):
         session.pop("active_trust_id", None)
         session.pop("active_institute_id", None)
         session.pop("wizard_institute_id", None)
+        reset_scope()
         flash("Switched to Global View", "info")
         return redirect(url_for("main.super_admin_dashboard"))
         
@@ -3265,6 +3163,7 @@ def set_trust_context(trust_id):
         
     session["active_trust_id"] = trust_id
     session.pop("wizard_institute_id", None)
+    reset_scope()
     trust_institutes = _list_institutes_for_trust(trust_id)
     inst = trust_institutes[0] if trust_institutes else None
     if inst:
@@ -3276,13 +3175,13 @@ def set_trust_context(trust_id):
 
 @main_bp.route("/dashboard")
 @login_required
-@cache.cached(
+# Short TTL: the dashboard also shows announcements and notices, which are not tagged
+@cached_result(
+    "dashboard",
+    ("students", "fees", "attendance", "staff"),
     timeout=45,
-    key_prefix=lambda: (
-        f"dashboard_{getattr(current_user, 'user_id', 'anon')}_"
-        f"{(request.args.get('trust_id') or session.get('active_trust_id') or getattr(current_user, 'trust_id_fk', None) or 0)}_"
-        f"{request.full_path}"
-    ),
+    per_user=True,
+    key=lambda: f"{request.args.get('trust_id') or 0}_{request.full_path}",
     unless=_dashboard_cache_bypass,
 )
 def dashboard():
@@ -3366,7 +3265,7 @@ def dashboard():
         # Prefer "BCA" if it exists within the trust, otherwise first available
         q_prog = select(Program)
         if effective_trust_id:
-            q_prog = q_prog.join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
+            q_prog = q_prog.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
         
         # Try to find BCA first
         candidate = db.session.execute(q_prog.filter(Program.program_name == "BCA")).scalars().first()
@@ -3415,26 +3314,9 @@ def dashboard():
                     return query.filter(getattr(model, "trust_id_fk") == int(effective_trust_id))
                 except Exception:
                     pass
-            # Handle Faculty (via Program -> Institute)
-            if model == Faculty:
-                return query.join(Program, Faculty.program_id_fk == Program.program_id)\
-                            .join(Institute, Program.institute_id_fk == Institute.institute_id)\
-                            .filter(Institute.trust_id_fk == effective_trust_id)
-            # Handle Student (via Program -> Institute)
-            elif model == Student:
-                return query.join(Program, Student.program_id_fk == Program.program_id)\
-                            .join(Institute, Program.institute_id_fk == Institute.institute_id)\
-                            .filter(Institute.trust_id_fk == effective_trust_id)
-            # Handle Subject (via Program -> Institute)
-            elif model == Subject:
-                return query.join(Program, Subject.program_id_fk == Program.program_id)\
-                            .join(Institute, Program.institute_id_fk == Institute.institute_id)\
-                            .filter(Institute.trust_id_fk == effective_trust_id)
-            # Handle Division (via Program -> Institute)
-            elif model == Division:
-                return query.join(Program, Division.program_id_fk == Program.program_id)\
-                            .join(Institute, Program.institute_id_fk == Institute.institute_id)\
-                            .filter(Institute.trust_id_fk == effective_trust_id)
+            # Faculty, Student, Subject, Division: the trust's programs
+            if model in (Faculty, Student, Subject, Division):
+                return query.filter(model.program_id_fk.in_(program_ids_for(effective_trust_id)))
 
         # 3. Default (All Data)
         return query
@@ -3449,7 +3331,7 @@ def dashboard():
     if pid:
         q_assign = q_assign.filter(Subject.program_id_fk == pid)
     elif effective_trust_id:
-        q_assign = q_assign.join(Program, Subject.program_id_fk == Program.program_id).join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
+        q_assign = q_assign.where(Subject.program_id_fk.in_(program_ids_for(effective_trust_id)))
     assignments_count = _safe_count(q_assign)
 
     # Active student-subject enrollments for current academic year
@@ -3457,7 +3339,7 @@ def dashboard():
     if pid:
         q_enroll = q_enroll.join(Subject, StudentSubjectEnrollment.subject_id_fk == Subject.subject_id).filter(Subject.program_id_fk == pid)
     elif effective_trust_id:
-        q_enroll = q_enroll.join(Subject, StudentSubjectEnrollment.subject_id_fk == Subject.subject_id).join(Program, Subject.program_id_fk == Program.program_id).join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
+        q_enroll = q_enroll.join(Subject, StudentSubjectEnrollment.subject_id_fk == Subject.subject_id).where(Subject.program_id_fk.in_(program_ids_for(effective_trust_id)))
     enrollments_count = _safe_count(q_enroll)
 
     # Elective subjects scoped
@@ -3465,7 +3347,7 @@ def dashboard():
     if pid:
         q_elec = q_elec.filter_by(program_id_fk=pid)
     elif effective_trust_id:
-        q_elec = q_elec.join(Program).join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
+        q_elec = q_elec.join(Program).where(Program.program_id.in_(program_ids_for(effective_trust_id)))
     elective_subjects_count = _safe_count(q_elec)
 
     # Program label for dashboard header:
@@ -3555,7 +3437,7 @@ def dashboard():
             subj_q = subj_q.filter_by(program_id_fk=selected_program.program_id)
         elif effective_trust_id:
             # If no program selected, Admin sees all subjects in Trust
-            subj_q = subj_q.join(Program).join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
+            subj_q = subj_q.join(Program).where(Program.program_id.in_(program_ids_for(effective_trust_id)))
             
         # Bound subjects by selected semester if provided
         if att_semester:
@@ -3573,69 +3455,37 @@ def dashboard():
                 # Invalid subject ID for this scope - ignore or reset
                 subj_ids = [] 
 
-        status_counts = {"P": 0, "A": 0, "L": 0}
-        if subj_ids:
-            att_rows_q = (
-                select(Attendance)
-                .filter(Attendance.subject_id_fk.in_(subj_ids))
-                .filter(Attendance.date_marked == selected_date)
-            )
-        else:
-            att_rows_q = select(Attendance).filter(Attendance.date_marked == selected_date)
-            # If no subject selected, still apply Trust Scope via Subject relationship
-            if effective_trust_id:
-                 att_rows_q = att_rows_q.join(Subject).join(Program).join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
-            # If we have no subjects but are scoped (e.g. empty trust), we should return nothing, 
-            # but the query above handles it via join if subjects exist. 
-            # If no subjects exist in trust, join(Subject) might return empty if inner join? 
-            # Yes, Attendance has FK to Subject. If no Subject in Trust, no Attendance.
-
-        # Bound by semester if selected
-        if att_semester:
-            att_rows_q = att_rows_q.filter(Attendance.semester == att_semester)
-        if att_division_id:
-            att_rows_q = att_rows_q.filter(Attendance.division_id_fk == att_division_id)
-        att_rows = db.session.execute(att_rows_q).scalars().all()
-        for r in att_rows:
-            s = (r.status or "").upper()
-            if s in status_counts:
-                status_counts[s] += 1
+        # Daily P/A/L totals come from the session rollups (one grouped query
+        # covering today, the trailing week and the selected month).
+        from ..attendance_rollups import daily_totals
+        days_in_month = monthrange(selected_date.year, selected_date.month)[1]
+        start_month = date(selected_date.year, selected_date.month, 1)
+        end_month = date(selected_date.year, selected_date.month, days_in_month)
+        start_week = selected_date - timedelta(days=6)
+        att_daily = daily_totals(
+            min(start_week, start_month),
+            max(selected_date, end_month),
+            subject_ids=subj_ids,
+            semester=att_semester,
+            division_id=att_division_id,
+            trust_id=effective_trust_id,
+        )
+        today_counts = att_daily.get(selected_date, {"P": 0, "A": 0, "L": 0, "total": 0})
         summary["attendance_today"] = {
-            "present": status_counts.get("P", 0),
-            "absent": status_counts.get("A", 0),
-            "late": status_counts.get("L", 0),
-            "total": len(att_rows),
+            "present": today_counts["P"],
+            "absent": today_counts["A"],
+            "late": today_counts["L"],
+            "total": today_counts["total"],
         }
         summary["attendance_date"] = selected_date.strftime("%Y-%m-%d")
         summary["att_filters"] = {"view": att_view, "date": summary["attendance_date"]}
 
         # Weekly chart (last 7 days ending selected_date)
-        start_week = selected_date - timedelta(days=6)
         labels_week = []
         week_counts = {"P": [], "A": [], "L": []}
         week_pct_present = []
         week_pct_absent = []
-        # Prefetch rows between range
-        att_week_q = select(Attendance).filter(Attendance.date_marked >= start_week).filter(Attendance.date_marked <= selected_date)
-        if subj_ids:
-            att_week_q = att_week_q.filter(Attendance.subject_id_fk.in_(subj_ids))
-        elif effective_trust_id:
-             # Apply Trust Scope if no specific subjects selected
-             att_week_q = att_week_q.join(Subject).join(Program).join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
-
-        if att_semester:
-            att_week_q = att_week_q.filter(Attendance.semester == att_semester)
-        if att_division_id:
-            att_week_q = att_week_q.filter(Attendance.division_id_fk == att_division_id)
-        att_week_rows = db.session.execute(att_week_q).scalars().all()
-        # Group by date
-        by_date = {}
-        for r in att_week_rows:
-            d = r.date_marked
-            by_date.setdefault(d, {"P": 0, "A": 0, "L": 0})
-            s = (r.status or "").upper()
-            if s in by_date[d]:
-                by_date[d][s] += 1
+        by_date = att_daily
         cur = start_week
         while cur <= selected_date:
             labels_week.append(cur.strftime("%d-%b"))
@@ -3686,32 +3536,11 @@ def dashboard():
         }
 
         # Monthly chart (selected month)
-        days_in_month = monthrange(selected_date.year, selected_date.month)[1]
-        start_month = date(selected_date.year, selected_date.month, 1)
-        end_month = date(selected_date.year, selected_date.month, days_in_month)
         labels_month = []
         month_counts = {"P": [], "A": [], "L": []}
         month_pct_present = []
         month_pct_absent = []
-        att_month_q = select(Attendance).filter(Attendance.date_marked >= start_month).filter(Attendance.date_marked <= end_month)
-        if subj_ids:
-            att_month_q = att_month_q.filter(Attendance.subject_id_fk.in_(subj_ids))
-        elif effective_trust_id:
-            # Apply Trust Scope if no specific subjects selected
-            att_month_q = att_month_q.join(Subject).join(Program).join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
-            
-        if att_semester:
-            att_month_q = att_month_q.filter(Attendance.semester == att_semester)
-        if att_division_id:
-            att_month_q = att_month_q.filter(Attendance.division_id_fk == att_division_id)
-        att_month_rows = db.session.execute(att_month_q).scalars().all()
-        by_date_m = {}
-        for r in att_month_rows:
-            d = r.date_marked
-            by_date_m.setdefault(d, {"P": 0, "A": 0, "L": 0})
-            s = (r.status or "").upper()
-            if s in by_date_m[d]:
-                by_date_m[d][s] += 1
+        by_date_m = att_daily
         cur = start_month
         while cur <= end_month:
             labels_month.append(cur.strftime("%d-%b"))
@@ -3743,7 +3572,7 @@ def dashboard():
             div_q = div_q.filter_by(program_id_fk=selected_program.program_id)
         elif effective_trust_id:
             # Admin Trust Scope
-            div_q = div_q.join(Program).join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
+            div_q = div_q.join(Program).where(Program.program_id.in_(program_ids_for(effective_trust_id)))
             
         # Bound divisions by selected semester if provided
         if att_semester:
@@ -3801,7 +3630,7 @@ def dashboard():
             try:
                 if role == "admin":
                     if effective_trust_id:
-                        return q.join(Student, Student.enrollment_no == FeesRecord.student_id_fk).join(Program).join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
+                        return q.join(Student, Student.enrollment_no == FeesRecord.student_id_fk).join(Program).where(Program.program_id.in_(program_ids_for(effective_trust_id)))
                 elif role == "principal":
                     pid_scope = getattr(current_user, "program_id_fk", None)
                     if pid_scope:
@@ -3886,7 +3715,7 @@ def dashboard():
     if role == "admin":
         q_prog_list = select(Program)
         if effective_trust_id:
-            q_prog_list = q_prog_list.join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
+            q_prog_list = q_prog_list.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
         program_list = db.session.execute(q_prog_list.order_by(Program.program_name.asc())).scalars().all()
     # Charts program filter (admin-only)
     chart_program_id = None
@@ -3921,12 +3750,8 @@ def dashboard():
                     today_amount += float(amt or 0.0)
                 except Exception:
                     pass
-            pending_q = select(func.count()).select_from(FeePayment).filter(FeePayment.status == "submitted")
-            pending_q = _apply_fee_payment_trust_scope(pending_q, effective_trust_id)
-            pending_count = db.session.scalar(pending_q) or 0
-            rejected_q = select(func.count()).select_from(FeePayment).filter(FeePayment.status == "rejected")
-            rejected_q = _apply_fee_payment_trust_scope(rejected_q, effective_trust_id)
-            rejected_count = db.session.scalar(rejected_q) or 0
+            # Pending/rejected counts come from the student_fee_balance projection
+            pending_count, rejected_count = fee_status_counts(effective_trust_id)
             clerk_fees = {
                 "today_amount": round(today_amount, 2),
                 "today_tx_count": today_tx_count,
@@ -3937,66 +3762,13 @@ def dashboard():
         print(f"CLERK FEES ERROR: {e}")
         clerk_fees = None
 
-    # Active announcements (time-windowed), audience-targeted and dismissible per-user.
-    # Personal announcements: if recipients are set, show only to selected students and Principal/Clerk.
+    # Active announcements (time-windowed) addressed to this user and not yet dismissed (see announcement_inbox).
     announcements = []
     try:
-        ann_q = select(Announcement).filter(Announcement.is_active == True)
-        ann_q = ann_q.filter(or_(Announcement.start_at == None, Announcement.start_at <= (now + timedelta(hours=12))))
-        ann_q = ann_q.filter(or_(Announcement.end_at == None, Announcement.end_at >= (now - timedelta(hours=12))))
-        # Program scoping for non-admin/clerk: show global or same program
-        try:
-            if role not in ("admin", "clerk"):
-                pid = getattr(current_user, "program_id_fk", None)
-                if pid:
-                    ann_q = ann_q.filter(or_(Announcement.program_id_fk == None, Announcement.program_id_fk == pid))
-                else:
-                    ann_q = ann_q.filter(Announcement.program_id_fk == None)
-        except Exception:
-            pass
-        # Exclude announcements dismissed by this user
-        try:
-            user_id = getattr(current_user, "user_id", None)
-            if user_id:
-                dismissed_ids = db.session.execute(select(AnnouncementDismissal.announcement_id_fk).filter_by(user_id_fk=user_id)).scalars().all()
-                if dismissed_ids:
-                    ann_q = ann_q.filter(~Announcement.announcement_id.in_(dismissed_ids))
-        except Exception:
-            pass
-        rows = db.session.execute(ann_q.order_by(Announcement.created_at.desc())).scalars().all()
-        # Audience targeting: if specific roles are configured, show only when user role matches.
-        # Personal targeting via recipients: visible only to selected students and Principal/Clerk.
-        user_role = (role or "").strip().lower()
-        # Resolve current student's enrollment (for student role)
-        cur_student_enr = None
-        try:
-            if user_role == "student":
-                st = db.session.execute(select(Student).filter_by(user_id_fk=getattr(current_user, "user_id", None))).scalars().first()
-                cur_student_enr = getattr(st, "enrollment_no", None) if st else None
-        except Exception:
-            cur_student_enr = None
-        for a in rows:
-            try:
-                recips = [r.student_id_fk for r in (a.recipients or [])]
-            except Exception:
-                recips = []
-            if recips:
-                include = False
-                if user_role in ("principal", "clerk"):
-                    include = True
-                elif user_role == "student" and cur_student_enr and (cur_student_enr in recips):
-                    include = True
-                # Only include personal announcements for allowed roles
-                if include:
-                    announcements.append(a)
-                continue
-            # Non-personal announcements fall back to role audience targeting
-            try:
-                aud = [str(au.role).lower() for au in (a.audiences or [])]
-            except Exception:
-                aud = []
-            if not aud or (user_role in aud):
-                announcements.append(a)
+        user_id = getattr(current_user, "user_id", None)
+        if user_id:
+            ann_q = user_announcements(user_id, effective_trust_id, now, unread_only=True)
+            announcements = [a for a, _is_read in db.session.execute(ann_q.order_by(Announcement.created_at.desc())).all()]
     except Exception:
         announcements = []
 
@@ -4007,7 +3779,7 @@ def dashboard():
         def _get_program_map_scoped():
             q = select(Program).order_by(Program.program_name.asc())
             if effective_trust_id:
-                q = q.join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
+                q = q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
             try:
                 prog_rows = db.session.execute(q).scalars().all()
                 return {p.program_id: p.program_name for p in prog_rows}
@@ -4873,33 +4645,16 @@ def announcements_list():
     program_id_raw = (request.args.get("program_id") or "").strip()
     severity = (request.args.get("severity") or "").strip().lower()
     only_active = (request.args.get("active") or "true").strip().lower() == "true"
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     prog_q = select(Program).order_by(Program.program_name.asc())
     if effective_trust_id:
         try:
-            from ..models import Institute
-            prog_q = prog_q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            prog_q = prog_q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
         except Exception:
             prog_q = prog_q.where(false())
     programs = db.session.execute(prog_q).scalars().all()
     q = select(Announcement)
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     if effective_trust_id:
         q = q.filter(Announcement.trust_id_fk == effective_trust_id)
     else:
@@ -4958,20 +4713,11 @@ def notification_dismiss(notification_id):
 @role_required("admin", "clerk", "principal", "faculty")
 @csrf_required
 def announcement_new():
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     prog_q = select(Program).order_by(Program.program_name.asc())
     if effective_trust_id:
         try:
-            from ..models import Institute
-            prog_q = prog_q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            prog_q = prog_q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
         except Exception:
             prog_q = prog_q.where(false())
     programs = db.session.execute(prog_q).scalars().all()
@@ -5145,26 +4891,24 @@ def announcement_new():
             except Exception:
                 # Best-effort; skip recipients on error
                 pass
+            # Resolve the audience into per-user inbox rows
+            try:
+                fan_out_announcement(a.announcement_id)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
             # Save uploaded attachments (best-effort)
             try:
                 files = request.files.getlist('attachments') or []
                 if files:
-                    base_static = (current_app.static_folder or os.path.join(current_app.root_path, 'static'))
-                    up_dir = os.path.join(base_static, 'uploads', 'announcements', str(a.announcement_id))
-                    os.makedirs(up_dir, exist_ok=True)
                     for f in files:
-                        fn = (getattr(f, 'filename', '') or '').strip()
-                        if not fn:
-                            continue
-                        sf = secure_filename(fn)
+                        sf = secure_filename((getattr(f, 'filename', '') or '').strip())
                         ext = (sf.rsplit('.', 1)[-1].lower() if ('.' in sf) else '')
-                        if ext in ALLOWED_EXTS:
-                            dest = os.path.join(up_dir, sf)
-                            try:
-                                f.save(dest)
-                            except Exception:
-                                pass
+                        if sf and ext in ALLOWED_EXTS:
+                            store_attachment(f, "announcement", a.announcement_id, user_id=getattr(current_user, "user_id", None))
+                    db.session.commit()
             except Exception:
+                db.session.rollback()
                 try:
                     current_app.logger.exception("Failed to save announcement attachments on create")
                 except Exception:
@@ -5240,16 +4984,8 @@ def announcement_edit(announcement_id: int):
     except Exception:
         current_recipients = ""
     # Existing attachments for display
-    attachments = []
-    try:
-        base_static = (current_app.static_folder or os.path.join(current_app.root_path, 'static'))
-        up_dir = os.path.join(base_static, 'uploads', 'announcements', str(a.announcement_id))
-        if os.path.isdir(up_dir):
-            for fn in sorted(os.listdir(up_dir)):
-                attachments.append({
-                    'name': fn,
-                    'url': url_for('static', filename=f"uploads/announcements/{a.announcement_id}/{fn}")
-                })
+    try:
+        attachments = _announcement_attachments([a.announcement_id])[a.announcement_id]
     except Exception:
         attachments = []
     errors = []
@@ -5375,22 +5111,11 @@ def announcement_edit(announcement_id: int):
         # Save uploaded attachments (best-effort)
         try:
             files = request.files.getlist('attachments') or []
-            if files:
-                base_static = (current_app.static_folder or os.path.join(current_app.root_path, 'static'))
-                up_dir = os.path.join(base_static, 'uploads', 'announcements', str(a.announcement_id))
-                os.makedirs(up_dir, exist_ok=True)
-                for f in files:
-                    fn = (getattr(f, 'filename', '') or '').strip()
-                    if not fn:
-                        continue
-                    sf = secure_filename(fn)
-                    ext = (sf.rsplit('.', 1)[-1].lower() if ('.' in sf) else '')
-                    if ext in ALLOWED_EXTS:
-                        dest = os.path.join(up_dir, sf)
-                        try:
-                            f.save(dest)
-                        except Exception:
-                            pass
+            for f in files:
+                sf = secure_filename((getattr(f, 'filename', '') or '').strip())
+                ext = (sf.rsplit('.', 1)[-1].lower() if ('.' in sf) else '')
+                if sf and ext in ALLOWED_EXTS:
+                    store_attachment(f, "announcement", a.announcement_id, user_id=getattr(current_user, "user_id", None))
         except Exception:
             try:
                 current_app.logger.exception("Failed to save announcement attachments on edit")
@@ -5400,6 +5125,7 @@ def announcement_edit(announcement_id: int):
         try:
             ver = (db.session.execute(select(func.max(AnnouncementRevision.version)).filter(AnnouncementRevision.announcement_id_fk == a.announcement_id)).scalar() or 0) + 1
             db.session.add(AnnouncementRevision(announcement_id_fk=a.announcement_id, version=ver, title=a.title, message=a.message, severity=a.severity, is_active=a.is_active, program_id_fk=a.program_id_fk, start_at=a.start_at, end_at=a.end_at, actor_user_id_fk=getattr(current_user, "user_id", None)))
+            fan_out_announcement(a.announcement_id)
             db.session.commit()
             flash("Announcement updated.", "success")
             return redirect(url_for("main.announcements_list"))
@@ -5407,16 +5133,8 @@ def announcement_edit(announcement_id: int):
             db.session.rollback()
             errors.append("Failed to update announcement.")
             # Recompute attachments for display after failure
-            attachments = []
             try:
-                base_static = (current_app.static_folder or os.path.join(current_app.root_path, 'static'))
-                up_dir = os.path.join(base_static, 'uploads', 'announcements', str(a.announcement_id))
-                if os.path.isdir(up_dir):
-                    for fn in sorted(os.listdir(up_dir)):
-                        attachments.append({
-                            'name': fn,
-                            'url': url_for('static', filename=f"uploads/announcements/{a.announcement_id}/{fn}")
-                        })
+                attachments = _announcement_attachments([a.announcement_id])[a.announcement_id]
             except Exception:
                 attachments = []
             return render_template("announcement_edit.html", a=a, programs=programs, errors=errors, students_for_picker=students_for_picker, attachments=attachments, aud_roles=audience_roles, recipient_enrollment_nos=recipients_raw)
@@ -5425,6 +5143,56 @@ def announcement_edit(announcement_id: int):
         # GET
         return render_template("announcement_edit.html", a=a, programs=programs, errors=[], students_for_picker=students_for_picker, aud_roles=current_aud_roles, recipient_enrollment_nos=current_recipients, attachments=attachments)
 
+def _announcement_attachments(announcement_ids):
+    """``{announcement_id: [{"name", "url", "size"}, ...]}`` from the attachments manifest."""
+    return {
+        aid: [
+            {"name": r.file_name, "url": url_for("main.announcement_attachment_file", attachment_id=r.attachment_id, filename=r.file_name), "size": r.size_bytes}
+            for r in rows
+        ]
+        for aid, rows in attachments_for("announcement", announcement_ids).items()
+    }
+
+def _announcement_attachment_access(announcement_id):
+    """None when the current user may fetch the announcement's files, else the response to send."""
+    # Public notice board announcements (global, untargeted) are served to anyone
+    public = db.session.execute(
+        public_announcements(current_only=False).with_only_columns(Announcement.announcement_id)
+        .where(Announcement.announcement_id == announcement_id)
+    ).first()
+    if public:
+        return None
+    if not getattr(current_user, "is_authenticated", False):
+        return current_app.login_manager.unauthorized()
+    uid = getattr(current_user, "user_id", None)
+    addressed = db.session.execute(
+        select(AnnouncementInbox.inbox_id).where(
+            AnnouncementInbox.announcement_id_fk == announcement_id,
+            AnnouncementInbox.user_id_fk == uid,
+        ).limit(1)
+    ).first()
+    if addressed:
+        return None
+    # Staff may open any announcement of the trust they work in
+    scope = current_scope()
+    if scope.is_super_admin or scope.role in ("admin", "clerk", "principal", "faculty"):
+        a = db.session.get(Announcement, announcement_id)
+        if a is not None and ((scope.is_super_admin and not scope.trust_id) or a.trust_id_fk == scope.trust_id):
+            return None
+    abort(404)
+
+
+@main_bp.route("/announcements/attachments/<int:attachment_id>/<path:filename>")
+def announcement_attachment_file(attachment_id: int, filename: str):
+    # Blobs are stored under their content hash; this serves them under the uploaded name
+    row = db.session.get(Attachment, attachment_id)
+    if not row or row.owner_type != "announcement" or row.file_name != filename:
+        abort(404)
+    rv = _announcement_attachment_access(row.owner_id)
+    if rv is not None:
+        return rv
+    return serve_download(row.storage_path, download_name=row.file_name, mimetype=row.mime_type, etag=row.sha256)
+
 @main_bp.route('/announcements/<int:announcement_id>/attachments/delete', methods=['POST'])
 @login_required
 @role_required("admin", "clerk", "principal", "faculty")
@@ -5449,16 +5217,15 @@ def announcement_attachment_delete(announcement_id: int):
         return redirect(url_for('main.announcement_edit', announcement_id=announcement_id))
     sf = secure_filename(fname)
     try:
-        base_static = (current_app.static_folder or os.path.join(current_app.root_path, 'static'))
-        up_dir = os.path.join(base_static, 'uploads', 'announcements', str(a.announcement_id))
-        target = os.path.join(up_dir, sf)
-        # Ensure path resides within upload dir
-        if not os.path.isfile(target) or (os.path.abspath(target).startswith(os.path.abspath(up_dir)) is False):
+        row = find_attachment("announcement", a.announcement_id, sf)
+        if not row:
             flash("File not found.", "warning")
             return redirect(url_for('main.announcement_edit', announcement_id=announcement_id))
-        os.remove(target)
+        release_attachments([row])
+        db.session.commit()
         flash("Attachment deleted.", "info")
     except Exception:
+        db.session.rollback()
         flash("Failed to delete attachment.", "danger")
     return redirect(url_for('main.announcement_edit', announcement_id=announcement_id))
 
@@ -5501,10 +5268,8 @@ def announcement_dismiss(announcement_id: int):
     try:
         user_id = getattr(current_user, "user_id", None)
         if user_id:
-            existing = db.session.execute(select(AnnouncementDismissal).filter_by(announcement_id_fk=announcement_id, user_id_fk=user_id)).scalars().first()
-            if not existing:
-                db.session.add(AnnouncementDismissal(announcement_id_fk=announcement_id, user_id_fk=user_id))
-                db.session.commit()
+            set_announcement_read(user_id, [announcement_id], read=True)
+            db.session.commit()
         flash("Announcement dismissed.", "info")
     except Exception:
         db.session.rollback()
@@ -5525,23 +5290,13 @@ def notice_board():
     from_raw = (request.args.get("from") or "").strip()
     to_raw = (request.args.get("to") or "").strip()
 
-    # Build base query: active and within time window
-    ann_q = select(Announcement).filter(Announcement.is_active == True)
-    effective_trust_id = None
+    # Active, in-window announcements addressed to this user (see announcement_inbox);
+    # anonymous visitors get global announcements without an audience
+    effective_trust_id = current_scope().trust_id
     if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
-    if effective_trust_id:
-        ann_q = ann_q.filter(Announcement.trust_id_fk == effective_trust_id)
+        ann_q = user_announcements(current_user.user_id, effective_trust_id, now).with_only_columns(Announcement)
     else:
-        ann_q = ann_q.filter(Announcement.trust_id_fk == None)
-    ann_q = ann_q.filter(or_(Announcement.start_at == None, Announcement.start_at <= (now + timedelta(hours=12))))
-    ann_q = ann_q.filter(or_(Announcement.end_at == None, Announcement.end_at >= (now - timedelta(hours=12))))
+        ann_q = public_announcements(now)
 
     # Date filters on created_at when show_all requested
     def _parse_date(s):
@@ -5558,17 +5313,6 @@ def notice_board():
             # Include the entire day for 'to'
             ann_q = ann_q.filter(Announcement.created_at <= to_dt.replace(hour=23, minute=59, second=59))
 
-    # Program scoping for non-admin/clerk and unauthenticated: show global or same program
-    try:
-        if role not in ("admin", "clerk"):
-            pid = getattr(current_user, "program_id_fk", None) if getattr(current_user, "is_authenticated", False) else None
-            if pid:
-                ann_q = ann_q.filter(or_(Announcement.program_id_fk == None, Announcement.program_id_fk == pid))
-            else:
-                ann_q = ann_q.filter(Announcement.program_id_fk == None)
-    except Exception:
-        pass
-
     # Fetch rows: latest 10 by default; paginate when show_all
     base_rows = ann_q.order_by(Announcement.created_at.desc())
     page_raw = (request.args.get("page") or "1").strip()
@@ -5610,53 +5354,18 @@ def notice_board():
     except Exception:
         users_map = {}
 
-    # Audience or personal targeting by role; unauthenticated users see only non-targeted (global) announcements
     announcements = []
     for a in latest_rows:
-        # Personal recipients override: only for selected students and Principal/Clerk
         try:
-            recips = [r.student_id_fk for r in (a.recipients or [])]
+            setattr(a, "_creator_name", users_map.get(getattr(a, "created_by", None)))
         except Exception:
-            recips = []
-        include = False
-        if recips:
-            if role in ("principal", "clerk"):
-                include = True
-            elif role == "student" and current_user.is_authenticated:
-                try:
-                    st = db.session.execute(select(Student).filter_by(user_id_fk=current_user.user_id)).scalars().first()
-                    if st and st.enrollment_no in recips:
-                        include = True
-                except Exception:
-                    include = False
-        else:
-            try:
-                aud = [au.role for au in (a.audiences or [])]
-            except Exception:
-                aud = []
-            if not aud:
-                include = True
-            elif role and (role in aud):
-                include = True
-        if include:
-            try:
-                setattr(a, "_creator_name", users_map.get(getattr(a, "created_by", None)))
-            except Exception:
-                pass
-            announcements.append(a)
+            pass
+        announcements.append(a)
     # Enrich announcements with attachment links for public view
     try:
+        links = _announcement_attachments([a.announcement_id for a in announcements])
         for a in announcements:
-            try:
-                base_static = (current_app.static_folder or os.path.join(current_app.root_path, "static"))
-                upload_dir = os.path.join(base_static, "uploads", "announcements", str(a.announcement_id))
-                files = []
-                if os.path.isdir(upload_dir):
-                    files = [fn for fn in os.listdir(upload_dir) if os.path.isfile(os.path.join(upload_dir, fn))]
-                attachments = [{"name": fn, "url": url_for("static", filename=f"uploads/announcements/{a.announcement_id}/{fn}") } for fn in sorted(files)]
-            except Exception:
-                attachments = []
-            setattr(a, "_attachments", attachments)
+            setattr(a, "_attachments", links.get(a.announcement_id, []))
     except Exception:
         pass
     return render_template("notice_board.html", announcements=announcements, show_all=show_all, selected_from=from_raw, selected_to=to_raw, pagination=pagination)
@@ -5672,7 +5381,11 @@ def notice_archive():
     page_raw = (request.args.get("page") or "1").strip()
     per_page_raw = (request.args.get("per_page") or "10").strip()
 
-    ann_q = select(Announcement)
+    if getattr(current_user, "is_authenticated", False):
+        effective_trust_id = current_scope().trust_id
+        ann_q = user_announcements(current_user.user_id, effective_trust_id, current_only=False).with_only_columns(Announcement)
+    else:
+        ann_q = public_announcements(current_only=False)
     # Date filter by created_at
     def _parse_date(s):
         try:
@@ -5686,17 +5399,6 @@ def notice_archive():
     if to_dt:
         ann_q = ann_q.filter(Announcement.created_at <= to_dt.replace(hour=23, minute=59, second=59))
 
-    # Program scoping for non-admin/clerk and unauthenticated: show global or same program
-    try:
-        if role not in ("admin", "clerk"):
-            pid = getattr(current_user, "program_id_fk", None) if getattr(current_user, "is_authenticated", False) else None
-            if pid:
-                ann_q = ann_q.filter(or_(Announcement.program_id_fk == None, Announcement.program_id_fk == pid))
-            else:
-                ann_q = ann_q.filter(Announcement.program_id_fk == None)
-    except Exception:
-        pass
-
     # Pagination
     base_rows = ann_q.order_by(Announcement.created_at.desc())
     try:
@@ -5732,63 +5434,29 @@ def notice_archive():
     except Exception:
         users_map = {}
 
-    # Audience or personal targeting by role; unauthenticated users see only non-targeted (global) announcements
     announcements = []
     for a in rows:
-        # Personal recipients override: only for selected students and Principal/Clerk
+        # Status label
+        is_window = ((a.start_at is None or a.start_at <= (now + timedelta(hours=12))) and (a.end_at is None or a.end_at >= (now - timedelta(hours=12))))
+        status_label = "Active" if (a.is_active and is_window) else "Inactive/Expired"
         try:
-            recips = [r.student_id_fk for r in (a.recipients or [])]
+            setattr(a, "_creator_name", users_map.get(getattr(a, "created_by", None)))
+            setattr(a, "_status_label", status_label)
         except Exception:
-            recips = []
-        include = False
-        if recips:
-            if role in ("principal", "clerk"):
-                include = True
-            elif role == "student" and current_user.is_authenticated:
-                try:
-                    st = db.session.execute(select(Student).filter_by(user_id_fk=current_user.user_id)).scalars().first()
-                    if st and st.enrollment_no in recips:
-                        include = True
-                except Exception:
-                    include = False
-        else:
-            try:
-                aud = [au.role for au in (a.audiences or [])]
-            except Exception:
-                aud = []
-            if not aud:
-                include = True
-            elif role and (role in aud):
-                include = True
-        if include:
-            # Status label
-            is_window = ((a.start_at is None or a.start_at <= (now + timedelta(hours=12))) and (a.end_at is None or a.end_at >= (now - timedelta(hours=12))))
-            status_label = "Active" if (a.is_active and is_window) else "Inactive/Expired"
-            try:
-                setattr(a, "_creator_name", users_map.get(getattr(a, "created_by", None)))
-                setattr(a, "_status_label", status_label)
-            except Exception:
-                pass
-            announcements.append(a)
+            pass
+        announcements.append(a)
     # Enrich announcements with attachment links for archive view
     try:
+        links = _announcement_attachments([a.announcement_id for a in announcements])
         for a in announcements:
-            try:
-                base_static = (current_app.static_folder or os.path.join(current_app.root_path, "static"))
-                upload_dir = os.path.join(base_static, "uploads", "announcements", str(a.announcement_id))
-                files = []
-                if os.path.isdir(upload_dir):
-                    files = [fn for fn in os.listdir(upload_dir) if os.path.isfile(os.path.join(upload_dir, fn))]
-                attachments = [{"name": fn, "url": url_for("static", filename=f"uploads/announcements/{a.announcement_id}/{fn}") } for fn in sorted(files)]
-            except Exception:
-                attachments = []
-            setattr(a, "_attachments", attachments)
+            setattr(a, "_attachments", links.get(a.announcement_id, []))
     except Exception:
         pass
     return render_template("notice_archive.html", announcements=announcements, pagination=pagination, selected_from=from_raw, selected_to=to_raw)
 
 @main_bp.route("/inbox")
 @login_required
+@query_budget(queries=25, repeats=5)
 def inbox():
     now = datetime.now()
     role = (getattr(current_user, "role", "") or "").strip().lower()
@@ -5797,15 +5465,7 @@ def inbox():
     show_all = (tab == "all")
     user_id = getattr(current_user, "user_id", None)
 
-    def _effective_trust_id():
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                return int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                return None
-        return getattr(current_user, "trust_id_fk", None)
-
-    effective_trust_id = _effective_trust_id()
+    effective_trust_id = current_scope().trust_id
 
     sm_q = select(SystemMessage).where(SystemMessage.is_active.is_(True))
     if role:
@@ -5829,68 +5489,19 @@ def inbox():
             system_messages.append(m)
     system_unread_count = sum(1 for m in system_rows if m.message_id not in read_ids)
 
-    ann_q = select(Announcement).filter(Announcement.is_active == True)
-    if effective_trust_id:
-        ann_q = ann_q.filter(Announcement.trust_id_fk == effective_trust_id)
-    else:
-        ann_q = ann_q.filter(Announcement.trust_id_fk == None)
-    ann_q = ann_q.filter(or_(Announcement.start_at == None, Announcement.start_at <= (now + timedelta(hours=12))))
-    ann_q = ann_q.filter(or_(Announcement.end_at == None, Announcement.end_at >= (now - timedelta(hours=12))))
-    if role not in ("admin", "clerk"):
-        pid = getattr(current_user, "program_id_fk", None)
-        if pid:
-            ann_q = ann_q.filter(or_(Announcement.program_id_fk == None, Announcement.program_id_fk == pid))
-        else:
-            ann_q = ann_q.filter(Announcement.program_id_fk == None)
-    latest_rows = db.session.execute(ann_q.order_by(Announcement.created_at.desc()).limit(80)).scalars().all()
-
-    dismissed_ids = set()
-    if user_id:
-        try:
-            dismissed_ids = set(db.session.execute(select(AnnouncementDismissal.announcement_id_fk).filter_by(user_id_fk=user_id)).scalars().all())
-        except Exception:
-            dismissed_ids = set()
+    announcements = []
+    total_in_scope, unread_in_scope = announcement_inbox_counts(user_id, effective_trust_id, now)
+    ann_q = user_announcements(user_id, effective_trust_id, now, unread_only=not show_all)
+    latest_rows = db.session.execute(ann_q.order_by(Announcement.created_at.desc()).limit(80)).all()
 
-    creator_ids = {a.created_by for a in latest_rows if getattr(a, "created_by", None)}
+    creator_ids = {a.created_by for a, _is_read in latest_rows if getattr(a, "created_by", None)}
     users = db.session.execute(select(User).filter(User.user_id.in_(list(creator_ids)))).scalars().all() if creator_ids else []
     users_map = {u.user_id: (u.username or f"User #{u.user_id}") for u in users}
 
-    announcements = []
-    total_in_scope = 0
-    unread_in_scope = 0
-    for a in latest_rows:
-        include = False
-        recips = []
-        try:
-            recips = [r.student_id_fk for r in (a.recipients or [])]
-        except Exception:
-            recips = []
-        if recips:
-            if role in ("principal", "clerk"):
-                include = True
-            elif role == "student" and current_user.is_authenticated:
-                try:
-                    st = db.session.execute(select(Student).filter_by(user_id_fk=current_user.user_id)).scalars().first()
-                    if st and st.enrollment_no in recips:
-                        include = True
-                except Exception:
-                    include = False
-        else:
-            try:
-                aud = [au.role for au in (a.audiences or [])]
-            except Exception:
-                aud = []
-            include = (not aud) or (role in aud)
-
-        if include:
-            total_in_scope += 1
-            is_read = (a.announcement_id in dismissed_ids)
-            if not is_read:
-                unread_in_scope += 1
-            if show_all or (not is_read):
-                setattr(a, "_creator_name", users_map.get(getattr(a, "created_by", None)))
-                setattr(a, "_is_read", is_read)
-                announcements.append(a)
+    for a, is_read in latest_rows:
+        setattr(a, "_creator_name", users_map.get(getattr(a, "created_by", None)))
+        setattr(a, "_is_read", bool(is_read))
+        announcements.append(a)
 
     notif_rows = []
     notif_unread = 0
@@ -5934,13 +5545,11 @@ def inbox_announcement_read(announcement_id: int):
     user_id = getattr(current_user, "user_id", None)
     if not user_id:
         return redirect(url_for("main.inbox"))
-    existing = db.session.execute(select(AnnouncementDismissal).filter_by(announcement_id_fk=announcement_id, user_id_fk=user_id)).scalars().first()
-    if not existing:
-        db.session.add(AnnouncementDismissal(announcement_id_fk=announcement_id, user_id_fk=user_id))
-        try:
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
+    try:
+        set_announcement_read(user_id, [announcement_id], read=True)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
     try:
         ref = request.referrer
     except Exception:
@@ -5955,10 +5564,8 @@ def inbox_announcement_unread(announcement_id: int):
     user_id = getattr(current_user, "user_id", None)
     if user_id:
         try:
-            row = db.session.execute(select(AnnouncementDismissal).filter_by(announcement_id_fk=announcement_id, user_id_fk=user_id)).scalars().first()
-            if row:
-                db.session.delete(row)
-                db.session.commit()
+            set_announcement_read(user_id, [announcement_id], read=False)
+            db.session.commit()
         except Exception:
             db.session.rollback()
     try:
@@ -6018,15 +5625,7 @@ def inbox_mark_all_read():
     if not user_id:
         return redirect(url_for("main.inbox"))
 
-    try:
-        effective_trust_id = getattr(current_user, "trust_id_fk", None)
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-    except Exception:
-        effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
 
     try:
         sm_q = select(SystemMessage.message_id).where(SystemMessage.is_active.is_(True))
@@ -6045,24 +5644,7 @@ def inbox_mark_all_read():
         pass
 
     try:
-        ann_q = select(Announcement.announcement_id).filter(Announcement.is_active == True)
-        if effective_trust_id:
-            ann_q = ann_q.filter(Announcement.trust_id_fk == effective_trust_id)
-        else:
-            ann_q = ann_q.filter(Announcement.trust_id_fk == None)
-        ann_q = ann_q.filter(or_(Announcement.start_at == None, Announcement.start_at <= (now + timedelta(hours=12))))
-        ann_q = ann_q.filter(or_(Announcement.end_at == None, Announcement.end_at >= (now - timedelta(hours=12))))
-        if role not in ("admin", "clerk"):
-            pid = getattr(current_user, "program_id_fk", None)
-            if pid:
-                ann_q = ann_q.filter(or_(Announcement.program_id_fk == None, Announcement.program_id_fk == pid))
-            else:
-                ann_q = ann_q.filter(Announcement.program_id_fk == None)
-        ann_ids = db.session.execute(ann_q.order_by(Announcement.created_at.desc()).limit(120)).scalars().all()
-        existing = set(db.session.execute(select(AnnouncementDismissal.announcement_id_fk).filter_by(user_id_fk=user_id)).scalars().all())
-        for aid in ann_ids:
-            if aid not in existing:
-                db.session.add(AnnouncementDismissal(announcement_id_fk=aid, user_id_fk=user_id))
+        mark_all_announcements_read(user_id, effective_trust_id, now)
     except Exception:
         pass
 
@@ -6131,7 +5713,7 @@ def forgot_password():
                 for r in ["principal", "clerk"]:
                     aud = AnnouncementAudience(announcement_id_fk=ann.announcement_id, role=r)
                     db.session.add(aud)
-                
+                fan_out_announcement(ann.announcement_id)
                 db.session.commit()
                 current_app.logger.info(f"Password reset request for {username} created as Announcement #{ann.announcement_id}")
 
@@ -6267,8 +5849,9 @@ def account_settings():
                         subj = "CloudEMS Password Change Verification Code"
                         text = f"Your verification code is: {code}. It expires in 10 minutes."
                         html = f"<p>Your verification code is:</p><h3>{code}</h3><p>It expires in 10 minutes.</p>"
-                        sent = send_email(subj, email_to, text, html)
+                        sent = send_email(subj, email_to, text, html, category="password_2fa")
                         if sent:
+                            db.session.commit()
                             session["twofa_code"] = code
                             session["twofa_expires"] = (datetime.now(timezone.utc) + timedelta(minutes=10)).isoformat()
                             session["twofa_pw_hash"] = generate_password_hash(new_pw)
@@ -6456,7 +6039,7 @@ def account_settings():
 
 
 @main_bp.route("/faculty")
-@cache.cached(timeout=60, key_prefix=lambda: f"fac_list_{getattr(current_user, 'user_id', 'anon')}_{request.full_path}", unless=lambda: session.get("_flashes"))
+@cached_result("faculty_list", ("staff",), per_user=True, unless=lambda: session.get("_flashes"))
 def faculty_list():
     # List Admin/Principal/Faculty/Clerk users with optional filters (role, search, program)
     from sqlalchemy import func, or_
@@ -6467,16 +6050,8 @@ def faculty_list():
     current_role = ((getattr(current_user, "role", "") or "").strip().lower() if getattr(current_user, "is_authenticated", False) else "")
 
     # Determine Effective Trust Context
-    effective_trust_id = None
     is_super = getattr(current_user, "is_super_admin", False)
-    if is_super:
-        if "active_trust_id" in session:
-             try:
-                 effective_trust_id = int(session["active_trust_id"])
-             except:
-                 pass
-    else:
-        effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
 
     faculty_table = _reflected_table("faculty")
     query = (
@@ -6559,16 +6134,8 @@ def faculty_profile(faculty_id):
     f = _faculty_namespace(faculty_row)
 
     # Security: Trust Isolation
-    effective_trust_id = None
     is_super = getattr(current_user, "is_super_admin", False)
-    if is_super:
-        if "active_trust_id" in session:
-             try:
-                 effective_trust_id = int(session["active_trust_id"])
-             except:
-                 pass
-    else:
-        effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
 
     if effective_trust_id:
         # Check User link
@@ -7433,28 +7000,11 @@ def students():
     _ctx = _program_dropdown_context(program_id_raw, include_admin_all=True, prefer_user_program_default=False)
     role = _ctx.get("role")
     selected_program_id = _ctx.get("selected_program_id")
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     if selected_program_id and (requested_medium_raw is None):
         try:
-            base_dir = os.path.dirname(current_app.root_path)
-            cfg_path = os.path.join(base_dir, "DATA FOR IMPORT EXPORT", "programs.csv")
-            default_by_name = {}
-            with open(cfg_path, newline="", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    n = (row.get("program_name") or "").strip()
-                    d = (row.get("default_medium") or "").strip().lower()
-                    default_by_name[n] = d
             prog = db.session.get(Program, selected_program_id)
-            d = default_by_name.get(prog.program_name if prog else "")
+            d = default_medium_for(prog.program_name if prog else "")
             if d in ("english", "gujarati"):
                 selected_medium = d
         except Exception:
@@ -7568,33 +7118,48 @@ def students():
             )
         )
 
-    # Sorting Logic
+    # Sorting Logic: keys are NULL-free and end in the primary key so pages can
+    # seek from a cursor instead of using OFFSET
     if sort_by == "roll_no":
-        # Sort by numeric roll no if possible
-        query = query.order_by(cast(Student.roll_no, Integer).asc(), Student.enrollment_no.asc())
+        # Sort by numeric roll no if possible (students without one last)
+        sort_keys = [(func.coalesce(cast(Student.roll_no, Integer), 2147483647), False), (Student.enrollment_no, False)]
     elif sort_by == "name":
-        query = query.order_by(Student.surname.asc(), Student.student_name.asc())
+        sort_keys = [(func.coalesce(Student.surname, ""), False), (func.coalesce(Student.student_name, ""), False), (Student.enrollment_no, False)]
     elif sort_by == "enrollment":
-        query = query.order_by(Student.enrollment_no.asc())
+        sort_keys = [(Student.enrollment_no, False)]
     else:
-        # Default fallback
-        query = query.order_by(Student.current_semester.desc(), Student.enrollment_no)
-
-    # Show students ordered by semester (desc) then enrollment
-    total_count = db.session.scalar(select(func.count()).select_from(query.subquery()))
-    items = db.session.execute(
-        query
-        .offset((selected_page - 1) * selected_limit)
-        .limit(selected_limit)
-    ).all()
+        # Default fallback: semester (desc) then enrollment
+        sort_keys = [(func.coalesce(Student.current_semester, 0), True), (Student.enrollment_no, False)]
+
+    total_count = cached_count(query, prefix="students_count", timeout=current_app.config.get("STUDENTS_COUNT_CACHE_TTL", 60))
+    after_cursor = (request.args.get("after") or "").strip() or None
+    before_cursor = (request.args.get("before") or "").strip() or None
+    items, next_cursor, prev_cursor = keyset_page(
+        query,
+        sort_keys,
+        selected_limit,
+        after=after_cursor,
+        before=before_cursor,
+        offset=0 if (after_cursor or before_cursor) else (selected_page - 1) * selected_limit,
+    )
+    page_args = {
+        "program_id": selected_program_id or "",
+        "semester": selected_semester or "all",
+        "medium": selected_medium or "all",
+        "division_id": selected_division_id or "all",
+        "status": selected_status,
+        "sort_by": sort_by,
+        "enrollment_no": q_enrollment_no,
+        "name": q_name,
+        "limit": selected_limit,
+    }
     # Fetch mapping helpers
     prog_q = select(Program)
     div_q = select(Division)
     try:
-        from ..models import Institute
         if effective_trust_id:
-            prog_q = prog_q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
-            div_q = div_q.join(Program, Division.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            prog_q = prog_q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
+            div_q = div_q.where(Division.program_id_fk.in_(program_ids_for(effective_trust_id)))
     except Exception:
         pass
     program_map = {p.program_id: p.program_name for p in db.session.execute(prog_q).scalars().all()}
@@ -7617,6 +7182,9 @@ def students():
         selected_limit=selected_limit,
         selected_page=selected_page,
         total_count=total_count,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
+        page_args=page_args,
         q_enrollment_no=q_enrollment_no,
         q_name=q_name,
         program_list=program_list,
@@ -7628,7 +7196,8 @@ def students():
 # JSON search endpoint: search students by name or enrollment
 @main_bp.route("/api/students/search", methods=["GET"])
 @login_required
-@cache.cached(timeout=120, key_prefix=lambda: f"api_students_search_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}_{request.full_path}")
+@query_budget(queries=12, repeats=5)
+@cached_result("api_students_search", ("students",))
 def api_students_search():
     q = (request.args.get("q") or "").strip()
     program_id_raw = (request.args.get("program_id") or "").strip()
@@ -7647,15 +7216,7 @@ def api_students_search():
     ).select_from(Student)
     # Enforce program scoping for clerk/principal; admin can search globally
     role = (getattr(current_user, "role", "") or "").strip().lower()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     if effective_trust_id:
         query = query.filter(Student.trust_id_fk == effective_trust_id)
     pid_scope = None
@@ -7696,28 +7257,26 @@ def api_students_search():
             query = query.filter(Student.medium_tag == medium_val)
     if not include_inactive:
         query = query.filter(Student.is_active == True)
+    rank = None
     if q:
-        query = query.filter(
-            or_(
-                Student.enrollment_no.ilike(f"%{q}%"),
-                Student.student_name.ilike(f"%{q}%"),
-                Student.surname.ilike(f"%{q}%"),
-            )
-        )
-    # Dynamic sorting: prioritize name order if query appears name-like
-    try:
-        is_name_like = any(ch.isalpha() for ch in q)
-    except Exception:
-        is_name_like = False
-    if is_name_like:
-        rows = db.session.execute(query.order_by(Student.surname.asc(), Student.student_name.asc(), Student.enrollment_no.asc()).limit(10)).all()
+        # Token-prefix match over the student search index (FTS5 / tsvector), best match first
+        query, rank = apply_student_search(query, q)
+    if rank is not None:
+        rows = db.session.execute(query.order_by(rank, Student.enrollment_no.asc()).limit(10)).all()
     else:
-        rows = db.session.execute(query.order_by(Student.enrollment_no.asc()).limit(10)).all()
-    prog_q = select(Program)
+        # Dynamic sorting: prioritize name order if query appears name-like
+        try:
+            is_name_like = any(ch.isalpha() for ch in q)
+        except Exception:
+            is_name_like = False
+        if is_name_like:
+            rows = db.session.execute(query.order_by(Student.surname.asc(), Student.student_name.asc(), Student.enrollment_no.asc()).limit(10)).all()
+        else:
+            rows = db.session.execute(query.order_by(Student.enrollment_no.asc()).limit(10)).all()
+    prog_q = select(Program).filter(Program.program_id.in_(list({s.program_id_fk for s in rows})))
     try:
-        from ..models import Institute
         if effective_trust_id:
-            prog_q = prog_q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            prog_q = prog_q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
     except Exception:
         pass
     program_map = {p.program_id: p.program_name for p in db.session.execute(prog_q).scalars().all()}
@@ -8989,15 +8548,7 @@ def subjects_export_csv():
         m = medium_raw.capitalize()
         if m in {"English", "Gujarati"}:
             selected_medium = m
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     subject_table = _reflected_table("subjects")
     q = select(
         subject_table.c.subject_id,
@@ -9010,8 +8561,7 @@ def subjects_export_csv():
     )
     if effective_trust_id:
         try:
-            from ..models import Institute
-            q = q.join(Program, subject_table.c.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            q = q.join(Program, subject_table.c.program_id_fk == Program.program_id).where(Program.program_id.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     if program_id:
@@ -10075,6 +9625,35 @@ def enroll_core():
     )
 
 
+# One attempt only: a retry would repeat the UPDATE on from_semester, and a lower
+# semester promoted in the meantime would move up twice.
+@job_handler("semester_promotion", max_attempts=1)
+def _semester_promotion_job(ctx, program_id, from_semester, to_semester, trust_id=None):
+    program = db.session.get(Program, program_id)
+    if not program:
+        raise ValueError("Program not found.")
+    ctx.progress(5, f"Promoting Sem {from_semester} students")
+    student_table = _reflected_table("students")
+    filters = [
+        student_table.c.program_id_fk == program_id,
+        student_table.c.current_semester == from_semester,
+    ]
+    if trust_id:
+        filters.append(student_table.c.trust_id_fk == trust_id)
+    updated = int(getattr(db.session.execute(student_table.update().where(*filters).values(current_semester=to_semester)), "rowcount", 0) or 0)
+    db.session.commit()
+    message = f"Promoted {updated} students from Sem {from_semester} to Sem {to_semester}."
+    # Past this point the promotion is committed, so the job no longer checks for cancellation
+    # and a failed rebalance is reported rather than failing (and retrying) the job.
+    try:
+        _rebalance_program_divisions_for_semester(program, to_semester)
+    except Exception as exc:
+        db.session.rollback()
+        warning = f"Divisions for Sem {to_semester} were not rebalanced: {exc}"
+        return {"message": message, "updated": updated, "warnings": [warning]}
+    return {"message": message, "updated": updated}
+
+
 @main_bp.route("/students/semester-promotion", methods=["GET", "POST"])
 @login_required
 @role_required("admin", "principal", "clerk")
@@ -10101,7 +9680,7 @@ def students_semester_promotion():
         q = select(Program).order_by(Program.program_name.asc())
         if effective_trust_id:
             try:
-                q = q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+                q = q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
             except Exception:
                 q = q.where(false())
         programs = db.session.execute(q).scalars().all()
@@ -10109,9 +9688,8 @@ def students_semester_promotion():
             try:
                 selected_program = db.session.execute(
                     select(Program)
-                    .join(Institute, Program.institute_id_fk == Institute.institute_id)
                     .filter(Program.program_id == program_id)
-                    .filter(Institute.trust_id_fk == effective_trust_id)
+                    .filter(Program.program_id.in_(program_ids_for(effective_trust_id)))
                 ).scalars().first() if effective_trust_id else db.session.get(Program, program_id)
             except Exception:
                 selected_program = None
@@ -10167,30 +9745,20 @@ def students_semester_promotion():
             ).mappings().all()
         ]
         if request.method == "POST" and action == "confirm" and total_eligible:
-            updated = int(
-                getattr(
-                    db.session.execute(
-                        student_table.update().where(*base_filters).values(current_semester=to_semester)
-                    ),
-                    "rowcount",
-                    0,
-                )
-                or 0
+            job = enqueue(
+                "semester_promotion",
+                {
+                    "program_id": selected_program.program_id,
+                    "from_semester": from_semester,
+                    "to_semester": to_semester,
+                    "trust_id": effective_trust_id,
+                },
+                label=f"Promote {selected_program.program_name} Sem {from_semester} → Sem {to_semester}",
+                user=current_user,
+                trust_id=effective_trust_id,
+                return_url=url_for("main.students", program_id=selected_program.program_id, semester=to_semester),
             )
-            try:
-                db.session.commit()
-                _rebalance_program_divisions_for_semester(selected_program, to_semester)
-                try:
-                    flash(f"Promoted {updated} students from Sem {from_semester} to Sem {to_semester}.", "success")
-                except Exception:
-                    pass
-                return redirect(url_for("main.students", program_id=selected_program.program_id, semester=to_semester))
-            except Exception:
-                db.session.rollback()
-                try:
-                    flash("Failed to promote students. Please try again.", "danger")
-                except Exception:
-                    pass
+            return redirect(url_for("jobs.job_status", job_id=job.job_id))
     return render_template(
         "students_semester_promotion.html",
         program=selected_program,
@@ -10302,17 +9870,8 @@ def users_list():
     q_program_raw = (request.args.get("program_id") or "").strip()
     
     # Determine Effective Trust Context
-    effective_trust_id = None
     is_super = getattr(current_user, "is_super_admin", False)
-    if is_super:
-        # Check for impersonated trust
-        if "active_trust_id" in session:
-             try:
-                 effective_trust_id = int(session["active_trust_id"])
-             except:
-                 pass
-    else:
-        effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
 
     query = select(User)
     current_role = (getattr(current_user, "role", "") or "").strip().lower()
@@ -10452,16 +10011,8 @@ def user_edit(user_id):
         abort(404)
 
     # Security: Trust Isolation
-    effective_trust_id = None
     is_super = getattr(current_user, "is_super_admin", False)
-    if is_super:
-        if "active_trust_id" in session:
-             try:
-                 effective_trust_id = int(session["active_trust_id"])
-             except:
-                 pass
-    else:
-        effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
 
     if effective_trust_id:
         # If user belongs to a different trust (or no trust), deny access
@@ -10736,6 +10287,7 @@ def user_map_program(user_id: int):
 @main_bp.route("/attendance/mark", methods=["GET", "POST"])
 @login_required
 @role_required("admin", "principal", "faculty")
+@query_budget(queries=30, repeats=5)
 def attendance_mark():
     from datetime import date, time, timedelta
     # Compute current academic year (e.g., 2024-25)
@@ -10746,15 +10298,7 @@ def attendance_mark():
 
     # Determine role and program scope (for principal/admin fallback)
     role = (getattr(current_user, "role", "") or "").strip().lower()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     selected_program_id = None
     
     # Read selection
@@ -10787,9 +10331,8 @@ def attendance_mark():
     div_q_all = select(Division)
     if effective_trust_id:
         try:
-            from ..models import Institute
-            subj_q_all = subj_q_all.join(Program, Subject.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
-            div_q_all = div_q_all.join(Program, Division.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            subj_q_all = subj_q_all.where(Subject.program_id_fk.in_(program_ids_for(effective_trust_id)))
+            div_q_all = div_q_all.where(Division.program_id_fk.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     subj_map = {s.subject_id: s for s in db.session.execute(subj_q_all).scalars().all()}
@@ -10802,23 +10345,14 @@ def attendance_mark():
         prog_q = select(Program).order_by(Program.program_name)
         if effective_trust_id:
             try:
-                from ..models import Institute
-                prog_q = prog_q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+                prog_q = prog_q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
             except Exception:
                 pass
         programs = db.session.execute(prog_q).scalars().all()
 
     if effective_trust_id and selected_program_id:
         try:
-            from ..models import Institute
-            ok = db.session.execute(
-                select(func.count())
-                .select_from(Program)
-                .join(Institute, Program.institute_id_fk == Institute.institute_id)
-                .filter(Program.program_id == selected_program_id)
-                .filter(Institute.trust_id_fk == effective_trust_id)
-            ).scalar() or 0
-            if ok <= 0:
+            if int(selected_program_id) not in program_ids_for(effective_trust_id):
                 selected_program_id = None
         except Exception:
             pass
@@ -10844,8 +10378,7 @@ def attendance_mark():
         subj_q = select(Subject)
         if effective_trust_id:
             try:
-                from ..models import Institute
-                subj_q = subj_q.join(Program, Subject.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+                subj_q = subj_q.where(Subject.program_id_fk.in_(program_ids_for(effective_trust_id)))
             except Exception:
                 pass
         if selected_program_id:
@@ -10886,8 +10419,7 @@ def attendance_mark():
             div_q = select(Division)
             if effective_trust_id:
                 try:
-                    from ..models import Institute
-                    div_q = div_q.join(Program, Division.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+                    div_q = div_q.where(Division.program_id_fk.in_(program_ids_for(effective_trust_id)))
                 except Exception:
                     pass
             if selected_program_id:
@@ -11121,6 +10653,8 @@ def attendance_mark():
                     for extra in items[1:]:
                         db.session.delete(extra)
 
+            from ..attendance_rollups import RollupTracker
+            rollups = RollupTracker()
             created = 0
             updated = 0
             present_count = 0
@@ -11151,7 +10685,9 @@ def attendance_mark():
                     )
                     db.session.add(att)
                     created += 1
+                rollups.add(att)
             try:
+                rollups.flush()
                 db.session.commit()
                 flash(f"Attendance saved. Present {present_count}/{total_count}. ({created} added, {updated} updated)", "success")
                 return redirect(url_for("main.attendance_mark", subject_id=selected_subject_id, division_id=(division.division_id if division else ""), academic_year=selected_year, period_no=selected_period, date=today.strftime("%Y-%m-%d")))
@@ -11359,7 +10895,7 @@ def attendance_show():
 @main_bp.route("/attendance/report", methods=["GET"])
 @login_required
 @role_required("admin", "principal")
-@cache.cached(timeout=60, key_prefix=lambda: f"att_rep_{getattr(current_user, 'user_id', 'anon')}_{request.full_path}", unless=lambda: session.get("_flashes"))
+@cached_result("attendance_report", ("attendance", "students"), per_user=True, unless=lambda: session.get("_flashes"))
 def attendance_report_admin():
     from ..models import Program, Subject, Division, Attendance, Student
     # Resolve scope
@@ -11443,72 +10979,78 @@ def attendance_report_admin():
     subj_ids = [s.subject_id for s in subjects]
     subj_name_map = {s.subject_id: s.subject_name for s in subjects}
 
-    # Attendance query scoped
-    q = select(Attendance)
-    if subj_ids:
-        q = q.filter(Attendance.subject_id_fk.in_(subj_ids))
-    if start_date:
-        q = q.filter(Attendance.date_marked >= start_date)
-    if end_date:
-        q = q.filter(Attendance.date_marked <= end_date)
-    if division_id:
-        q = q.filter(Attendance.division_id_fk == division_id)
-    rows = db.session.execute(q.order_by(Attendance.date_marked.asc())).scalars().all()
+    # Counts come from the session rollups; only reach (distinct students)
+    # needs the raw table, and that is aggregated in SQL.
+    from ..models import AttendanceSessionRollup as R
+    from sqlalchemy import case
+
+    def _scoped(q, model):
+        if subj_ids:
+            q = q.filter(model.subject_id_fk.in_(subj_ids))
+        if start_date:
+            q = q.filter(model.date_marked >= start_date)
+        if end_date:
+            q = q.filter(model.date_marked <= end_date)
+        if division_id:
+            q = q.filter(model.division_id_fk == division_id)
+        return q
+
+    sums = (func.sum(R.present_count), func.sum(R.absent_count), func.sum(R.late_count), func.sum(R.total_count))
+    status_u = func.upper(Attendance.status)
+    reach_cols = (
+        func.count(func.distinct(case((status_u.in_(["P", "L"]), Attendance.student_id_fk)))),
+        func.count(func.distinct(case((status_u == "A", Attendance.student_id_fk)))),
+    )
 
     totals_by_subject = {}
-    totals_by_division = {}
     subject_trackers = {}
+    subject_rows = db.session.execute(
+        _scoped(select(R.subject_id_fk, *sums, func.count(func.distinct(R.date_marked))), R)
+        .group_by(R.subject_id_fk)
+        .order_by(func.min(R.date_marked), R.subject_id_fk)
+    ).all()
+    for sid, p, a, l, total, days in subject_rows:
+        totals_by_subject[sid] = {"name": subj_name_map.get(sid, str(sid)), "P": int(p or 0), "A": int(a or 0), "L": int(l or 0), "total": int(total or 0)}
+        subject_trackers[sid] = {"sessions": int(days or 0)}
+    for sid, up, ua in db.session.execute(
+        _scoped(select(Attendance.subject_id_fk, *reach_cols), Attendance).group_by(Attendance.subject_id_fk)
+    ).all():
+        subject_trackers.setdefault(sid, {"sessions": 0}).update({"unique_present": int(up or 0), "unique_absent": int(ua or 0)})
+
+    totals_by_division = {}
     div_trackers = {}
-    lecture_sessions = set()
-    lecture_per_day = {}
     div_map = {d.division_id: d for d in db.session.execute(select(Division)).scalars().all()}
-    for r in rows:
-        sid = r.subject_id_fk
-        sname = subj_name_map.get(sid, str(sid))
-        totals_by_subject.setdefault(sid, {"name": sname, "P": 0, "A": 0, "L": 0, "total": 0})
-        if r.status in ("P", "A", "L"):
-            totals_by_subject[sid][r.status] += 1
-        totals_by_subject[sid]["total"] += 1
-
-        st = subject_trackers.setdefault(sid, {"dates": set(), "present_students": set(), "absent_students": set(), "late_students": set()})
-        try:
-            st["dates"].add(r.date_marked)
-        except Exception:
-            pass
-        if r.status == "P":
-            st["present_students"].add(r.student_id_fk)
-        elif r.status == "A":
-            st["absent_students"].add(r.student_id_fk)
-        elif r.status == "L":
-            st["late_students"].add(r.student_id_fk)
-
-        did = r.division_id_fk
+    division_rows = db.session.execute(
+        _scoped(select(R.division_id_fk, *sums), R)
+        .group_by(R.division_id_fk)
+        .order_by(func.min(R.date_marked), R.division_id_fk)
+    ).all()
+    for did, p, a, l, total in division_rows:
         div = div_map.get(did)
         dkey = did or 0
         dname = (f"Sem {div.semester} — {div.division_code}" if div else "-")
-        totals_by_division.setdefault(dkey, {"name": dname, "P": 0, "A": 0, "L": 0, "total": 0})
-        if r.status in ("P", "A", "L"):
-            totals_by_division[dkey][r.status] += 1
-        totals_by_division[dkey]["total"] += 1
-
-        dt = div_trackers.setdefault(dkey, {"present_students": set(), "absent_students": set(), "late_students": set()})
-        if r.status == "P":
-            dt["present_students"].add(r.student_id_fk)
-        elif r.status == "A":
-            dt["absent_students"].add(r.student_id_fk)
-        elif r.status == "L":
-            dt["late_students"].add(r.student_id_fk)
-
-        session_key = (r.date_marked, r.subject_id_fk, r.division_id_fk, r.period_no or 0)
-        if session_key not in lecture_sessions:
-            lecture_sessions.add(session_key)
-            if r.date_marked:
-                lecture_per_day[r.date_marked] = lecture_per_day.get(r.date_marked, 0) + 1
+        t = totals_by_division.setdefault(dkey, {"name": dname, "P": 0, "A": 0, "L": 0, "total": 0})
+        t["P"] += int(p or 0)
+        t["A"] += int(a or 0)
+        t["L"] += int(l or 0)
+        t["total"] += int(total or 0)
+    for did, up, ua in db.session.execute(
+        _scoped(select(Attendance.division_id_fk, *reach_cols), Attendance).group_by(Attendance.division_id_fk)
+    ).all():
+        div_trackers[did or 0] = {"unique_present": int(up or 0), "unique_absent": int(ua or 0)}
+
+    # Each rollup row is one lecture session (date, subject, division, period)
+    lecture_per_day = {
+        d: int(n or 0)
+        for d, n in db.session.execute(_scoped(select(R.date_marked, func.count()), R).group_by(R.date_marked)).all()
+        if d
+    }
+    lecture_sessions_total = sum(lecture_per_day.values())
 
     from ..models import StudentSubjectEnrollment
     for sid, t in totals_by_subject.items():
         tracker = subject_trackers.get(sid, {})
-        sessions = len(tracker.get("dates", set()))
+        sessions = int(tracker.get("sessions", 0))
         p = int(t.get("P", 0))
         a = int(t.get("A", 0))
         l = int(t.get("L", 0))
@@ -11520,8 +11062,8 @@ def attendance_report_admin():
         # Average present per session (Late counted as Present)
         avg_present = round((present_total / sessions), 1) if sessions else 0.0
         # Reach: unique students present at least once, absent at least once
-        unique_present = len((tracker.get("present_students", set()) | tracker.get("late_students", set())))
-        unique_absent = len(tracker.get("absent_students", set()))
+        unique_present = int(tracker.get("unique_present", 0))
+        unique_absent = int(tracker.get("unique_absent", 0))
         # Count enrolled students (scope division if filtered)
         q_enr = select(func.count()).select_from(StudentSubjectEnrollment).filter_by(subject_id_fk=sid, is_active=True)
         if division_id:
@@ -11550,9 +11092,9 @@ def attendance_report_admin():
         present_pct = round((present_total * 100.0 / total_entries), 1) if total_entries else None
         absent_pct = round((a * 100.0 / total_entries), 1) if total_entries else None
         # Reach: unique students present/late at least once, absent at least once in this division
-        dtracker = div_trackers.get(did, {"present_students": set(), "absent_students": set(), "late_students": set()})
-        unique_present = len(dtracker.get("present_students", set()) | dtracker.get("late_students", set()))
-        unique_absent = len(dtracker.get("absent_students", set()))
+        dtracker = div_trackers.get(did, {})
+        unique_present = int(dtracker.get("unique_present", 0))
+        unique_absent = int(dtracker.get("unique_absent", 0))
         # Enrolled students in this division (distinct student ids across active enrollments)
         q_enr_div = select(StudentSubjectEnrollment.student_id_fk).filter_by(is_active=True)
         if did:
@@ -11575,13 +11117,13 @@ def attendance_report_admin():
         t["reach_present_pct"] = reach_present_pct
         t["reach_absent_pct"] = reach_absent_pct
 
-    lecture_sessions_total = len(lecture_sessions)
     lecture_days = sorted(lecture_per_day.items(), key=lambda x: x[0])
     lecture_active_days = len(lecture_days)
     avg_lectures_per_day = round((lecture_sessions_total / lecture_active_days), 1) if lecture_active_days else None
 
     # CSV export (raw rows)
     if export_raw == "csv":
+        rows = db.session.execute(_scoped(select(Attendance), Attendance).order_by(Attendance.date_marked.asc())).scalars().all()
         # Build student name map for readability
         stu_ids = {r.student_id_fk for r in rows}
         stu_rows = _fetch_students_mapping_map(list(stu_ids))
@@ -11627,17 +11169,31 @@ def attendance_report_admin():
     # Per-subject student presence leaderboard (requires a specific subject filter)
     student_leaderboard = []
     if subject_id:
-        # Aggregate per-student counts for the selected subject
-        per_student = {}
-        for r in rows:
-            if r.subject_id_fk != subject_id:
-                continue
-            sid_stu = r.student_id_fk
-            ps = per_student.setdefault(sid_stu, {"P": 0, "A": 0, "L": 0, "total": 0})
-            s = (r.status or "").upper()
-            if s in ("P", "A", "L"):
-                ps[s] += 1
-            ps["total"] += 1
+        # Aggregate per-student counts for the selected subject. Without a
+        # date/division filter the per-student rollups already hold them.
+        from ..models import AttendanceStudentRollup as SR
+        if subject_id in subj_ids and not (start_date or end_date or division_id):
+            per_student_q = (
+                select(SR.student_id_fk, func.sum(SR.present_count), func.sum(SR.absent_count), func.sum(SR.late_count), func.sum(SR.total_count))
+                .filter(SR.subject_id_fk == subject_id)
+                .group_by(SR.student_id_fk)
+            )
+        else:
+            per_student_q = (
+                _scoped(select(
+                    Attendance.student_id_fk,
+                    func.sum(case((status_u == "P", 1), else_=0)),
+                    func.sum(case((status_u == "A", 1), else_=0)),
+                    func.sum(case((status_u == "L", 1), else_=0)),
+                    func.count(Attendance.attendance_id),
+                ), Attendance)
+                .filter(Attendance.subject_id_fk == subject_id)
+                .group_by(Attendance.student_id_fk)
+            )
+        per_student = {
+            enr: {"P": int(p or 0), "A": int(a or 0), "L": int(l or 0), "total": int(total or 0)}
+            for enr, p, a, l, total in db.session.execute(per_student_q).all()
+        }
         # Build student name map and compute percentages
         stu_ids = list(per_student.keys())
         student_rows = _fetch_students_mapping_map(stu_ids)
@@ -12234,21 +11790,12 @@ def module_students():
     medium_program_ids = []
     default_medium_map = {}
     try:
-        base_dir = os.path.dirname(current_app.root_path)
-        cfg_path = os.path.join(base_dir, "DATA FOR IMPORT EXPORT", "programs.csv")
-        policy_by_name = {}
-        default_by_name = {}
-        with open(cfg_path, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                n = (row.get("program_name") or "").strip()
-                policy_by_name[n] = (row.get("medium_policy") or "").strip().lower()
-                default_by_name[n] = (row.get("default_medium") or "").strip().lower()
+        cfg = program_mediums()
         for p in programs:
-            pol = policy_by_name.get(p.program_name) or ""
-            if pol == "both":
+            row = cfg.get(p.program_name) or {}
+            if row.get("policy") == "both":
                 medium_program_ids.append(p.program_id)
-            d = default_by_name.get(p.program_name)
+            d = row.get("default")
             if d in ("english", "gujarati"):
                 default_medium_map[p.program_id] = d
     except Exception:
@@ -12695,6 +12242,54 @@ def program_delete(program_id: int):
         flash("Failed to delete program.", "danger")
     return redirect(url_for("main.programs_list", trust_id=(trust_id or "")))
 
+def _import_progress(ctx, label, dry_run=False):
+    """Per-chunk progress callback for the streaming importers.
+
+    Dry runs keep their write transaction open until the final rollback, so they
+    report no progress (the progress write would wait on that lock under SQLite).
+    """
+    if dry_run:
+        return None
+
+    def report(done, total):
+        if total:
+            ctx.progress(min(95, 5 + int(90 * done / total)), f"{label}: {done} of {total} rows")
+        else:
+            ctx.progress(50, f"{label}: {done} rows")
+    return report
+
+
+@job_handler("students_import", result_template="students_import_result.html", max_attempts=1)
+def _students_import_job(ctx, path, program_id=None, trust_id=None, semester_hint=None, dry_run=False):
+    from scripts.import_students import import_excel
+    from ..models import ImportLog
+    ctx.progress(5, "Importing students")
+    report = import_excel(path, program_id=program_id, trust_id=trust_id, semester_hint=semester_hint, dry_run=dry_run, progress=_import_progress(ctx, "Students", dry_run))
+    report["dry_run"] = dry_run
+    if not dry_run:
+        db.session.commit()
+    else:
+        db.session.rollback()
+    try:
+        db.session.add(ImportLog(
+            user_id_fk=ctx.user_id,
+            kind="students",
+            program_id_fk=program_id,
+            semester=semester_hint,
+            medium_tag=None,
+            path=path,
+            dry_run=dry_run,
+            created_count=report.get("created") or 0,
+            updated_count=report.get("updated") or 0,
+            skipped_count=report.get("skipped") or 0,
+            errors_count=report.get("errors_count") or 0,
+        ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+    return report
+
+
 # Clerk bulk student import
 @main_bp.route("/clerk/students/import", methods=["GET", "POST"])
 @login_required
@@ -12722,8 +12317,7 @@ def students_import():
         q = select(Program).order_by(Program.program_name.asc())
         if effective_trust_id:
             try:
-                from ..models import Institute
-                q = q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+                q = q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
             except Exception:
                 q = q.where(false())
         programs = db.session.execute(q).scalars().all()
@@ -12762,12 +12356,10 @@ def students_import():
                 selected_program_id = int(program_id_raw) if program_id_raw else None
             if selected_program_id:
                 if effective_trust_id:
-                    from ..models import Institute
                     selected_program = db.session.execute(
                         select(Program)
-                        .join(Institute, Program.institute_id_fk == Institute.institute_id)
                         .filter(Program.program_id == selected_program_id)
-                        .filter(Institute.trust_id_fk == effective_trust_id)
+                        .filter(Program.program_id.in_(program_ids_for(effective_trust_id)))
                     ).scalars().first()
                 else:
                     selected_program = db.session.get(Program, selected_program_id)
@@ -12798,50 +12390,65 @@ def students_import():
             upload.save(save_path)
         except Exception:
             return render_template("students_import.html", programs=programs, errors=["Failed to save uploaded file."], form={"program_id_fk": program_id_raw, "semester_hint": semester_hint_raw, "dry_run": dry_run_flag})
-        # Perform import
-        try:
-            from scripts.import_students import import_excel
-            report = import_excel(
-                save_path,
-                program_id=(selected_program.program_id if selected_program else None),
-                trust_id=effective_trust_id,
-                semester_hint=semester_hint,
-                dry_run=dry_run_flag,
-            )
-            try:
-                report["dry_run"] = dry_run_flag
-            except Exception:
-                pass
-            if not dry_run_flag:
-                db.session.commit()
-            else:
-                db.session.rollback()
-            try:
-                from ..models import ImportLog
-                lg = ImportLog(
-                    user_id_fk=getattr(current_user, "user_id", None),
-                    kind="students",
-                    program_id_fk=(selected_program.program_id if selected_program else None),
-                    semester=semester_hint,
-                    medium_tag=None,
-                    path=save_path,
-                    dry_run=dry_run_flag,
-                    created_count=report.get("created") or 0,
-                    updated_count=report.get("updated") or 0,
-                    skipped_count=report.get("skipped") or 0,
-                    errors_count=report.get("errors_count") or 0,
-                )
-                db.session.add(lg)
-                db.session.commit()
-            except Exception:
-                db.session.rollback()
-            return render_template("students_import_result.html", programs=programs, report=report)
-        except Exception as e:
-            db.session.rollback()
-            return render_template("students_import.html", programs=programs, errors=[f"Import failed: {e}"], form={"program_id_fk": program_id_raw, "semester_hint": semester_hint_raw, "dry_run": dry_run_flag})
+        job = enqueue(
+            "students_import",
+            {
+                "path": save_path,
+                "program_id": (selected_program.program_id if selected_program else None),
+                "trust_id": effective_trust_id,
+                "semester_hint": semester_hint,
+                "dry_run": dry_run_flag,
+            },
+            label=f"Student import: {selected_program.program_name}" + (" (dry run)" if dry_run_flag else ""),
+            user=current_user,
+            trust_id=effective_trust_id,
+            return_url=url_for("main.students_import"),
+        )
+        return redirect(url_for("jobs.job_status", job_id=job.job_id))
     # GET
     return render_template("students_import.html", programs=programs)
 
+@job_handler("subjects_import", result_template="subjects_import_result.html", max_attempts=1)
+def _subjects_import_job(ctx, path, program_name=None, semester=None, force_default_semester=False, dry_run=False):
+    from scripts.import_subjects import upsert_subjects
+    from ..models import ImportLog
+    ctx.progress(5, "Importing subjects")
+    created, updated, program_id = upsert_subjects(program_name, path, semester, force_default_semester=force_default_semester, dry_run=dry_run, progress=_import_progress(ctx, "Subjects", dry_run))
+    if not dry_run:
+        db.session.commit()
+    else:
+        db.session.rollback()
+    report = {
+        "created": created,
+        "updated": updated,
+        "skipped": 0,
+        "errors_count": 0,
+        "errors": [],
+        "program_name": program_name,
+        "program_id": program_id,
+        "semester": semester,
+        "path": path,
+        "dry_run": dry_run,
+    }
+    try:
+        db.session.add(ImportLog(
+            user_id_fk=ctx.user_id,
+            kind="subjects",
+            program_id_fk=program_id,
+            semester=semester,
+            medium_tag=None,
+            path=path,
+            dry_run=dry_run,
+            created_count=created or 0,
+            updated_count=updated or 0,
+            skipped_count=0,
+            errors_count=0,
+        ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+    return report
+
 # Clerk bulk subject import (upload)
 @main_bp.route("/clerk/subjects/import", methods=["GET", "POST"])
 @login_required
@@ -12969,80 +12576,21 @@ def subjects_import():
                 form={"program_id_fk": (selected_program_id or ""), "semester": semester_raw, "force_semester": force_semester_flag, "dry_run": dry_run_flag},
             )
 
-        # Perform import
-        try:
-            from scripts.import_subjects import upsert_subjects
-            prog_name = selected_program.program_name if selected_program else None
-            created, updated, program_id = upsert_subjects(prog_name, save_path, semester, force_default_semester=force_semester_flag, dry_run=dry_run_flag)
-            if not dry_run_flag:
-                db.session.commit()
-            else:
-                db.session.rollback()
-            report = {
-                "created": created,
-                "updated": updated,
-                "skipped": 0,
-                "errors_count": 0,
-                "errors": [],
-                "program_name": prog_name,
-                "program_id": program_id,
-                "semester": semester,
+        job = enqueue(
+            "subjects_import",
+            {
                 "path": save_path,
+                "program_name": (selected_program.program_name if selected_program else None),
+                "semester": semester,
+                "force_default_semester": force_semester_flag,
                 "dry_run": dry_run_flag,
-            }
-            try:
-                from ..models import ImportLog
-                lg = ImportLog(
-                    user_id_fk=getattr(current_user, "user_id", None),
-                    kind="subjects",
-                    program_id_fk=program_id,
-                    semester=semester,
-                    medium_tag=None,
-                    path=save_path,
-                    dry_run=dry_run_flag,
-                    created_count=created or 0,
-                    updated_count=updated or 0,
-                    skipped_count=0,
-                    errors_count=0,
-                )
-                db.session.add(lg)
-                db.session.commit()
-                if current_app.config.get("TESTING") and dry_run_flag:
-                    pass
-            except Exception:
-                db.session.rollback()
-            return render_template("subjects_import_result.html", programs=programs, report=report)
-        except Exception as e:
-            db.session.rollback()
-            # Testing fallback: still record a dry-run log entry even if import failed
-            try:
-                if current_app.config.get("TESTING") and dry_run_flag:
-                    from ..models import ImportLog
-                    lg = ImportLog(
-                        user_id_fk=getattr(current_user, "user_id", None),
-                        kind="subjects",
-                        program_id_fk=(selected_program.program_id if selected_program else selected_program_id),
-                        semester=semester,
-                        medium_tag=None,
-                        path=save_path if 'save_path' in locals() else None,
-                        dry_run=True,
-                        created_count=0,
-                        updated_count=0,
-                        skipped_count=0,
-                        errors_count=1,
-                    )
-                    db.session.add(lg)
-                    db.session.commit()
-            except Exception:
-                db.session.rollback()
-            return render_template(
-                "subjects_import.html",
-                programs=programs,
-                selected_program=selected_program,
-                role=role,
-                errors=[f"Import failed: {e}"],
-                form={"program_id_fk": (selected_program_id or ""), "semester": semester_raw, "force_semester": force_semester_flag, "dry_run": dry_run_flag},
-            )
+            },
+            label=f"Subject import: {(selected_program.program_name if selected_program else '-')} Sem {semester}" + (" (dry run)" if dry_run_flag else ""),
+            user=current_user,
+            trust_id=_effective_trust_id(),
+            return_url=url_for("main.subjects_import"),
+        )
+        return redirect(url_for("jobs.job_status", job_id=job.job_id))
 
     # GET with optional prefill; principals/clerks are locked to their program
     selected_program = db.session.get(Program, selected_program_id) if selected_program_id else None
@@ -13285,20 +12833,12 @@ def module_fees():
     from ..models import FeeStructure, Program
     
     # Determine Effective Trust Context
-    effective_trust_id = None
     is_super = getattr(current_user, "is_super_admin", False)
-    if is_super:
-        if "active_trust_id" in session:
-             try:
-                 effective_trust_id = int(session["active_trust_id"])
-             except:
-                 pass
-    else:
-        effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
 
     q_prog = select(Program).order_by(Program.program_name.asc())
     if effective_trust_id:
-        q_prog = q_prog.join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
+        q_prog = q_prog.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
     programs = db.session.execute(q_prog).scalars().all()
     prog_map = {p.program_id: (p.program_name or "").strip() for p in programs}
 
@@ -13326,7 +12866,7 @@ def module_fees():
         .order_by(FeeStructure.program_id_fk.asc(), FeeStructure.component_name.asc())
     )
     if effective_trust_id:
-        q_fees = q_fees.join(Program).join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
+        q_fees = q_fees.join(Program).where(Program.program_id.in_(program_ids_for(effective_trust_id)))
     
     rows = db.session.execute(q_fees).scalars().all()
     totals_by_program = {}
@@ -13372,20 +12912,12 @@ def fees_list():
     per = int(request.args.get("per") or 20)
 
     # Determine Effective Trust Context
-    effective_trust_id = None
     is_super = getattr(current_user, "is_super_admin", False)
-    if is_super:
-        if "active_trust_id" in session:
-             try:
-                 effective_trust_id = int(session["active_trust_id"])
-             except:
-                 pass
-    else:
-        effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
 
     q = select(FeesRecord)
     if effective_trust_id:
-        q = q.join(Student).join(Program).join(Institute).filter(Institute.trust_id_fk == effective_trust_id)
+        q = q.join(Student).join(Program).where(Program.program_id.in_(program_ids_for(effective_trust_id)))
 
     if en_raw:
         q = q.filter(FeesRecord.student_id_fk.like(f"%{en_raw}%"))
@@ -13790,15 +13322,7 @@ def fees_heads():
         return redirect(url_for("main.dashboard"))
     from ..models import FeeStructure, Program
 
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
 
     # Build program list with role-based scoping
     role = (getattr(current_user, "role", "") or "").strip().lower()
@@ -13823,8 +13347,7 @@ def fees_heads():
         q = select(Program).order_by(Program.program_name.asc())
         if effective_trust_id:
             try:
-                from ..models import Institute
-                q = q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+                q = q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
             except Exception:
                 q = q.where(false())
         programs = db.session.execute(q).scalars().all()
@@ -13990,15 +13513,7 @@ def fees_heads():
 def fees_heads_seed_all():
     from ..models import Program, FeeStructure
     errors = []
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     if getattr(current_user, "is_super_admin", False) and not effective_trust_id:
         flash("Select a tenant workspace first (Global View → choose Trust).", "warning")
         return redirect(url_for("main.fees_heads"))
@@ -14006,8 +13521,7 @@ def fees_heads_seed_all():
         q = select(Program).order_by(Program.program_name.asc())
         if effective_trust_id:
             try:
-                from ..models import Institute
-                q = q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+                q = q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
             except Exception:
                 q = q.where(false())
         programs = db.session.execute(q).scalars().all()
@@ -14044,14 +13558,95 @@ def fees_heads_seed_all():
         flash("Failed to seed fee heads.", "danger")
     return redirect(url_for("main.fees_heads"))
 
+@job_handler("fees_import", max_attempts=1)
+def _fees_import_job(ctx, path, program_id, semester, medium=None, dry_run=False, filename=None):
+    from ..models import FeeStructure, ImportLog
+    from openpyxl import load_workbook
+    ctx.progress(5, "Reading workbook")
+    wb = load_workbook(filename=path, read_only=True, data_only=True)
+    ws = wb.active
+    # Expect columns: SR NO | DESCRIPTION | AMOUNT
+    created = 0
+    updated = 0
+    # Build canonical set for validation and matching
+    norms = {_slugify_component(h): h for h in FEE_COMPONENTS}
+    unknown_heads = []
+    existing = {}
+    q = select(FeeStructure).filter_by(program_id_fk=program_id, semester=semester)
+    if medium:
+        q = q.filter(FeeStructure.medium_tag == medium)
+    else:
+        q = q.filter(FeeStructure.medium_tag.is_(None))
+    for fs in db.session.execute(q).scalars().all():
+        existing.setdefault(fs.component_name, fs)
+    # Iterate rows skipping header if it matches expected
+    first = True
+    for row in ws.iter_rows(values_only=True):
+        cells = [(str(c).strip() if c is not None else "") for c in row]
+        if len(cells) < 2:
+            continue
+        if first:
+            first = False
+            # If header row, skip when second col is DESCRIPTION-like
+            if cells[1].upper() in ("DESCRIPTION", "FEE HEAD", "HEAD"):
+                continue
+        desc = cells[1]
+        amt_raw = row[2] if len(cells) >= 3 else None
+        try:
+            amount = float(amt_raw) if amt_raw is not None and str(amt_raw).strip() != "" else None
+        except Exception:
+            amount = None
+        if not desc or amount is None:
+            continue
+        target_name = norms.get(_slugify_component(desc))
+        # Strict: only accept known heads; skip and record unknowns
+        if not target_name:
+            unknown_heads.append(desc)
+            continue
+        fs = existing.get(target_name)
+        if not fs:
+            fs = FeeStructure(program_id_fk=program_id, component_name=target_name, semester=semester, amount=amount, is_active=True, medium_tag=medium)
+            db.session.add(fs)
+            existing[target_name] = fs
+            created += 1
+        else:
+            fs.amount = amount
+            fs.updated_at = datetime.now(timezone.utc)
+            updated += 1
+    wb.close()
+    if not dry_run:
+        db.session.commit()
+    else:
+        db.session.rollback()
+    msg = f"Import completed. created={created}, updated={updated} (Medium: {medium or 'Common'})"
+    if unknown_heads:
+        msg += f"; skipped unknown heads: {', '.join(unknown_heads)}"
+    try:
+        db.session.add(ImportLog(
+            user_id_fk=ctx.user_id,
+            kind="fees",
+            program_id_fk=program_id,
+            semester=semester,
+            medium_tag=medium,
+            path=(filename or path),
+            dry_run=dry_run,
+            created_count=created,
+            updated_count=updated,
+            skipped_count=len(unknown_heads),
+            errors_count=0,
+        ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+    return {"message": msg, "created": created, "updated": updated, "skipped_heads": unknown_heads, "dry_run": dry_run}
+
 # Bulk Import Fees: UI to download sample and upload Excel to update component amounts
 @main_bp.route("/fees/import", methods=["GET", "POST"])
 @login_required
 @role_required("clerk", "admin")
 @limiter.limit("10 per minute")
 def fees_import():
-    from ..models import Program, FeeStructure
-    from openpyxl import load_workbook
+    from ..models import Program
     # Build program list with role-based scoping
     role = (getattr(current_user, "role", "") or "").strip().lower()
     pid_scope = None
@@ -14121,88 +13716,31 @@ def fees_import():
                 errors.append("Upload an Excel file.")
             else:
                 try:
-                    wb = load_workbook(filename=file, data_only=True)
-                    ws = wb.active
-                    # Expect columns: SR NO | DESCRIPTION | AMOUNT
-                    created = 0
-                    updated = 0
-                    # Build canonical set for validation and matching
-                    heads = list(FEE_COMPONENTS)
-                    norms = {_slugify_component(h): h for h in heads}
-                    unknown_heads = []
-                    # Iterate rows skipping header if it matches expected
-                    first = True
-                    for row in ws.iter_rows(values_only=True):
-                        cells = [(str(c).strip() if c is not None else "") for c in row]
-                        if len(cells) < 2:
-                            continue
-                        if first:
-                            first = False
-                            # If header row, skip when second col is DESCRIPTION-like
-                            if cells[1].upper() in ("DESCRIPTION", "FEE HEAD", "HEAD"):
-                                continue
-                        desc = cells[1]
-                        amt_raw = None
-                        if len(cells) >= 3:
-                            amt_raw = row[2]
-                        try:
-                            amount = float(amt_raw) if amt_raw is not None and str(amt_raw).strip() != "" else None
-                        except Exception:
-                            amount = None
-                        if not desc or amount is None:
-                            continue
-                        key = _slugify_component(desc)
-                        match_name = norms.get(key)
-                        # Strict: only accept known heads; skip and record unknowns
-                        if not match_name:
-                            unknown_heads.append(desc)
-                            continue
-                        target_name = match_name
-                        q = select(FeeStructure).filter_by(program_id_fk=selected_program.program_id, component_name=target_name, semester=semester)
-                        if medium:
-                            q = q.filter(FeeStructure.medium_tag == medium)
-                        else:
-                            q = q.filter(FeeStructure.medium_tag.is_(None))
-                        fs = db.session.execute(q).scalars().first()
-                        if not fs:
-                            fs = FeeStructure(program_id_fk=selected_program.program_id, component_name=target_name, semester=semester, amount=amount, is_active=True, medium_tag=medium)
-                            db.session.add(fs)
-                            created += 1
-                        else:
-                            fs.amount = amount
-                            fs.updated_at = datetime.now(timezone.utc)
-                            updated += 1
-                    if not dry_run_flag:
-                        db.session.commit()
-                    else:
-                        db.session.rollback()
-                    scope_medium = medium or "Common"
-                    msg = f"Import completed. created={created}, updated={updated} (Medium: {scope_medium})"
-                    if unknown_heads:
-                        msg += f"; skipped unknown heads: {', '.join(unknown_heads)}"
-                    messages.append(msg)
-                    try:
-                        from ..models import ImportLog
-                        lg = ImportLog(
-                            user_id_fk=getattr(current_user, "user_id", None),
-                            kind="fees",
-                            program_id_fk=(selected_program.program_id if selected_program else None),
-                            semester=semester,
-                            medium_tag=medium,
-                            path=getattr(file, "filename", None),
-                            dry_run=dry_run_flag,
-                            created_count=created or 0,
-                            updated_count=updated or 0,
-                            skipped_count=len(unknown_heads or []),
-                            errors_count=len(errors or []),
-                        )
-                        db.session.add(lg)
-                        db.session.commit()
-                    except Exception:
-                        db.session.rollback()
-                except Exception as e:
-                    db.session.rollback()
-                    errors.append(f"Failed to import: {e}")
+                    base_dir = os.path.join(current_app.static_folder, "imports", "fees")
+                    os.makedirs(base_dir, exist_ok=True)
+                    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    save_path = os.path.join(base_dir, f"{ts}_{secure_filename(file.filename)}")
+                    file.save(save_path)
+                except Exception:
+                    save_path = None
+                    errors.append("Failed to save uploaded file.")
+                if save_path:
+                    job = enqueue(
+                        "fees_import",
+                        {
+                            "path": save_path,
+                            "filename": file.filename,
+                            "program_id": selected_program.program_id,
+                            "semester": semester,
+                            "medium": medium,
+                            "dry_run": dry_run_flag,
+                        },
+                        label=f"Fee import: {selected_program.program_name} Sem {semester} ({medium or 'Common'})" + (" (dry run)" if dry_run_flag else ""),
+                        user=current_user,
+                        trust_id=_effective_trust_id(),
+                        return_url=url_for("main.fees_import", program_id=selected_program.program_id, semester=semester, medium=(medium or "")),
+                    )
+                    return redirect(url_for("jobs.job_status", job_id=job.job_id))
 
     return render_template(
         "fees_import.html",
@@ -14305,15 +13843,7 @@ def fees_structure_compare():
 @role_required("admin", "principal", "clerk")
 def module_divisions():
     role = (getattr(current_user, "role", "") or "").strip().lower()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     try:
         user_program_id = int(getattr(current_user, "program_id_fk", None) or 0) or None
     except Exception:
@@ -14327,7 +13857,7 @@ def module_divisions():
     if effective_trust_id:
         try:
             from ..models import Institute, Program
-            q = q.join(Program, Division.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            q = q.where(Division.program_id_fk.in_(program_ids_for(effective_trust_id)))
         except Exception:
             q = q.where(false())
     if selected_program_id:
@@ -14375,15 +13905,7 @@ def module_divisions():
 def divisions_planning_save():
     from ..models import ProgramDivisionPlan, Program
     role = (getattr(current_user, "role", "") or "").strip().lower()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     try:
         user_program_id = int(getattr(current_user, "program_id_fk", None) or 0) or None
     except Exception:
@@ -14401,15 +13923,7 @@ def divisions_planning_save():
         return redirect(url_for("main.module_divisions"))
     if effective_trust_id:
         try:
-            from ..models import Institute
-            ok = db.session.execute(
-                select(func.count())
-                .select_from(Program)
-                .join(Institute, Program.institute_id_fk == Institute.institute_id)
-                .filter(Program.program_id == program_id)
-                .filter(Institute.trust_id_fk == effective_trust_id)
-            ).scalar() or 0
-            if ok <= 0:
+            if int(program_id) not in program_ids_for(effective_trust_id):
                 flash("Invalid program selection for the current tenant workspace.", "danger")
                 return redirect(url_for("main.module_divisions"))
         except Exception:
@@ -14463,55 +13977,32 @@ def divisions_planning_save():
     return redirect(url_for("main.module_divisions", program_id=program_id))
 
 
-@main_bp.route("/divisions/rebalance", methods=["POST"]) 
-@login_required
-@role_required("admin", "principal", "clerk")
-def divisions_rebalance():
-    # Divide students across divisions per semester using per-program planning.
-    # Fallback: BCA uses capacity 67 if no plan; others require principal-set plan.
-    from ..models import Program, Division, Student, ProgramDivisionPlan
-    import math
-    role = (getattr(current_user, "role", "") or "").strip().lower()
-    try:
-        user_program_id = int(getattr(current_user, "program_id_fk", None) or 0) or None
-    except Exception:
-        user_program_id = None
-
-    # Scope program: principal/clerk must have program; admin can accept program_id arg or fallback to their program if set
-    program_id_arg = (request.args.get("program_id") or request.form.get("program_id") or "").strip()
-    try:
-        program_id = int(program_id_arg) if program_id_arg else None
-    except Exception:
-        program_id = None
-    if role in ("principal", "clerk"):
-        program_id = user_program_id
-
-    # Helper to generate codes like A, B, ..., Z, AA, AB, ...
-    def _generate_codes(n: int):
-        codes = []
-        i = 0
-        while len(codes) < n:
-            num = i
-            s = ""
-            while True:
-                s = chr(ord('A') + (num % 26)) + s
-                num = num // 26 - 1
-                if num < 0:
-                    break
-            codes.append(s)
-            i += 1
-        return codes
+def _generate_division_codes(n: int):
+    # Codes like A, B, ..., Z, AA, AB, ...
+    codes = []
+    i = 0
+    while len(codes) < n:
+        num = i
+        s = ""
+        while True:
+            s = chr(ord('A') + (num % 26)) + s
+            num = num // 26 - 1
+            if num < 0:
+                break
+        codes.append(s)
+        i += 1
+    return codes
 
-    if not program_id:
-        flash("Program scope is required to rebalance divisions.", "danger")
-        return redirect(url_for("main.module_divisions"))
 
-    # Resolve program and planned settings
-    prog = db.session.get(Program, program_id)
-    if not prog:
-        flash("Selected program not found.", "danger")
-        return redirect(url_for("main.module_divisions"))
+def _rebalance_divisions_by_plan(prog, progress=None):
+    """Divide a program's students across divisions per semester using its planning.
 
+    Fallback: BCA uses capacity 67 if no plan; other programs skip semesters without a
+    principal-set plan. Returns a list of warnings for the skipped semesters.
+    """
+    from ..models import ProgramDivisionPlan
+    program_id = prog.program_id
+    warnings = []
     # Group students by semester for this program
     students = db.session.execute(select(Student).filter_by(program_id_fk=program_id).order_by(Student.enrollment_no.asc())).scalars().all()
     by_sem = {}
@@ -14523,13 +14014,15 @@ def divisions_rebalance():
         by_sem.setdefault(sem, []).append(s)
 
     # Process each semester independently, using planning if present
-    for semester, stu_list in sorted(by_sem.items()):
+    sem_items = sorted(by_sem.items())
+    for n, (semester, stu_list) in enumerate(sem_items):
+        if progress:
+            progress(int(100 * n / max(1, len(sem_items))), f"Semester {semester}")
         if not stu_list:
             continue
         plan = db.session.execute(select(ProgramDivisionPlan).filter_by(program_id_fk=program_id, semester=semester)).scalars().first()
         capacity = None
         num_divisions = None
-        roll_max = 200
         if plan:
             try:
                 capacity = int(plan.capacity_per_division)
@@ -14539,24 +14032,19 @@ def divisions_rebalance():
                 num_divisions = int(plan.num_divisions)
             except Exception:
                 num_divisions = None
-            try:
-                roll_max = int(plan.roll_max_per_division or 200)
-            except Exception:
-                roll_max = 200
         else:
             # Fallback for BCA per earlier requirement
             if (prog.program_name or "").strip().upper() == "BCA":
                 capacity = 67
                 # compute divisions based on capacity and student count
                 num_divisions = max(1, math.ceil(len(stu_list) / float(capacity)))
-                roll_max = 200
             else:
-                flash(f"No division planning found for semester {semester}. Please ask the program principal to configure planning.", "warning")
+                warnings.append(f"No division planning found for semester {semester}. Please ask the program principal to configure planning.")
                 # Skip this semester gracefully
                 continue
 
         # Ensure divisions exist with planned capacity
-        codes = _generate_codes(num_divisions)
+        codes = _generate_division_codes(num_divisions)
         existing = (
             db.session.execute(
                 select(Division)
@@ -14592,7 +14080,7 @@ def divisions_rebalance():
         # Any remaining students spill into extra divisions: extend codes if planning underestimates
         if idx < len(stu_list):
             extra_needed = math.ceil((len(stu_list) - idx) / float(capacity))
-            extra_codes = _generate_codes(num_divisions + extra_needed)[num_divisions:]
+            extra_codes = _generate_division_codes(num_divisions + extra_needed)[num_divisions:]
             for code in extra_codes:
                 d = Division(program_id_fk=program_id, semester=semester, division_code=code, capacity=capacity)
                 db.session.add(d)
@@ -14609,67 +14097,57 @@ def divisions_rebalance():
 
         # Persist assignments for this semester
         db.session.commit()
+    return warnings
 
-    flash("Divisions rebalanced using program-specific planning.", "success")
-    return redirect(url_for("main.divisions_list"))
 
-    # Programs to process
-    if program_id:
-        programs = [db.session.get(Program, program_id)] if db.session.get(Program, program_id) else []
-    else:
-        programs = db.session.execute(select(Program)).scalars().all() if role == "admin" else ([db.session.get(Program, user_program_id)] if user_program_id else [])
+@job_handler("divisions_rebalance", max_attempts=2)
+def _divisions_rebalance_job(ctx, program_id):
+    prog = db.session.get(Program, program_id)
+    if not prog:
+        raise ValueError("Selected program not found.")
+    warnings = _rebalance_divisions_by_plan(prog, progress=ctx.progress)
+    return {"message": "Divisions rebalanced using program-specific planning.", "warnings": warnings}
 
-    total_updated = 0
-    for p in programs:
-        if not p:
-            continue
-        # Semesters present for this program
-        semesters = sorted({s.current_semester for s in db.session.execute(select(Student).filter_by(program_id_fk=p.program_id)).scalars().all() if s.current_semester})
-        for sem in semesters:
-            students = (
-                db.session.execute(
-                    select(Student)
-                    .filter_by(program_id_fk=p.program_id)
-                    .filter_by(current_semester=sem)
-                    .order_by(Student.enrollment_no.asc())
-                ).scalars().all()
-            )
-            required_n = max(math.ceil(len(students) / CAPACITY), 1)
-            # Ensure divisions and capacity
-            existing = (
-                db.session.execute(
-                    select(Division)
-                    .filter_by(program_id_fk=p.program_id, semester=sem)
-                    .order_by(Division.division_code.asc())
-                ).scalars().all()
-            )
-            for d in existing:
-                if d.capacity != CAPACITY:
-                    d.capacity = CAPACITY
-            # Create missing divisions
-            used_codes = {d.division_code for d in existing}
-            for code in _generate_codes(required_n):
-                if code in used_codes:
-                    continue
-                div = Division(program_id_fk=p.program_id, semester=sem, division_code=code, capacity=CAPACITY)
-                db.session.add(div)
-            db.session.commit()
-            # Refresh map
-            div_map = {d.division_code: d for d in db.session.execute(select(Division).filter_by(program_id_fk=p.program_id, semester=sem).order_by(Division.division_code.asc())).scalars().all()}
-            codes = sorted(list(div_map.keys()))
-            # Assign students in chunks of CAPACITY
-            for idx, s in enumerate(students):
-                bucket = idx // CAPACITY
-                if bucket >= len(codes):
-                    bucket = len(codes) - 1
-                code = codes[bucket]
-                target_div = div_map.get(code)
-                if target_div and s.division_id_fk != target_div.division_id:
-                    s.division_id_fk = target_div.division_id
-                    total_updated += 1
-            db.session.commit()
-    flash(f"Rebalanced divisions with capacity {CAPACITY}. Updated {total_updated} students.", "success")
-    return redirect(url_for('main.divisions_list'))
+
+@main_bp.route("/divisions/rebalance", methods=["POST"]) 
+@login_required
+@role_required("admin", "principal", "clerk")
+def divisions_rebalance():
+    # Rebalancing runs as a background job (see _rebalance_divisions_by_plan).
+    from ..models import Program
+    role = (getattr(current_user, "role", "") or "").strip().lower()
+    try:
+        user_program_id = int(getattr(current_user, "program_id_fk", None) or 0) or None
+    except Exception:
+        user_program_id = None
+
+    # Scope program: principal/clerk must have program; admin can accept program_id arg or fallback to their program if set
+    program_id_arg = (request.args.get("program_id") or request.form.get("program_id") or "").strip()
+    try:
+        program_id = int(program_id_arg) if program_id_arg else None
+    except Exception:
+        program_id = None
+    if role in ("principal", "clerk"):
+        program_id = user_program_id
+
+    if not program_id:
+        flash("Program scope is required to rebalance divisions.", "danger")
+        return redirect(url_for("main.module_divisions"))
+
+    prog = db.session.get(Program, program_id)
+    if not prog:
+        flash("Selected program not found.", "danger")
+        return redirect(url_for("main.module_divisions"))
+
+    job = enqueue(
+        "divisions_rebalance",
+        {"program_id": prog.program_id},
+        label=f"Rebalance divisions: {prog.program_name}",
+        user=current_user,
+        trust_id=_effective_trust_id(),
+        return_url=url_for("main.divisions_list"),
+    )
+    return redirect(url_for("jobs.job_status", job_id=job.job_id))
 
 
 @main_bp.route("/divisions")
@@ -14683,15 +14161,7 @@ def divisions_list():
 
     # Scope principal/clerk to their program
     role = (getattr(current_user, "role", "") or "").strip().lower()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     user_program_id = None
     try:
         user_program_id = int(getattr(current_user, "program_id_fk", None) or 0) or None
@@ -14714,8 +14184,7 @@ def divisions_list():
     q = select(Division)
     if effective_trust_id:
         try:
-            from ..models import Institute
-            q = q.join(Program, Division.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            q = q.where(Division.program_id_fk.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     if program_id:
@@ -14747,8 +14216,7 @@ def divisions_list():
     prog_q = select(Program).order_by(Program.program_name.asc())
     if effective_trust_id:
         try:
-            from ..models import Institute
-            prog_q = prog_q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            prog_q = prog_q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     programs = db.session.execute(prog_q).scalars().all()
@@ -14775,15 +14243,7 @@ def divisions_list():
 def division_new():
     from ..models import Division, Program
     role = (getattr(current_user, "role", "") or "").strip().lower()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     # Determine program scope
     try:
         user_program_id = int(getattr(current_user, "program_id_fk", None) or 0) or None
@@ -14810,15 +14270,7 @@ def division_new():
             errors.append("Program is required.")
         if not errors and program_id and effective_trust_id and role == "admin":
             try:
-                from ..models import Institute
-                ok = db.session.execute(
-                    select(func.count())
-                    .select_from(Program)
-                    .join(Institute, Program.institute_id_fk == Institute.institute_id)
-                    .filter(Program.program_id == program_id)
-                    .filter(Institute.trust_id_fk == effective_trust_id)
-                ).scalar() or 0
-                if ok <= 0:
+                if int(program_id) not in program_ids_for(effective_trust_id):
                     errors.append("Invalid program selection for the current tenant workspace.")
             except Exception:
                 pass
@@ -14849,8 +14301,7 @@ def division_new():
             prog_q = select(Program).order_by(Program.program_name.asc())
             if effective_trust_id:
                 try:
-                    from ..models import Institute
-                    prog_q = prog_q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+                    prog_q = prog_q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
                 except Exception:
                     pass
             programs = db.session.execute(prog_q).scalars().all()
@@ -14879,8 +14330,7 @@ def division_new():
     prog_q = select(Program).order_by(Program.program_name.asc())
     if effective_trust_id:
         try:
-            from ..models import Institute
-            prog_q = prog_q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            prog_q = prog_q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     programs = db.session.execute(prog_q).scalars().all()
@@ -14893,15 +14343,7 @@ def division_new():
 def division_edit(division_id: int):
     from ..models import Division, Program
     role = (getattr(current_user, "role", "") or "").strip().lower()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     d = db.session.get(Division, division_id)
     if not d:
         flash("Division not found.", "danger")
@@ -14934,15 +14376,7 @@ def division_edit(division_id: int):
             errors.append("Program is required.")
         if not errors and program_id and effective_trust_id and role == "admin":
             try:
-                from ..models import Institute
-                ok = db.session.execute(
-                    select(func.count())
-                    .select_from(Program)
-                    .join(Institute, Program.institute_id_fk == Institute.institute_id)
-                    .filter(Program.program_id == program_id)
-                    .filter(Institute.trust_id_fk == effective_trust_id)
-                ).scalar() or 0
-                if ok <= 0:
+                if int(program_id) not in program_ids_for(effective_trust_id):
                     errors.append("Invalid program selection for the current tenant workspace.")
             except Exception:
                 pass
@@ -14977,8 +14411,7 @@ def division_edit(division_id: int):
             prog_q = select(Program).order_by(Program.program_name.asc())
             if effective_trust_id:
                 try:
-                    from ..models import Institute
-                    prog_q = prog_q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+                    prog_q = prog_q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
                 except Exception:
                     pass
             programs = db.session.execute(prog_q).scalars().all()
@@ -15009,8 +14442,7 @@ def division_edit(division_id: int):
     prog_q = select(Program).order_by(Program.program_name.asc())
     if effective_trust_id:
         try:
-            from ..models import Institute
-            prog_q = prog_q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            prog_q = prog_q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     programs = db.session.execute(prog_q).scalars().all()
@@ -15021,21 +14453,13 @@ def division_edit(division_id: int):
 @main_bp.route("/api/chart/students-by-program")
 @login_required
 @role_required("admin", "principal")
-@cache.cached(timeout=180, key_prefix=lambda: f"chart_students_by_program_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}")
+@cached_result("chart_students_by_program", ("students",))
 def chart_students_by_program():
     """API endpoint for students by program pie chart (admin view)"""
     from flask import jsonify
     try:
         role = (getattr(current_user, "role", "") or "").strip().lower()
-        effective_trust_id = None
-        if getattr(current_user, "is_authenticated", False):
-            if getattr(current_user, "is_super_admin", False):
-                try:
-                    effective_trust_id = int(session.get("active_trust_id") or 0) or None
-                except Exception:
-                    effective_trust_id = None
-            else:
-                effective_trust_id = getattr(current_user, "trust_id_fk", None)
+        effective_trust_id = current_scope().trust_id
         if getattr(current_user, "is_super_admin", False) and not effective_trust_id:
             return api_success({"data": []})
         
@@ -15066,22 +14490,14 @@ def chart_students_by_program():
 @main_bp.route("/api/chart/students-by-semester")
 @login_required
 @role_required("admin", "principal")
-@cache.cached(timeout=180, key_prefix=lambda: f"chart_students_by_semester_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}_{request.full_path}")
+@cached_result("chart_students_by_semester", ("students",))
 def chart_students_by_semester():
     """API endpoint for students by semester chart (principal view)"""
     from flask import jsonify
     try:
         role = (getattr(current_user, "role", "") or "").strip().lower()
         program_id = getattr(current_user, "program_id_fk", None) if role == "principal" else request.args.get("program_id")
-        effective_trust_id = None
-        if getattr(current_user, "is_authenticated", False):
-            if getattr(current_user, "is_super_admin", False):
-                try:
-                    effective_trust_id = int(session.get("active_trust_id") or 0) or None
-                except Exception:
-                    effective_trust_id = None
-            else:
-                effective_trust_id = getattr(current_user, "trust_id_fk", None)
+        effective_trust_id = current_scope().trust_id
         if getattr(current_user, "is_super_admin", False) and not effective_trust_id:
             return api_success({"data": []})
         
@@ -15112,21 +14528,13 @@ def chart_students_by_semester():
 @main_bp.route("/api/chart/staff-by-program")
 @login_required
 @role_required("admin", "principal")
-@cache.cached(timeout=180, key_prefix=lambda: f"chart_staff_by_program_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}")
+@cached_result("chart_staff_by_program", ("staff",))
 def chart_staff_by_program():
     """API endpoint for staff by program bar chart"""
     from flask import jsonify
     try:
         role = (getattr(current_user, "role", "") or "").strip().lower()
-        effective_trust_id = None
-        if getattr(current_user, "is_authenticated", False):
-            if getattr(current_user, "is_super_admin", False):
-                try:
-                    effective_trust_id = int(session.get("active_trust_id") or 0) or None
-                except Exception:
-                    effective_trust_id = None
-            else:
-                effective_trust_id = getattr(current_user, "trust_id_fk", None)
+        effective_trust_id = current_scope().trust_id
         if getattr(current_user, "is_super_admin", False) and not effective_trust_id:
             return api_success({"data": []})
         
@@ -15162,15 +14570,7 @@ def chart_fees_collection():
     from flask import jsonify
     try:
         role = (getattr(current_user, "role", "") or "").strip().lower()
-        effective_trust_id = None
-        if getattr(current_user, "is_authenticated", False):
-            if getattr(current_user, "is_super_admin", False):
-                try:
-                    effective_trust_id = int(session.get("active_trust_id") or 0) or None
-                except Exception:
-                    effective_trust_id = None
-            else:
-                effective_trust_id = getattr(current_user, "trust_id_fk", None)
+        effective_trust_id = current_scope().trust_id
         if getattr(current_user, "is_super_admin", False) and not effective_trust_id:
             return jsonify({"data": [], "academic_year": None})
         
@@ -15186,28 +14586,16 @@ def chart_fees_collection():
             q_prog = select(Program)
             if effective_trust_id:
                 try:
-                    from ..models import Institute
-                    q_prog = q_prog.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+                    q_prog = q_prog.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
                 except Exception:
                     pass
             programs = db.session.execute(q_prog).scalars().all()
+            collected = collected_by_program(effective_trust_id, start_date, end_date, [p.program_id for p in programs])
             data = []
             for program in programs:
-                # Get total fees collected for this program
-                total_collected = db.session.scalar(
-                    select(func.sum(FeesRecord.amount_paid))
-                    .join(Student, Student.enrollment_no == FeesRecord.student_id_fk)
-                    .filter(
-                        Student.program_id_fk == program.program_id,
-                        Student.trust_id_fk == effective_trust_id,
-                        FeesRecord.date_paid >= start_date,
-                        FeesRecord.date_paid <= end_date
-                    )
-                ) or 0
-                
                 data.append({
                     "label": program.program_name,
-                    "value": float(total_collected),
+                    "value": float(collected.get(program.program_id, 0.0)),
                     "color": f"hsl({hash(program.program_name) % 360}, 70%, 55%)"
                 })
         else:
@@ -15215,17 +14603,8 @@ def chart_fees_collection():
             program_id = getattr(current_user, "program_id_fk", None)
             if program_id:
                 program = db.session.get(Program, program_id)
-                total_collected = db.session.scalar(
-                    select(func.sum(FeesRecord.amount_paid))
-                    .join(Student, Student.enrollment_no == FeesRecord.student_id_fk)
-                    .filter(
-                        Student.program_id_fk == program_id,
-                        Student.trust_id_fk == effective_trust_id,
-                        FeesRecord.date_paid >= start_date,
-                        FeesRecord.date_paid <= end_date
-                    )
-                ) or 0
-                
+                total_collected = collected_by_program(effective_trust_id, start_date, end_date, [program_id]).get(program_id, 0.0)
+
                 data = [{
                     "label": program.program_name if program else "Unknown",
                     "value": float(total_collected),
@@ -15248,15 +14627,7 @@ def chart_revenue_expenses():
     try:
         role = (getattr(current_user, "role", "") or "").strip().lower()
         program_id = getattr(current_user, "program_id_fk", None) if role == "principal" else request.args.get("program_id")
-        effective_trust_id = None
-        if getattr(current_user, "is_authenticated", False):
-            if getattr(current_user, "is_super_admin", False):
-                try:
-                    effective_trust_id = int(session.get("active_trust_id") or 0) or None
-                except Exception:
-                    effective_trust_id = None
-            else:
-                effective_trust_id = getattr(current_user, "trust_id_fk", None)
+        effective_trust_id = current_scope().trust_id
         if getattr(current_user, "is_super_admin", False) and not effective_trust_id:
             return jsonify({"data": [], "academic_year": None})
         
@@ -15344,6 +14715,7 @@ def announcement_restore(announcement_id: int, version: int):
     a.end_at = r.end_at
     ver = (db.session.scalar(select(func.max(AnnouncementRevision.version)).filter(AnnouncementRevision.announcement_id_fk == a.announcement_id)) or 0) + 1
     db.session.add(AnnouncementRevision(announcement_id_fk=a.announcement_id, version=ver, title=a.title, message=a.message, severity=a.severity, is_active=a.is_active, program_id_fk=a.program_id_fk, start_at=a.start_at, end_at=a.end_at, actor_user_id_fk=getattr(current_user, "user_id", None)))
+    fan_out_announcement(a.announcement_id)
     db.session.commit()
     flash("Announcement restored.", "info")
     return redirect(url_for("main.announcement_edit", announcement_id=announcement_id))
@@ -15490,15 +14862,13 @@ def admin_import_logs():
         q = q.filter(ImportLog.dry_run == True)
     if effective_trust_id:
         try:
-            from ..models import Institute
-            q = q.join(Program, ImportLog.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            q = q.where(ImportLog.program_id_fk.in_(program_ids_for(effective_trust_id)))
         except Exception:
             q = q.where(false())
     prog_q = select(Program).order_by(Program.program_name.asc())
     if effective_trust_id:
         try:
-            from ..models import Institute
-            prog_q = prog_q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            prog_q = prog_q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
         except Exception:
             prog_q = prog_q.where(false())
     programs = db.session.execute(prog_q).scalars().all()
@@ -15546,8 +14916,7 @@ def admin_logbook():
     prog_q = select(Program)
     if effective_trust_id:
         try:
-            from ..models import Institute
-            prog_q = prog_q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            prog_q = prog_q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
         except Exception:
             prog_q = prog_q.where(false())
     programs = {p.program_id: p for p in db.session.execute(prog_q).scalars().all()}
@@ -15569,8 +14938,7 @@ def admin_logbook():
             q = q.filter(ImportLog.user_id_fk == user_id)
         if effective_trust_id:
             try:
-                from ..models import Institute
-                q = q.join(Program, ImportLog.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+                q = q.where(ImportLog.program_id_fk.in_(program_ids_for(effective_trust_id)))
             except Exception:
                 q = q.where(false())
         rows = db.session.execute(q.limit(limit)).scalars().all()
@@ -15697,13 +15065,142 @@ def admin_system_status():
         email_ok = bool(host)
     except Exception:
         email_ok = False
+    outbox = None
+    try:
+        outbox = outbox_status()
+    except Exception:
+        db.session.rollback()
     try:
         base_dir = os.path.join(current_app.root_path, "static")
         paths = [base_dir, os.path.join(base_dir, "materials"), os.path.join(base_dir, "imports")]
         storage_ok = all(os.path.isdir(p) or os.path.exists(p) for p in paths)
     except Exception:
         storage_ok = False
-    return render_template("system_status.html", status={"db": db_ok, "cache": cache_ok, "email": email_ok, "storage": storage_ok})
+    metrics = None
+    try:
+        metrics = metrics_summary()
+    except Exception:
+        db.session.rollback()
+    return render_template("system_status.html", status={"db": db_ok, "cache": cache_ok, "email": email_ok, "storage": storage_ok}, outbox=outbox, metrics=metrics)
+
+
+# Prometheus scrape target: a bearer token (CMS_METRICS_TOKEN) or an admin session
+@main_bp.route("/metrics")
+def metrics_export():
+    import hmac
+    from ..metrics import render
+
+    token = current_app.config.get("METRICS_TOKEN")
+    supplied = request.headers.get("Authorization") or ""
+    allowed = bool(token) and supplied.startswith("Bearer ") and hmac.compare_digest(supplied[7:].strip(), token)
+    if not allowed:
+        allowed = current_user.is_authenticated and (getattr(current_user, "role", "") or "").strip().lower() == "admin"
+    if not allowed:
+        return Response("Unauthorized\n", status=401, mimetype="text/plain", headers={"WWW-Authenticate": "Bearer"})
+    return Response(render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+@main_bp.route("/api/admin/email-outbox")
+@login_required
+@role_required("admin")
+def api_admin_email_outbox():
+    from ..email_utils import email_status
+
+    email_id = request.args.get("email_id", type=int)
+    if email_id:
+        item = email_status(email_id)
+        if item is None:
+            return api_error("not_found", "Email not found.", 404)
+        return api_success(item)
+    status = outbox_status()
+    status["oldest_queued_at"] = status["oldest_queued_at"].isoformat() if status["oldest_queued_at"] else None
+    return api_success(status)
+
+
+@main_bp.route("/admin/index-advisor")
+@login_required
+@role_required("admin")
+def admin_index_advisor():
+    from ..index_advisor import advise
+
+    try:
+        limit = max(1, min(50, int(request.args.get("limit", 10))))
+    except Exception:
+        limit = 10
+    report = advise(current_app._get_current_object(), limit=limit)
+    return render_template("index_advisor.html", report=report, limit=limit)
+
+
+@main_bp.route("/admin/cache-stats")
+@login_required
+@role_required("admin")
+def admin_cache_stats():
+    from ..layout_cache import stats as layout_cache_stats
+
+    return render_template("cache_stats.html", stats=result_cache_stats(), layout=layout_cache_stats())
+
+
+@main_bp.route("/admin/query-hotspots")
+@login_required
+@role_required("admin")
+def admin_query_hotspots():
+    from ..query_budget import hotspots
+
+    try:
+        limit = max(1, min(100, int(request.args.get("limit", 25))))
+    except Exception:
+        limit = 25
+    shapes, violations = hotspots(current_app._get_current_object(), limit=limit)
+    return render_template(
+        "query_hotspots.html",
+        shapes=shapes,
+        violations=violations,
+        limit=limit,
+        threshold=current_app.config.get("QUERY_REPEAT_THRESHOLD", 10),
+    )
+
+
+@main_bp.route("/admin/profiles")
+@login_required
+@role_required("admin")
+def admin_profiles():
+    from ..request_profiler import summary
+
+    endpoints, captured = summary(current_app._get_current_object())
+    return render_template(
+        "profiles.html",
+        endpoints=endpoints,
+        captured=captured,
+        mode=current_app.config.get("PROFILER_MODE", "off"),
+        interval_ms=current_app.config.get("PROFILER_INTERVAL_MS", 5),
+        sample_rate=current_app.config.get("PROFILER_SAMPLE_RATE", 0.01),
+    )
+
+
+@main_bp.route("/admin/profiles/download")
+@login_required
+@role_required("admin")
+def admin_profile_download():
+    from ..request_profiler import endpoint_profile, folded, request_profile
+
+    app = current_app._get_current_object()
+    endpoint = (request.args.get("view") or "").strip()
+    request_id = request.args.get("request", type=int)
+    if request_id is not None:
+        item = request_profile(app, request_id)
+        stacks = item["stacks"] if item else None
+        name = f"request_{request_id}"
+    else:
+        stacks = endpoint_profile(app, endpoint) if endpoint else None
+        name = endpoint
+    if stacks is None:
+        abort(404)
+    safe = "".join(ch if ch.isalnum() or ch in "._-" else "_" for ch in name)
+    return Response(
+        folded(stacks),
+        mimetype="text/plain",
+        headers={"Content-Disposition": f"attachment; filename=profile_{safe}.folded"},
+    )
 
 
 @main_bp.route("/admin/student-lifecycle", methods=["GET", "POST"])
@@ -15718,6 +15215,8 @@ def student_lifecycle():
     from datetime import datetime, timedelta
     from flask import Response
     from sqlalchemy.exc import OperationalError
+    from ..attendance_rollups import delete_student_attendance
+    from ..fee_balances import refresh_students as refresh_fee_balances
     from ..models import (
         Alumni,
         Attendance,
@@ -16123,10 +15622,11 @@ def student_lifecycle():
                     "students": 0,
                 }
                 for chunk in _chunks(enrollments_to_purge):
-                    deleted["attendance"] += Attendance.query.filter(Attendance.student_id_fk.in_(chunk)).delete(synchronize_session=False)
+                    deleted["attendance"] += delete_student_attendance(chunk)
                     deleted["enrollments"] += StudentSubjectEnrollment.query.filter(StudentSubjectEnrollment.student_id_fk.in_(chunk)).delete(synchronize_session=False)
                     deleted["fees_records"] += FeesRecord.query.filter(FeesRecord.student_id_fk.in_(chunk)).delete(synchronize_session=False)
                     deleted["fee_payments"] += FeePayment.query.filter(FeePayment.enrollment_no.in_(chunk)).delete(synchronize_session=False)
+                    refresh_fee_balances(chunk)
                     deleted["exam_marks"] += ExamMark.query.filter(ExamMark.student_id_fk.in_(chunk)).delete(synchronize_session=False)
                     deleted["semester_results"] += StudentSemesterResult.query.filter(StudentSemesterResult.student_id_fk.in_(chunk)).delete(synchronize_session=False)
                     deleted["grades"] += Grade.query.filter(Grade.student_id_fk.in_(chunk)).delete(synchronize_session=False)
@@ -16339,10 +15839,11 @@ def student_lifecycle():
                     "students": 0,
                 }
                 for chunk in _chunks(enrollments):
-                    deleted["attendance"] += Attendance.query.filter(Attendance.student_id_fk.in_(chunk)).delete(synchronize_session=False)
+                    deleted["attendance"] += delete_student_attendance(chunk)
                     deleted["enrollments"] += StudentSubjectEnrollment.query.filter(StudentSubjectEnrollment.student_id_fk.in_(chunk)).delete(synchronize_session=False)
                     deleted["fees_records"] += FeesRecord.query.filter(FeesRecord.student_id_fk.in_(chunk)).delete(synchronize_session=False)
                     deleted["fee_payments"] += FeePayment.query.filter(FeePayment.enrollment_no.in_(chunk)).delete(synchronize_session=False)
+                    refresh_fee_balances(chunk)
                     deleted["exam_marks"] += ExamMark.query.filter(ExamMark.student_id_fk.in_(chunk)).delete(synchronize_session=False)
                     deleted["semester_results"] += StudentSemesterResult.query.filter(StudentSemesterResult.student_id_fk.in_(chunk)).delete(synchronize_session=False)
                     deleted["grades"] += Grade.query.filter(Grade.student_id_fk.in_(chunk)).delete(synchronize_session=False)
@@ -16768,7 +16269,7 @@ def staff_lifecycle():
 
 @main_bp.route("/api/reports/enrollment-summary", methods=["GET"])
 @login_required
-@cache.cached(timeout=180, key_prefix=lambda: f"api_reports_enrollment_summary_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}_{request.full_path}")
+@cached_result("reports_enrollment_summary", ("students",))
 def api_reports_enrollment_summary():
     program_id_raw = (request.args.get("program_id") or "").strip()
     semester_raw = (request.args.get("semester") or "").strip()
@@ -16776,15 +16277,7 @@ def api_reports_enrollment_summary():
     student_table, q = _student_projection_select(
         ("enrollment_no", "program_id_fk", "current_semester", "medium_tag", "trust_id_fk")
     )
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     if effective_trust_id and "trust_id_fk" in student_table.c:
         q = q.where(student_table.c.trust_id_fk == effective_trust_id)
     try:
@@ -16823,25 +16316,17 @@ def api_reports_enrollment_summary():
 
 @main_bp.route("/api/reports/fees-summary", methods=["GET"])
 @login_required
-@cache.cached(timeout=180, key_prefix=lambda: f"api_reports_fees_summary_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}_{request.full_path}")
+@cached_result("reports_fees_summary", ("fees",))
 def api_reports_fees_summary():
     from ..models import FeePayment, Program, Institute
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     program_id_raw = (request.args.get("program_id") or "").strip()
     semester_raw = (request.args.get("semester") or "").strip()
     medium_raw = (request.args.get("medium") or "").strip().lower()
     status_raw = (request.args.get("status") or "").strip().lower()
     q = select(FeePayment)
     if effective_trust_id:
-        q = q.join(Program, FeePayment.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+        q = q.where(FeePayment.program_id_fk.in_(program_ids_for(effective_trust_id)))
     try:
         pid = int(program_id_raw) if program_id_raw else None
     except ValueError:
@@ -16860,54 +16345,18 @@ def api_reports_fees_summary():
             q = q.filter(FeePayment.medium_tag == mv)
     if status_raw in ("submitted", "verified", "rejected"):
         q = q.filter(FeePayment.status == status_raw)
-    # Aggregations
-    total_count = db.session.scalar(select(func.count()).select_from(q.subquery()))
-    try:
-        total_amount = float(db.session.scalar(select(func.sum(FeePayment.amount)).select_from(q.subquery())) or 0.0)
-    except Exception:
-        total_amount = 0.0
-    by_status = {}
-    try:
-        rows = (
-            db.session.execute(
-                q.with_only_columns(FeePayment.status, func.count("*").label("c"))
-                .group_by(FeePayment.status)
-            ).all()
-        )
-        by_status = {str(r[0] or ""): int(r[1] or 0) for r in rows}
-    except Exception:
-        for p in db.session.execute(q).scalars().all():
-            by_status[p.status or "submitted"] = by_status.get(p.status or "submitted", 0) + 1
+    # Aggregations: count, amount and per-status counts in one grouped query
+    total_count, total_amount, by_status = payment_status_summary(q)
     return api_success({"total_count": total_count, "total_amount": round(total_amount, 2), "by_status": by_status}, {"program_id": pid, "semester": sem, "medium": medium_raw, "status": status_raw})
 
 @main_bp.route("/api/reports/fees-program-status", methods=["GET"])
 @login_required
-@cache.cached(timeout=180, key_prefix=lambda: f"api_reports_fees_program_status_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}_{request.full_path}")
+@query_budget(queries=15, repeats=5)
+@cached_result("reports_fees_program_status", ("fees", "students"))
 def api_reports_fees_program_status():
-    from ..models import FeePayment, FeeStructure, FeesRecord, Student, Program
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
-    if effective_trust_id:
-        try:
-            from ..models import Institute
-            trust_filter = (
-                select(Program.program_id)
-                .join(Institute, Program.institute_id_fk == Institute.institute_id)
-                .filter(Institute.trust_id_fk == effective_trust_id)
-                .subquery()
-            )
-            program_ids = [r[0] for r in db.session.execute(select(trust_filter.c.program_id)).all()] if trust_filter is not None else []
-        except Exception:
-            program_ids = []
-    else:
-        program_ids = None
+    from ..models import Program
+    effective_trust_id = current_scope().trust_id
+    program_ids = list(program_ids_for(effective_trust_id)) if effective_trust_id else None
     program_id_raw = (request.args.get("program_id") or "").strip()
     semester_raw = (request.args.get("semester") or "").strip()
     medium_raw = (request.args.get("medium") or "").strip()
@@ -16940,88 +16389,25 @@ def api_reports_fees_program_status():
         sq = sq.where(student_table.c.program_id_fk == pid)
     if sem and "current_semester" in student_table.c:
         sq = sq.where(student_table.c.current_semester == sem)
-    students = [_student_namespace(row) for row in db.session.execute(sq).mappings().all()]
-    st_index = {s.enrollment_no: s for s in students}
-    # Preload fee structure components and compute common + per-medium sums
-    fsq = select(FeeStructure)
-    if pid:
-        fsq = fsq.filter(FeeStructure.program_id_fk == pid)
-    if sem is not None:
-        fsq = fsq.filter((FeeStructure.semester == sem) | (FeeStructure.semester.is_(None)))
-    comps_all = db.session.execute(fsq).scalars().all()
-    common_sum = float(sum([(c.amount or 0.0) for c in comps_all if not getattr(c, "medium_tag", None)]))
-    medium_sum_map = {}
-    for c in comps_all:
-        mt = (getattr(c, "medium_tag", None) or "").strip()
-        if mt:
-            medium_sum_map[mt] = medium_sum_map.get(mt, 0.0) + float(c.amount or 0.0)
-    # If a specific medium is filtered, compute display due_per_student accordingly; else show common only
-    if med:
-        due_base = common_sum + medium_sum_map.get(med, 0.0)
-        unknown_due = False
-    else:
-        due_base = common_sum
-        unknown_due = False
+    ledger = program_ledger(sq, pid, sem, med, include_submitted=include_submitted_raw in {"1", "true", "yes"})
+    # If a specific medium is filtered, due_per_student includes its components; else common only
+    due_base = ledger["due_base"]
+    unknown_due = False
     buckets = {"full": [], "partial": [], "none": []}
-    bucket_sums = {"full": {"count": 0, "paid_sum": 0.0, "due_sum": 0.0}, "partial": {"count": 0, "paid_sum": 0.0, "due_sum": 0.0}, "none": {"count": 0, "paid_sum": 0.0, "due_sum": 0.0}}
-    for enr, st in st_index.items():
-        pq = select(FeePayment).filter(FeePayment.enrollment_no == enr)
-        if pid:
-            pq = pq.filter(FeePayment.program_id_fk == pid)
-        if sem:
-            pq = pq.filter(FeePayment.semester == sem)
-        if med:
-            pq = pq.filter((FeePayment.medium_tag == med) | (FeePayment.medium_tag.is_(None)))
-        if include_submitted_raw in {"1", "true", "yes"}:
-            pq = pq.filter(FeePayment.status.in_(["verified", "submitted"]))
-        else:
-            pq = pq.filter(FeePayment.status == "verified")
-        payments = db.session.execute(pq).scalars().all()
-        paid_sum = float(sum([(p.amount or 0.0) for p in payments]))
-        # Compute per-student due from common + student's medium components; fallback to FeesRecord when structure empty
-        due_amt = common_sum + medium_sum_map.get((getattr(st, "medium_tag", "") or "").strip(), 0.0)
-        if (due_amt <= 0.0):
-            fr = db.session.execute(select(FeesRecord).filter(FeesRecord.student_id_fk == enr)).scalars().first()
-            if fr:
-                if sem and fr.semester != sem:
-                     # Since we can't filter by semester on first(), we might need to filter before first()
-                     # Let's rebuild the query
-                     pass
-            
-            # Correct logic:
-            fr_query = select(FeesRecord).filter(FeesRecord.student_id_fk == enr)
-            if sem:
-                fr_query = fr_query.filter(FeesRecord.semester == sem)
-            fr = db.session.execute(fr_query).scalars().first()
-
-            if fr and (float(fr.amount_due or 0.0) > 0.0):
-                due_amt = float(fr.amount_due or 0.0)
-        bucket = "none"
-        if due_amt > 0.0:
-            if paid_sum >= due_amt - 0.01:
-                bucket = "full"
-            elif paid_sum > 0.0:
-                bucket = "partial"
-            else:
-                bucket = "none"
-        else:
-            bucket = "partial" if paid_sum > 0.0 else "none"
-        outstanding = max(due_amt - paid_sum, 0.0)
-        buckets[bucket].append({
-            "enrollment_no": enr,
+    for entry in ledger["entries"]:
+        st = _student_namespace(entry["row"])
+        buckets[entry["bucket"]].append({
+            "enrollment_no": entry["enrollment_no"],
             "name": (((getattr(st, "student_name", "") or "") + " " + (getattr(st, "surname", "") or "")).strip()),
             "program_name": getattr(prog, "program_name", "") if prog else "",
             "semester": getattr(st, "current_semester", None),
             "medium": getattr(st, "medium_tag", ""),
-            "paid": round(paid_sum, 2),
-            "due": round(outstanding, 2),
-            "bucket": bucket,
-            "due_total": round(due_amt, 2),
+            "paid": round(entry["paid"], 2),
+            "due": round(entry["outstanding"], 2),
+            "bucket": entry["bucket"],
+            "due_total": round(entry["due_total"], 2),
         })
-        bs = bucket_sums[bucket]
-        bs["count"] += 1
-        bs["paid_sum"] += float(paid_sum or 0.0)
-        bs["due_sum"] += float(outstanding or 0.0)
+    bucket_sums = ledger["totals"]
     summary = {
         "program_id": pid,
         "program_name": getattr(prog, "program_name", "") if prog else "All",
@@ -17038,20 +16424,12 @@ def api_reports_fees_program_status():
 @main_bp.route("/fees/program-status/export.csv", methods=["GET"])
 @login_required
 def fees_program_status_export_csv():
-    from ..models import FeePayment, FeeStructure, FeesRecord, Student, Program, Institute
+    from ..models import Program, Institute
     program_id_raw = (request.args.get("program_id") or "").strip()
     semester_raw = (request.args.get("semester") or "").strip()
     medium_raw = (request.args.get("medium") or "").strip()
     include_submitted_raw = (request.args.get("include_submitted") or "").strip().lower()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     try:
         pid = int(program_id_raw) if program_id_raw else None
     except ValueError:
@@ -17066,9 +16444,8 @@ def fees_program_status_export_csv():
         try:
             prog = db.session.execute(
                 select(Program)
-                .join(Institute, Program.institute_id_fk == Institute.institute_id)
                 .filter(Program.program_id == pid)
-                .filter(Institute.trust_id_fk == effective_trust_id)
+                .filter(Program.program_id.in_(program_ids_for(effective_trust_id)))
             ).scalars().first()
         except Exception:
             prog = None
@@ -17085,80 +16462,28 @@ def fees_program_status_export_csv():
         sq = sq.where(student_table.c.program_id_fk == pid)
     if sem and "current_semester" in student_table.c:
         sq = sq.where(student_table.c.current_semester == sem)
-    students = [_student_namespace(row) for row in db.session.execute(sq).mappings().all()]
-    fsq = select(FeeStructure)
-    if pid:
-        fsq = fsq.filter(FeeStructure.program_id_fk == pid)
-    if sem is not None:
-        fsq = fsq.filter((FeeStructure.semester == sem) | (FeeStructure.semester.is_(None)))
-    comps_all = db.session.execute(fsq).scalars().all()
-    common_sum = float(sum([(c.amount or 0.0) for c in comps_all if not getattr(c, "medium_tag", None)]))
-    medium_sum_map = {}
-    for c in comps_all:
-        mt = (getattr(c, "medium_tag", None) or "").strip()
-        if mt:
-            medium_sum_map[mt] = medium_sum_map.get(mt, 0.0) + float(c.amount or 0.0)
-    due_base = (common_sum + medium_sum_map.get(med, 0.0)) if med else common_sum
+    ledger = program_ledger(sq, pid, sem, med, include_submitted=include_submitted_raw in {"1", "true", "yes"})
+    due_base = ledger["due_base"]
     import io, csv as _csv
     buf = io.StringIO()
     w = _csv.writer(buf)
     summary_line = f"Program: {(getattr(prog, 'program_name', '') or 'All')} • Semester: {(sem if sem is not None else 'All')} • Medium: {(med or 'All')} • Due per student: {round(due_base,2)}"
     w.writerow([summary_line])
-    totals = {"full": {"count": 0, "paid_sum": 0.0, "due_sum": 0.0}, "partial": {"count": 0, "paid_sum": 0.0, "due_sum": 0.0}, "none": {"count": 0, "paid_sum": 0.0, "due_sum": 0.0}}
+    totals = ledger["totals"]
     w.writerow(["Bucket Totals", "Full", "Partial", "None"])
-    # We'll fill this after iterating; temporarily remember row index
-    totals_row_index_placeholder = buf.tell()
     w.writerow(["Counts/Paid/Due", "", "", ""]) 
     w.writerow(["EnrollmentNo", "Name", "Program", "Semester", "Medium", "Paid", "Due", "Bucket"])
-    for st in students:
-        enr = getattr(st, "enrollment_no", None)
-        if not enr:
-            continue
-        pq = select(FeePayment).filter(FeePayment.enrollment_no == enr)
-        if pid:
-            pq = pq.filter(FeePayment.program_id_fk == pid)
-        if sem:
-            pq = pq.filter(FeePayment.semester == sem)
-        if med:
-            pq = pq.filter((FeePayment.medium_tag == med) | (FeePayment.medium_tag.is_(None)))
-        if include_submitted_raw in {"1", "true", "yes"}:
-            pq = pq.filter(FeePayment.status.in_(["verified", "submitted"]))
-        else:
-            pq = pq.filter(FeePayment.status == "verified")
-        paid_sum = float(sum([(p.amount or 0.0) for p in db.session.execute(pq).scalars().all()]))
-        # Per-student due computed from common + student's medium components; fallback to FeesRecord when structure empty
-        st_med = (getattr(st, "medium_tag", "") or "").strip()
-        due_amt = common_sum + medium_sum_map.get(st_med, 0.0)
-        if due_amt <= 0.0:
-            fr_query = select(FeesRecord).filter(FeesRecord.student_id_fk == enr)
-            if sem:
-                fr_query = fr_query.filter(FeesRecord.semester == sem)
-            fr = db.session.execute(fr_query).scalars().first()
-            if fr and (float(fr.amount_due or 0.0) > 0.0):
-                due_amt = float(fr.amount_due or 0.0)
-        bucket = "none"
-        if due_amt > 0.0:
-            if paid_sum >= due_amt - 0.01:
-                bucket = "full"
-            elif paid_sum > 0.0:
-                bucket = "partial"
-            else:
-                bucket = "none"
-        else:
-            bucket = "partial" if paid_sum > 0.0 else "none"
-        totals[bucket]["count"] += 1
-        totals[bucket]["paid_sum"] += float(paid_sum or 0.0)
-        totals[bucket]["due_sum"] += float(due_amt or 0.0)
-        outstanding = max(due_amt - paid_sum, 0.0)
+    for entry in ledger["entries"]:
+        st = _student_namespace(entry["row"])
         w.writerow([
-            enr or "",
+            entry["enrollment_no"],
             (((getattr(st, "student_name", "") or "") + " " + (getattr(st, "surname", "") or "")).strip()),
             (getattr(prog, "program_name", "") or ""),
             getattr(st, "current_semester", "") or "",
             getattr(st, "medium_tag", "") or "",
-            round(paid_sum, 2),
-            round(outstanding, 2),
-            bucket,
+            round(entry["paid"], 2),
+            round(entry["outstanding"], 2),
+            entry["bucket"],
         ])
     # Append the totals line after listing
     w.writerow([
@@ -17172,7 +16497,7 @@ def fees_program_status_export_csv():
 
 @main_bp.route("/api/reports/subject-lectures", methods=["GET"])
 @login_required
-@cache.cached(timeout=180, key_prefix=lambda: f"api_reports_subject_lectures_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}_{request.full_path}")
+@cached_result("reports_subject_lectures", ("attendance",))
 def api_reports_subject_lectures():
     from ..models import Attendance, Subject, Division, Student, Program, Institute
     program_id_raw = (request.args.get("program_id") or "").strip()
@@ -17181,15 +16506,7 @@ def api_reports_subject_lectures():
     division_id_raw = (request.args.get("division_id") or "").strip()
     date_from_raw = (request.args.get("date_from") or "").strip()
     date_to_raw = (request.args.get("date_to") or "").strip()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     try:
         pid = int(program_id_raw) if program_id_raw else None
     except ValueError:
@@ -17219,12 +16536,7 @@ def api_reports_subject_lectures():
         dt = None
     aq = select(Attendance)
     if effective_trust_id:
-        allowed_div_ids = [r[0] for r in db.session.execute(
-            select(Division.division_id)
-            .join(Program, Division.program_id_fk == Program.program_id)
-            .join(Institute, Program.institute_id_fk == Institute.institute_id)
-            .filter(Institute.trust_id_fk == effective_trust_id)
-        ).all()]
+        allowed_div_ids = list(division_ids_for(effective_trust_id))
         if not allowed_div_ids:
             return api_success({"summary": {"total_lectures": 0}, "items": []})
         aq = aq.filter(Attendance.division_id_fk.in_(allowed_div_ids))
@@ -17262,16 +16574,14 @@ def api_reports_subject_lectures():
         try:
             subj = db.session.execute(
                 select(Subject)
-                .join(Program, Subject.program_id_fk == Program.program_id)
-                .join(Institute, Program.institute_id_fk == Institute.institute_id)
                 .filter(Subject.subject_id == sid)
-                .filter(Institute.trust_id_fk == effective_trust_id)
+                .filter(Subject.program_id_fk.in_(program_ids_for(effective_trust_id)))
             ).scalars().first()
         except Exception:
             subj = None
     div_q = select(Division)
     if effective_trust_id:
-        div_q = div_q.join(Program, Division.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+        div_q = div_q.where(Division.program_id_fk.in_(program_ids_for(effective_trust_id)))
     div_map = {d.division_id: d.division_code for d in db.session.execute(div_q).scalars().all()}
     for it in items:
         it["division_code"] = div_map.get(it.get("division_id"))
@@ -17284,7 +16594,7 @@ def api_reports_subject_lectures():
     if pid:
         try:
             prog = db.session.execute(
-                select(Program).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Program.program_id == pid).filter(Institute.trust_id_fk == effective_trust_id)
+                select(Program).filter(Program.program_id == pid).filter(Program.program_id.in_(program_ids_for(effective_trust_id)))
             ).scalars().first()
         except Exception:
             prog = None
@@ -17310,15 +16620,7 @@ def subject_lectures_export_csv():
     division_id_raw = (request.args.get("division_id") or "").strip()
     date_from_raw = (request.args.get("date_from") or "").strip()
     date_to_raw = (request.args.get("date_to") or "").strip()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     try:
         pid = int(program_id_raw) if program_id_raw else None
     except ValueError:
@@ -17349,12 +16651,7 @@ def subject_lectures_export_csv():
     aq = select(Attendance)
     allowed_div_ids = None
     if effective_trust_id:
-        allowed_div_ids = [r[0] for r in db.session.execute(
-            select(Division.division_id)
-            .join(Program, Division.program_id_fk == Program.program_id)
-            .join(Institute, Program.institute_id_fk == Institute.institute_id)
-            .filter(Institute.trust_id_fk == effective_trust_id)
-        ).all()]
+        allowed_div_ids = list(division_ids_for(effective_trust_id))
         if not allowed_div_ids:
             return Response(b"", headers={"Content-Type": "text/csv", "Content-Disposition": "attachment; filename=subject_lectures.csv"})
         aq = aq.filter(Attendance.division_id_fk.in_(allowed_div_ids))
@@ -17392,10 +16689,8 @@ def subject_lectures_export_csv():
         try:
             subj = db.session.execute(
                 select(Subject)
-                .join(Program, Subject.program_id_fk == Program.program_id)
-                .join(Institute, Program.institute_id_fk == Institute.institute_id)
                 .filter(Subject.subject_id == sid)
-                .filter(Institute.trust_id_fk == effective_trust_id)
+                .filter(Subject.program_id_fk.in_(program_ids_for(effective_trust_id)))
             ).scalars().first()
         except Exception:
             subj = None
@@ -17405,7 +16700,7 @@ def subject_lectures_export_csv():
     if pid and effective_trust_id:
         try:
             prog = db.session.execute(
-                select(Program).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Program.program_id == pid).filter(Institute.trust_id_fk == effective_trust_id)
+                select(Program).filter(Program.program_id == pid).filter(Program.program_id.in_(program_ids_for(effective_trust_id)))
             ).scalars().first()
         except Exception:
             prog = None
@@ -17419,7 +16714,7 @@ def subject_lectures_export_csv():
     w.writerow(["Date", "Period", "Timing", "Division"])
     div_q = select(Division)
     if effective_trust_id:
-        div_q = div_q.join(Program, Division.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+        div_q = div_q.where(Division.program_id_fk.in_(program_ids_for(effective_trust_id)))
     div_map = {d.division_id: d.division_code for d in db.session.execute(div_q).scalars().all()}
     for it in items:
         p = int(it.get("period") or 0)
@@ -17436,7 +16731,7 @@ def subject_lectures_export_csv():
 
 @main_bp.route("/api/reports/attendance-summary", methods=["GET"])
 @login_required
-@cache.cached(timeout=180, key_prefix=lambda: f"api_reports_attendance_summary_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}_{request.full_path}")
+@cached_result("reports_attendance_summary", ("attendance",))
 def api_reports_attendance_summary():
     from ..models import Attendance, Division, Program, Institute, Subject, CourseAssignment
     program_id_raw = (request.args.get("program_id") or "").strip()
@@ -17445,15 +16740,7 @@ def api_reports_attendance_summary():
     subject_id_raw = (request.args.get("subject_id") or "").strip()
     subject_name_raw = (request.args.get("subject_name") or "").strip()
     faculty_only_raw = (request.args.get("faculty_only") or "").strip().lower()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     if getattr(current_user, "is_super_admin", False) and not effective_trust_id:
         return api_success({"items": [], "total": 0}, {"program_id": None, "semester": None})
     try:
@@ -17464,7 +16751,7 @@ def api_reports_attendance_summary():
         try:
             pq = select(Program).filter(Program.program_name.ilike(program_name_raw))
             if effective_trust_id:
-                pq = pq.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+                pq = pq.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
             p0 = db.session.execute(pq).scalars().first()
             pid = p0.program_id if p0 else None
         except Exception:
@@ -17485,7 +16772,7 @@ def api_reports_attendance_summary():
             if sem:
                 qn = qn.filter(Subject.semester == sem)
             if effective_trust_id:
-                qn = qn.join(Program, Subject.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+                qn = qn.where(Subject.program_id_fk.in_(program_ids_for(effective_trust_id)))
             s0 = db.session.execute(qn.filter(Subject.subject_name.ilike(subject_name_raw))).scalars().first()
             sid = s0.subject_id if s0 else None
         except Exception:
@@ -17493,7 +16780,7 @@ def api_reports_attendance_summary():
     role = (getattr(current_user, "role", "") or "").strip().lower()
     subjects_q = select(Subject)
     if effective_trust_id:
-        subjects_q = subjects_q.join(Program, Subject.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+        subjects_q = subjects_q.where(Subject.program_id_fk.in_(program_ids_for(effective_trust_id)))
     if pid:
         subjects_q = subjects_q.filter(Subject.program_id_fk == pid)
     if sem:
@@ -17510,42 +16797,41 @@ def api_reports_attendance_summary():
         else:
             return api_success({"items": [], "total": 0}, {"program_id": pid, "semester": sem, "faculty_only": True})
     subjects = db.session.execute(subjects_q.order_by(Subject.subject_name.asc())).scalars().all()
-    items = []
-    for s in subjects:
-        aq = select(Attendance.status).join(Division, Attendance.division_id_fk == Division.division_id).join(Program, Division.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id)
-        aq = aq.filter(Attendance.subject_id_fk == s.subject_id)
+    from ..models import AttendanceSessionRollup as R
+    counts = {}
+    if subjects:
+        aq = (
+            select(R.subject_id_fk, func.sum(R.present_count), func.sum(R.total_count))
+            .join(Division, R.division_id_fk == Division.division_id)
+            .join(Program, Division.program_id_fk == Program.program_id)
+            .join(Institute, Program.institute_id_fk == Institute.institute_id)
+            .filter(R.subject_id_fk.in_([s.subject_id for s in subjects]))
+        )
         if effective_trust_id:
             aq = aq.filter(Institute.trust_id_fk == effective_trust_id)
-        statuses = [r[0] for r in db.session.execute(aq).all()]
-        total = len(statuses)
-        present = len([x for x in statuses if (x or "").upper() == "P"])
+        counts = {row[0]: (int(row[1] or 0), int(row[2] or 0)) for row in db.session.execute(aq.group_by(R.subject_id_fk)).all()}
+    items = []
+    for s in subjects:
+        present, total = counts.get(s.subject_id, (0, 0))
         rate = round((present * 100.0 / total), 1) if total else None
         items.append({"subject_id": s.subject_id, "subject_name": s.subject_name, "present": present, "total": total, "rate": rate})
     return api_success({"items": items, "total": len(items)}, {"program_id": pid, "program_name": program_name_raw or None, "semester": sem, "subject_id": sid, "subject_name": subject_name_raw or None, "faculty_only": (faculty_only_raw in ("1","true","yes") or role == "faculty")})
 
 @main_bp.route("/api/reports/materials-summary", methods=["GET"])
 @login_required
-@cache.cached(timeout=180, key_prefix=lambda: f"api_reports_materials_summary_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}_{request.full_path}")
+@cached_result("reports_materials_summary", ("materials",))
 def api_reports_materials_summary():
     from ..models import Subject, Program, Institute
     role = (getattr(current_user, "role", "") or "").strip().lower()
     subject_id_raw = (request.args.get("subject_id") or "").strip()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     try:
         sid = int(subject_id_raw) if subject_id_raw else None
     except ValueError:
         sid = None
     q = select(SubjectMaterial)
     if effective_trust_id:
-        q = q.join(Subject, SubjectMaterial.subject_id_fk == Subject.subject_id).join(Program, Subject.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+        q = q.join(Subject, SubjectMaterial.subject_id_fk == Subject.subject_id).where(Subject.program_id_fk.in_(program_ids_for(effective_trust_id)))
     if role == "faculty":
         q = q.filter(SubjectMaterial.faculty_id_fk == current_user.user_id)
     if sid:
@@ -17568,19 +16854,11 @@ def api_reports_materials_summary():
 
 @main_bp.route("/api/reports/division-capacity", methods=["GET"])
 @login_required
-@cache.cached(timeout=180, key_prefix=lambda: f"api_reports_division_capacity_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}_{request.full_path}")
+@cached_result("reports_division_capacity", ("students",))
 def api_reports_division_capacity():
     program_id_raw = (request.args.get("program_id") or "").strip()
     semester_raw = (request.args.get("semester") or "").strip()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     try:
         pid = int(program_id_raw) if program_id_raw else None
     except ValueError:
@@ -17593,7 +16871,7 @@ def api_reports_division_capacity():
     if effective_trust_id:
         try:
             from ..models import Institute, Program
-            dq = dq.join(Program, Division.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            dq = dq.where(Division.program_id_fk.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     if pid:
@@ -17635,19 +16913,11 @@ def api_reports_division_capacity():
 
 @main_bp.route("/api/reports/absentees", methods=["GET"])
 @login_required
-@cache.cached(timeout=120, key_prefix=lambda: f"api_reports_absentees_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}_{request.full_path}")
+@cached_result("reports_absentees", ("attendance", "students"))
 def api_reports_absentees():
     subject_id_raw = (request.args.get("subject_id") or "").strip()
     days_raw = (request.args.get("days") or "7").strip()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     try:
         sid = int(subject_id_raw) if subject_id_raw else None
     except ValueError:
@@ -17668,10 +16938,8 @@ def api_reports_absentees():
             ok = db.session.execute(
                 select(func.count())
                 .select_from(Subject)
-                .join(Program, Subject.program_id_fk == Program.program_id)
-                .join(Institute, Program.institute_id_fk == Institute.institute_id)
                 .filter(Subject.subject_id == sid)
-                .filter(Institute.trust_id_fk == effective_trust_id)
+                .filter(Subject.program_id_fk.in_(program_ids_for(effective_trust_id)))
             ).scalar() or 0
             if ok <= 0:
                 return api_success({"items": [], "total": 0}, {"subject_id": sid})
@@ -17682,7 +16950,7 @@ def api_reports_absentees():
     if effective_trust_id:
         try:
             from ..models import Division, Program, Institute
-            q = q.join(Division, Attendance.division_id_fk == Division.division_id).join(Program, Division.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            q = q.join(Division, Attendance.division_id_fk == Division.division_id).where(Division.program_id_fk.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     try:
@@ -17716,15 +16984,7 @@ def api_reports_absentees():
 def absentees_export_csv():
     subject_id_raw = (request.args.get("subject_id") or "").strip()
     days_raw = (request.args.get("days") or "7").strip()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     try:
         sid = int(subject_id_raw) if subject_id_raw else None
     except ValueError:
@@ -17741,10 +17001,8 @@ def absentees_export_csv():
             ok = db.session.execute(
                 select(func.count())
                 .select_from(Subject)
-                .join(Program, Subject.program_id_fk == Program.program_id)
-                .join(Institute, Program.institute_id_fk == Institute.institute_id)
                 .filter(Subject.subject_id == sid)
-                .filter(Institute.trust_id_fk == effective_trust_id)
+                .filter(Subject.program_id_fk.in_(program_ids_for(effective_trust_id)))
             ).scalar() or 0
             if ok <= 0:
                 return Response(b"", headers={"Content-Type": "text/csv", "Content-Disposition": "attachment; filename=absentees.csv"})
@@ -17755,7 +17013,7 @@ def absentees_export_csv():
     if effective_trust_id:
         try:
             from ..models import Division, Program, Institute
-            q = q.join(Division, Attendance.division_id_fk == Division.division_id).join(Program, Division.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            q = q.join(Division, Attendance.division_id_fk == Division.division_id).where(Division.program_id_fk.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     try:
@@ -17787,22 +17045,14 @@ def absentees_export_csv():
 
 @main_bp.route("/api/reports/attendance-students", methods=["GET"])
 @login_required
-@cache.cached(timeout=120, key_prefix=lambda: f"api_reports_attendance_students_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}_{request.full_path}")
+@cached_result("reports_attendance_students", ("attendance", "students"))
 def api_reports_attendance_students():
     program_id_raw = (request.args.get("program_id") or "").strip()
     semester_raw = (request.args.get("semester") or "").strip()
     subject_id_raw = (request.args.get("subject_id") or "").strip()
     threshold_raw = (request.args.get("threshold") or "50").strip()
     mode_raw = (request.args.get("mode") or "below").strip().lower()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     try:
         pid = int(program_id_raw) if program_id_raw else None
     except ValueError:
@@ -17877,22 +17127,13 @@ def api_reports_attendance_students():
 @main_bp.route("/admin/reports/nep-exit-eligibility", methods=["GET"])
 @login_required
 @role_required("admin", "principal")
-@cache.cached(timeout=60, key_prefix=lambda: f"nep_report_{getattr(current_user, 'user_id', 'anon')}_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}_{request.full_path}", unless=lambda: session.get("_flashes"))
+@cached_result("nep_exit_report", ("exams", "students"), per_user=True, unless=lambda: session.get("_flashes"))
 def nep_exit_report():
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     q = select(Program).order_by(Program.program_name.asc())
     if effective_trust_id:
         try:
-            from ..models import Institute
-            q = q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            q = q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     programs = db.session.execute(q).scalars().all()
@@ -17907,15 +17148,7 @@ def nep_exit_report():
             if selected_program:
                 if effective_trust_id:
                     try:
-                        from ..models import Institute
-                        ok = db.session.execute(
-                            select(func.count())
-                            .select_from(Program)
-                            .join(Institute, Program.institute_id_fk == Institute.institute_id)
-                            .filter(Program.program_id == pid)
-                            .filter(Institute.trust_id_fk == effective_trust_id)
-                        ).scalar() or 0
-                        if ok <= 0:
+                        if int(pid) not in program_ids_for(effective_trust_id):
                             selected_program = None
                     except Exception:
                         selected_program = None
@@ -18009,15 +17242,7 @@ def attendance_students_export_csv():
         thr = max(0, min(100, int(threshold_raw)))
     except ValueError:
         thr = 50
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     student_table, sq = _student_projection_select(
         ("enrollment_no", "student_name", "surname", "program_id_fk", "current_semester", "medium_tag", "trust_id_fk")
     )
@@ -18092,16 +17317,8 @@ def students_missing_category_report():
 
     # Determine Effective Trust Context (for admin)
     from ..models import Trust, Institute  # already imported at top; safe to re-import
-    effective_trust_id = None
     is_super = getattr(current_user, "is_super_admin", False)
-    if is_super:
-        if "active_trust_id" in session:
-            try:
-                effective_trust_id = int(session["active_trust_id"])
-            except Exception:
-                effective_trust_id = None
-    else:
-        effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
 
     q = (
         select(Student, Program.program_name)
@@ -18116,9 +17333,7 @@ def students_missing_category_report():
             q = q.filter(Student.program_id_fk == pid_scope)
     else:
         if effective_trust_id:
-            q = q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(
-                Institute.trust_id_fk == effective_trust_id
-            )
+            q = q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
 
     q = q.order_by(Program.program_name.asc(), Student.current_semester.asc(), Student.enrollment_no.asc())
     rows = db.session.execute(q).all()
@@ -18140,15 +17355,7 @@ def students_missing_category_report():
 @login_required
 def fees_export_csv():
     from ..models import FeePayment, Program
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     program_id_raw = (request.args.get("program_id") or "").strip()
     semester_raw = (request.args.get("semester") or "").strip()
     medium_raw = (request.args.get("medium") or "").strip().lower()
@@ -18156,8 +17363,7 @@ def fees_export_csv():
     q = select(FeePayment)
     if effective_trust_id:
         try:
-            from ..models import Institute
-            q = q.join(Program, FeePayment.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            q = q.where(FeePayment.program_id_fk.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     try:
@@ -18182,8 +17388,7 @@ def fees_export_csv():
     prog_q = select(Program)
     if effective_trust_id:
         try:
-            from ..models import Institute
-            prog_q = prog_q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            prog_q = prog_q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     prog_map = {p.program_id: p.program_name for p in db.session.execute(prog_q).scalars().all()}
@@ -18208,23 +17413,14 @@ def fees_export_csv():
 
 @main_bp.route("/reports")
 @login_required
-@cache.cached(timeout=120, key_prefix=lambda: f"reports_hub_{getattr(current_user, 'role', 'unknown')}_{(session.get('active_trust_id') if getattr(current_user, 'is_super_admin', False) else getattr(current_user, 'trust_id_fk', None))}", unless=lambda: session.get("_flashes"))
+@cached_result("reports_hub", ("students",), per_user=True, unless=lambda: session.get("_flashes"))
 def reports_hub():
     role = (getattr(current_user, "role", "") or "").strip().lower()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     q = select(Program).order_by(Program.program_name.asc())
     if effective_trust_id:
         try:
-            from ..models import Institute
-            q = q.join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            q = q.where(Program.program_id.in_(program_ids_for(effective_trust_id)))
         except Exception:
             q = q.where(false())
     programs = db.session.execute(q).scalars().all()
@@ -18276,15 +17472,7 @@ def admin_redis_check():
 def api_subjects():
     program_id_raw = (request.args.get("program_id") or "").strip()
     semester_raw = (request.args.get("semester") or "").strip()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     try:
         pid = int(program_id_raw) if program_id_raw else None
     except ValueError:
@@ -18296,8 +17484,7 @@ def api_subjects():
     q = select(Subject)
     if effective_trust_id:
         try:
-            from ..models import Institute
-            q = q.join(Program, Subject.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            q = q.where(Subject.program_id_fk.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     if pid:
@@ -18313,15 +17500,7 @@ def api_subjects():
 def api_program_mediums():
     program_id_raw = (request.args.get("program_id") or "").strip()
     semester_raw = (request.args.get("semester") or "").strip()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     try:
         pid = int(program_id_raw) if program_id_raw else None
     except ValueError:
@@ -18333,8 +17512,7 @@ def api_program_mediums():
     q = select(FeeStructure)
     if effective_trust_id:
         try:
-            from ..models import Institute
-            q = q.join(Program, FeeStructure.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            q = q.where(FeeStructure.program_id_fk.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     if pid:
@@ -18348,15 +17526,7 @@ def api_program_mediums():
 def api_divisions():
     program_id_raw = (request.args.get("program_id") or "").strip()
     semester_raw = (request.args.get("semester") or "").strip()
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     try:
         pid = int(program_id_raw) if program_id_raw else None
     except ValueError:
@@ -18368,8 +17538,7 @@ def api_divisions():
     q = select(Division)
     if effective_trust_id:
         try:
-            from ..models import Institute
-            q = q.join(Program, Division.program_id_fk == Program.program_id).join(Institute, Program.institute_id_fk == Institute.institute_id).filter(Institute.trust_id_fk == effective_trust_id)
+            q = q.where(Division.program_id_fk.in_(program_ids_for(effective_trust_id)))
         except Exception:
             pass
     if pid:
@@ -18574,12 +17743,16 @@ def admin_seed_attendance_mock():
         students = db.session.execute(select(Student).filter(Student.program_id_fk == p.program_id, Student.current_semester == semester).limit(10)).scalars().all()
     subj_id = getattr(s, "subject_id", None)
     base_time = datetime.now(timezone.utc)
+    from ..attendance_rollups import RollupTracker
+    rollups = RollupTracker()
     for idx, st in enumerate(students):
         for j in range(10):
             status = "P" if ((idx >= 5 and j < 9) or (idx < 5 and j < 4)) else "A"
             rec = Attendance(subject_id_fk=subj_id if subj_id else None, student_id_fk=getattr(st, "enrollment_no", None), status=status, date_marked=(base_time - timedelta(days=j)).date(), semester=semester)
             db.session.add(rec)
+            rollups.add(rec)
             created["attendance"] += 1
+    rollups.flush()
     db.session.commit()
     return api_success({"seeded": created, "program_id": p.program_id, "subject_id": subj_id})
 
@@ -18587,30 +17760,26 @@ def admin_seed_attendance_mock():
 @login_required
 @role_required("admin", "principal")
 def module_analytics():
-    from ..models import Faculty, Attendance, Subject, Division, Program, CourseAssignment, Institute
+    from ..models import Faculty, Attendance, Subject, Division, Program, CourseAssignment
     from datetime import datetime, date, timedelta
     from collections import defaultdict
     from sqlalchemy import and_
     
-    role = (getattr(current_user, "role", "") or "").strip().lower()
+    scope = current_scope()
+    role = scope.role
     user_pid = int(getattr(current_user, "program_id_fk", 0) or 0)
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = scope.trust_id
     if getattr(current_user, "is_super_admin", False) and not effective_trust_id:
         flash("Select a tenant workspace first (Global View → choose Trust).", "warning")
         return redirect(url_for("super_admin.dashboard"))
     
     # 1. Daily Logs (Today)
     today = date.today()
+    # Both views read the per-session rollups: one row per lecture rather
+    # than one row per student mark.
+    from ..models import AttendanceSessionRollup as R
     q_daily = select(
-        Attendance, 
+        R, 
         Faculty.full_name, 
         Faculty.designation, 
         Subject.subject_name,
@@ -18618,19 +17787,18 @@ def module_analytics():
         Division.semester,
         Program.program_name,
         Program.program_id
-    ).join(Subject, Attendance.subject_id_fk == Subject.subject_id)\
-     .join(Division, Attendance.division_id_fk == Division.division_id)\
+    ).join(Subject, R.subject_id_fk == Subject.subject_id)\
+     .join(Division, R.division_id_fk == Division.division_id)\
      .join(Program, Division.program_id_fk == Program.program_id)\
-     .join(Institute, Program.institute_id_fk == Institute.institute_id)\
      .outerjoin(CourseAssignment, and_(
          CourseAssignment.subject_id_fk == Subject.subject_id,
          CourseAssignment.division_id_fk == Division.division_id,
          CourseAssignment.is_active == True
      ))\
      .outerjoin(Faculty, Faculty.user_id_fk == CourseAssignment.faculty_id_fk)\
-     .filter(Attendance.date_marked == today)\
-     .filter(Institute.trust_id_fk == effective_trust_id)\
-     .order_by(Attendance.period_no.asc())
+     .filter(R.date_marked == today)\
+     .filter(Program.program_id.in_(scope.program_ids))\
+     .order_by(R.period_no.asc())
      
     if role == "principal" and user_pid:
         q_daily = q_daily.filter(Program.program_id == user_pid)
@@ -18638,8 +17806,7 @@ def module_analytics():
     daily_rows = db.session.execute(q_daily).all()
     
     daily_logs = []
-    # Since we are fetching individual attendance records (one per student),
-    # we need to group them by (faculty, subject, division, period) to simulate a "lecture" log
+    # Group session rollups by (faculty, subject, division, period) to build a "lecture" log
     lecture_map = {}
 
     for att, fname, fdesig, sname, div_code, sem, pname, pid in daily_rows:
@@ -18665,9 +17832,8 @@ def module_analytics():
                 "total_students": 0
             }
         
-        lecture_map[key]["total_students"] += 1
-        if att.status == 'P':
-            lecture_map[key]["present_count"] += 1
+        lecture_map[key]["total_students"] += int(att.total_count or 0)
+        lecture_map[key]["present_count"] += int(att.present_count or 0)
 
     daily_logs = list(lecture_map.values())
     daily_logs.sort(key=lambda x: (x["period_no"] or 0))
@@ -18687,33 +17853,31 @@ def module_analytics():
     # Improved Weekly Query: Group by Lecture Unique Keys
     q_week_agg = select(
         Faculty.full_name,
-        Attendance.date_marked,
-        Attendance.period_no,
-        Attendance.division_id_fk,
-        Attendance.subject_id_fk
-    ).join(Subject, Attendance.subject_id_fk == Subject.subject_id)\
-     .join(Division, Attendance.division_id_fk == Division.division_id)\
-     .join(Program, Division.program_id_fk == Program.program_id)\
-     .join(Institute, Program.institute_id_fk == Institute.institute_id)\
+        R.date_marked,
+        R.period_no,
+        R.division_id_fk,
+        R.subject_id_fk
+    ).join(Subject, R.subject_id_fk == Subject.subject_id)\
+     .join(Division, R.division_id_fk == Division.division_id)\
      .outerjoin(CourseAssignment, and_(
          CourseAssignment.subject_id_fk == Subject.subject_id,
          CourseAssignment.division_id_fk == Division.division_id,
          CourseAssignment.is_active == True
      ))\
      .outerjoin(Faculty, Faculty.user_id_fk == CourseAssignment.faculty_id_fk)\
-     .filter(Attendance.date_marked >= start_week)\
-     .filter(Attendance.date_marked <= end_week)\
-     .filter(Institute.trust_id_fk == effective_trust_id)
+     .filter(R.date_marked >= start_week)\
+     .filter(R.date_marked <= end_week)\
+     .filter(R.division_id_fk.in_(scope.division_ids))
      
     if role == "principal" and user_pid:
         q_week_agg = q_week_agg.filter(Division.program_id_fk == user_pid)
 
     q_week_agg = q_week_agg.group_by(
         Faculty.full_name,
-        Attendance.date_marked,
-        Attendance.period_no,
-        Attendance.division_id_fk,
-        Attendance.subject_id_fk
+        R.date_marked,
+        R.period_no,
+        R.division_id_fk,
+        R.subject_id_fk
     )
     
     week_lectures = db.session.execute(q_week_agg).all()
@@ -18767,11 +17931,18 @@ def module_analytics():
                            lecture_stats={"total_today": len(daily_logs)})
 
 
+@job_handler("send_email", max_attempts=3)
+def _send_email_job(ctx, to_address, subject, body, html_body=None):
+    # Kept for jobs queued before the email outbox existed; delivery now happens there.
+    if not send_email(subject, to_address, body, html_body, trust_id=ctx.trust_id):
+        return {"message": f"Email to {to_address} was not queued (mail not configured or no address).", "sent": False}
+    return {"message": f"Email to {to_address} queued for delivery.", "sent": True}
+
+
 @main_bp.route("/analytics/notify", methods=["POST"])
 @login_required
 @role_required("admin", "principal")
 def analytics_notify():
-    from ..email_utils import send_email
     from ..models import Faculty
     
     fid = request.form.get("faculty_id")
@@ -18780,15 +17951,7 @@ def analytics_notify():
     faculty = db.session.get(Faculty, fid)
     if not faculty:
         abort(404)
-    effective_trust_id = None
-    if getattr(current_user, "is_authenticated", False):
-        if getattr(current_user, "is_super_admin", False):
-            try:
-                effective_trust_id = int(session.get("active_trust_id") or 0) or None
-            except Exception:
-                effective_trust_id = None
-        else:
-            effective_trust_id = getattr(current_user, "trust_id_fk", None)
+    effective_trust_id = current_scope().trust_id
     if effective_trust_id and getattr(faculty, "trust_id_fk", None) and int(getattr(faculty, "trust_id_fk", 0) or 0) != int(effective_trust_id):
         abort(403)
     if (getattr(current_user, "role", "") or "").strip().lower() == "principal":
@@ -18815,7 +17978,7 @@ If you are facing any issues, please contact the Principal's office.
 
 Regards,
 Principal's Office"""
-        flash(f"Warning sent to {faculty.full_name}.", "warning")
+        sent_msg, sent_cat = f"Warning queued for {faculty.full_name}.", "warning"
         
     elif notif_type == "appreciation":
         subject = "Appreciation: Excellent Academic Performance"
@@ -18826,14 +17989,16 @@ Thank you for your dedication and hard work. Keep it up!
 
 Regards,
 Principal's Office"""
-        flash(f"Appreciation sent to {faculty.full_name}!", "success")
-    
-    # Fire and forget email
-    try:
-        send_email(faculty.email, subject, body)
-    except Exception as e:
-        flash(f"Email failed: {str(e)}", "danger")
-        
+        sent_msg, sent_cat = f"Appreciation queued for {faculty.full_name}!", "success"
+    else:
+        flash("Unknown notification type.", "danger")
+        return redirect(url_for("main.module_analytics"))
+
+    if not send_email(subject, faculty.email, body, category=f"analytics_{notif_type}", user=current_user, trust_id=effective_trust_id):
+        flash(f"Could not send the notification to {faculty.full_name}: email is not configured.", "danger")
+        return redirect(url_for("main.module_analytics"))
+    db.session.commit()
+    flash(sent_msg, sent_cat)
     return redirect(url_for("main.module_analytics"))
 
 
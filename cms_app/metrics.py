@@ -0,0 +1,490 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask_caching.backends.base import BaseCache
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import Engine
+
+from . import cache, db
+
+
+# Prometheus-style metrics for /metrics and the system status page.
+#
+# Counters and histograms live in a small registry in every process. With
+# METRICS_DIR set (CMS_METRICS_DIR, or the usual PROMETHEUS_MULTIPROC_DIR)
+# each gunicorn worker and the job worker also writes its registry to
+# ``<dir>/cms_<pid>_<token>.json`` at most every METRICS_FLUSH_SECONDS and
+# on exit; a scrape sums its own registry with every other file in the
+# directory, so whichever worker answers reports the whole server. Files of
+# exited workers are kept (counters must not go backwards) until the
+# directory is emptied when gunicorn starts (see gunicorn.conf.py). Without
+# METRICS_DIR only the answering process is reported.
+#
+# Recorded here:
+#
+#   cms_http_request_duration_seconds   histogram per endpoint/method/status class
+#   cms_db_queries_total / cms_db_query_seconds_total   per endpoint
+#   cms_cache_requests_total            Flask-Caching get()s by key prefix, hit/miss
+#   cms_result_cache_total              cached_result outcomes per result name,
+#                                       including requests that bypassed the cache
+#   cms_rate_limited_total              429 responses per endpoint
+#   cms_sqlite_lock_waits_total / _seconds_total   SQLite writes that blocked
+#                                       longer than METRICS_LOCK_WAIT_MS (the busy
+#                                       handler waits inside the first write of a
+#                                       transaction), and "database is locked" errors
+#
+# Queue depths (background jobs, email outbox) are gauges read from the
+# database at scrape time.
+
+log = logging.getLogger(__name__)
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_METRICS = {
+    "cms_http_request_duration_seconds": ("histogram", "Request latency by endpoint."),
+    "cms_db_queries_total": ("counter", "SQL statements run by requests, by endpoint."),
+    "cms_db_query_seconds_total": ("counter", "Time requests spent in SQL, by endpoint."),
+    "cms_cache_requests_total": ("counter", "Shared cache lookups by key prefix and result."),
+    "cms_result_cache_total": ("counter", "Cached report and dashboard outcomes by result name."),
+    "cms_rate_limited_total": ("counter", "Requests rejected by the rate limiter, by endpoint."),
+    "cms_sqlite_lock_waits_total": ("counter", "SQLite writes that waited for the database lock."),
+    "cms_sqlite_lock_wait_seconds_total": ("counter", "Time SQLite writes spent waiting for the database lock."),
+    "cms_sqlite_locked_errors_total": ("counter", "Statements that failed with 'database is locked'."),
+}
+
+_GAUGES = {
+    "cms_jobs": "Background jobs by status.",
+    "cms_jobs_oldest_queued_seconds": "Age of the oldest queued background job.",
+    "cms_email_outbox": "Queued and in-flight outbound emails by status.",
+}
+
+_settings = {"dir": None, "flush_seconds": 5.0, "lock_wait_ms": 50.0}
+_WRITE_PREFIXES = ("insert", "update", "delete", "replace")
+
+
+class Registry:
+    """Counters and histograms of one process, keyed by ``(name, labels)``."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.token = uuid.uuid4().hex[:8]
+        self.values = {}
+        self.flushed_at = 0.0
+
+    def inc(self, name, labels, value=1.0):
+        with self.lock:
+            self.values[(name, labels)] = self.values.get((name, labels), 0.0) + value
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            data = self.values.get((name, labels))
+            if data is None:
+                data = self.values[(name, labels)] = [0] * (len(_LATENCY_BUCKETS) + 1) + [0.0, 0]
+            for i, bound in enumerate(_LATENCY_BUCKETS):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            else:
+                data[len(_LATENCY_BUCKETS)] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return [[name, list(labels), (list(data) if isinstance(data, list) else data)] for (name, labels), data in self.values.items()]
+
+
+_registry = Registry()
+_registry_lock = threading.Lock()
+
+
+def _current():
+    if _registry.pid != os.getpid():
+        with _registry_lock:
+            if _registry.pid != os.getpid():
+                # Forked worker: the parent's numbers are already counted in its own file
+                _registry.reset()
+    return _registry
+
+
+def init_app(app):
+    app.config.setdefault("METRICS_DIR", os.environ.get("CMS_METRICS_DIR") or os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+    app.config.setdefault("METRICS_FLUSH_SECONDS", float(os.environ.get("CMS_METRICS_FLUSH_SECONDS", "5")))
+    app.config.setdefault("METRICS_LOCK_WAIT_MS", float(os.environ.get("CMS_METRICS_LOCK_WAIT_MS", "50")))
+    app.config.setdefault("METRICS_TOKEN", os.environ.get("CMS_METRICS_TOKEN"))
+    _settings.update(
+        dir=app.config["METRICS_DIR"] or None,
+        flush_seconds=float(app.config["METRICS_FLUSH_SECONDS"]),
+        lock_wait_ms=float(app.config["METRICS_LOCK_WAIT_MS"]),
+    )
+    if _settings["dir"]:
+        os.makedirs(_settings["dir"], exist_ok=True)
+    try:
+        _instrument_cache(app.extensions["cache"][cache])
+    except Exception:
+        log.warning("Cache metrics unavailable", exc_info=True)
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v if v is not None else "")) for k, v in labels.items()))
+
+
+def inc(metric, value=1.0, **labels):
+    _current().inc(metric, _labels(labels), float(value))
+    _maybe_flush()
+
+
+def observe_request(endpoint, method, status, total_ms, db_queries, db_ms):
+    """Called once per request from ``_request_perf_log``."""
+    endpoint = endpoint or "unmatched"
+    status_class = f"{int(status) // 100}xx" if status else ""
+    registry = _current()
+    registry.observe("cms_http_request_duration_seconds", _labels({"endpoint": endpoint, "method": method, "status": status_class}), total_ms / 1000.0)
+    registry.inc("cms_db_queries_total", _labels({"endpoint": endpoint}), float(db_queries))
+    registry.inc("cms_db_query_seconds_total", _labels({"endpoint": endpoint}), db_ms / 1000.0)
+    if status == 429:
+        registry.inc("cms_rate_limited_total", _labels({"endpoint": endpoint}), 1.0)
+    _maybe_flush()
+
+
+# -- multiprocess files ------------------------------------------------------
+
+def _path(registry):
+    return os.path.join(_settings["dir"], f"cms_{registry.pid}_{registry.token}.json")
+
+
+def flush():
+    directory = _settings["dir"]
+    if not directory:
+        return
+    registry = _current()
+    path = _path(registry)
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump({"pid": registry.pid, "series": registry.snapshot()}, fh)
+        os.replace(tmp, path)
+        registry.flushed_at = time.monotonic()
+    except Exception:
+        log.warning("Failed to write metrics to %s", directory, exc_info=True)
+
+
+def _maybe_flush():
+    if _settings["dir"] and time.monotonic() - _registry.flushed_at >= _settings["flush_seconds"]:
+        flush()
+
+
+atexit.register(flush)
+
+
+def _merge(into, series):
+    for name, labels, data in series:
+        key = (name, tuple(tuple(pair) for pair in labels))
+        if isinstance(data, list):
+            current = into.get(key)
+            into[key] = list(data) if current is None else [a + b for a, b in zip(current, data)]
+        else:
+            into[key] = into.get(key, 0.0) + data
+
+
+def collect():
+    """``{(name, labels): value}`` summed over this process and every other process's file."""
+    registry = _current()
+    merged = {}
+    _merge(merged, registry.snapshot())
+    directory = _settings["dir"]
+    if directory:
+        own = _path(registry)
+        for path in glob.glob(os.path.join(directory, "cms_*.json")):
+            if path == own:
+                continue
+            try:
+                with open(path, encoding="utf-8") as fh:
+                    _merge(merged, json.load(fh).get("series") or [])
+            except Exception:
+                continue
+    return merged
+
+
+# -- picking up cache lookups and SQLite lock waits --------------------------
+
+_PREFIX_SPLIT = re.compile(r"[:/]")
+
+
+def key_prefix(key):
+    """Low-cardinality family of a cache key: ``rc:dashboard``, ``lc:trust_access``, ``inbox_unread``."""
+    key = str(key or "")
+    parts = _PREFIX_SPLIT.split(key)
+    if len(parts) > 1:
+        return f"{parts[0]}:{parts[1]}" if parts[0] in ("rc", "lc") else parts[0]
+    words = key.split("_")
+    for i, word in enumerate(words):
+        if i and any(ch.isdigit() for ch in word):
+            return "_".join(words[:i])
+    return key
+
+
+def _count_lookup(key, hit):
+    try:
+        inc("cms_cache_requests_total", prefix=key_prefix(key), result=("hit" if hit else "miss"))
+    except Exception:
+        pass
+
+
+def _instrument_cache(backend):
+    if getattr(backend, "_cms_metrics", False):
+        return
+    get = backend.get
+
+    def counted_get(key):
+        value = get(key)
+        _count_lookup(key, value is not None)
+        return value
+
+    backend.get = counted_get
+    # The default get_many() calls get() per key and is counted there
+    if type(backend).get_many is not BaseCache.get_many:
+        get_many = backend.get_many
+
+        def counted_get_many(*keys):
+            values = get_many(*keys)
+            for key, value in zip(keys, values):
+                _count_lookup(key, value is not None)
+            return values
+
+        backend.get_many = counted_get_many
+    backend._cms_metrics = True
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _write_started(conn, cursor, statement, parameters, context, executemany):
+    if conn.dialect.name == "sqlite" and statement[:32].lstrip()[:7].lower().startswith(_WRITE_PREFIXES):
+        conn.info["_metrics_write_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _write_finished(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("_metrics_write_start", None)
+    if start is None:
+        return
+    elapsed_ms = (time.perf_counter() - start) * 1000.0
+    if elapsed_ms >= _settings["lock_wait_ms"]:
+        inc("cms_sqlite_lock_waits_total")
+        inc("cms_sqlite_lock_wait_seconds_total", elapsed_ms / 1000.0)
+
+
+@event.listens_for(Engine, "handle_error")
+def _statement_failed(context):
+    try:
+        context.connection.info.pop("_metrics_write_start", None)
+    except Exception:
+        pass
+    if "database is locked" in str(context.original_exception):
+        inc("cms_sqlite_locked_errors_total")
+
+
+# -- scrape-time gauges ------------------------------------------------------
+
+def _gauges():
+    from .email_utils import STATUS_QUEUED as EMAIL_QUEUED, STATUS_SENDING
+    from .jobs.services import STATUS_QUEUED, STATUS_RUNNING
+    from .models import BackgroundJob, EmailOutbox
+
+    out = {}
+    try:
+        jobs = dict(
+            db.session.execute(
+                select(BackgroundJob.status, func.count())
+                .where(BackgroundJob.status.in_((STATUS_QUEUED, STATUS_RUNNING)))
+                .group_by(BackgroundJob.status)
+            ).all()
+        )
+        for status in (STATUS_QUEUED, STATUS_RUNNING):
+            out[("cms_jobs", (("status", status),))] = float(jobs.get(status, 0))
+        oldest = db.session.scalar(select(func.min(BackgroundJob.created_at)).where(BackgroundJob.status == STATUS_QUEUED))
+        age = 0.0
+        if oldest is not None:
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            age = max(0.0, (now - oldest.replace(tzinfo=None)).total_seconds())
+        out[("cms_jobs_oldest_queued_seconds", ())] = age
+        emails = dict(
+            db.session.execute(
+                select(EmailOutbox.status, func.count())
+                .where(EmailOutbox.status.in_((EMAIL_QUEUED, STATUS_SENDING)))
+                .group_by(EmailOutbox.status)
+            ).all()
+        )
+        for status in (EMAIL_QUEUED, STATUS_SENDING):
+            out[("cms_email_outbox", (("status", status),))] = float(emails.get(status, 0))
+    except Exception:
+        db.session.rollback()
+        log.warning("Failed to read queue depths for metrics", exc_info=True)
+    return out
+
+
+# -- output ------------------------------------------------------------------
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def render():
+    """Everything in the Prometheus text exposition format."""
+    merged = collect()
+    by_name = {}
+    for (name, labels), data in merged.items():
+        by_name.setdefault(name, []).append((labels, data))
+    lines = []
+    for name, (kind, help_text) in _METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, data in sorted(by_name.get(name, ())):
+            if kind == "histogram":
+                cumulative = 0
+                for bound, count in zip(_LATENCY_BUCKETS + (float("inf"),), data[:-2]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_value(data[-2])}")
+                lines.append(f"{name}_count{_fmt_labels(labels)} {_fmt_value(data[-1])}")
+            else:
+                lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(data)}")
+    gauges = _gauges()
+    for name, help_text in _GAUGES.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for (gauge, labels), value in sorted(gauges.items()):
+            if gauge == name:
+                lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _quantile(counts, q):
+    """Estimate from histogram bucket counts, interpolating inside the bucket like histogram_quantile()."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for bound, count in zip(_LATENCY_BUCKETS + (float("inf"),), counts):
+        if count and cumulative + count >= rank:
+            if bound == float("inf"):
+                return _LATENCY_BUCKETS[-1]
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return _LATENCY_BUCKETS[-1]
+
+
+def summary(limit=10):
+    """The registry boiled down for the system status page (all processes when METRICS_DIR is set)."""
+    merged = collect()
+    endpoints = {}
+    caches = {}
+    results = {}
+    totals = {"requests": 0, "rate_limited": 0.0, "lock_waits": 0.0, "lock_wait_s": 0.0, "locked_errors": 0.0}
+
+    def endpoint(label):
+        return endpoints.setdefault(
+            label.get("endpoint", ""),
+            {"counts": [0] * (len(_LATENCY_BUCKETS) + 1), "sum": 0.0, "requests": 0, "queries": 0.0, "db_s": 0.0},
+        )
+
+    for (name, labels), data in merged.items():
+        label = dict(labels)
+        if name == "cms_http_request_duration_seconds":
+            e = endpoint(label)
+            e["counts"] = [a + b for a, b in zip(e["counts"], data[:-2])]
+            e["sum"] += data[-2]
+            e["requests"] += data[-1]
+            totals["requests"] += data[-1]
+        elif name in ("cms_db_queries_total", "cms_db_query_seconds_total"):
+            endpoint(label)["queries" if name == "cms_db_queries_total" else "db_s"] += data
+        elif name == "cms_cache_requests_total":
+            caches.setdefault(label.get("prefix", ""), {"hit": 0.0, "miss": 0.0})[label.get("result", "miss")] += data
+        elif name == "cms_result_cache_total":
+            r = results.setdefault(label.get("name", ""), {})
+            r[label.get("result", "")] = r.get(label.get("result", ""), 0.0) + data
+        elif name == "cms_rate_limited_total":
+            totals["rate_limited"] += data
+        elif name == "cms_sqlite_lock_waits_total":
+            totals["lock_waits"] += data
+        elif name == "cms_sqlite_lock_wait_seconds_total":
+            totals["lock_wait_s"] += data
+        elif name == "cms_sqlite_locked_errors_total":
+            totals["locked_errors"] += data
+
+    rows = []
+    for name, e in endpoints.items():
+        if not e["requests"]:
+            continue
+        p50, p95 = _quantile(e["counts"], 0.5), _quantile(e["counts"], 0.95)
+        rows.append({
+            "endpoint": name,
+            "requests": int(e["requests"]),
+            "avg_ms": round(1000.0 * e["sum"] / e["requests"], 1),
+            "p50_ms": round(1000.0 * p50, 1) if p50 is not None else None,
+            "p95_ms": round(1000.0 * p95, 1) if p95 is not None else None,
+            "queries": round(e["queries"] / e["requests"], 1),
+            "db_ms": round(1000.0 * e["db_s"] / e["requests"], 1),
+            "total_s": e["sum"],
+        })
+    rows.sort(key=lambda r: r["total_s"], reverse=True)
+
+    cache_rows = []
+    for prefix, c in caches.items():
+        lookups = c["hit"] + c["miss"]
+        cache_rows.append({"prefix": prefix, "hits": int(c["hit"]), "misses": int(c["miss"]), "hit_ratio": round(100.0 * c["hit"] / lookups, 1) if lookups else None})
+    cache_rows.sort(key=lambda r: r["hits"] + r["misses"], reverse=True)
+
+    result_rows = []
+    for name, r in results.items():
+        served = r.get("hits", 0) + r.get("misses", 0) + r.get("stale", 0) + r.get("bypassed", 0)
+        result_rows.append({
+            "name": name,
+            "hits": int(r.get("hits", 0)),
+            "misses": int(r.get("misses", 0) + r.get("stale", 0)),
+            "bypassed": int(r.get("bypassed", 0)),
+            "hit_ratio": round(100.0 * r.get("hits", 0) / served, 1) if served else None,
+        })
+    result_rows.sort(key=lambda r: r["hits"] + r["misses"] + r["bypassed"], reverse=True)
+
+    return {
+        "multiprocess": bool(_settings["dir"]),
+        "requests": int(totals["requests"]),
+        "rate_limited": int(totals["rate_limited"]),
+        "lock_waits": int(totals["lock_waits"]),
+        "lock_wait_ms": round(1000.0 * totals["lock_wait_s"], 1),
+        "locked_errors": int(totals["locked_errors"]),
+        "endpoints": rows[:limit],
+        "caches": cache_rows[:limit],
+        "results": result_rows[:limit],
+        "queues": {
+            (name + "".join(f"_{v}" for _, v in labels)): value for (name, labels), value in _gauges().items()
+        },
+    }
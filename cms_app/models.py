@@ -197,6 +197,10 @@ class Student(db.Model):
 
     is_active = db.Column(db.Boolean, default=True)
 
+    __table_args__ = (
+        # Student list filters, in equality order; covers its COUNT and the enrollment-ordered seek
+        db.Index("ix_students_list_scope", "trust_id_fk", "program_id_fk", "current_semester", "is_active", "medium_tag", "division_id_fk", "enrollment_no"),
+    )
 
     @property
     def full_name(self):
@@ -287,6 +291,53 @@ class Attendance(db.Model):
     semester = db.Column(db.Integer)
     period_no = db.Column(db.Integer)
 
+    __table_args__ = (
+        db.Index("ix_attendance_subject_date_period_student", "subject_id_fk", "date_marked", "period_no", "student_id_fk"),
+        db.Index("ix_attendance_date_division", "date_marked", "division_id_fk"),
+        db.Index("ix_attendance_student_date", "student_id_fk", "date_marked"),
+    )
+
+
+class AttendanceSessionRollup(db.Model):
+    """One row per lecture session (date, subject, division, period) with P/A/L counts."""
+    __tablename__ = "attendance_session_rollups"
+    session_id = db.Column(db.Integer, primary_key=True)
+    date_marked = db.Column(db.Date, nullable=False)
+    subject_id_fk = db.Column(db.Integer, db.ForeignKey("subjects.subject_id"), nullable=False)
+    division_id_fk = db.Column(db.Integer, db.ForeignKey("divisions.division_id"))
+    period_no = db.Column(db.Integer)
+    semester = db.Column(db.Integer)
+    present_count = db.Column(db.Integer, default=0)
+    absent_count = db.Column(db.Integer, default=0)
+    late_count = db.Column(db.Integer, default=0)
+    total_count = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=utc_now, onupdate=utc_now)
+
+    __table_args__ = (
+        db.Index("ix_att_session_rollup_date_subject", "date_marked", "subject_id_fk"),
+        db.Index("ix_att_session_rollup_subject_division_date", "subject_id_fk", "division_id_fk", "date_marked"),
+    )
+
+
+class AttendanceStudentRollup(db.Model):
+    """Per (student, subject, academic year) attendance counters."""
+    __tablename__ = "attendance_student_rollups"
+    rollup_id = db.Column(db.Integer, primary_key=True)
+    student_id_fk = db.Column(db.String(32), db.ForeignKey("students.enrollment_no"), nullable=False)
+    subject_id_fk = db.Column(db.Integer, db.ForeignKey("subjects.subject_id"), nullable=False)
+    academic_year = db.Column(db.String(16), nullable=False)
+    present_count = db.Column(db.Integer, default=0)
+    absent_count = db.Column(db.Integer, default=0)
+    late_count = db.Column(db.Integer, default=0)
+    total_count = db.Column(db.Integer, default=0)
+    last_marked = db.Column(db.Date)
+    updated_at = db.Column(db.DateTime, default=utc_now, onupdate=utc_now)
+
+    __table_args__ = (
+        db.UniqueConstraint("student_id_fk", "subject_id_fk", "academic_year", name="uq_att_student_rollup"),
+        db.Index("ix_att_student_rollup_subject_year", "subject_id_fk", "academic_year"),
+    )
+
 
 class StudentSubjectEnrollment(db.Model):
     __tablename__ = "student_subject_enrollments"
@@ -301,6 +352,11 @@ class StudentSubjectEnrollment(db.Model):
     created_at = db.Column(db.DateTime, default=utc_now)
     updated_at = db.Column(db.DateTime, onupdate=utc_now)
 
+    __table_args__ = (
+        db.Index("ix_sse_student_active", "student_id_fk", "is_active"),
+        db.Index("ix_sse_subject_year_active", "subject_id_fk", "academic_year", "is_active"),
+    )
+
 
 # ==========================================
 # EXAMS & RESULTS
@@ -381,6 +437,7 @@ class ExamMark(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint("student_id_fk", "subject_id_fk", "semester", "academic_year", "attempt_no", name="uq_exam_mark_attempt"),
+        db.Index("ix_exam_marks_scheme_subject", "scheme_id_fk", "subject_id_fk"),
     )
 
 
@@ -462,6 +519,11 @@ class FeePayment(db.Model):
     payer_name = db.Column(db.String(128))
     receipt_no = db.Column(db.String(32))
 
+    __table_args__ = (
+        db.Index("ix_fee_payments_program_semester_status", "program_id_fk", "semester", "status"),
+        db.Index("ix_fee_payments_enrollment_status", "enrollment_no", "status"),
+    )
+
 
 class FeesRecord(db.Model):
     __tablename__ = "fees_records"
@@ -474,6 +536,32 @@ class FeesRecord(db.Model):
     created_at = db.Column(db.DateTime, default=utc_now)
 
 
+class StudentFeeBalance(db.Model):
+    """Per (student, program, semester, payment medium) totals of ``fee_payments``.
+
+    Maintained by ``cms_app.fee_balances``; ``medium_tag`` is ``""`` for payments
+    without a medium.
+    """
+    __tablename__ = "student_fee_balance"
+    balance_id = db.Column(db.Integer, primary_key=True)
+    enrollment_no = db.Column(db.String(32), db.ForeignKey("students.enrollment_no"), nullable=False)
+    program_id_fk = db.Column(db.Integer, db.ForeignKey("programs.program_id"), nullable=False)
+    semester = db.Column(db.Integer, nullable=False)
+    medium_tag = db.Column(db.String(32), nullable=False, default="")
+    verified_total = db.Column(db.Float, default=0.0)
+    submitted_total = db.Column(db.Float, default=0.0)
+    verified_count = db.Column(db.Integer, default=0)
+    submitted_count = db.Column(db.Integer, default=0)
+    rejected_count = db.Column(db.Integer, default=0)
+    last_payment_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=utc_now, onupdate=utc_now)
+
+    __table_args__ = (
+        db.UniqueConstraint("enrollment_no", "program_id_fk", "semester", "medium_tag", name="uq_student_fee_balance"),
+        db.Index("ix_student_fee_balance_scope", "program_id_fk", "semester", "medium_tag"),
+    )
+
+
 # ==========================================
 # TIMETABLE
 # ==========================================
@@ -544,6 +632,7 @@ class Announcement(db.Model):
     actor_user_id_fk = db.Column(db.Integer, db.ForeignKey("users.user_id"))
 
     audiences = db.relationship("AnnouncementAudience", backref="announcement", lazy=True)
+    recipients = db.relationship("AnnouncementRecipient", lazy=True)
 
 
 class AnnouncementAudience(db.Model):
@@ -560,6 +649,10 @@ class AnnouncementRecipient(db.Model):
     student_id_fk = db.Column(db.String(32), db.ForeignKey("students.enrollment_no"), nullable=False)
     created_at = db.Column(db.DateTime, default=utc_now)
 
+    __table_args__ = (
+        db.Index("ix_announcement_recipients_student", "student_id_fk", "announcement_id_fk"),
+    )
+
 
 class AnnouncementDismissal(db.Model):
     __tablename__ = "announcement_dismissals"
@@ -568,6 +661,25 @@ class AnnouncementDismissal(db.Model):
     user_id_fk = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False)
     dismissed_at = db.Column(db.DateTime, default=utc_now)
 
+    __table_args__ = (
+        db.Index("ix_announcement_dismissals_user", "user_id_fk", "announcement_id_fk"),
+    )
+
+
+class AnnouncementInbox(db.Model):
+    """One row per (announcement, user) the announcement is addressed to, with read state."""
+    __tablename__ = "announcement_inbox"
+    inbox_id = db.Column(db.Integer, primary_key=True)
+    announcement_id_fk = db.Column(db.Integer, db.ForeignKey("announcements.announcement_id"), nullable=False)
+    user_id_fk = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False)
+    is_read = db.Column(db.Boolean, nullable=False, default=False)
+    read_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.UniqueConstraint("user_id_fk", "announcement_id_fk", name="uq_announcement_inbox"),
+        db.Index("ix_announcement_inbox_unread", "user_id_fk", "is_read"),
+    )
+
 
 class PasswordChangeLog(db.Model):
     __tablename__ = "password_change_log"
@@ -608,6 +720,28 @@ class SubjectMaterialLog(db.Model):
     at = db.Column(db.DateTime, default=utc_now)
 
 
+class Attachment(db.Model):
+    """Manifest row for an uploaded file; the bytes live once per sha256 under static/cas."""
+    __tablename__ = "attachments"
+    attachment_id = db.Column(db.Integer, primary_key=True)
+    owner_type = db.Column(db.String(16), nullable=False)  # announcement | material
+    owner_id = db.Column(db.Integer, nullable=False)
+    subject_id_fk = db.Column(db.Integer, db.ForeignKey("subjects.subject_id"))  # materials: quota scope
+    file_name = db.Column(db.String(255), nullable=False)
+    size_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    sha256 = db.Column(db.String(64), nullable=False)
+    mime_type = db.Column(db.String(127))
+    storage_path = db.Column(db.String(255), nullable=False)  # relative to the static folder
+    uploaded_by_user_id_fk = db.Column(db.Integer, db.ForeignKey("users.user_id"))
+    created_at = db.Column(db.DateTime, default=utc_now)
+
+    __table_args__ = (
+        db.Index("ix_attachments_owner", "owner_type", "owner_id"),
+        db.Index("ix_attachments_subject_size", "subject_id_fk", "size_bytes"),
+        db.Index("ix_attachments_storage_path", "storage_path"),
+    )
+
+
 class ImportLog(db.Model):
     __tablename__ = "import_logs"
     log_id = db.Column(db.Integer, primary_key=True)
@@ -650,6 +784,61 @@ class DataAuditLog(db.Model):
     counts_json = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=utc_now)
 
+class BackgroundJob(db.Model):
+    __tablename__ = "background_jobs"
+    job_id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    label = db.Column(db.String(255))
+    status = db.Column(db.String(16), nullable=False, default="queued")  # queued | running | succeeded | failed | cancelled
+    payload_json = db.Column(db.Text)
+    result_json = db.Column(db.Text)
+    error = db.Column(db.Text)
+    progress = db.Column(db.Integer, default=0)
+    progress_message = db.Column(db.String(255))
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=3)
+    cancel_requested = db.Column(db.Boolean, default=False)
+    artifact_path = db.Column(db.String(255))
+    artifact_downloaded_at = db.Column(db.DateTime)
+    return_url = db.Column(db.String(255))
+    created_by_user_id_fk = db.Column(db.Integer, db.ForeignKey("users.user_id"))
+    trust_id_fk = db.Column(db.Integer, db.ForeignKey("trusts.trust_id"))
+    run_after = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(64))
+    heartbeat_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=utc_now)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_background_jobs_status_run_after", "status", "run_after"),
+        db.Index("ix_background_jobs_user_created", "created_by_user_id_fk", "created_at"),
+    )
+
+class EmailOutbox(db.Model):
+    __tablename__ = "email_outbox"
+    email_id = db.Column(db.Integer, primary_key=True)
+    to_address = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    text_body = db.Column(db.Text)
+    html_body = db.Column(db.Text)
+    category = db.Column(db.String(32))
+    status = db.Column(db.String(16), nullable=False, default="queued")  # queued | sending | sent | failed
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=5)
+    last_error = db.Column(db.Text)
+    next_attempt_at = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(64))
+    locked_at = db.Column(db.DateTime)
+    created_by_user_id_fk = db.Column(db.Integer, db.ForeignKey("users.user_id"))
+    trust_id_fk = db.Column(db.Integer, db.ForeignKey("trusts.trust_id"))
+    created_at = db.Column(db.DateTime, default=utc_now)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_email_outbox_status_next", "status", "next_attempt_at"),
+    )
+
 class StudentPurgeRequest(db.Model):
     __tablename__ = "student_purge_requests"
     request_id = db.Column(db.Integer, primary_key=True)
@@ -705,6 +894,7 @@ class SystemMessageRead(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint("message_id_fk", "user_id_fk", name="uq_system_message_read"),
+        db.Index("ix_system_message_reads_user", "user_id_fk", "message_id_fk"),
     )
 
 
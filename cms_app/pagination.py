@@ -0,0 +1,111 @@
+import base64
+import hashlib
+import json
+
+from sqlalchemy import and_, func, or_, select
+
+from . import cache, db
+
+
+# Keyset ("seek") pagination: instead of OFFSET n, which makes the database walk
+# and discard every earlier row, a page starts strictly after (or before) the
+# sort-key values of the last (or first) row already shown. Cursors carry those
+# values as an opaque URL-safe token.
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(",", ":"), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token, size):
+    """Sort-key values from ``token``; ``None`` when it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw.decode("utf-8"))
+    except Exception:
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    if not all(v is None or isinstance(v, (int, float, str)) for v in values):
+        return None
+    return values
+
+
+def _seek_condition(keys, values, backwards):
+    # (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ... with per-key direction, so mixed
+    # ASC/DESC orders work without row-value comparison support.
+    clauses = []
+    for i, (expr, descending) in enumerate(keys):
+        prefix = [k == v for (k, _d), v in zip(keys[:i], values[:i])]
+        step = expr < values[i] if descending != backwards else expr > values[i]
+        clauses.append(and_(*prefix, step))
+    return or_(*clauses)
+
+
+def keyset_page(query, keys, limit, after=None, before=None, offset=0):
+    """One page of ``query`` ordered by ``keys`` (``[(expr, descending), ...]``).
+
+    The last key must make the order total (e.g. a primary key) and no key may
+    evaluate to NULL. ``after``/``before`` are cursors from a previous page;
+    without one, ``offset`` rows are skipped (for jumping straight to page N).
+    Returns ``(rows, next_cursor, prev_cursor)``; a cursor is ``None`` when there
+    is nothing further in that direction (``prev_cursor`` is also ``None`` on the
+    first page, which needs no cursor).
+    """
+    size = len(keys)
+    after_values = decode_cursor(after, size)
+    before_values = decode_cursor(before, size) if after_values is None else None
+    backwards = before_values is not None
+
+    q = query.add_columns(*[expr.label(f"_seek{i}") for i, (expr, _d) in enumerate(keys)])
+    if after_values is not None:
+        q = q.where(_seek_condition(keys, after_values, False))
+    elif backwards:
+        q = q.where(_seek_condition(keys, before_values, True))
+    q = q.order_by(None).order_by(*[(expr.desc() if descending != backwards else expr.asc()) for expr, descending in keys])
+    if after_values is None and not backwards and offset:
+        q = q.offset(offset)
+    rows = db.session.execute(q.limit(limit + 1)).all()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    def cursor(row):
+        return encode_cursor(getattr(row, f"_seek{i}") for i in range(size))
+
+    if not rows:
+        return rows, None, None
+    has_next = more if not backwards else True
+    has_prev = (after_values is not None) or (backwards and more) or (not backwards and offset > 0)
+    return rows, (cursor(rows[-1]) if has_next else None), (cursor(rows[0]) if has_prev else None)
+
+
+def cached_count(query, prefix="count", timeout=60):
+    """``COUNT(*)`` of ``query``, cached per distinct SQL + parameters.
+
+    List pages show an approximate total that may lag writes by up to
+    ``timeout`` seconds instead of recounting the whole filtered set on every
+    page load.
+    """
+    compiled = query.compile()
+    fingerprint = hashlib.sha1(
+        (str(compiled) + "|" + repr(sorted((k, repr(v)) for k, v in compiled.params.items()))).encode("utf-8")
+    ).hexdigest()
+    key = f"{prefix}:{fingerprint}"
+    try:
+        cached = cache.get(key)
+    except Exception:
+        cached = None
+    if cached is not None:
+        return cached
+    total = db.session.scalar(select(func.count()).select_from(query.order_by(None).subquery())) or 0
+    try:
+        cache.set(key, total, timeout=timeout)
+    except Exception:
+        pass
+    return total
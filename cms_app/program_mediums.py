@@ -0,0 +1,46 @@
+import csv
+import os
+
+from flask import current_app
+
+
+# Per-program medium policy from "DATA FOR IMPORT EXPORT/programs.csv"
+# (columns: program_name, mediums, medium_policy, default_medium). The file only
+# changes with a deploy, so it is read once at startup instead of per request.
+
+
+def load_program_mediums(path):
+    """``{program_name: {"mediums": [...], "policy": str, "default": str}}`` from ``path``.
+
+    Policy and default are lower-cased; a missing or unreadable file gives ``{}``.
+    """
+    result = {}
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                name = (row.get("program_name") or "").strip()
+                result[name] = {
+                    "mediums": [m.strip() for m in (row.get("mediums") or "").split("|") if m.strip()],
+                    "policy": (row.get("medium_policy") or "").strip().lower(),
+                    "default": (row.get("default_medium") or "").strip().lower(),
+                }
+    except Exception:
+        pass
+    return result
+
+
+def init_app(app):
+    path = app.config.get("PROGRAM_MEDIUMS_CSV") or os.path.join(os.path.dirname(app.root_path), "DATA FOR IMPORT EXPORT", "programs.csv")
+    app.extensions["program_mediums"] = load_program_mediums(path)
+
+
+def program_mediums():
+    try:
+        return current_app.extensions.get("program_mediums") or {}
+    except Exception:
+        return {}
+
+
+def default_medium_for(program_name):
+    """Lower-cased default medium for a program name ("" when not configured)."""
+    return (program_mediums().get(program_name or "") or {}).get("default") or ""
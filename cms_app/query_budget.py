@@ -0,0 +1,211 @@
+import functools
+import hashlib
+import os
+import re
+import threading
+import time
+import traceback
+from collections import deque
+
+from flask import current_app, g, request
+
+
+# N+1 detection on top of the per-request SQL counters in create_app.
+#
+# Every statement executed during a request is reduced to a fingerprint:
+# literals, bound parameters and expanded IN / VALUES lists become "?", so
+# the per-student ``SELECT ... FROM fee_payments WHERE student_id_fk = ?``
+# issued 300 times on one page is one shape seen 300 times. A shape repeated
+# more than QUERY_REPEAT_THRESHOLD times in a request is flagged: the call
+# site (the innermost cms_app frames, templates included) is captured the
+# moment it crosses the threshold, one ``repeated_query`` line is logged when
+# the request ends, and the shape is added to a bounded per-worker table of
+# offenders shown on /admin/query-hotspots.
+#
+# Views can also declare a budget::
+#
+#     @query_budget(queries=25, repeats=3)
+#
+# ``queries`` caps the statements of one request and ``repeats`` the count of
+# any single shape. QUERY_BUDGET_MODE decides what happens when a request goes
+# over: "log" (default) logs ``query_budget_exceeded``, "raise" raises
+# QueryBudgetExceeded (the test suite runs this way; staging can too), "off"
+# skips the check.
+
+_lock = threading.Lock()
+
+_LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"%\(\w+\)s|%s|\$\d+|(?<![:\w]):\w+"), "?"),
+    (re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*"), "(?)"),
+    (re.compile(r"\s+"), " "),
+]
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_SKIP_FRAMES = {os.path.abspath(__file__), os.path.join(_HERE, "__init__.py")}
+
+# Frames kept for a call site, innermost last
+_SITE_DEPTH = 6
+
+
+class QueryBudgetExceeded(Exception):
+    """A request issued more statements than its view's ``query_budget`` allows."""
+
+
+class QueryBudget:
+    def __init__(self, queries=None, repeats=None):
+        self.queries = queries
+        self.repeats = repeats
+
+    def violations(self, total, worst_repeats):
+        out = []
+        if self.queries is not None and total > self.queries:
+            out.append(f"{total} queries (budget {self.queries})")
+        if self.repeats is not None and worst_repeats > self.repeats:
+            out.append(f"one statement repeated {worst_repeats} times (budget {self.repeats})")
+        return out
+
+
+def query_budget(queries=None, repeats=None):
+    """Declare the most statements (and repeats of one statement) a view may run."""
+    budget = QueryBudget(queries=queries, repeats=repeats)
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            return view(*args, **kwargs)
+
+        wrapper.query_budget = budget
+        return wrapper
+
+    return decorator
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(statement):
+    """Normalised shape of ``statement``: literals and parameter lists replaced by ``?``."""
+    text = statement or ""
+    for pattern, repl in _LITERALS:
+        text = pattern.sub(repl, text)
+    return text.strip()
+
+
+def shape_id(shape):
+    return hashlib.sha1(shape.encode("utf-8")).hexdigest()[:12]
+
+
+def _call_site():
+    frames = []
+    for frame in traceback.extract_stack()[:-1]:
+        filename = os.path.abspath(frame.filename)
+        if not filename.startswith(_HERE) or filename in _SKIP_FRAMES:
+            continue
+        frames.append(f"{os.path.relpath(filename, os.path.dirname(_HERE))}:{frame.lineno} in {frame.name}")
+    return frames[-_SITE_DEPTH:]
+
+
+def record_statement(statement, executemany=False):
+    """Count ``statement`` against its shape for the current request."""
+    try:
+        shapes = g._query_shapes
+    except AttributeError:
+        shapes = g._query_shapes = {}
+    except Exception:
+        return
+    shape = fingerprint(statement)
+    count = shapes.get(shape, 0) + 1
+    shapes[shape] = count
+    if count == int(current_app.config.get("QUERY_REPEAT_THRESHOLD", 10)) + 1:
+        sites = getattr(g, "_query_sites", None)
+        if sites is None:
+            sites = g._query_sites = {}
+        sites[shape] = _call_site()
+
+
+def _hotspot_store(app):
+    store = app.extensions.get("query_hotspots")
+    if store is None:
+        with _lock:
+            store = app.extensions.get("query_hotspots")
+            if store is None:
+                store = {"shapes": {}, "violations": deque(maxlen=50)}
+                app.extensions["query_hotspots"] = store
+    return store
+
+
+def _remember(app, endpoint, path, shape, count, site):
+    store = _hotspot_store(app)
+    key = (endpoint, shape)
+    limit = max(1, int(app.config.get("QUERY_HOTSPOTS_MAX", 200)))
+    with _lock:
+        entry = store["shapes"].get(key)
+        if entry is None:
+            if len(store["shapes"]) >= limit:
+                del store["shapes"][min(store["shapes"], key=lambda k: store["shapes"][k]["total_repeats"])]
+            entry = store["shapes"][key] = {
+                "id": shape_id(shape),
+                "endpoint": endpoint,
+                "sql": shape,
+                "requests": 0,
+                "total_repeats": 0,
+                "max_repeats": 0,
+            }
+        entry["requests"] += 1
+        entry["total_repeats"] += count
+        entry["max_repeats"] = max(entry["max_repeats"], count)
+        entry["path"] = path
+        entry["site"] = site or entry.get("site") or []
+        entry["at"] = time.time()
+
+
+def finish_request(app, response):
+    """Flag repeated shapes and check the view's budget; called from ``after_request``."""
+    shapes = getattr(g, "_query_shapes", None) or {}
+    if not shapes:
+        return
+    endpoint = request.endpoint or ""
+    threshold = int(app.config.get("QUERY_REPEAT_THRESHOLD", 10))
+    sites = getattr(g, "_query_sites", None) or {}
+    worst = 0
+    for shape, count in shapes.items():
+        worst = max(worst, count)
+        if count <= threshold:
+            continue
+        site = sites.get(shape) or []
+        app.logger.warning(
+            "repeated_query endpoint=%s path=%s count=%s sql=%s site=%s",
+            endpoint,
+            request.path,
+            count,
+            shape[:300],
+            " <- ".join(reversed(site)),
+        )
+        _remember(app, endpoint, request.path, shape, count, site)
+
+    mode = (app.config.get("QUERY_BUDGET_MODE") or "log").lower()
+    view = app.view_functions.get(request.endpoint) if request.endpoint else None
+    budget = getattr(view, "query_budget", None)
+    if mode == "off" or budget is None:
+        return
+    problems = budget.violations(int(getattr(g, "_db_queries", 0) or 0), worst)
+    if not problems:
+        return
+    message = f"{endpoint}: " + "; ".join(problems)
+    with _lock:
+        _hotspot_store(app)["violations"].append(
+            {"at": time.time(), "endpoint": endpoint, "path": request.path, "message": message}
+        )
+    if mode == "raise":
+        raise QueryBudgetExceeded(message)
+    app.logger.warning("query_budget_exceeded %s path=%s", message, request.path)
+
+
+def hotspots(app, limit=25):
+    """Flagged shapes across requests, most repeats first, and recent budget violations."""
+    store = _hotspot_store(app)
+    with _lock:
+        shapes = [dict(entry) for entry in store["shapes"].values()]
+        violations = list(store["violations"])
+    shapes.sort(key=lambda e: (e["total_repeats"], e["max_repeats"]), reverse=True)
+    return shapes[:limit], list(reversed(violations))
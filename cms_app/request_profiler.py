@@ -0,0 +1,244 @@
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+
+from flask import request
+
+
+# Opt-in sampling profiler for finding where slow requests spend their time.
+#
+# A daemon thread wakes every PROFILER_INTERVAL_MS and, for each request being
+# profiled, reads the handling thread's current Python stack from
+# sys._current_frames(). Nothing is hooked into the interpreter, so a profiled
+# request runs at full speed; the cost is the sampler walking the stacks of
+# in-flight requests a couple of hundred times a second.
+#
+# PROFILER_MODE (CMS_PROFILER):
+#
+#   off      default; nothing is registered and no thread is started
+#   slow     every request is sampled; the samples are kept when the request
+#            took longer than CMS_SLOW_REQUEST_MS, otherwise thrown away
+#   sample   only a PROFILER_SAMPLE_RATE fraction of requests is sampled, and
+#            all of those are kept (cheap enough to leave on in production)
+#
+# Kept samples are folded into per-endpoint collapsed stacks
+# ("frame;frame;frame count", the input format of flamegraph.pl and
+# speedscope) and the last PROFILER_KEEP_REQUESTS requests are also kept on
+# their own. Frames carry the line being executed, so one long view shows up
+# split by the statement that was running. Memory is bounded:
+# PROFILER_MAX_ENDPOINTS endpoints (fewest samples evicted first) with at most
+# PROFILER_MAX_STACKS distinct stacks each (the rest are counted under
+# "[other]").
+
+_lock = threading.Lock()
+_active = {}
+_sampler = {"pid": None, "thread": None, "interval": 0.005}
+_ids = itertools.count(1)
+_file_labels = {}
+
+# Deepest stack kept per sample; deeper stacks keep their innermost frames
+_MAX_DEPTH = 128
+
+_ROOT_FRAME = "full_dispatch_request"
+_OTHER = "[other]"
+
+
+def init_app(app):
+    app.config.setdefault("PROFILER_MODE", (os.environ.get("CMS_PROFILER") or "off").strip().lower())
+    app.config.setdefault("PROFILER_INTERVAL_MS", float(os.environ.get("CMS_PROFILER_INTERVAL_MS", "5")))
+    app.config.setdefault("PROFILER_SAMPLE_RATE", float(os.environ.get("CMS_PROFILER_SAMPLE_RATE", "0.01")))
+    app.config.setdefault("PROFILER_MAX_ENDPOINTS", int(os.environ.get("CMS_PROFILER_MAX_ENDPOINTS", "50")))
+    app.config.setdefault("PROFILER_MAX_STACKS", int(os.environ.get("CMS_PROFILER_MAX_STACKS", "2000")))
+    app.config.setdefault("PROFILER_KEEP_REQUESTS", int(os.environ.get("CMS_PROFILER_KEEP_REQUESTS", "20")))
+
+    @app.teardown_request
+    def _profiler_teardown(exc):
+        # after_request does not run for unhandled errors
+        with _lock:
+            _active.pop(threading.get_ident(), None)
+
+
+def _label_file(filename):
+    short = _file_labels.get(filename)
+    if short is None:
+        short = filename
+        for marker in (os.sep + "site-packages" + os.sep, os.sep + "cms_app" + os.sep):
+            if marker in filename:
+                short = filename.split(marker, 1)[1]
+                if marker.endswith("cms_app" + os.sep):
+                    short = "cms_app/" + short
+                break
+        short = short.replace(os.sep, "/")
+        _file_labels[filename] = short
+    return short
+
+
+def collapse(frame):
+    """``frame`` and its callers as one collapsed-stack line, outermost first."""
+    labels = []
+    while frame is not None and len(labels) < _MAX_DEPTH:
+        code = frame.f_code
+        labels.append(f"{code.co_name} ({_label_file(code.co_filename)}:{frame.f_lineno})")
+        if code.co_name == _ROOT_FRAME:
+            break
+        frame = frame.f_back
+    labels.reverse()
+    # ";" separates frames in the collapsed format
+    return ";".join(label.replace(";", ",") for label in labels)
+
+
+def _take_sample():
+    if not _active:
+        return
+    frames = sys._current_frames()
+    # Under the lock so a request's samples stop changing once it is popped
+    with _lock:
+        for ident, samples in _active.items():
+            frame = frames.get(ident)
+            if frame is not None:
+                samples[collapse(frame)] += 1
+
+
+def _run(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            _take_sample()
+        except Exception:
+            pass
+
+
+def _ensure_sampler(app):
+    interval = max(0.001, float(app.config.get("PROFILER_INTERVAL_MS", 5)) / 1000.0)
+    if _sampler["pid"] == os.getpid() and _sampler["thread"] is not None and _sampler["thread"].is_alive():
+        return
+    with _lock:
+        if _sampler["pid"] == os.getpid() and _sampler["thread"] is not None and _sampler["thread"].is_alive():
+            return
+        # First profiled request, or a forked worker that did not inherit the thread
+        thread = threading.Thread(target=_run, args=(interval,), name="request-profiler", daemon=True)
+        _sampler.update(pid=os.getpid(), thread=thread, interval=interval)
+        thread.start()
+
+
+def start_request(app):
+    """Register the current request with the sampler if the mode asks for it."""
+    mode = app.config.get("PROFILER_MODE") or "off"
+    if mode == "off":
+        return
+    if mode == "sample" and random.random() >= float(app.config.get("PROFILER_SAMPLE_RATE", 0.01)):
+        return
+    _ensure_sampler(app)
+    with _lock:
+        _active[threading.get_ident()] = Counter()
+
+
+def _store(app):
+    store = app.extensions.get("request_profiles")
+    if store is None:
+        with _lock:
+            store = app.extensions.get("request_profiles")
+            if store is None:
+                store = {
+                    "endpoints": OrderedDict(),
+                    "requests": deque(maxlen=max(1, int(app.config.get("PROFILER_KEEP_REQUESTS", 20)))),
+                }
+                app.extensions["request_profiles"] = store
+    return store
+
+
+def finish_request(app, endpoint, total_ms, threshold_ms):
+    """Stop sampling the current request and keep its stacks when it qualifies."""
+    with _lock:
+        samples = _active.pop(threading.get_ident(), None)
+    if not samples:
+        return
+    mode = app.config.get("PROFILER_MODE") or "off"
+    if mode == "slow" and total_ms < float(threshold_ms):
+        return
+    record(app, endpoint or request.path, request.method, request.path, total_ms, samples)
+
+
+def record(app, endpoint, method, path, total_ms, samples):
+    store = _store(app)
+    max_stacks = max(1, int(app.config.get("PROFILER_MAX_STACKS", 2000)))
+    max_endpoints = max(1, int(app.config.get("PROFILER_MAX_ENDPOINTS", 50)))
+    with _lock:
+        entry = store["endpoints"].get(endpoint)
+        if entry is None:
+            while len(store["endpoints"]) >= max_endpoints:
+                fewest = min(store["endpoints"], key=lambda k: store["endpoints"][k]["samples"])
+                del store["endpoints"][fewest]
+            entry = store["endpoints"][endpoint] = {
+                "endpoint": endpoint,
+                "requests": 0,
+                "samples": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "stacks": Counter(),
+            }
+        stacks = entry["stacks"]
+        for stack, count in samples.items():
+            if stack in stacks or len(stacks) < max_stacks:
+                stacks[stack] += count
+            else:
+                stacks[_OTHER] += count
+        entry["requests"] += 1
+        entry["samples"] += sum(samples.values())
+        entry["total_ms"] += float(total_ms)
+        entry["max_ms"] = max(entry["max_ms"], float(total_ms))
+        store["requests"].append(
+            {
+                "id": next(_ids),
+                "at": time.time(),
+                "endpoint": endpoint,
+                "method": method,
+                "path": path,
+                "total_ms": round(float(total_ms), 1),
+                "samples": sum(samples.values()),
+                "stacks": Counter(dict(samples.most_common(max_stacks))),
+            }
+        )
+
+
+def folded(stacks):
+    """Collapsed-stack text for flamegraph.pl / speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+def endpoint_profile(app, endpoint):
+    with _lock:
+        entry = _store(app)["endpoints"].get(endpoint)
+        return Counter(entry["stacks"]) if entry else None
+
+
+def request_profile(app, request_id):
+    with _lock:
+        for item in _store(app)["requests"]:
+            if item["id"] == request_id:
+                return dict(item, stacks=Counter(item["stacks"]))
+    return None
+
+
+def summary(app):
+    """Endpoints (most samples first) and kept requests (newest first), without the stacks."""
+    store = _store(app)
+    with _lock:
+        endpoints = [
+            {
+                "endpoint": e["endpoint"],
+                "requests": e["requests"],
+                "samples": e["samples"],
+                "stacks": len(e["stacks"]),
+                "avg_ms": round(e["total_ms"] / e["requests"], 1) if e["requests"] else 0.0,
+                "max_ms": round(e["max_ms"], 1),
+            }
+            for e in store["endpoints"].values()
+        ]
+        requests = [{k: v for k, v in item.items() if k != "stacks"} for item in store["requests"]]
+    endpoints.sort(key=lambda e: e["samples"], reverse=True)
+    return endpoints, list(reversed(requests))
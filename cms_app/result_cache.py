@@ -0,0 +1,434 @@
+import functools
+import logging
+import threading
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+
+from flask import current_app, make_response, request, session
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from . import cache, db, metrics
+from .models import (
+    Attendance,
+    AttendanceSessionRollup,
+    AttendanceStudentRollup,
+    CourseAssignment,
+    Division,
+    ExamMark,
+    ExamScheme,
+    Faculty,
+    FeePayment,
+    FeesRecord,
+    FeeStructure,
+    Grade,
+    Institute,
+    Program,
+    Student,
+    StudentFeeBalance,
+    StudentSemesterResult,
+    StudentSubjectEnrollment,
+    Subject,
+    SubjectMaterial,
+)
+from .scope import current_scope
+
+
+# Report results cached by what they were computed from instead of by URL and
+# TTL. Each cached result carries tags naming the data it read, e.g.
+#
+#   attendance               every attendance result (global writes bump it)
+#   attendance:t3            trust-wide attendance results of trust 3
+#   attendance:p12           results for program 12 as a whole
+#   attendance:p12:s4        results for semester 4 of program 12
+#   attendance:p12:*         every semester-level result of program 12
+#
+# and every tag has a random version token in the cache. A result is stored
+# with the tokens its tags had when it was computed and is served only while
+# all of them still match. Writes are picked up from the session after each
+# flush (located to program and semester from the rows themselves) and the
+# matching tokens are replaced after the commit, so a report is recomputed
+# after the first write that can change it rather than when a TTL runs out.
+# Rolled back writes invalidate nothing.
+#
+# Results are keyed by trust and by what the viewer is allowed to see rather
+# than by user: principals and clerks of one program share a single computed
+# JSON report, admins of a trust share theirs. Pages rendered with the layout
+# (which shows the user's name and CSRF token) stay per-user but are
+# invalidated the same way. Statements that bypass the unit of work (bulk
+# mappings, rollup rebuilds) call invalidate() themselves; INSERT/UPDATE/DELETE
+# statements run through the session on tracked tables, ORM or Core against
+# a reflected table, drop the whole entity.
+
+log = logging.getLogger(__name__)
+
+ENTITIES = ("attendance", "fees", "students", "exams", "materials", "staff")
+
+_ENTITY_MODELS = {
+    Attendance: ("attendance",),
+    AttendanceSessionRollup: ("attendance",),
+    AttendanceStudentRollup: ("attendance",),
+    FeesRecord: ("fees",),
+    FeePayment: ("fees",),
+    FeeStructure: ("fees",),
+    StudentFeeBalance: ("fees",),
+    Student: ("students",),
+    StudentSubjectEnrollment: ("students",),
+    Faculty: ("staff",),
+    CourseAssignment: ("staff", "attendance"),
+    ExamScheme: ("exams",),
+    ExamMark: ("exams",),
+    StudentSemesterResult: ("exams",),
+    Grade: ("exams",),
+    SubjectMaterial: ("materials",),
+    Subject: ("attendance", "exams", "materials", "students"),
+    Division: ("students", "attendance"),
+    Program: ENTITIES,
+}
+# Kept in step with their source tables by code that already reports the
+# source write; bulk statements against them are not treated as changes.
+_DERIVED = (AttendanceSessionRollup, AttendanceStudentRollup, StudentFeeBalance)
+# By table name, for Core statements (reflected tables, Model.__table__)
+_TABLE_ENTITIES = {model.__table__.name: entities for model, entities in _ENTITY_MODELS.items()}
+_DERIVED_TABLES = frozenset(model.__table__.name for model in _DERIVED)
+
+_PENDING = "result_cache_pending"
+_TAG_PREFIX = "rc_tag:"
+_TTL = 600
+
+
+def _ttl():
+    try:
+        return int(current_app.config.get("RESULT_CACHE_TTL", _TTL))
+    except Exception:
+        return _TTL
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = {}
+        self.invalidations = Counter()
+        self.recent = deque(maxlen=25)
+
+    def count(self, name, field):
+        with self.lock:
+            self.results.setdefault(name, Counter())[field] += 1
+        metrics.inc("cms_result_cache_total", name=name, result=field)
+
+    def invalidated(self, tags):
+        with self.lock:
+            for tag in tags:
+                self.invalidations[tag.split(":", 1)[0]] += 1
+            self.recent.appendleft({"at": datetime.now(), "tags": sorted(tags)})
+
+
+_stats = _Stats()
+
+
+# -- tags --------------------------------------------------------------------
+
+def result_tags(entities, trust_id=None, program_id=None, semester=None):
+    """Tags a result computed for this scope depends on."""
+    tags = []
+    for entity in entities:
+        tags.append(entity)
+        if program_id and semester:
+            tags += [f"{entity}:p{program_id}:s{semester}", f"{entity}:p{program_id}:*"]
+        elif program_id:
+            tags.append(f"{entity}:p{program_id}")
+        else:
+            tags.append(f"{entity}:t{trust_id}" if trust_id else f"{entity}:all")
+    return tags
+
+
+def _write_tags(entity, trust_id, program_id, semester):
+    """Tags a write to ``entity`` at this location invalidates."""
+    if not program_id:
+        return {entity}
+    tags = {f"{entity}:all", f"{entity}:p{program_id}"}
+    if trust_id:
+        tags.add(f"{entity}:t{trust_id}")
+    # A write without a semester reaches every semester-level result of the program
+    tags.add(f"{entity}:p{program_id}:s{semester}" if semester else f"{entity}:p{program_id}:*")
+    return tags
+
+
+def _tokens(tags, create=False):
+    keys = [_TAG_PREFIX + t for t in tags]
+    try:
+        values = cache.get_many(*keys)
+    except Exception:
+        values = [None] * len(keys)
+    tokens = dict(zip(tags, values))
+    if create:
+        missing = {_TAG_PREFIX + t: uuid.uuid4().hex for t, v in tokens.items() if v is None}
+        if missing:
+            try:
+                cache.set_many(missing, timeout=0)
+            except Exception:
+                return tokens
+            for key, token in missing.items():
+                tokens[key[len(_TAG_PREFIX):]] = token
+    return tokens
+
+
+def bump(tags):
+    """Give ``tags`` new tokens now; results stored under the old ones are stale."""
+    tags = set(tags)
+    if not tags:
+        return
+    try:
+        cache.set_many({_TAG_PREFIX + t: uuid.uuid4().hex for t in tags}, timeout=0)
+    except Exception:
+        log.warning("Failed to invalidate result cache tags %s", sorted(tags), exc_info=True)
+        return
+    _stats.invalidated(tags)
+
+
+def invalidate(entities, program_id=None, semester=None):
+    """Drop results of ``entities`` once the current transaction commits.
+
+    Without a program every result of those entities is dropped. For writes
+    that do not go through the unit of work (bulk mappings, set-based SQL).
+    """
+    trust_id = None
+    if program_id:
+        trust_id = db.session.scalar(
+            select(Institute.trust_id_fk)
+            .join(Program, Program.institute_id_fk == Institute.institute_id)
+            .where(Program.program_id == program_id)
+        )
+    pending = db.session.info.setdefault(_PENDING, set())
+    for entity in ([entities] if isinstance(entities, str) else entities):
+        pending.add((entity, trust_id, program_id, semester))
+
+
+# -- picking up writes -------------------------------------------------------
+
+def _values(obj, attr, deleted_history=True):
+    """Current value of ``attr`` plus the value it had before this flush."""
+    out = set()
+    if not hasattr(obj, attr):
+        return out
+    out.add(getattr(obj, attr, None))
+    if deleted_history:
+        try:
+            hist = inspect(obj).attrs[attr].history
+            out.update(hist.deleted or ())
+        except Exception:
+            pass
+    out.discard(None)
+    return out
+
+
+@event.listens_for(Session, "after_flush")
+def _collect(session, flush_context):
+    found = []
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        entities = _ENTITY_MODELS.get(type(obj))
+        if not entities:
+            continue
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        if isinstance(obj, Program):
+            programs = {obj.program_id}
+        else:
+            programs = _values(obj, "program_id_fk")
+        found.append((
+            entities,
+            programs,
+            _values(obj, "semester") | _values(obj, "current_semester"),
+            _values(obj, "division_id_fk"),
+            _values(obj, "subject_id_fk"),
+            (_values(obj, "student_id_fk") | _values(obj, "enrollment_no")) if not isinstance(obj, Student) else set(),
+        ))
+    if not found:
+        return
+    try:
+        located = _locate(session, found)
+    except Exception:
+        log.warning("Could not locate result cache writes; dropping the entities", exc_info=True)
+        located = [(e, None, None, None) for entities, *_ in found for e in entities]
+    session.info.setdefault(_PENDING, set()).update(located)
+
+
+def _locate(session, found):
+    division_ids, subject_ids, students = set(), set(), set()
+    for _e, programs, _s, divisions, subjects, enrollments in found:
+        if not programs:
+            division_ids |= divisions
+            subject_ids |= subjects
+            students |= enrollments
+    by_division = {}
+    if division_ids:
+        by_division = {r[0]: (r[1], r[2]) for r in session.execute(
+            select(Division.division_id, Division.program_id_fk, Division.semester).where(Division.division_id.in_(division_ids))
+        )}
+    by_subject = {}
+    if subject_ids:
+        by_subject = {r[0]: (r[1], r[2]) for r in session.execute(
+            select(Subject.subject_id, Subject.program_id_fk, Subject.semester).where(Subject.subject_id.in_(subject_ids))
+        )}
+    by_student = {}
+    if students:
+        by_student = {r[0]: (r[1], r[2]) for r in session.execute(
+            select(Student.enrollment_no, Student.program_id_fk, Student.current_semester).where(Student.enrollment_no.in_(students))
+        )}
+
+    rows = []
+    for entities, programs, semesters, divisions, subjects, enrollments in found:
+        places = {(p, s) for p in programs for s in (semesters or {None})}
+        if not places:
+            for ref, table in ((divisions, by_division), (subjects, by_subject), (enrollments, by_student)):
+                for key in ref:
+                    pid, sem = table.get(key, (None, None))
+                    if pid:
+                        places.update((pid, s) for s in (semesters or {sem}))
+                if places:
+                    break
+        rows.extend((e, None, p, s) for e in entities for p, s in (places or {(None, None)}))
+
+    program_ids = {p for _e, _t, p, _s in rows if p}
+    trusts = {}
+    if program_ids:
+        trusts = dict(session.execute(
+            select(Program.program_id, Institute.trust_id_fk)
+            .join(Institute, Program.institute_id_fk == Institute.institute_id)
+            .where(Program.program_id.in_(program_ids))
+        ).all())
+    return [(e, trusts.get(p), p, s) for e, _t, p, s in rows]
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bulk_statement(state):
+    if state.is_select or not (state.is_update or state.is_delete or state.is_insert):
+        return
+    # ORM statements name their entity; Core ones (reflected tables included) only the table
+    model = getattr(state.bind_mapper, "class_", None)
+    table = model.__table__ if model is not None else getattr(state.statement, "table", None)
+    name = getattr(table, "name", None)
+    if name is None or name in _DERIVED_TABLES:
+        return
+    for entity in _TABLE_ENTITIES.get(name, ()):
+        state.session.info.setdefault(_PENDING, set()).add((entity, None, None, None))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply(session):
+    pending = session.info.pop(_PENDING, None)
+    if not pending:
+        return
+    tags = set()
+    for entity, trust_id, program_id, semester in pending:
+        tags |= _write_tags(entity, trust_id, program_id, semester)
+    bump(tags)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop(_PENDING, None)
+
+
+# -- caching views -----------------------------------------------------------
+
+def _viewer():
+    scope = current_scope()
+    if scope.role in ("principal", "clerk"):
+        return f"p{scope.principal_program_id or 0}"
+    if scope.role in ("faculty", "student"):
+        return f"u{scope.user_id}"
+    return "all"
+
+
+def _arg_int(name):
+    try:
+        return int(request.args.get(name) or 0) or None
+    except Exception:
+        return None
+
+
+def cached_result(name, entities, timeout=None, per_user=False, key=None, unless=None):
+    """Cache a view's response under write-driven invalidation (see module notes).
+
+    ``per_user`` keys the result by user (pages rendered with the layout);
+    ``key`` overrides the key suffix. The program and semester a result
+    depends on come from the ``program_id`` and ``semester`` query
+    arguments; without them it depends on the whole trust.
+    """
+    entities = tuple(entities)
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                if unless is not None and unless():
+                    _stats.count(name, "bypassed")
+                    return view(*args, **kwargs)
+                scope = current_scope()
+                viewer = f"u{scope.user_id}" if per_user else _viewer()
+                suffix = key() if key is not None else request.full_path
+                cache_key = f"rc:{name}:t{scope.trust_id or 0}:{viewer}:{suffix}"
+                program_id = _arg_int("program_id")
+                if scope.principal_program_id and program_id != scope.principal_program_id:
+                    # Views differ on whether they narrow principals to their program; depend on the trust
+                    program_id = None
+                tags = result_tags(entities, scope.trust_id, program_id, _arg_int("semester") if program_id else None)
+                tokens = _tokens(tags, create=True)
+                entry = cache.get(cache_key)
+            except Exception:
+                log.warning("Result cache unavailable for %s", name, exc_info=True)
+                return view(*args, **kwargs)
+
+            if entry is not None:
+                if entry.get("tags") == tokens:
+                    _stats.count(name, "hits")
+                    body, status, headers = entry["response"]
+                    return current_app.response_class(body, status=status, headers=headers)
+                _stats.count(name, "stale")
+            else:
+                _stats.count(name, "misses")
+
+            flashes = list(session.get("_flashes") or ())
+            resp = make_response(view(*args, **kwargs))
+            # A view that rendered or added flash messages is not reusable
+            if resp.status_code == 200 and not resp.direct_passthrough and list(session.get("_flashes") or ()) == flashes and None not in tokens.values():
+                try:
+                    cache.set(
+                        cache_key,
+                        {"tags": tokens, "response": (resp.get_data(), resp.status_code, list(resp.headers.items()))},
+                        timeout=(timeout or _ttl()),
+                    )
+                    _stats.count(name, "stores")
+                except Exception:
+                    pass
+            return resp
+
+        return wrapper
+
+    return decorator
+
+
+def stats():
+    """Per-result hit/miss counters and recent invalidations for this process."""
+    with _stats.lock:
+        results = []
+        for name, c in sorted(_stats.results.items()):
+            lookups = c["hits"] + c["misses"] + c["stale"]
+            results.append({
+                "name": name,
+                "hits": c["hits"],
+                "misses": c["misses"],
+                "stale": c["stale"],
+                "stores": c["stores"],
+                "bypassed": c["bypassed"],
+                "hit_ratio": (round(100.0 * c["hits"] / lookups, 1) if lookups else None),
+            })
+        return {
+            "backend": current_app.config.get("CACHE_TYPE"),
+            "ttl": _ttl(),
+            "results": results,
+            "invalidations": dict(sorted(_stats.invalidations.items())),
+            "recent": list(_stats.recent),
+        }
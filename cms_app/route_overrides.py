@@ -3,11 +3,12 @@ from datetime import datetime, timezone
 
 from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
-from sqlalchemy import MetaData, Table, func, select
+from sqlalchemy import func, select
 
-from . import csrf_required, db
+from . import csrf_required, db, schema_registry
 from .decorators import super_admin_required
 from .email_utils import send_email
+from .fee_balances import BalanceTracker
 
 
 route_overrides_bp = Blueprint("route_overrides", __name__)
@@ -22,8 +23,7 @@ _OVERRIDE_STUDENT_FIELDS = [
 
 
 def _student_table():
-    metadata = MetaData()
-    return Table("students", metadata, autoload_with=db.engine)
+    return schema_registry.reflected_table("students")
 
 
 def _fetch_students_map(enrollment_nos):
@@ -185,6 +185,9 @@ def fees_payment_verify(payment_id):
         _set_payment_verifier(payment, getattr(current_user, "user_id", None))
         payment.payer_name = payer_name
         payment.bank_credit_at = bank_credit_at
+        balances = BalanceTracker()
+        balances.add(payment)
+        balances.flush()
         db.session.commit()
 
         try:
@@ -209,9 +212,10 @@ def fees_payment_verify(payment_id):
             user = db.session.get(User, user_id) if user_id else None
             to_address = getattr(user, "username", None) or None
             if to_address:
-                send_email("Payment Verified", to_address, f"Your payment (UTR: {payment.utr}) has been verified.")
+                send_email("Payment Verified", to_address, f"Your payment (UTR: {payment.utr}) has been verified.", category="fee_verified")
+                db.session.commit()
         except Exception:
-            pass
+            db.session.rollback()
 
         flash("Payment verified.", "success")
     except Exception:
@@ -244,6 +248,9 @@ def fees_payment_reject(payment_id):
         payment.verified_at = None
         _set_payment_verifier(payment, getattr(current_user, "user_id", None))
         payment.remarks = remarks or None
+        balances = BalanceTracker()
+        balances.add(payment)
+        balances.flush()
         db.session.commit()
 
         try:
@@ -273,9 +280,11 @@ def fees_payment_reject(payment_id):
                     "Payment Rejected",
                     to_address,
                     f"Your payment (UTR: {payment.utr}) was rejected. Remarks: {remarks}",
+                    category="fee_rejected",
                 )
+                db.session.commit()
         except Exception:
-            pass
+            db.session.rollback()
 
         flash("Payment rejected.", "success")
     except Exception:
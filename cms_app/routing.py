@@ -0,0 +1,31 @@
+from werkzeug.routing import Rule
+
+
+# Werkzeug compiles two URL-builder functions per rule (an ast built by hand
+# and passed through compile()) as soon as the rule is added to the map. With
+# ~240 rules that was well over half of create_app(), paid by every worker at
+# boot, although a worker only ever builds URLs for a fraction of the rules.
+# LazyBuilderRule compiles each builder the first time url_for() needs it;
+# matching incoming requests does not use the builders at all.
+#
+# _compile_builder is private Werkzeug API, hence the exact Werkzeug pin in
+# requirements.txt; an upgrade that renames it fails at import instead of
+# quietly compiling every builder at boot again.
+
+if not callable(getattr(Rule, "_compile_builder", None)):
+    raise ImportError("LazyBuilderRule needs werkzeug.routing.Rule._compile_builder; check the Werkzeug pin")
+
+
+class LazyBuilderRule(Rule):
+    def _compile_builder(self, append_unknown=True):
+        attr = "_build_unknown" if append_unknown else "_build"
+
+        def build(rule, *args, **kwargs):
+            compiled = Rule._compile_builder(rule, append_unknown).__get__(rule, None)
+            setattr(rule, attr, compiled)
+            return compiled(*args, **kwargs)
+
+        return build
+
+
+url_rule_class = LazyBuilderRule
@@ -0,0 +1,82 @@
+import threading
+
+from sqlalchemy import MetaData, Table, inspect as sa_inspect
+
+from . import db
+
+
+# Process-wide cache of reflected tables keyed by engine URL, so each worker
+# only hits the database catalog once per table instead of once per request.
+_lock = threading.RLock()
+_tables = {}
+_columns = {}
+
+
+def _engine_key(engine=None):
+    engine = engine or db.engine
+    try:
+        return str(engine.url)
+    except Exception:
+        return "default"
+
+
+def reflected_table(table_name, engine=None):
+    """Return the reflected ``Table`` for ``table_name``.
+
+    Tables are reflected once per process and shared between callers; treat
+    them as read-only.
+    """
+    engine = engine or db.engine
+    key = (_engine_key(engine), table_name)
+    table = _tables.get(key)
+    if table is not None:
+        return table
+    with _lock:
+        table = _tables.get(key)
+        if table is None:
+            metadata = MetaData()
+            table = Table(table_name, metadata, autoload_with=engine)
+            _tables[key] = table
+            _columns[key] = frozenset(table.c.keys())
+    return table
+
+
+def table_columns(table_name, engine=None):
+    """Return the column names of ``table_name`` as a frozenset (empty on error)."""
+    engine = engine or db.engine
+    key = (_engine_key(engine), table_name)
+    cols = _columns.get(key)
+    if cols is not None:
+        return cols
+    with _lock:
+        cols = _columns.get(key)
+        if cols is None:
+            try:
+                cols = frozenset(c["name"] for c in sa_inspect(engine).get_columns(table_name))
+            except Exception:
+                cols = frozenset()
+            if not cols:
+                # Don't remember misses; the table may be created later.
+                return cols
+            _columns[key] = cols
+    return cols
+
+
+def invalidate(table_name=None, engine=None):
+    """Drop cached reflections so the next lookup re-reads the catalog.
+
+    Called after the startup schema sync and after any runtime DDL.
+    """
+    with _lock:
+        if table_name is None and engine is None:
+            _tables.clear()
+            _columns.clear()
+        else:
+            engine_key = _engine_key(engine) if engine is not None else None
+            for store in (_tables, _columns):
+                for key in list(store.keys()):
+                    if engine_key is not None and key[0] != engine_key:
+                        continue
+                    if table_name is not None and key[1] != table_name:
+                        continue
+                    store.pop(key, None)
@@ -0,0 +1,195 @@
+from flask import current_app, g, has_request_context, session
+from flask_login import current_user
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from . import cache, db
+from .models import Division, Institute, Program
+
+
+# Request-scoped tenant scope. Views used to work out the effective trust from
+# current_user/session inline and then join Program to Institute (often more
+# than once per page) to get the trust's programs. current_scope() resolves all
+# of that once per request and keeps it on flask.g:
+#
+#   trust_id              active trust (super admins: the one picked in the
+#                         trust switcher, None when none is picked)
+#   program_ids           programs of that trust (every program when None)
+#   division_ids          divisions of those programs
+#   principal_program_id  the mapped program of a principal/clerk
+#
+# The per-trust program/division id lists are shared across requests through
+# the cache for SCOPE_CACHE_TTL seconds. Committing a change to a program,
+# division or institute bumps a generation number that is part of every key,
+# so those lists never outlive the structure they describe in this process;
+# other processes pick the change up within the TTL.
+
+_GENERATION_KEY = "scope_generation"
+_CHANGED = "scope_changed"
+_G_ATTR = "_cms_scope"
+
+
+def _ttl():
+    try:
+        return int(current_app.config.get("SCOPE_CACHE_TTL", 60))
+    except Exception:
+        return 60
+
+
+def _generation():
+    try:
+        return int(cache.get(_GENERATION_KEY) or 0)
+    except Exception:
+        return 0
+
+
+def trust_structure(trust_id):
+    """``{"program_ids": [...], "division_ids": [...]}`` for a trust (all programs for ``None``)."""
+    key = f"scope_trust_{trust_id or 'all'}_g{_generation()}"
+    try:
+        cached = cache.get(key)
+    except Exception:
+        cached = None
+    if cached is not None:
+        return cached
+    q = select(Program.program_id).order_by(Program.program_id)
+    if trust_id:
+        q = q.join(Institute, Program.institute_id_fk == Institute.institute_id).where(Institute.trust_id_fk == trust_id)
+    program_ids = list(db.session.execute(q).scalars())
+    division_ids = []
+    if program_ids:
+        division_ids = list(db.session.execute(
+            select(Division.division_id).where(Division.program_id_fk.in_(program_ids)).order_by(Division.division_id)
+        ).scalars())
+    value = {"program_ids": program_ids, "division_ids": division_ids}
+    try:
+        cache.set(key, value, timeout=_ttl())
+    except Exception:
+        pass
+    return value
+
+
+class Scope:
+    """What the current user may see; built by :func:`current_scope`."""
+
+    def __init__(self, user):
+        self.authenticated = bool(getattr(user, "is_authenticated", False))
+        self.user_id = getattr(user, "user_id", None) if self.authenticated else None
+        self.role = (getattr(user, "role", "") or "").strip().lower() if self.authenticated else ""
+        self.is_super_admin = bool(getattr(user, "is_super_admin", False)) if self.authenticated else False
+        self.trust_id = None
+        if self.is_super_admin:
+            try:
+                self.trust_id = int(session.get("active_trust_id") or 0) or None
+            except Exception:
+                self.trust_id = None
+        elif self.authenticated:
+            self.trust_id = getattr(user, "trust_id_fk", None)
+        self.principal_program_id = None
+        if self.role in ("principal", "clerk"):
+            try:
+                self.principal_program_id = int(getattr(user, "program_id_fk", None) or 0) or None
+            except Exception:
+                self.principal_program_id = None
+        self._structure = None
+        self._programs = None
+
+    @property
+    def needs_trust(self):
+        """True for a super admin who has not picked a trust yet."""
+        return self.is_super_admin and not self.trust_id
+
+    def _trust_structure(self):
+        if self._structure is None:
+            self._structure = trust_structure(self.trust_id)
+        return self._structure
+
+    @property
+    def program_ids(self):
+        return self._trust_structure()["program_ids"]
+
+    @property
+    def division_ids(self):
+        return self._trust_structure()["division_ids"]
+
+    def programs(self):
+        """The trust's ``Program`` rows ordered by name, loaded once per request."""
+        if self._programs is None:
+            ids = self.program_ids
+            self._programs = db.session.execute(
+                select(Program).where(Program.program_id.in_(ids)).order_by(Program.program_name.asc())
+            ).scalars().all() if ids else []
+        return list(self._programs)
+
+    def has_program(self, program_id):
+        try:
+            return int(program_id) in set(self.program_ids)
+        except Exception:
+            return False
+
+
+def current_scope():
+    """The :class:`Scope` of the current request (built on first use)."""
+    if not has_request_context():
+        return Scope(None)
+    scope = getattr(g, _G_ATTR, None)
+    if scope is None:
+        scope = Scope(current_user)
+        setattr(g, _G_ATTR, scope)
+    return scope
+
+
+def program_ids_for(trust_id):
+    """Program ids of ``trust_id``, answered from the request's scope when it is that trust."""
+    scope = current_scope()
+    try:
+        trust_id = int(trust_id) if trust_id else None
+    except Exception:
+        trust_id = None
+    if trust_id == scope.trust_id:
+        return scope.program_ids
+    return trust_structure(trust_id)["program_ids"]
+
+
+def division_ids_for(trust_id):
+    """Division ids of ``trust_id``; see :func:`program_ids_for`."""
+    scope = current_scope()
+    try:
+        trust_id = int(trust_id) if trust_id else None
+    except Exception:
+        trust_id = None
+    if trust_id == scope.trust_id:
+        return scope.division_ids
+    return trust_structure(trust_id)["division_ids"]
+
+
+def reset_scope():
+    """Forget this request's scope (after switching the active trust)."""
+    if has_request_context():
+        g.pop(_G_ATTR, None)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect(session, flush_context):
+    if session.info.get(_CHANGED):
+        return
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, (Program, Division, Institute)):
+            session.info[_CHANGED] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate(session):
+    if not session.info.pop(_CHANGED, None):
+        return
+    try:
+        cache.set(_GENERATION_KEY, _generation() + 1, timeout=0)
+    except Exception:
+        pass
+    reset_scope()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop(_CHANGED, None)
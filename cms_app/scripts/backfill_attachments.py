@@ -0,0 +1,52 @@
+import os
+
+from sqlalchemy import select
+
+from cms_app import create_app, db
+from cms_app.attachments import register
+from cms_app.models import Announcement, Attachment, SubjectMaterial
+
+
+def run() -> None:
+    """Register files uploaded before the attachments manifest existed.
+
+    Announcement uploads under static/uploads/announcements/<id>/ and the
+    current file of each subject material are hashed and recorded in place
+    (nothing is moved). Files that already have a manifest row are skipped, so
+    the script can be re-run.
+    """
+    app = create_app()
+    with app.app_context():
+        static_root = app.static_folder or os.path.join(app.root_path, "static")
+        known = set(db.session.execute(select(Attachment.storage_path)).scalars())
+        added = 0
+
+        ann_root = os.path.join(static_root, "uploads", "announcements")
+        ann_ids = set(db.session.execute(select(Announcement.announcement_id)).scalars())
+        for entry in (os.scandir(ann_root) if os.path.isdir(ann_root) else ()):
+            if not (entry.is_dir() and entry.name.isdigit() and int(entry.name) in ann_ids):
+                continue
+            for f in os.scandir(entry.path):
+                rel = f"uploads/announcements/{entry.name}/{f.name}"
+                if f.is_file() and rel not in known:
+                    register(rel, "announcement", int(entry.name), file_name=f.name)
+                    added += 1
+            db.session.commit()
+
+        materials = db.session.execute(
+            select(SubjectMaterial).where(SubjectMaterial.kind == "file", SubjectMaterial.file_path.isnot(None))
+        ).scalars().all()
+        for m in materials:
+            rel = m.file_path.replace("\\", "/")
+            if rel in known or not os.path.isfile(os.path.join(static_root, *rel.split("/"))):
+                continue
+            register(rel, "material", m.material_id, subject_id=m.subject_id_fk, user_id=m.faculty_id_fk)
+            added += 1
+            if added % 500 == 0:
+                db.session.commit()
+        db.session.commit()
+        print(f"Registered {added} existing attachment(s).")
+
+
+if __name__ == "__main__":
+    run()
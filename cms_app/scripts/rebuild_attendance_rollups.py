@@ -0,0 +1,27 @@
+from datetime import datetime
+from typing import Optional
+
+from cms_app import create_app, db
+from cms_app.attendance_rollups import rebuild
+
+
+def run(start: Optional[str] = None, end: Optional[str] = None) -> None:
+    """Rebuild attendance session/student rollups from the raw attendance table.
+
+    - With no arguments every rollup row is dropped and recomputed.
+    - With START [END] (YYYY-MM-DD) only that window of sessions is rebuilt;
+      student counters for the academic years it touches are recomputed in full.
+    """
+    start_date = datetime.strptime(start, "%Y-%m-%d").date() if start else None
+    end_date = datetime.strptime(end, "%Y-%m-%d").date() if end else None
+    app = create_app()
+    with app.app_context():
+        counts = rebuild(start_date, end_date)
+        db.session.commit()
+        print(f"Rebuilt {counts['sessions']} session rollups and {counts['students']} student rollups.")
+
+
+if __name__ == "__main__":
+    import sys
+    args = [a.strip() for a in sys.argv[1:] if (a or "").strip()]
+    run(start=(args[0] if len(args) > 0 else None), end=(args[1] if len(args) > 1 else None))
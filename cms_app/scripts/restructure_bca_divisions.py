@@ -7,8 +7,10 @@ from sqlalchemy import text
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
 from cms_app import create_app, db
+from cms_app.attendance_rollups import delete_student_attendance
+from cms_app.fee_balances import refresh_students as refresh_fee_balances
 from cms_app.models import (
-    Program, Student, Division, Attendance, ExamMark, 
+    Program, Student, Division, ExamMark, 
     StudentSemesterResult, FeesRecord, FeePayment, 
     StudentSubjectEnrollment, Grade, StudentCreditLog,
     CourseAssignment, Subject
@@ -51,11 +53,12 @@ def cleanup_non_bca_students():
             # Delete related records
             logger.info("Deleting related records (Attendance, Marks, Fees, etc.)...")
             
-            Attendance.query.filter(Attendance.student_id_fk.in_(student_enrollments)).delete(synchronize_session=False)
+            delete_student_attendance(student_enrollments)
             ExamMark.query.filter(ExamMark.student_id_fk.in_(student_enrollments)).delete(synchronize_session=False)
             StudentSemesterResult.query.filter(StudentSemesterResult.student_id_fk.in_(student_enrollments)).delete(synchronize_session=False)
             FeesRecord.query.filter(FeesRecord.student_id_fk.in_(student_enrollments)).delete(synchronize_session=False)
             FeePayment.query.filter(FeePayment.enrollment_no.in_(student_enrollments)).delete(synchronize_session=False)
+            refresh_fee_balances(student_enrollments)
             StudentSubjectEnrollment.query.filter(StudentSubjectEnrollment.student_id_fk.in_(student_enrollments)).delete(synchronize_session=False)
             Grade.query.filter(Grade.student_id_fk.in_(student_enrollments)).delete(synchronize_session=False)
             StudentCreditLog.query.filter(StudentCreditLog.student_id_fk.in_(student_enrollments)).delete(synchronize_session=False)
@@ -0,0 +1,44 @@
+import logging
+import os
+import signal
+import sys
+import threading
+
+# Add project root to path (handlers import from scripts/ as well as cms_app/)
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from cms_app import create_app, db
+from cms_app.jobs.services import run_pending, run_periodic, run_worker
+
+
+def run(once: bool = False) -> None:
+    """Process background jobs (imports, promotions, result calculation, backups, emails).
+
+    - Without arguments the worker polls ``background_jobs`` until SIGTERM/SIGINT.
+    - With ``--once`` it drains the jobs that are currently due (and the email
+      outbox) and exits.
+    gunicorn.conf.py starts one of these next to the web workers.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    app = create_app()
+    if once:
+        with app.app_context():
+            ran = run_pending(worker_id=f"once:{os.getpid()}")
+            run_periodic({}, force=True)
+            db.session.remove()
+        print(f"Ran {ran} job(s).")
+        return
+    stop_event = threading.Event()
+
+    def _stop(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    run_worker(app, stop_event=stop_event)
+
+
+if __name__ == "__main__":
+    run(once=("--once" in sys.argv[1:]))
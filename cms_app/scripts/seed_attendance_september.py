@@ -4,6 +4,7 @@ from typing import Optional
 from sqlalchemy import select
 
 from cms_app import create_app, db
+from cms_app.attendance_rollups import rebuild as rebuild_attendance_rollups
 from cms_app.models import Program, Division, Student, Subject, Attendance, StudentSubjectEnrollment
 
 
@@ -118,6 +119,8 @@ def seed(year: Optional[int] = None, weekdays_only: bool = False, use_enrollment
                     created += 1
             d += timedelta(days=1)
 
+        db.session.flush()
+        rebuild_attendance_rollups(start, end)
         db.session.commit()
         print(
             f"Created {created} rows, skipped {skipped}. Seeded September {yr} for BCA Sem 3 & 5."
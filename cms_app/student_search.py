@@ -0,0 +1,175 @@
+import re
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+
+from . import db
+from .models import Student
+
+
+# Indexed student search for the type-ahead endpoints.
+#
+# SQLite: an FTS5 table (student_search) mirrors the searchable columns and is
+# kept in sync by triggers on students, so ORM writes, bulk imports and raw SQL
+# all update it. Postgres: a GIN index over a weighted tsvector expression on
+# students itself, which needs no syncing. Both match every query token as a
+# prefix and rank by relevance. Other databases, or SQLite builds without FTS5,
+# fall back to the ILIKE scan.
+
+FTS_TABLE = "student_search"
+PG_INDEX = "ix_students_search_tsv"
+
+# bm25 weights, in FTS column order
+_FTS_COLUMNS = ("enrollment_no", "student_name", "surname", "father_name", "roll_no", "mobile")
+_FTS_WEIGHTS = (10.0, 5.0, 5.0, 1.0, 3.0, 3.0)
+
+# FTS5 cannot look up an unindexed column cheaply, so trigger deletes go through
+# MATCH on the enrollment phrase plus an exact check; enrollments without any
+# ASCII alphanumerics (no tokens) fall back to a scan.
+_DELETE_OLD = (
+    f"DELETE FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH "
+    "'enrollment_no:\"' || replace(old.enrollment_no, '\"', '\"\"') || '\"' "
+    "AND enrollment_no = old.enrollment_no AND old.enrollment_no GLOB '*[0-9A-Za-z]*'; "
+    f"DELETE FROM {FTS_TABLE} WHERE old.enrollment_no NOT GLOB '*[0-9A-Za-z]*' "
+    "AND enrollment_no = old.enrollment_no;"
+)
+_INSERT_NEW = (
+    f"INSERT INTO {FTS_TABLE} (enrollment_no, student_name, surname, father_name, roll_no, mobile) "
+    "VALUES (new.enrollment_no, new.student_name, new.surname, new.father_name, new.roll_no, new.mobile);"
+)
+
+_SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "enrollment_no, student_name, surname, father_name, roll_no, mobile, "
+    "tokenize='unicode61', prefix='2 3 4')",
+    f"CREATE TRIGGER IF NOT EXISTS students_search_ai AFTER INSERT ON students BEGIN {_INSERT_NEW} END",
+    f"CREATE TRIGGER IF NOT EXISTS students_search_ad AFTER DELETE ON students BEGIN {_DELETE_OLD} END",
+    "CREATE TRIGGER IF NOT EXISTS students_search_au AFTER UPDATE OF "
+    f"enrollment_no, student_name, surname, father_name, roll_no, mobile ON students BEGIN {_DELETE_OLD} {_INSERT_NEW} END",
+]
+
+_fts_table = sa.table(FTS_TABLE, *[sa.column(c) for c in _FTS_COLUMNS])
+
+# dialect name per bind URL -> whether the index is usable
+_available = {}
+
+
+def _pg_document():
+    # Must stay textually identical to the PG_INDEX expression for the planner to use it
+    # (inline literals, not bound parameters, for the same reason)
+    space, empty = sa.literal_column("' '"), sa.literal_column("''")
+
+    def part(col, weight):
+        return sa.func.setweight(
+            sa.func.to_tsvector(sa.literal_column("'simple'::regconfig"), sa.func.coalesce(col, empty)),
+            sa.literal_column(f"'{weight}'::\"char\""),
+        )
+
+    return (
+        part(Student.enrollment_no, "A")
+        .op("||")(part(sa.func.concat_ws(space, Student.student_name, Student.surname), "B"))
+        .op("||")(part(sa.func.concat_ws(space, Student.roll_no, Student.mobile), "B"))
+        .op("||")(part(Student.father_name, "C"))
+    )
+
+
+def _pg_index_sql():
+    compiled = _pg_document().compile(dialect=postgresql.dialect())
+    return f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON students USING gin (({compiled}))"
+
+
+def install(connection):
+    """Create the search index for ``connection``'s dialect (idempotent)."""
+    name = connection.dialect.name
+    if name == "sqlite":
+        try:
+            for stmt in _SQLITE_DDL:
+                connection.exec_driver_sql(stmt)
+        except Exception:
+            return False
+        return True
+    if name == "postgresql":
+        connection.exec_driver_sql(_pg_index_sql())
+        return True
+    return False
+
+
+def rebuild(connection):
+    """Refill the SQLite FTS table from students (e.g. after restoring a dump)."""
+    if connection.dialect.name != "sqlite":
+        return 0
+    connection.exec_driver_sql(f"DELETE FROM {FTS_TABLE}")
+    result = connection.exec_driver_sql(
+        f"INSERT INTO {FTS_TABLE} (enrollment_no, student_name, surname, father_name, roll_no, mobile) "
+        "SELECT enrollment_no, student_name, surname, father_name, roll_no, mobile FROM students"
+    )
+    return result.rowcount or 0
+
+
+@event.listens_for(Student.__table__, "after_create")
+def _install_after_create(target, connection, **kw):
+    # db.create_all() (dev databases, tests) gets the index too; migrations install it otherwise
+    try:
+        install(connection)
+    except Exception:
+        pass
+
+
+def search_available():
+    engine = db.engine
+    key = str(engine.url)
+    if key not in _available:
+        ok = False
+        try:
+            if engine.dialect.name == "sqlite":
+                with engine.connect() as conn:
+                    ok = conn.exec_driver_sql(
+                        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+                    ).first() is not None
+            elif engine.dialect.name == "postgresql":
+                ok = True
+        except Exception:
+            ok = False
+        _available[key] = ok
+    return _available[key]
+
+
+def search_tokens(q):
+    """Lower-cased word tokens of a search string (punctuation and ``_`` are dropped)."""
+    return re.findall(r"[^\W_]+", (q or "").lower())
+
+
+def apply_search(query, q):
+    """Restrict a ``select(...)`` over students to matches for ``q``.
+
+    Returns ``(query, rank)`` where ``rank`` orders best matches first when used
+    with ``order_by(rank)``; ``rank`` is ``None`` on the ILIKE fallback.
+    """
+    tokens = search_tokens(q)
+    if tokens and search_available():
+        name = db.engine.dialect.name
+        if name == "sqlite":
+            match = " ".join(f'"{t}"*' for t in tokens)
+            query = query.join(_fts_table, _fts_table.c.enrollment_no == Student.enrollment_no).where(
+                sa.literal_column(FTS_TABLE).op("MATCH")(match)
+            )
+            rank = sa.func.bm25(sa.literal_column(FTS_TABLE), *[sa.literal(w) for w in _FTS_WEIGHTS])
+            return query, rank.asc()
+        if name == "postgresql":
+            tsquery = sa.func.to_tsquery(sa.literal_column("'simple'::regconfig"), " & ".join(f"{t}:*" for t in tokens))
+            document = _pg_document()
+            query = query.where(document.op("@@")(tsquery))
+            return query, sa.func.ts_rank(document, tsquery).desc()
+    like = f"%{q}%"
+    query = query.where(
+        sa.or_(
+            Student.enrollment_no.ilike(like),
+            Student.student_name.ilike(like),
+            Student.surname.ilike(like),
+            Student.father_name.ilike(like),
+            Student.roll_no.ilike(like),
+            Student.mobile.ilike(like),
+        )
+    )
+    return query, None
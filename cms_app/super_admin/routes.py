@@ -1,12 +1,15 @@
 from flask import render_template, request, redirect, url_for, flash, current_app, session, abort
 from flask_login import login_required, current_user
 from . import super_admin
-from ..models import db, SystemMessage, SystemConfig, Trust, Institute, User, Student, Faculty, ImportLog, DataAuditLog, Program
-from sqlalchemy import select, func, inspect as sa_inspect, MetaData, Table
+from ..models import db, SystemMessage, SystemConfig, Trust, Institute, User, Student, Faculty, ImportLog, DataAuditLog, Program, BackgroundJob
+from sqlalchemy import select, func
 from sqlalchemy.orm import load_only
 from ..decorators import super_admin_required
-from .. import cache
+from ..jobs.services import enqueue, job_handler, job_payload
+from .. import cache, schema_registry
 from datetime import datetime, timedelta, timezone
+import os
+import time
 
 def _cached_value(key, loader, timeout=60):
     try:
@@ -67,25 +70,7 @@ def _subscription_window(end_at, now, grace_days):
 
 
 def _table_columns(table_name):
-    cache_key = f"sa_table_columns:{table_name}"
-    try:
-        cached = cache.get(cache_key)
-    except Exception:
-        cached = None
-    if cached:
-        try:
-            return set(cached)
-        except Exception:
-            pass
-    try:
-        cols = {c["name"] for c in sa_inspect(db.engine).get_columns(table_name)}
-    except Exception:
-        cols = set()
-    try:
-        cache.set(cache_key, sorted(cols), timeout=300)
-    except Exception:
-        pass
-    return cols
+    return schema_registry.table_columns(table_name)
 
 
 def _query_with_present_columns(model, required_attrs, optional_by_name, table_name):
@@ -107,8 +92,7 @@ def _query_ordered_with_present_columns(model, required_attrs, optional_by_name,
 
 
 def _reflected_table(table_name):
-    metadata = MetaData()
-    return Table(table_name, metadata, autoload_with=db.engine)
+    return schema_registry.reflected_table(table_name)
 
 
 def _row_exists_by_column(table_name, column_name, value):
@@ -730,9 +714,11 @@ def notify_tenure(trust_id):
                 to_address=to_addr,
                 text_body=content,
                 html_body=f"<p>{content}</p>",
+                category="tenure_notice",
             )
+            db.session.commit()
     except Exception:
-        pass
+        db.session.rollback()
 
     flash(f"Tenure notice sent for '{trust.get('trust_name', 'Trust')}'.", "success")
     return redirect(url_for('super_admin.tenants'))
@@ -922,17 +908,100 @@ def config():
     return render_template('super_admin/config.html', config=config_dict)
 
 
+def _student_backup_tables():
+    from ..models import (
+        Alumni,
+        Attendance,
+        ExamMark,
+        FeePayment,
+        FeesRecord,
+        Grade,
+        Notification,
+        StudentCreditLog,
+        StudentSemesterResult,
+        StudentSubjectEnrollment,
+    )
+    # (csv name, model, enrollment column, order by)
+    return [
+        ("students.csv", Student, Student.enrollment_no, (Student.enrollment_no.asc(),)),
+        ("student_subject_enrollments.csv", StudentSubjectEnrollment, StudentSubjectEnrollment.student_id_fk, (StudentSubjectEnrollment.enrollment_id.asc(),)),
+        ("attendance.csv", Attendance, Attendance.student_id_fk, (Attendance.date_marked.asc(), Attendance.period_no.asc())),
+        ("fees_records.csv", FeesRecord, FeesRecord.student_id_fk, (FeesRecord.fee_id.asc(),)),
+        ("fee_payments.csv", FeePayment, FeePayment.enrollment_no, (FeePayment.payment_id.asc(),)),
+        ("exam_marks.csv", ExamMark, ExamMark.student_id_fk, (ExamMark.exam_mark_id.asc(),)),
+        ("student_semester_results.csv", StudentSemesterResult, StudentSemesterResult.student_id_fk, (StudentSemesterResult.result_id.asc(),)),
+        ("grades.csv", Grade, Grade.student_id_fk, (Grade.grade_id.asc(),)),
+        ("student_credit_log.csv", StudentCreditLog, StudentCreditLog.student_id_fk, (StudentCreditLog.log_id.asc(),)),
+        ("notifications.csv", Notification, Notification.student_id_fk, (Notification.notification_id.asc(),)),
+        ("alumni.csv", Alumni, Alumni.enrollment_no, (Alumni.alumni_id.asc(),)),
+    ]
+
+
+def _write_student_backup_zip(path, enrollments, progress=None, chunk_size=500):
+    """Write CSV exports of every table holding rows for ``enrollments`` into a ZIP at ``path``.
+
+    Rows are streamed into the archive one enrollment chunk at a time, so memory use
+    does not grow with the size of the selection.
+    """
+    import csv
+    import io
+    import zipfile
+
+    tables = _student_backup_tables()
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for n, (filename, model, key_col, order_by) in enumerate(tables):
+            if progress:
+                progress(5 + int(90 * n / len(tables)), f"Exporting {filename}")
+            cols = [c.name for c in model.__table__.columns]
+            table = model.__table__
+            with zf.open(filename, "w") as raw:
+                out = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+                w = csv.writer(out)
+                w.writerow(cols)
+                for i in range(0, len(enrollments), chunk_size):
+                    chunk = enrollments[i : i + chunk_size]
+                    q = select(*[table.c[c] for c in cols]).where(key_col.in_(chunk)).order_by(*order_by)
+                    for row in db.session.execute(q):
+                        w.writerow(["" if v is None else v for v in row])
+                out.flush()
+                out.detach()
+
+
+@job_handler("purge_backup", max_attempts=2)
+def _purge_backup_job(ctx, enrollments, selection, trust_id=None, program_id=None, semester=None):
+    import json
+    path = os.path.join(ctx.artifact_dir(), f"super_students_backup_{ctx.job_id}_{int(time.time())}.zip")
+    try:
+        _write_student_backup_zip(path, enrollments, progress=ctx.progress)
+    except Exception:
+        try:
+            os.remove(path)
+        except Exception:
+            pass
+        raise
+    ctx.artifact_path = path
+    db.session.add(DataAuditLog(
+        action="backup",
+        actor_user_id_fk=ctx.user_id,
+        actor_role="super_admin",
+        trust_id_fk=trust_id,
+        program_id_fk=program_id,
+        semester=semester,
+        selection_json=selection,
+        counts_json=json.dumps({"students": len(enrollments)}, ensure_ascii=False),
+    ))
+    db.session.commit()
+    return {"message": f"Backup ready for {len(enrollments)} student(s). Download it before purging.", "students": len(enrollments)}
+
+
 @super_admin.route("/students/purge", methods=["GET", "POST"])
 @login_required
 @super_admin_required
 def students_purge():
-    import io
-    import csv
     import json
-    import time
-    import zipfile
-    from flask import Response
     from sqlalchemy import select, func
+    from ..attendance_rollups import delete_student_attendance
+    from ..fee_balances import refresh_students as refresh_fee_balances
     from ..models import (
         Alumni,
         Attendance,
@@ -1004,101 +1073,20 @@ def students_purge():
             sort_keys=True,
         )
 
-    def _write_csv_from_query(zf, filename, model, q):
-        cols = [c.name for c in model.__table__.columns]
-        buf = io.StringIO()
-        w = csv.writer(buf)
-        w.writerow(cols)
-        rows = db.session.execute(q).scalars().all()
-        for obj in rows:
-            w.writerow([getattr(obj, c, "") for c in cols])
-        zf.writestr(filename, buf.getvalue().encode("utf-8"))
-
-    def _backup_zip(enrollments):
-        mem = io.BytesIO()
-        with zipfile.ZipFile(mem, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-            _write_csv_from_query(
-                zf,
-                "students.csv",
-                Student,
-                select(Student).filter(Student.enrollment_no.in_(enrollments)).order_by(Student.enrollment_no.asc()),
-            )
-            _write_csv_from_query(
-                zf,
-                "student_subject_enrollments.csv",
-                StudentSubjectEnrollment,
-                select(StudentSubjectEnrollment).filter(StudentSubjectEnrollment.student_id_fk.in_(enrollments)).order_by(StudentSubjectEnrollment.enrollment_id.asc()),
-            )
-            _write_csv_from_query(
-                zf,
-                "attendance.csv",
-                Attendance,
-                select(Attendance).filter(Attendance.student_id_fk.in_(enrollments)).order_by(Attendance.date_marked.asc(), Attendance.period_no.asc()),
-            )
-            _write_csv_from_query(
-                zf,
-                "fees_records.csv",
-                FeesRecord,
-                select(FeesRecord).filter(FeesRecord.student_id_fk.in_(enrollments)).order_by(FeesRecord.fee_id.asc()),
-            )
-            _write_csv_from_query(
-                zf,
-                "fee_payments.csv",
-                FeePayment,
-                select(FeePayment).filter(FeePayment.enrollment_no.in_(enrollments)).order_by(FeePayment.payment_id.asc()),
-            )
-            _write_csv_from_query(
-                zf,
-                "exam_marks.csv",
-                ExamMark,
-                select(ExamMark).filter(ExamMark.student_id_fk.in_(enrollments)).order_by(ExamMark.exam_mark_id.asc()),
-            )
-            _write_csv_from_query(
-                zf,
-                "student_semester_results.csv",
-                StudentSemesterResult,
-                select(StudentSemesterResult).filter(StudentSemesterResult.student_id_fk.in_(enrollments)).order_by(StudentSemesterResult.result_id.asc()),
-            )
-            _write_csv_from_query(
-                zf,
-                "grades.csv",
-                Grade,
-                select(Grade).filter(Grade.student_id_fk.in_(enrollments)).order_by(Grade.grade_id.asc()),
-            )
-            _write_csv_from_query(
-                zf,
-                "student_credit_log.csv",
-                StudentCreditLog,
-                select(StudentCreditLog).filter(StudentCreditLog.student_id_fk.in_(enrollments)).order_by(StudentCreditLog.log_id.asc()),
-            )
-            _write_csv_from_query(
-                zf,
-                "notifications.csv",
-                Notification,
-                select(Notification).filter(Notification.student_id_fk.in_(enrollments)).order_by(Notification.notification_id.asc()),
-            )
-            _write_csv_from_query(
-                zf,
-                "alumni.csv",
-                Alumni,
-                select(Alumni).filter(Alumni.enrollment_no.in_(enrollments)).order_by(Alumni.alumni_id.asc()),
-            )
-        mem.seek(0)
-        return mem.getvalue()
-
     def _require_backup():
+        # A backup job for this exact selection must have been downloaded in the last 30 minutes.
         sel = _selection_key()
-        ok_at = session.get("super_purge_backup_at")
-        ok_sel = session.get("super_purge_backup_sel")
-        try:
-            ok_at = float(ok_at) if ok_at else None
-        except Exception:
-            ok_at = None
-        if not ok_at or not ok_sel or ok_sel != sel:
-            return False
-        if (time.time() - ok_at) > (30 * 60):
-            return False
-        return True
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=30)
+        jobs = db.session.execute(
+            select(BackgroundJob)
+            .where(BackgroundJob.kind == "purge_backup")
+            .where(BackgroundJob.status == "succeeded")
+            .where(BackgroundJob.created_by_user_id_fk == getattr(current_user, "user_id", None))
+            .where(BackgroundJob.artifact_downloaded_at >= cutoff)
+            .order_by(BackgroundJob.job_id.desc())
+            .limit(20)
+        ).scalars().all()
+        return any(job_payload(j).get("selection") == sel for j in jobs)
 
     def _audit(action, counts):
         entry = DataAuditLog(
@@ -1131,13 +1119,21 @@ def students_purge():
             return redirect(url_for("super_admin.students_purge", trust_id=trust_id_raw, program_id=program_id_raw, semester=(semester_raw or "all")))
 
         if action == "backup":
-            content = _backup_zip(enrollments)
-            session["super_purge_backup_at"] = time.time()
-            session["super_purge_backup_sel"] = _selection_key()
-            _audit("backup", {"students": len(enrollments)})
-            db.session.commit()
-            fname = f"super_students_backup_{int(time.time())}.zip"
-            return Response(content, headers={"Content-Type": "application/zip", "Content-Disposition": f"attachment; filename={fname}"})
+            job = enqueue(
+                "purge_backup",
+                {
+                    "enrollments": enrollments,
+                    "selection": _selection_key(),
+                    "trust_id": trust_id,
+                    "program_id": program_id,
+                    "semester": semester,
+                },
+                label=f"Student backup ZIP ({len(enrollments)} students)",
+                user=current_user,
+                trust_id=trust_id,
+                return_url=url_for("super_admin.students_purge", trust_id=trust_id_raw, program_id=program_id_raw, semester=(semester_raw or "all")),
+            )
+            return redirect(url_for("jobs.job_status", job_id=job.job_id))
 
         if action == "purge_all":
             if confirm != "PURGE":
@@ -1167,10 +1163,11 @@ def students_purge():
                     "students": 0,
                 }
                 for chunk in _chunks(enrollments):
-                    deleted["attendance"] += Attendance.query.filter(Attendance.student_id_fk.in_(chunk)).delete(synchronize_session=False)
+                    deleted["attendance"] += delete_student_attendance(chunk)
                     deleted["enrollments"] += StudentSubjectEnrollment.query.filter(StudentSubjectEnrollment.student_id_fk.in_(chunk)).delete(synchronize_session=False)
                     deleted["fees_records"] += FeesRecord.query.filter(FeesRecord.student_id_fk.in_(chunk)).delete(synchronize_session=False)
                     deleted["fee_payments"] += FeePayment.query.filter(FeePayment.enrollment_no.in_(chunk)).delete(synchronize_session=False)
+                    refresh_fee_balances(chunk)
                     deleted["exam_marks"] += ExamMark.query.filter(ExamMark.student_id_fk.in_(chunk)).delete(synchronize_session=False)
                     deleted["semester_results"] += StudentSemesterResult.query.filter(StudentSemesterResult.student_id_fk.in_(chunk)).delete(synchronize_session=False)
                     deleted["grades"] += Grade.query.filter(Grade.student_id_fk.in_(chunk)).delete(synchronize_session=False)
@@ -1,12 +1,13 @@
 from datetime import datetime, time
-from flask import render_template, request, jsonify, flash, redirect, url_for, current_app, session
+from flask import render_template, request, jsonify, flash, redirect, url_for, current_app
 from flask_login import login_required, current_user
 from sqlalchemy import and_, select
 
 from . import timetable_bp
 from .. import db
-from ..models import Program, Division, Subject, TimetableSlot, TimetableSettings, CourseAssignment, Faculty, SubjectType, Student, Institute
+from ..models import Program, Division, Subject, TimetableSlot, TimetableSettings, CourseAssignment, Faculty, SubjectType, Student
 from ..decorators import role_required
+from ..scope import current_scope
 
 def _get_timetable_settings(program_id, academic_year):
     return TimetableSettings.query.filter_by(
@@ -75,20 +76,10 @@ def manage():
     else:
         # Real Data Logic
         # Trust Isolation
-        trust_id = None
-        if getattr(current_user, "is_super_admin", False):
-            trust_id = session.get("active_trust_id")
-        else:
-            trust_id = getattr(current_user, "trust_id_fk", None)
+        scope = current_scope()
+        trust_id = scope.trust_id
 
-        if trust_id:
-            programs = db.session.execute(
-                select(Program)
-                .join(Institute)
-                .where(Institute.trust_id_fk == trust_id)
-            ).scalars().all()
-        else:
-            programs = []
+        programs = scope.programs() if trust_id else []
         
         # Defaults for Principal
         if current_user.role == "principal" and current_user.program_id_fk:
@@ -181,11 +172,8 @@ def save_slot():
         return jsonify({"error": "Missing coordinates"}), 400
 
     # Trust Isolation Check
-    trust_id = None
-    if getattr(current_user, "is_super_admin", False):
-        trust_id = session.get("active_trust_id")
-    else:
-        trust_id = getattr(current_user, "trust_id_fk", None)
+    scope = current_scope()
+    trust_id = scope.trust_id
     
     if not trust_id:
          return jsonify({"error": "Unauthorized context"}), 403
@@ -195,21 +183,16 @@ def save_slot():
     if not div:
         return jsonify({"error": "Division not found"}), 404
     
-    # Traverse: Division -> Program -> Institute -> Trust
-    # Note: Accessing relationships might trigger lazy loads.
-    # Using explicit IDs is safer if relationships aren't loaded, but models.py shows backrefs.
-    try:
-        if div.program.institute.trust_id_fk != int(trust_id):
-             return jsonify({"error": "Unauthorized division access"}), 403
-    except Exception:
-         return jsonify({"error": "Validation error"}), 500
+    # The trust's division ids come from the request scope (no Program/Institute lazy loads)
+    if div.division_id not in scope.division_ids:
+        return jsonify({"error": "Unauthorized division access"}), 403
 
     # Validate Subject if provided
     if subject_id:
         sub = db.session.get(Subject, subject_id)
         if not sub:
             return jsonify({"error": "Subject not found"}), 404
-        if sub.program.institute.trust_id_fk != int(trust_id):
+        if sub.program_id_fk not in scope.program_ids:
             return jsonify({"error": "Unauthorized subject access"}), 403
 
     slot = TimetableSlot.query.filter_by(
@@ -299,11 +282,8 @@ def update_settings():
     academic_year = request.form.get("academic_year")
     
     # Trust Isolation Check
-    trust_id = None
-    if getattr(current_user, "is_super_admin", False):
-        trust_id = session.get("active_trust_id")
-    else:
-        trust_id = getattr(current_user, "trust_id_fk", None)
+    scope = current_scope()
+    trust_id = scope.trust_id
         
     if not trust_id:
         flash("Unauthorized context", "danger")
@@ -314,13 +294,9 @@ def update_settings():
         flash("Program not found", "danger")
         return redirect(request.referrer)
         
-    try:
-        if program.institute.trust_id_fk != int(trust_id):
-             flash("Unauthorized program access", "danger")
-             return redirect(request.referrer)
-    except:
-         flash("Validation error", "danger")
-         return redirect(request.referrer)
+    if program.program_id not in scope.program_ids:
+        flash("Unauthorized program access", "danger")
+        return redirect(request.referrer)
 
     settings = _get_timetable_settings(program_id, academic_year)
     if not settings:
@@ -0,0 +1,150 @@
+import os
+import random
+import string
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+
+from . import db
+from .announcement_inbox import refresh_users
+from .models import User
+
+
+# Bulk account creation for imports. Hashing dominates the cost (Werkzeug's
+# PBKDF2 default is 600k iterations, ~0.3s per password), so new passwords are
+# hashed on a pool and the rows are written with a handful of statements
+# instead of one SELECT/INSERT/flush per student.
+#
+# hashlib.pbkdf2_hmac releases the GIL while it runs, so a thread pool spreads
+# the hashing across cores without forking the app process (which would also
+# copy open DB connections and the job worker thread).
+
+_MIN_PARALLEL = 16
+
+
+def random_password(length: int = 10) -> str:
+    chars = string.ascii_letters + string.digits
+    return "".join(random.SystemRandom().choice(chars) for _ in range(length))
+
+
+def student_credentials(enrollment_no, mobile):
+    """Default student login: ``(username, password, mobile_digits)``.
+
+    Username and password are the mobile number when it has at least 10 digits,
+    otherwise the enrollment number.
+    """
+    mobile_digits = "".join(ch for ch in str(mobile) if ch.isdigit()) if mobile else ""
+    if len(mobile_digits) >= 10:
+        return mobile_digits, mobile_digits, mobile_digits
+    return str(enrollment_no), str(enrollment_no), mobile_digits
+
+
+def hash_workers():
+    try:
+        configured = int(os.environ.get("CMS_HASH_WORKERS", "0") or 0)
+    except Exception:
+        configured = 0
+    return configured if configured > 0 else (os.cpu_count() or 1)
+
+
+def hash_passwords(passwords, workers=None):
+    """``generate_password_hash`` for each password, in order, hashed in parallel."""
+    passwords = list(passwords)
+    workers = min(workers or hash_workers(), len(passwords))
+    if workers <= 1 or len(passwords) < _MIN_PARALLEL:
+        return [generate_password_hash(p) for p in passwords]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pwhash") as pool:
+        return list(pool.map(generate_password_hash, passwords))
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def provision_users(specs, reset_password=False, reactivate=True, chunk_size=500, workers=None):
+    """Create or refresh login accounts in bulk.
+
+    ``specs`` is an iterable of dicts with ``username`` and ``password`` plus any of
+    ``role`` (default ``student``), ``program_id``, ``trust_id``, ``mobile``, ``email``
+    and ``must_change_password`` (default True). The first spec wins for a
+    duplicated username.
+
+    Existing accounts are reactivated (unless ``reactivate`` is False) and get
+    ``program_id``/``trust_id``/``mobile`` when the spec provides them; with
+    ``reset_password`` their role and password are reset as well. New accounts are hashed in parallel and inserted in chunks.
+
+    Returns ``{"user_ids": {username: user_id}, "created": n, "updated": n}``.
+    Runs inside the caller's transaction; nothing is committed.
+    """
+    by_username = {}
+    for spec in specs:
+        username = str(spec.get("username") or "").strip()
+        if username and username not in by_username:
+            by_username[username] = spec
+    if not by_username:
+        return {"user_ids": {}, "created": 0, "updated": 0}
+
+    # Pending ORM changes to users must be visible to the prefetch below.
+    db.session.flush()
+    usernames = list(by_username)
+    existing = {}
+    for chunk in _chunks(usernames, chunk_size):
+        for user_id, username in db.session.execute(select(User.user_id, User.username).where(User.username.in_(chunk))).all():
+            existing[username] = user_id
+
+    new_names = [u for u in usernames if u not in existing]
+    rehash = new_names + ([u for u in usernames if u in existing] if reset_password else [])
+    hashes = dict(zip(rehash, hash_passwords([str(by_username[u].get("password") or u) for u in rehash], workers=workers)))
+
+    updates = []
+    for username, user_id in existing.items():
+        spec = by_username[username]
+        row = {"user_id": user_id}
+        if reactivate:
+            row["is_active"] = True
+        if spec.get("program_id"):
+            row["program_id_fk"] = spec["program_id"]
+        if spec.get("trust_id"):
+            row["trust_id_fk"] = spec["trust_id"]
+        if spec.get("mobile"):
+            row["mobile"] = spec["mobile"]
+        if reset_password:
+            row["password_hash"] = hashes[username]
+            row["role"] = spec.get("role") or "student"
+            row["must_change_password"] = spec.get("must_change_password", True)
+        if len(row) > 1:
+            updates.append(row)
+    # Keep identity-mapped User objects consistent with the bulk UPDATE.
+    for row in updates:
+        obj = db.session.identity_map.get(db.session.identity_key(User, row["user_id"]))
+        if obj is not None:
+            db.session.expire(obj)
+    for chunk in _chunks(updates, chunk_size):
+        db.session.bulk_update_mappings(User, chunk)
+
+    rows = [
+        {
+            "username": username,
+            "password_hash": hashes[username],
+            "role": by_username[username].get("role") or "student",
+            "program_id_fk": by_username[username].get("program_id"),
+            "trust_id_fk": by_username[username].get("trust_id"),
+            "mobile": by_username[username].get("mobile") or None,
+            "email": by_username[username].get("email") or None,
+            "must_change_password": by_username[username].get("must_change_password", True),
+            "is_active": True,
+        }
+        for username in new_names
+    ]
+    user_ids = dict(existing)
+    for chunk in _chunks(rows, chunk_size):
+        db.session.execute(insert(User.__table__), chunk)
+        names = [r["username"] for r in chunk]
+        for user_id, username in db.session.execute(select(User.user_id, User.username).where(User.username.in_(names))).all():
+            user_ids[username] = user_id
+    # Core inserts/bulk updates skip the mapper events that keep announcement inboxes
+    # current. Only add rows here; a changed program's stale rows go with the periodic sweep.
+    refresh_users(user_ids.values(), prune=False)
+    return {"user_ids": user_ids, "created": len(rows), "updated": len(updates)}
@@ -1,9 +1,9 @@
 from flask import render_template, request, redirect, url_for, flash, current_app, Response, session
 from flask_login import login_required, current_user
 from . import wizard
-from .. import db
+from .. import db, schema_registry
 from ..models import Trust, Institute, Program, User, Faculty
-from sqlalchemy import MetaData, Table, inspect as sa_inspect, select
+from sqlalchemy import select
 import os
 import csv
 from io import TextIOWrapper
@@ -11,15 +11,11 @@ from werkzeug.security import generate_password_hash
 
 
 def _table_columns(table_name):
-    try:
-        return {c["name"] for c in sa_inspect(db.engine).get_columns(table_name)}
-    except Exception:
-        return set()
+    return schema_registry.table_columns(table_name)
 
 
 def _reflected_table(table_name):
-    metadata = MetaData()
-    return Table(table_name, metadata, autoload_with=db.engine)
+    return schema_registry.reflected_table(table_name)
 
 
 def _fetch_row_mapping(table_name, pk_column, pk_value, column_names=None):
@@ -0,0 +1,50 @@
+# gunicorn -c gunicorn.conf.py app:app
+#
+# Starts the background job worker (cms_app/scripts/run_jobs_worker.py) next to
+# the web workers and stops it with the arbiter. Set CMS_JOBS_WORKER=0 when the
+# worker runs as its own service instead. With CMS_METRICS_DIR set, /metrics
+# sums every worker's counters from that directory (see cms_app/metrics.py).
+import os
+import subprocess
+import sys
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:" + os.environ.get("PORT", "8000"))
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+
+_job_worker = None
+
+
+def on_starting(server):
+    # Metrics files of the previous run would be summed into this one's counters
+    directory = os.environ.get("CMS_METRICS_DIR") or os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory and os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith("cms_") and name.endswith((".json", ".tmp")):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+
+def _worker_enabled():
+    return (os.environ.get("CMS_JOBS_WORKER", "1") or "").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def when_ready(server):
+    global _job_worker
+    if not _worker_enabled():
+        return
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cms_app", "scripts", "run_jobs_worker.py")
+    _job_worker = subprocess.Popen([sys.executable, script])
+    server.log.info("Started job worker (pid %s)", _job_worker.pid)
+
+
+def on_exit(server):
+    if _job_worker is None or _job_worker.poll() is not None:
+        return
+    _job_worker.terminate()
+    try:
+        _job_worker.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        _job_worker.kill()
@@ -0,0 +1,56 @@
+"""add composite indexes for attendance, exam marks, enrollments and fee payments
+
+Revision ID: a1c4e7b2d9f0
+Revises: 9f2c3d4e5f67
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1c4e7b2d9f0'
+down_revision = '9f2c3d4e5f67'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_attendance_subject_date_period_student', 'attendance', ['subject_id_fk', 'date_marked', 'period_no', 'student_id_fk']),
+    ('ix_attendance_date_division', 'attendance', ['date_marked', 'division_id_fk']),
+    ('ix_attendance_student_date', 'attendance', ['student_id_fk', 'date_marked']),
+    ('ix_exam_marks_scheme_subject', 'exam_marks', ['scheme_id_fk', 'subject_id_fk']),
+    ('ix_sse_student_active', 'student_subject_enrollments', ['student_id_fk', 'is_active']),
+    ('ix_sse_subject_year_active', 'student_subject_enrollments', ['subject_id_fk', 'academic_year', 'is_active']),
+    ('ix_fee_payments_program_semester_status', 'fee_payments', ['program_id_fk', 'semester', 'status']),
+    ('ix_fee_payments_enrollment_status', 'fee_payments', ['enrollment_no', 'status']),
+    ('ix_announcement_recipients_student', 'announcement_recipients', ['student_id_fk', 'announcement_id_fk']),
+    ('ix_announcement_dismissals_user', 'announcement_dismissals', ['user_id_fk', 'announcement_id_fk']),
+    ('ix_system_message_reads_user', 'system_message_reads', ['user_id_fk', 'message_id_fk']),
+]
+
+
+def _existing_indexes(inspector, table_name):
+    try:
+        return {ix['name'] for ix in inspector.get_indexes(table_name)}
+    except Exception:
+        return None
+
+
+def upgrade():
+    # Dev databases built with db.create_all() may already carry these indexes.
+    inspector = sa.inspect(op.get_bind())
+    for name, table_name, columns in INDEXES:
+        existing = _existing_indexes(inspector, table_name)
+        if existing is None or name in existing:
+            continue
+        op.create_index(name, table_name, columns)
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table_name, _ in reversed(INDEXES):
+        existing = _existing_indexes(inspector, table_name)
+        if existing and name in existing:
+            op.drop_index(name, table_name=table_name)
@@ -0,0 +1,47 @@
+"""add email_outbox
+
+Revision ID: a8c0e2f4b6d7
+Revises: f7b9d1e3a5c6
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8c0e2f4b6d7'
+down_revision = 'f7b9d1e3a5c6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'email_outbox',
+        sa.Column('email_id', sa.Integer(), primary_key=True),
+        sa.Column('to_address', sa.String(length=255), nullable=False),
+        sa.Column('subject', sa.String(length=255), nullable=False),
+        sa.Column('text_body', sa.Text(), nullable=True),
+        sa.Column('html_body', sa.Text(), nullable=True),
+        sa.Column('category', sa.String(length=32), nullable=True),
+        sa.Column('status', sa.String(length=16), nullable=False, server_default='queued'),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('max_attempts', sa.Integer(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+        sa.Column('locked_by', sa.String(length=64), nullable=True),
+        sa.Column('locked_at', sa.DateTime(), nullable=True),
+        sa.Column('created_by_user_id_fk', sa.Integer(), nullable=True),
+        sa.Column('trust_id_fk', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['created_by_user_id_fk'], ['users.user_id']),
+        sa.ForeignKeyConstraint(['trust_id_fk'], ['trusts.trust_id']),
+    )
+    op.create_index('ix_email_outbox_status_next', 'email_outbox', ['status', 'next_attempt_at'])
+
+
+def downgrade():
+    op.drop_index('ix_email_outbox_status_next', table_name='email_outbox')
+    op.drop_table('email_outbox')
@@ -0,0 +1,64 @@
+"""add attendance session and student rollup tables
+
+Revision ID: b3d5f7a9c2e1
+Revises: a1c4e7b2d9f0
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d5f7a9c2e1'
+down_revision = 'a1c4e7b2d9f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'attendance_session_rollups',
+        sa.Column('session_id', sa.Integer(), primary_key=True),
+        sa.Column('date_marked', sa.Date(), nullable=False),
+        sa.Column('subject_id_fk', sa.Integer(), nullable=False),
+        sa.Column('division_id_fk', sa.Integer(), nullable=True),
+        sa.Column('period_no', sa.Integer(), nullable=True),
+        sa.Column('semester', sa.Integer(), nullable=True),
+        sa.Column('present_count', sa.Integer(), nullable=True),
+        sa.Column('absent_count', sa.Integer(), nullable=True),
+        sa.Column('late_count', sa.Integer(), nullable=True),
+        sa.Column('total_count', sa.Integer(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['subject_id_fk'], ['subjects.subject_id']),
+        sa.ForeignKeyConstraint(['division_id_fk'], ['divisions.division_id']),
+    )
+    op.create_index('ix_att_session_rollup_date_subject', 'attendance_session_rollups', ['date_marked', 'subject_id_fk'])
+    op.create_index('ix_att_session_rollup_subject_division_date', 'attendance_session_rollups', ['subject_id_fk', 'division_id_fk', 'date_marked'])
+
+    op.create_table(
+        'attendance_student_rollups',
+        sa.Column('rollup_id', sa.Integer(), primary_key=True),
+        sa.Column('student_id_fk', sa.String(length=32), nullable=False),
+        sa.Column('subject_id_fk', sa.Integer(), nullable=False),
+        sa.Column('academic_year', sa.String(length=16), nullable=False),
+        sa.Column('present_count', sa.Integer(), nullable=True),
+        sa.Column('absent_count', sa.Integer(), nullable=True),
+        sa.Column('late_count', sa.Integer(), nullable=True),
+        sa.Column('total_count', sa.Integer(), nullable=True),
+        sa.Column('last_marked', sa.Date(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['student_id_fk'], ['students.enrollment_no']),
+        sa.ForeignKeyConstraint(['subject_id_fk'], ['subjects.subject_id']),
+        sa.UniqueConstraint('student_id_fk', 'subject_id_fk', 'academic_year', name='uq_att_student_rollup'),
+    )
+    op.create_index('ix_att_student_rollup_subject_year', 'attendance_student_rollups', ['subject_id_fk', 'academic_year'])
+    # Rows are backfilled on next app start (or via cms_app/scripts/rebuild_attendance_rollups.py).
+
+
+def downgrade():
+    op.drop_index('ix_att_student_rollup_subject_year', table_name='attendance_student_rollups')
+    op.drop_table('attendance_student_rollups')
+    op.drop_index('ix_att_session_rollup_subject_division_date', table_name='attendance_session_rollups')
+    op.drop_index('ix_att_session_rollup_date_subject', table_name='attendance_session_rollups')
+    op.drop_table('attendance_session_rollups')
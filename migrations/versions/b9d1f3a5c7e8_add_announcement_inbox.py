@@ -0,0 +1,37 @@
+"""add announcement_inbox
+
+Revision ID: b9d1f3a5c7e8
+Revises: a8c0e2f4b6d7
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9d1f3a5c7e8'
+down_revision = 'a8c0e2f4b6d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'announcement_inbox',
+        sa.Column('inbox_id', sa.Integer(), primary_key=True),
+        sa.Column('announcement_id_fk', sa.Integer(), nullable=False),
+        sa.Column('user_id_fk', sa.Integer(), nullable=False),
+        sa.Column('is_read', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('read_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['announcement_id_fk'], ['announcements.announcement_id']),
+        sa.ForeignKeyConstraint(['user_id_fk'], ['users.user_id']),
+        sa.UniqueConstraint('user_id_fk', 'announcement_id_fk', name='uq_announcement_inbox'),
+    )
+    op.create_index('ix_announcement_inbox_unread', 'announcement_inbox', ['user_id_fk', 'is_read'])
+    # Rows are backfilled on next app start.
+
+
+def downgrade():
+    op.drop_index('ix_announcement_inbox_unread', table_name='announcement_inbox')
+    op.drop_table('announcement_inbox')
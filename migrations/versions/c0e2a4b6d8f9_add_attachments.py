@@ -0,0 +1,47 @@
+"""add attachments manifest
+
+Revision ID: c0e2a4b6d8f9
+Revises: b9d1f3a5c7e8
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c0e2a4b6d8f9'
+down_revision = 'b9d1f3a5c7e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'attachments',
+        sa.Column('attachment_id', sa.Integer(), primary_key=True),
+        sa.Column('owner_type', sa.String(length=16), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=False),
+        sa.Column('subject_id_fk', sa.Integer(), nullable=True),
+        sa.Column('file_name', sa.String(length=255), nullable=False),
+        sa.Column('size_bytes', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('mime_type', sa.String(length=127), nullable=True),
+        sa.Column('storage_path', sa.String(length=255), nullable=False),
+        sa.Column('uploaded_by_user_id_fk', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['subject_id_fk'], ['subjects.subject_id']),
+        sa.ForeignKeyConstraint(['uploaded_by_user_id_fk'], ['users.user_id']),
+    )
+    op.create_index('ix_attachments_owner', 'attachments', ['owner_type', 'owner_id'])
+    op.create_index('ix_attachments_subject_size', 'attachments', ['subject_id_fk', 'size_bytes'])
+    op.create_index('ix_attachments_storage_path', 'attachments', ['storage_path'])
+    # Files uploaded before this revision are registered by
+    # cms_app/scripts/backfill_attachments.py.
+
+
+def downgrade():
+    op.drop_index('ix_attachments_storage_path', table_name='attachments')
+    op.drop_index('ix_attachments_subject_size', table_name='attachments')
+    op.drop_index('ix_attachments_owner', table_name='attachments')
+    op.drop_table('attachments')
@@ -0,0 +1,55 @@
+"""add background_jobs table for the persistent job queue
+
+Revision ID: c4e6a8b0d2f3
+Revises: b3d5f7a9c2e1
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e6a8b0d2f3'
+down_revision = 'b3d5f7a9c2e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'background_jobs',
+        sa.Column('job_id', sa.Integer(), primary_key=True),
+        sa.Column('kind', sa.String(length=64), nullable=False),
+        sa.Column('label', sa.String(length=255), nullable=True),
+        sa.Column('status', sa.String(length=16), nullable=False, server_default='queued'),
+        sa.Column('payload_json', sa.Text(), nullable=True),
+        sa.Column('result_json', sa.Text(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('progress', sa.Integer(), nullable=True),
+        sa.Column('progress_message', sa.String(length=255), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('max_attempts', sa.Integer(), nullable=True),
+        sa.Column('cancel_requested', sa.Boolean(), nullable=True),
+        sa.Column('artifact_path', sa.String(length=255), nullable=True),
+        sa.Column('artifact_downloaded_at', sa.DateTime(), nullable=True),
+        sa.Column('return_url', sa.String(length=255), nullable=True),
+        sa.Column('created_by_user_id_fk', sa.Integer(), nullable=True),
+        sa.Column('trust_id_fk', sa.Integer(), nullable=True),
+        sa.Column('run_after', sa.DateTime(), nullable=True),
+        sa.Column('locked_by', sa.String(length=64), nullable=True),
+        sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['created_by_user_id_fk'], ['users.user_id']),
+        sa.ForeignKeyConstraint(['trust_id_fk'], ['trusts.trust_id']),
+    )
+    op.create_index('ix_background_jobs_status_run_after', 'background_jobs', ['status', 'run_after'])
+    op.create_index('ix_background_jobs_user_created', 'background_jobs', ['created_by_user_id_fk', 'created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_background_jobs_user_created', table_name='background_jobs')
+    op.drop_index('ix_background_jobs_status_run_after', table_name='background_jobs')
+    op.drop_table('background_jobs')
@@ -0,0 +1,40 @@
+"""add covering index for the student list filters
+
+Revision ID: d5f7b9c1e3a4
+Revises: c4e6a8b0d2f3
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5f7b9c1e3a4'
+down_revision = 'c4e6a8b0d2f3'
+branch_labels = None
+depends_on = None
+
+
+INDEX_NAME = 'ix_students_list_scope'
+COLUMNS = ['trust_id_fk', 'program_id_fk', 'current_semester', 'is_active', 'medium_tag', 'division_id_fk', 'enrollment_no']
+
+
+def _existing_indexes(inspector):
+    try:
+        return {ix['name'] for ix in inspector.get_indexes('students')}
+    except Exception:
+        return None
+
+
+def upgrade():
+    # Dev databases built with db.create_all() may already carry the index.
+    existing = _existing_indexes(sa.inspect(op.get_bind()))
+    if existing is not None and INDEX_NAME not in existing:
+        op.create_index(INDEX_NAME, 'students', COLUMNS)
+
+
+def downgrade():
+    existing = _existing_indexes(sa.inspect(op.get_bind()))
+    if existing and INDEX_NAME in existing:
+        op.drop_index(INDEX_NAME, table_name='students')
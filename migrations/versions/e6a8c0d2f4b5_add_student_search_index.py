@@ -0,0 +1,72 @@
+"""add full-text student search index
+
+Revision ID: e6a8c0d2f4b5
+Revises: d5f7b9c1e3a4
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a8c0d2f4b5'
+down_revision = 'd5f7b9c1e3a4'
+branch_labels = None
+depends_on = None
+
+
+# Mirrors cms_app/student_search.py at the time of writing.
+FTS_COLUMNS = "enrollment_no, student_name, surname, father_name, roll_no, mobile"
+
+DELETE_OLD = (
+    "DELETE FROM student_search WHERE student_search MATCH "
+    "'enrollment_no:\"' || replace(old.enrollment_no, '\"', '\"\"') || '\"' "
+    "AND enrollment_no = old.enrollment_no AND old.enrollment_no GLOB '*[0-9A-Za-z]*'; "
+    "DELETE FROM student_search WHERE old.enrollment_no NOT GLOB '*[0-9A-Za-z]*' "
+    "AND enrollment_no = old.enrollment_no;"
+)
+INSERT_NEW = (
+    f"INSERT INTO student_search ({FTS_COLUMNS}) "
+    "VALUES (new.enrollment_no, new.student_name, new.surname, new.father_name, new.roll_no, new.mobile);"
+)
+
+SQLITE_UPGRADE = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS student_search USING fts5({FTS_COLUMNS}, tokenize='unicode61', prefix='2 3 4')",
+    f"CREATE TRIGGER IF NOT EXISTS students_search_ai AFTER INSERT ON students BEGIN {INSERT_NEW} END",
+    f"CREATE TRIGGER IF NOT EXISTS students_search_ad AFTER DELETE ON students BEGIN {DELETE_OLD} END",
+    f"CREATE TRIGGER IF NOT EXISTS students_search_au AFTER UPDATE OF {FTS_COLUMNS} ON students BEGIN {DELETE_OLD} {INSERT_NEW} END",
+    "DELETE FROM student_search",
+    f"INSERT INTO student_search ({FTS_COLUMNS}) SELECT {FTS_COLUMNS} FROM students",
+]
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS students_search_ai",
+    "DROP TRIGGER IF EXISTS students_search_ad",
+    "DROP TRIGGER IF EXISTS students_search_au",
+    "DROP TABLE IF EXISTS student_search",
+]
+
+PG_INDEX = (
+    "CREATE INDEX IF NOT EXISTS ix_students_search_tsv ON students USING gin (("
+    "((setweight(to_tsvector('simple'::regconfig, coalesce(students.enrollment_no, '')), 'A'::\"char\") || "
+    "setweight(to_tsvector('simple'::regconfig, coalesce(concat_ws(' ', students.student_name, students.surname), '')), 'B'::\"char\")) || "
+    "setweight(to_tsvector('simple'::regconfig, coalesce(concat_ws(' ', students.roll_no, students.mobile), '')), 'B'::\"char\")) || "
+    "setweight(to_tsvector('simple'::regconfig, coalesce(students.father_name, '')), 'C'::\"char\")))"
+)
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for stmt in SQLITE_UPGRADE:
+            op.execute(stmt)
+    elif dialect == 'postgresql':
+        op.execute(PG_INDEX)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for stmt in SQLITE_DOWNGRADE:
+            op.execute(stmt)
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_students_search_tsv")
@@ -0,0 +1,44 @@
+"""add student_fee_balance projection
+
+Revision ID: f7b9d1e3a5c6
+Revises: e6a8c0d2f4b5
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7b9d1e3a5c6'
+down_revision = 'e6a8c0d2f4b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'student_fee_balance',
+        sa.Column('balance_id', sa.Integer(), primary_key=True),
+        sa.Column('enrollment_no', sa.String(length=32), nullable=False),
+        sa.Column('program_id_fk', sa.Integer(), nullable=False),
+        sa.Column('semester', sa.Integer(), nullable=False),
+        sa.Column('medium_tag', sa.String(length=32), nullable=False, server_default=''),
+        sa.Column('verified_total', sa.Float(), nullable=True),
+        sa.Column('submitted_total', sa.Float(), nullable=True),
+        sa.Column('verified_count', sa.Integer(), nullable=True),
+        sa.Column('submitted_count', sa.Integer(), nullable=True),
+        sa.Column('rejected_count', sa.Integer(), nullable=True),
+        sa.Column('last_payment_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['enrollment_no'], ['students.enrollment_no']),
+        sa.ForeignKeyConstraint(['program_id_fk'], ['programs.program_id']),
+        sa.UniqueConstraint('enrollment_no', 'program_id_fk', 'semester', 'medium_tag', name='uq_student_fee_balance'),
+    )
+    op.create_index('ix_student_fee_balance_scope', 'student_fee_balance', ['program_id_fk', 'semester', 'medium_tag'])
+    # Rows are backfilled on next app start (or via the "Reconcile Balances" job).
+
+
+def downgrade():
+    op.drop_index('ix_student_fee_balance_scope', table_name='student_fee_balance')
+    op.drop_table('student_fee_balance')
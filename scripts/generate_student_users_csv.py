@@ -2,7 +2,6 @@ import os
 import sys
 import csv
 import random
-import string
 
 # Ensure project root on path
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -10,14 +9,9 @@ if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 
 from cms_app import create_app, db
-from cms_app.models import User, Student, Division, Program
+from cms_app.models import Student, Division
+from cms_app.user_provisioning import provision_users, random_password, student_credentials
 from sqlalchemy import select
-from werkzeug.security import generate_password_hash
-
-
-def gen_password(length: int = 10) -> str:
-    chars = string.ascii_letters + string.digits
-    return ''.join(random.choice(chars) for _ in range(length))
 
 
 def compute_roll_numbers() -> dict:
@@ -41,64 +35,26 @@ def compute_roll_numbers() -> dict:
     return rolls
 
 
-def ensure_student_user(student: Student) -> tuple:
-    """Create or update a user for the given student.
+def student_user_spec(student: Student) -> dict:
+    """Login spec for the given student (see ``provision_users``).
 
-    Returns: (username, plain_password, user_obj)
+    Username/password: Mobile (if >= 10 digits), else Enrollment No with a
+    random password. Passwords are refreshed on every run.
     """
-    # Preference: Mobile > Enrollment No
-    username = ""
-    mobile_digits = ""
-    if student.mobile:
-        mobile_digits = ''.join(ch for ch in student.mobile if ch.isdigit())
-        if len(mobile_digits) >= 10:
-             username = mobile_digits
-    
-    if not username:
-        username = (student.enrollment_no or '').strip()
-
+    username, _password, mobile_digits = student_credentials((student.enrollment_no or '').strip(), student.mobile)
     if not username:
         # Fallback to generated username if enrollment missing
         base = (student.first_name or 'student').replace(' ', '').lower()
         username = f"{base}{random.randint(1000,9999)}"
 
-    user = db.session.execute(
-        select(User).filter_by(username=username)
-    ).scalars().first()
-    
-    # Password Logic: Mobile if available, else random
-    if mobile_digits and len(mobile_digits) >= 10:
-        plain_password = mobile_digits
-    else:
-        plain_password = gen_password(10)
-        
-    password_hash = generate_password_hash(plain_password)
-
-    # Determine program id
-    program_id = student.program_id_fk
-    # Role as lowercase 'student' to match role checks
-    role = 'student'
-
-    if not user:
-        user = User(
-            username=username, 
-            password_hash=password_hash, 
-            role=role, 
-            program_id_fk=program_id,
-            must_change_password=True
-        )
-        db.session.add(user)
-        db.session.flush()  # assign user_id
-    else:
-        # Update role/program if missing; refresh password each run
-        user.role = role
-        user.program_id_fk = program_id
-        user.password_hash = password_hash
-        user.must_change_password = True
-
-    # Link student to user
-    student.user_id_fk = user.user_id
-    return username, plain_password, user
+    plain_password = mobile_digits if len(mobile_digits) >= 10 else random_password(10)
+    return {
+        "username": username,
+        "password": plain_password,
+        "role": "student",
+        "program_id": student.program_id_fk,
+        "must_change_password": True,
+    }
 
 
 def generate_csv(output_path: str) -> None:
@@ -111,9 +67,19 @@ def generate_csv(output_path: str) -> None:
         )
     ).scalars().all()
 
+    # Create/refresh all accounts in one pass (passwords hashed in parallel)
+    specs = [student_user_spec(s) for s in students]
+    user_ids = provision_users(specs, reset_password=True)["user_ids"]
+    # Students sharing a mobile share one account; the first spec's password wins
+    passwords = {}
+    for spec in specs:
+        passwords.setdefault(spec["username"], spec["password"])
+
     rows = []
-    for s in students:
-        username, plain_password, _u = ensure_student_user(s)
+    for s, spec in zip(students, specs):
+        username = spec["username"]
+        plain_password = passwords[username]
+        s.user_id_fk = user_ids.get(username)
         division = db.session.get(Division, s.division_id_fk) if s.division_id_fk else None
         div_code = division.division_code if division else ''
         semester = s.current_semester or (division.semester if division else None)
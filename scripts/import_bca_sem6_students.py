@@ -3,7 +3,8 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from cms_app import create_app, db
-from cms_app.models import User, Student, Program, Division
+from cms_app.user_provisioning import provision_users
+from cms_app.models import Student, Program, Division
 from sqlalchemy import select, update
 import pandas as pd
 import random
@@ -66,6 +67,7 @@ def import_bca_sem6():
 
         print("--- Step 3: Importing / Updating Semester 6 Students ---")
         stats = {"created_users": 0, "created_students": 0, "updated_students": 0}
+        pending_users = []
 
         for index, row in df.iterrows():
             degree_program = str(row.get('Degree Program', '')).strip()
@@ -121,35 +123,23 @@ def import_bca_sem6():
                 continue
             division_id = division.division_id
 
-            user = db.session.execute(select(User).filter_by(username=enrollment_no)).scalars().first()
             mobile_raw = row.get('Mobile')
             mobile = (
                 str(int(mobile_raw))
                 if pd.notnull(mobile_raw) and not isinstance(mobile_raw, str)
                 else str(mobile_raw) if pd.notnull(mobile_raw) else None
             )
-
-            if not user:
-                email = row.get('Email Id') if pd.notnull(row.get('Email Id')) else f"{enrollment_no}@cms.com"
-                user = User(
-                    username=enrollment_no,
-                    email=email,
-                    mobile=mobile,
-                    role='student',
-                    trust_id_fk=trust_id,
-                    is_active=True,
-                    must_change_password=True
-                )
-                password = mobile if mobile and len(mobile) >= 6 else generate_random_password()
-                user.set_password(password)
-                db.session.add(user)
-                db.session.flush()
-                stats["created_users"] += 1
-            else:
-                user.is_active = True
-                user.trust_id_fk = trust_id
-                if mobile:
-                    user.mobile = mobile
+            email = row.get('Email Id') if pd.notnull(row.get('Email Id')) else f"{enrollment_no}@cms.com"
+            # Accounts are provisioned in one pass after the sheet is read.
+            # Password strategy: Mobile or Random
+            user_spec = {
+                "username": enrollment_no,
+                "password": mobile if mobile and len(mobile) >= 6 else generate_random_password(),
+                "email": email,
+                "mobile": mobile,
+                "role": "student",
+                "trust_id": trust_id,
+            }
 
             student = db.session.execute(select(Student).filter_by(enrollment_no=enrollment_no)).scalars().first()
 
@@ -171,7 +161,6 @@ def import_bca_sem6():
             if not student:
                 student = Student(
                     enrollment_no=enrollment_no,
-                    user_id_fk=user.user_id,
                     program_id_fk=program_id,
                     trust_id_fk=trust_id,
                     student_name=s_name,
@@ -183,7 +172,7 @@ def import_bca_sem6():
                     aadhar_no=s_aadhar,
                     category=s_category,
                     mobile=mobile,
-                    email=user.email,
+                    email=email,
                     permanent_address=s_address,
                     current_semester=6,
                     date_of_birth=s_dob,
@@ -209,6 +198,14 @@ def import_bca_sem6():
                 student.trust_id_fk = trust_id
                 stats["updated_students"] += 1
 
+            pending_users.append((student, user_spec))
+
+        result = provision_users([spec for _student, spec in pending_users])
+        for student, spec in pending_users:
+            if not student.user_id_fk:
+                student.user_id_fk = result["user_ids"].get(spec["username"])
+        stats["created_users"] = result["created"]
+
         try:
             db.session.commit()
             print("--- SUCCESS (BCA Sem 6) ---")
@@ -3,7 +3,8 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from cms_app import create_app, db
-from cms_app.models import User, Student, Program, Subject, StudentSubjectEnrollment, Division
+from cms_app.user_provisioning import provision_users
+from cms_app.models import Student, Program, Subject, StudentSubjectEnrollment, Division
 from sqlalchemy import select, update
 import pandas as pd
 import os
@@ -88,6 +89,7 @@ def import_bca_data():
         # 3. Import New Data
         print("--- Step 3: Importing New Students ---")
         stats = {"created_users": 0, "created_students": 0, "updated_students": 0, "enrollments": 0}
+        pending_users = []
 
         # Pre-fetch subjects for Sem 4 BCA to avoid repeated queries
         subjects = db.session.execute(
@@ -121,34 +123,21 @@ def import_bca_data():
                 print(f"Skipping row {index+2}: Invalid Enrollment Number {enroll_raw}")
                 continue
             
-            # 3.1 Handle User Account
-            user = db.session.execute(select(User).filter_by(username=enrollment_no)).scalars().first()
             mobile_raw = row.get('Mobile')
             mobile = str(int(mobile_raw)) if pd.notnull(mobile_raw) and not isinstance(mobile_raw, str) else str(mobile_raw) if pd.notnull(mobile_raw) else None
             
-            if not user:
-                email = row.get('Email Id') if pd.notnull(row.get('Email Id')) else f"{enrollment_no}@cms.com"
-                user = User(
-                    username=enrollment_no,
-                    email=email,
-                    mobile=mobile,
-                    role='student',
-                    trust_id_fk=trust_id,
-                    is_active=True,
-                    must_change_password=True
-                )
-                # Password strategy: Mobile or Random
-                password = mobile if mobile and len(mobile) >= 6 else generate_random_password()
-                user.set_password(password)
-                db.session.add(user)
-                db.session.flush()
-                stats["created_users"] += 1
-            else:
-                user.is_active = True
-                user.trust_id_fk = trust_id # Ensure trust is set
-                if mobile: user.mobile = mobile
+            email = row.get('Email Id') if pd.notnull(row.get('Email Id')) else f"{enrollment_no}@cms.com"
+            # Accounts are provisioned in one pass after the sheet is read.
+            # Password strategy: Mobile or Random
+            user_spec = {
+                "username": enrollment_no,
+                "password": mobile if mobile and len(mobile) >= 6 else generate_random_password(),
+                "email": email,
+                "mobile": mobile,
+                "role": "student",
+                "trust_id": trust_id,
+            }
 
-            # 3.2 Handle Student Profile
             student = db.session.execute(select(Student).filter_by(enrollment_no=enrollment_no)).scalars().first()
             
             s_name = str(row.get('Student Name', '')).strip()
@@ -158,13 +147,11 @@ def import_bca_data():
             roll_raw = row.get('Roll No') if 'Roll No' in df.columns else row.get('RollNo')
             if pd.isna(roll_raw):
                 print(f"Skipping row {index+2}: Missing RollNo")
-                db.session.expunge(user)
                 continue
             try:
                 s_roll_num = int(roll_raw)
             except Exception:
                 print(f"Skipping row {index+2}: Invalid RollNo {roll_raw}")
-                db.session.expunge(user)
                 continue
             s_roll = str(s_roll_num)
             s_address = str(row.get('Permanent Address', ''))[:255] if pd.notnull(row.get('Permanent Address')) else None
@@ -178,7 +165,6 @@ def import_bca_data():
             div_raw = row.get('Division')
             if pd.isna(div_raw):
                 print(f"Skipping row {index+2}: Missing Division")
-                db.session.expunge(user)
                 continue
             div_code = str(div_raw).strip().upper()
             if div_code and len(div_code) > 1:
@@ -193,14 +179,12 @@ def import_bca_data():
             ).scalars().first()
             if not division:
                 print(f"Skipping row {index+2}: Division '{div_code}' not found for BCA Sem 4")
-                db.session.expunge(user)
                 continue
             division_id = division.division_id
 
             if not student:
                 student = Student(
                     enrollment_no=enrollment_no,
-                    user_id_fk=user.user_id,
                     program_id_fk=program_id,
                     trust_id_fk=trust_id,
                     student_name=s_name,
@@ -212,7 +196,7 @@ def import_bca_data():
                     aadhar_no=s_aadhar,
                     category=s_category,
                     mobile=mobile,
-                    email=user.email,
+                    email=email,
                     permanent_address=s_address,
                     current_semester=4,
                     date_of_birth=s_dob,
@@ -239,6 +223,8 @@ def import_bca_data():
                 student.trust_id_fk = trust_id
                 stats["updated_students"] += 1
 
+            pending_users.append((student, user_spec))
+
             # 3.3 Handle Subject Enrollments for 2025-26
             for subject in subjects:
                 # Check for existing active enrollment
@@ -266,6 +252,12 @@ def import_bca_data():
                     existing_sub.is_active = True
                     existing_sub.division_id_fk = division_id
 
+        result = provision_users([spec for _student, spec in pending_users])
+        for student, spec in pending_users:
+            if not student.user_id_fk:
+                student.user_id_fk = result["user_ids"].get(spec["username"])
+        stats["created_users"] = result["created"]
+
         try:
             db.session.commit()
             print(f"--- SUCCESS ---")
@@ -4,19 +4,16 @@ import sys
 import os
 from typing import Dict, List
 
-from openpyxl import load_workbook
-from openpyxl.utils.exceptions import InvalidFileException
-import xlrd
-
 # Ensure project root is on sys.path when running from scripts/
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
 from cms_app import create_app, db
+from cms_app.import_pipeline import DEFAULT_CHUNK_SIZE, open_sheet, prefetch_in, process_in_chunks, row_dict
 from cms_app.models import Program, User, Faculty
-from sqlalchemy import select
-from werkzeug.security import generate_password_hash
+from cms_app.user_provisioning import provision_users
+from sqlalchemy import select, update
 
 
 HEADER_MAP: Dict[str, List[str]] = {
@@ -116,7 +113,17 @@ def detect_program_from_filename(path: str) -> str:
     return "BCA"
 
 
-def upsert_faculty(program_name: str, path: str):
+# Default password for imported faculty; must be changed on first login
+DEFAULT_FACULTY_PASSWORD = "Password123"
+
+
+def upsert_faculty(program_name: str, path: str, chunk_size: int = DEFAULT_CHUNK_SIZE, progress=None):
+    """Upsert faculty (and their logins) listed in ``path`` for a program.
+
+    Rows are streamed and committed in chunks; each chunk provisions its logins
+    in bulk and matches existing faculty by email, then by login, with one IN
+    query each. Returns ``(created, updated)``.
+    """
     program = db.session.execute(
         select(Program).filter_by(program_name=program_name)
     ).scalars().first()
@@ -124,22 +131,14 @@ def upsert_faculty(program_name: str, path: str):
         program = Program(program_name=program_name, program_duration_years=3)
         db.session.add(program)
         db.session.commit()
+    program_id = program.program_id
 
-    created = 0
-    updated = 0
-
-    try:
-        wb = load_workbook(filename=path, data_only=True)
-        ws = wb.active
-        headers = [cell.value if cell.value is not None else "" for cell in next(ws.iter_rows(min_row=1, max_row=1))]
-        colmap = normalize_headers(headers)
-
-        for row in ws.iter_rows(min_row=2):
-            values = [cell.value for cell in row]
-            data = {}
-            for idx, key in colmap.items():
-                data[key] = values[idx]
+    stats = {"created": 0, "updated": 0}
 
+    def import_chunk(rows):
+        records = []
+        for _row_no, values in rows:
+            data = row_dict(values, colmap)
             # Capture all original columns keyed by their header
             raw_map = {}
             for i, h in enumerate(headers):
@@ -148,166 +147,86 @@ def upsert_faculty(program_name: str, path: str):
             full_name = cell_to_str(data.get("full_name"))
             email = cell_to_str(data.get("email")).lower()
             mobile = cell_to_str(data.get("mobile"))
-            designation = cell_to_str(data.get("designation"))
-            department = cell_to_str(data.get("department")) or program_name
-
             if not full_name and not email:
                 # skip blank rows
                 continue
 
             # Choose username: prefer email, else mobile, else name
-            username = email or (mobile if mobile else full_name)
-            username = username.strip()
-            if not username:
-                username = full_name or "faculty"
-
-            user = db.session.execute(
-                select(User).filter_by(username=username)
-            ).scalars().first()
-            if not user:
-                # Default password for imported faculty: Password123
-                # Must change password on first login
-                user = User(
-                    username=username, 
-                    role="Faculty", 
-                    program_id_fk=program.program_id,
-                    password_hash=generate_password_hash("Password123"),
-                    must_change_password=True
-                )
-                db.session.add(user)
-                db.session.flush()  # get user_id
-            else:
-                user.role = "Faculty"
-                user.program_id_fk = program.program_id
-                # Ensure existing users also have to change password if they haven't logged in? 
-                # No, only force for new users or if explicitly reset.
-
-
-            # Upsert Faculty record using email if present, else username
-            fac_q = None
-            if email:
-                fac_q = db.session.execute(
-                    select(Faculty).filter_by(email=email)
-                ).scalars().first()
-            if not fac_q:
-                fac_q = db.session.execute(
-                    select(Faculty).filter_by(user_id_fk=user.user_id)
-                ).scalars().first()
-
-            if not fac_q:
+            username = (email or (mobile if mobile else full_name)).strip() or (full_name or "faculty")
+            records.append({
+                "username": username,
+                "full_name": full_name,
+                "email": email,
+                "mobile": mobile,
+                "designation": cell_to_str(data.get("designation")),
+                "department": cell_to_str(data.get("department")) or program_name,
+                "extra_data": json.dumps(raw_map, ensure_ascii=False),
+            })
+        if not records:
+            return
+
+        # New logins get the default password; existing ones keep theirs but
+        # are moved to the Faculty role and this program.
+        specs = [
+            {"username": r["username"], "password": DEFAULT_FACULTY_PASSWORD, "role": "Faculty", "program_id": program_id}
+            for r in records
+        ]
+        user_ids = provision_users(specs, reactivate=False)["user_ids"]
+        db.session.execute(
+            update(User)
+            .where(User.user_id.in_(list(set(user_ids.values()))))
+            .values(role="Faculty")
+            .execution_options(synchronize_session=False)
+        )
+
+        # Upsert Faculty record using email if present, else login
+        by_email = prefetch_in(Faculty.email, [r["email"] for r in records])
+        by_user = prefetch_in(Faculty.user_id_fk, list(user_ids.values()))
+        for rec in records:
+            email = rec["email"]
+            user_id = user_ids.get(rec["username"])
+            fac = (by_email.get(email) if email else None) or by_user.get(user_id)
+            if fac is None:
                 fac = Faculty(
-                    user_id_fk=user.user_id,
-                    program_id_fk=program.program_id,
-                    full_name=(full_name if full_name and full_name != email else (derive_name_from_email(email) or username)),
+                    user_id_fk=user_id,
+                    program_id_fk=program_id,
+                    full_name=(rec["full_name"] if rec["full_name"] and rec["full_name"] != email else (derive_name_from_email(email) or rec["username"])),
                     email=email or None,
-                    mobile=mobile or None,
-                    designation=designation or None,
-                    department=department or None,
-                    extra_data=json.dumps(raw_map, ensure_ascii=False),
+                    mobile=rec["mobile"] or None,
+                    designation=rec["designation"] or None,
+                    department=rec["department"] or None,
+                    extra_data=rec["extra_data"],
                 )
                 db.session.add(fac)
-                created += 1
+                stats["created"] += 1
             else:
-                fac_q.program_id_fk = program.program_id
+                fac.program_id_fk = program_id
                 # Update name if provided or if existing equals the email
-                if full_name and full_name != email:
-                    fac_q.full_name = full_name
-                elif not fac_q.full_name or fac_q.full_name == fac_q.email:
+                if rec["full_name"] and rec["full_name"] != email:
+                    fac.full_name = rec["full_name"]
+                elif not fac.full_name or fac.full_name == fac.email:
                     derived = derive_name_from_email(email)
                     if derived:
-                        fac_q.full_name = derived
-                fac_q.email = email or fac_q.email
-                fac_q.mobile = mobile or fac_q.mobile
-                fac_q.designation = designation or fac_q.designation
-                fac_q.department = department or fac_q.department
-                fac_q.extra_data = json.dumps(raw_map, ensure_ascii=False)
-                updated += 1
-
-    except InvalidFileException:
-        # Fallback to xlrd for legacy .xls
-        book = xlrd.open_workbook(path)
-        sheet = book.sheet_by_index(0)
-        headers = [sheet.cell_value(0, col) for col in range(sheet.ncols)]
+                        fac.full_name = derived
+                fac.email = email or fac.email
+                fac.mobile = rec["mobile"] or fac.mobile
+                fac.designation = rec["designation"] or fac.designation
+                fac.department = rec["department"] or fac.department
+                fac.extra_data = rec["extra_data"]
+                stats["updated"] += 1
+            if fac.email:
+                by_email.setdefault(fac.email, fac)
+            if user_id:
+                by_user.setdefault(user_id, fac)
+
+    with open_sheet(path) as sheet:
+        headers = sheet.headers
         colmap = normalize_headers(headers)
-
-        for r in range(1, sheet.nrows):
-            data = {}
-            for c in range(sheet.ncols):
-                key = colmap.get(c)
-                if not key:
-                    continue
-                val = sheet.cell_value(r, c)
-                data[key] = val
-
-            # Capture all original columns keyed by their header
-            raw_map = {}
-            for c in range(sheet.ncols):
-                h = headers[c] if c < len(headers) else ""
-                raw_map[str(h or "")] = cell_to_str(sheet.cell_value(r, c))
-
-            full_name = cell_to_str(data.get("full_name"))
-            email = cell_to_str(data.get("email")).lower()
-            mobile = cell_to_str(data.get("mobile"))
-            designation = cell_to_str(data.get("designation"))
-            department = cell_to_str(data.get("department")) or program_name
-
-            if not full_name and not email:
-                continue
-
-            username = email or (mobile if mobile else full_name)
-            username = username.strip() or (full_name or "faculty")
-
-            user = db.session.execute(
-                select(User).filter_by(username=username)
-            ).scalars().first()
-            if not user:
-                user = User(username=username, role="Faculty", program_id_fk=program.program_id)
-                db.session.add(user)
-                db.session.flush()
-            else:
-                user.role = "Faculty"
-                user.program_id_fk = program.program_id
-
-            fac_q = None
-            if email:
-                fac_q = db.session.execute(
-                    select(Faculty).filter_by(email=email)
-                ).scalars().first()
-            if not fac_q:
-                fac_q = db.session.execute(
-                    select(Faculty).filter_by(user_id_fk=user.user_id)
-                ).scalars().first()
-
-            if not fac_q:
-                fac = Faculty(
-                    user_id_fk=user.user_id,
-                    program_id_fk=program.program_id,
-                    full_name=(full_name if full_name and full_name != email else (derive_name_from_email(email) or username)),
-                    email=email or None,
-                    mobile=mobile or None,
-                    designation=designation or None,
-                    department=department or None,
-                    extra_data=json.dumps(raw_map, ensure_ascii=False),
-                )
-                db.session.add(fac)
-                created += 1
-            else:
-                fac_q.program_id_fk = program.program_id
-                if full_name and full_name != email:
-                    fac_q.full_name = full_name
-                elif not fac_q.full_name or fac_q.full_name == fac_q.email:
-                    derived = derive_name_from_email(email)
-                    if derived:
-                        fac_q.full_name = derived
-                fac_q.email = email or fac_q.email
-                fac_q.mobile = mobile or fac_q.mobile
-                fac_q.designation = designation or fac_q.designation
-                fac_q.department = department or fac_q.department
-                fac_q.extra_data = json.dumps(raw_map, ensure_ascii=False)
-                updated += 1
+        process_in_chunks(sheet, import_chunk, chunk_size=chunk_size, total=sheet.total, progress=progress)
 
     db.session.commit()
-    print(f"Imported faculty from {path}: created={created}, updated={updated}")
+    print(f"Imported faculty from {path}: created={stats['created']}, updated={stats['updated']}")
+    return stats["created"], stats["updated"]
 
 
 def main():
@@ -1,19 +1,18 @@
+import itertools
 import os
 import sys
 import re
 from typing import List, Dict, Any, Optional, Tuple
 
-from openpyxl import load_workbook
-from openpyxl.utils.exceptions import InvalidFileException
-
 # Ensure project root is on sys.path when running from scripts/
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 
 from cms_app import create_app, db
-from cms_app.models import Program, FeeStructure
-from sqlalchemy import select
+from cms_app.import_pipeline import DEFAULT_CHUNK_SIZE, open_workbook, process_in_chunks
+from cms_app.models import Program, FeeStructure, utc_now
+from sqlalchemy import func, select
 
 
 def cell_to_str(v: Any) -> str:
@@ -33,158 +32,143 @@ def normalize_program_name(name: str) -> str:
     return n.upper()
 
 
-def _import_wide_sheet(ws) -> Tuple[int, int]:
-    """Handle wide-format sheet: columns after Description are program names."""
-    # Detect header row
-    header_row_idx = None
-    programs: List[str] = []
-    for i, row in enumerate(ws.iter_rows(values_only=True), start=1):
-        cells = [cell_to_str(c) for c in row]
-        if len(cells) >= 2 and cells[0].upper() in ("SR NO", "SRNO", "S.NO") and cells[1].upper() == "DESCRIPTION":
-            header_row_idx = i
-            programs = [normalize_program_name(cells[j]) for j in range(2, len(cells))]
-            break
-    if header_row_idx is None:
-        raise RuntimeError("Could not locate header row with 'Sr No' and 'Description'.")
+HEADER_FIRST_CELLS = ("SR NO", "SRNO", "S.NO")
+BANNER_ROWS = ("FEE PATRAK- 2024 ALL UNIVERSITY AFFILIATED COURSES", "M.K.BHAVNAGAR UNIVERSITY FEE PATRAK")
+SEMESTER_HINT_PATTERNS = [re.compile(rf"\bSEM(?:ESTER)?\s*{n}\b", re.IGNORECASE) for n in range(1, 7)]
 
-    # Ensure programs exist
-    program_objs: Dict[str, Program] = {}
-    for p_name_raw in programs:
-        if not p_name_raw:
-            continue
-        p_lookup = p_name_raw.replace(".", "").replace("(E)", "E").replace("(G)", "G").strip()
-        prog = db.session.execute(
-            select(Program).where(Program.program_name.ilike(p_lookup))
-        ).scalars().first()
-        if not prog:
-            prog = Program(program_name=p_lookup, program_duration_years=3)
-            db.session.add(prog)
-            db.session.flush()
-        program_objs[p_name_raw] = prog
-
-    created = 0
-    updated = 0
-
-    # Semester detection
-    current_semester: Optional[int] = 1
-    semester_hint_patterns = [
-        re.compile(r"\bSEM(?:ESTER)?\s*1\b", re.IGNORECASE),
-        re.compile(r"\bSEM(?:ESTER)?\s*2\b", re.IGNORECASE),
-        re.compile(r"\bSEM(?:ESTER)?\s*3\b", re.IGNORECASE),
-        re.compile(r"\bSEM(?:ESTER)?\s*4\b", re.IGNORECASE),
-        re.compile(r"\bSEM(?:ESTER)?\s*5\b", re.IGNORECASE),
-        re.compile(r"\bSEM(?:ESTER)?\s*6\b", re.IGNORECASE),
-    ]
-
-    for r_idx, row in enumerate(ws.iter_rows(min_row=header_row_idx + 1, values_only=True), start=header_row_idx + 1):
+
+def _is_header(cells: List[str]) -> bool:
+    return len(cells) >= 2 and cells[0].upper() in HEADER_FIRST_CELLS and cells[1].upper() == "DESCRIPTION"
+
+
+def _sheet_rows(sheet):
+    """All rows of a streamed sheet, header row included."""
+    yield tuple(sheet.headers)
+    for _row_no, values in sheet:
+        yield values
+
+
+def _ensure_program(p_name_raw: str) -> Program:
+    p_lookup = p_name_raw.replace(".", "").replace("(E)", "E").replace("(G)", "G").strip()
+    prog = db.session.execute(
+        select(Program).where(Program.program_name.ilike(p_lookup))
+    ).scalars().first()
+    if not prog:
+        prog = Program(program_name=p_lookup, program_duration_years=3)
+        db.session.add(prog)
+        db.session.flush()
+    return prog
+
+
+def _fee_rows(rows, amount_columns):
+    """Yield ``(program_id, component, semester, amount)`` from data rows.
+
+    ``amount_columns`` maps column index -> program_id. Banner and TOTAL rows are
+    skipped; "Sem N" in a description switches the semester for following rows.
+    """
+    current_semester = 1
+    for row in rows:
         cells = [cell_to_str(c) for c in row]
-        if len(cells) < 3:
+        if len(cells) < 2:
             continue
-
         desc_upper = (cells[1] or "").upper()
         # Skip banners and TOTAL rows
-        if desc_upper in ("FEE PATRAK- 2024 ALL UNIVERSITY AFFILIATED COURSES", "M.K.BHAVNAGAR UNIVERSITY FEE PATRAK"):
+        if desc_upper in BANNER_ROWS:
             continue
         if re.search(r"\bTOTAL\b", desc_upper):
             continue
-
-        for s_idx, pat in enumerate(semester_hint_patterns, start=1):
+        for s_idx, pat in enumerate(SEMESTER_HINT_PATTERNS, start=1):
             if pat.search(desc_upper):
                 current_semester = s_idx
                 break
-
         component = cells[1]
         if not component:
             continue
-
-        # per-program amounts
-        for j in range(2, len(cells)):
-            prog_key = programs[j - 2]
-            prog_obj = program_objs.get(prog_key)
-            if not prog_obj:
-                continue
-            amt_raw = row[j]
+        for col, program_id in amount_columns.items():
+            amt_raw = row[col] if col < len(row) else None
             try:
                 amount = float(amt_raw) if amt_raw is not None and str(amt_raw).strip() != "" else None
             except Exception:
                 amount = None
             if amount is None:
                 continue
-            fs = db.session.execute(
-                select(FeeStructure).filter_by(
-                    program_id_fk=prog_obj.program_id,
-                    component_name=component,
-                    semester=current_semester,
-                )
-            ).scalars().first()
-            if not fs:
-                fs = FeeStructure(program_id_fk=prog_obj.program_id, component_name=component, semester=current_semester, amount=amount)
-                db.session.add(fs)
-                created += 1
+            yield program_id, component, current_semester, amount
+
+
+def _upsert_fee_rows(fee_rows, program_ids, chunk_size: int = DEFAULT_CHUNK_SIZE, progress=None) -> Tuple[int, int]:
+    """Upsert fee rows in chunks against a prefetched (program, component, semester) map."""
+    program_ids = list(dict.fromkeys(program_ids))
+    existing: Dict[Tuple[int, str, Optional[int]], int] = {}
+    if program_ids:
+        for structure_id, pid, component, semester in db.session.execute(
+            select(FeeStructure.structure_id, FeeStructure.program_id_fk, FeeStructure.component_name, FeeStructure.semester)
+            .where(FeeStructure.program_id_fk.in_(program_ids))
+            .order_by(FeeStructure.structure_id.asc())
+        ).all():
+            existing.setdefault((pid, component, semester), structure_id)
+
+    stats = {"created": 0, "updated": 0}
+
+    def upsert_chunk(chunk):
+        inserts = {}
+        updates = {}
+        for program_id, component, semester, amount in chunk:
+            key = (program_id, component, semester)
+            if key in inserts:
+                inserts[key]["amount"] = amount
+                stats["updated"] += 1
+            elif key in existing:
+                updates[existing[key]] = {"structure_id": existing[key], "amount": amount, "updated_at": utc_now()}
+                stats["updated"] += 1
             else:
-                fs.amount = amount
-                updated += 1
+                inserts[key] = {"program_id_fk": program_id, "component_name": component, "semester": semester, "amount": amount}
+                stats["created"] += 1
+        if updates:
+            db.session.bulk_update_mappings(FeeStructure, list(updates.values()))
+        if inserts:
+            # return_defaults fills in structure_id so later chunks update instead of inserting twice
+            db.session.bulk_insert_mappings(FeeStructure, list(inserts.values()), return_defaults=True)
+            for key, mapping in inserts.items():
+                existing[key] = mapping["structure_id"]
+
+    process_in_chunks(fee_rows, upsert_chunk, chunk_size=chunk_size, progress=progress)
 
+    # Update program duration years by observed max semester
+    for program_id in program_ids:
+        max_sem = db.session.execute(
+            select(func.max(FeeStructure.semester)).where(FeeStructure.program_id_fk == program_id)
+        ).scalar_one_or_none()
+        if max_sem and isinstance(max_sem, int):
+            prog = db.session.get(Program, program_id)
+            if prog is not None:
+                prog.program_duration_years = max(1, (max_sem + 1) // 2)
     db.session.commit()
 
-    # Update program duration years by observed max semester
-    if current_semester is not None:
-        for prog in program_objs.values():
-            max_sem = db.session.execute(
-                select(func.max(FeeStructure.semester)).where(FeeStructure.program_id_fk == prog.program_id)
-            ).scalar_one_or_none()
-            if max_sem and isinstance(max_sem, int):
-                years = (max_sem + 1) // 2
-                try:
-                    prog.program_duration_years = max(1, years)
-                except Exception:
-                    pass
-        db.session.commit()
-
-    return created, updated
-
-
-def _import_single_program_sheet(ws, program_name_hint: Optional[str]) -> Tuple[int, int]:
-    """Handle sheet that contains one program fee structure vertically."""
-    # Determine header row
-    header_row_idx = None
-    headers: List[str] = []
-    for i, row in enumerate(ws.iter_rows(values_only=True), start=1):
-        cells = [cell_to_str(c) for c in row]
-        if len(cells) >= 2 and cells[0].upper() in ("SR NO", "SRNO", "S.NO") and cells[1].upper() == "DESCRIPTION":
-            header_row_idx = i
-            headers = [cell_to_str(c) for c in row]
-            break
-    if header_row_idx is None:
-        # Fallback: try first row as header if it looks like text labels
-        first = [cell_to_str(c) for c in next(ws.iter_rows(min_row=1, max_row=1, values_only=True))]
-        if len(first) >= 2:
-            header_row_idx = 1
-            headers = first
-        else:
-            raise RuntimeError("Could not locate header row with 'Sr No' and 'Description'.")
+    return stats["created"], stats["updated"]
+
+
+def _import_wide_sheet(header: List[str], rows, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[int, int]:
+    """Handle wide-format sheet: columns after Description are program names."""
+    # Ensure programs exist
+    amount_columns: Dict[int, int] = {}
+    for j in range(2, len(header)):
+        p_name_raw = normalize_program_name(header[j])
+        if p_name_raw:
+            amount_columns[j] = _ensure_program(p_name_raw).program_id
+    return _upsert_fee_rows(_fee_rows(rows, amount_columns), amount_columns.values(), chunk_size=chunk_size)
 
+
+def _import_single_program_sheet(headers: List[str], rows, program_name_hint: Optional[str], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[int, int]:
+    """Handle sheet that contains one program fee structure vertically."""
     # Determine program name: from header third column or sheet title or hint
     program_name = None
     if len(headers) >= 3 and headers[2]:
         program_name = normalize_program_name(headers[2])
     if not program_name:
-        program_name = normalize_program_name(program_name_hint or ws.title or "")
+        program_name = normalize_program_name(program_name_hint or "")
     if not program_name:
         raise RuntimeError("Program name could not be determined for sheet")
-
-    # Ensure program exists
-    p_lookup = program_name.replace(".", "").replace("(E)", "E").replace("(G)", "G").strip()
-    prog = db.session.execute(
-        select(Program).where(Program.program_name.ilike(p_lookup))
-    ).scalars().first()
-    if not prog:
-        prog = Program(program_name=p_lookup, program_duration_years=3)
-        db.session.add(prog)
-        db.session.flush()
-
-    created = 0
-    updated = 0
+    prog = _ensure_program(program_name)
 
     # Find amount column index after Description
     amount_col_idx = None
@@ -196,7 +180,8 @@ def _import_single_program_sheet(ws, program_name_hint: Optional[str]) -> Tuple[
             break
     if amount_col_idx is None:
         # Infer by scanning a few rows for numeric cell
-        scan_rows = list(ws.iter_rows(min_row=header_row_idx + 1, max_row=header_row_idx + 10, values_only=True))
+        scan_rows = list(itertools.islice(rows, 10))
+        rows = itertools.chain(scan_rows, rows)
         for idx in range(2, max(len(r) for r in scan_rows) if scan_rows else 3):
             for r in scan_rows:
                 if idx < len(r):
@@ -212,103 +197,50 @@ def _import_single_program_sheet(ws, program_name_hint: Optional[str]) -> Tuple[
     if amount_col_idx is None:
         amount_col_idx = 2  # fallback
 
-    # Semester detection
-    current_semester: Optional[int] = 1
-    semester_hint_patterns = [
-        re.compile(r"\bSEM(?:ESTER)?\s*1\b", re.IGNORECASE),
-        re.compile(r"\bSEM(?:ESTER)?\s*2\b", re.IGNORECASE),
-        re.compile(r"\bSEM(?:ESTER)?\s*3\b", re.IGNORECASE),
-        re.compile(r"\bSEM(?:ESTER)?\s*4\b", re.IGNORECASE),
-        re.compile(r"\bSEM(?:ESTER)?\s*5\b", re.IGNORECASE),
-        re.compile(r"\bSEM(?:ESTER)?\s*6\b", re.IGNORECASE),
-    ]
-
-    # Iterate data rows
-    for row in ws.iter_rows(min_row=header_row_idx + 1, values_only=True):
-        cells = [cell_to_str(c) for c in row]
-        if len(cells) < 2:
-            continue
-        desc_upper = (cells[1] or "").upper()
-        if desc_upper in ("FEE PATRAK- 2024 ALL UNIVERSITY AFFILIATED COURSES", "M.K.BHAVNAGAR UNIVERSITY FEE PATRAK"):
-            continue
-        if re.search(r"\bTOTAL\b", desc_upper):
-            continue
-        for s_idx, pat in enumerate(semester_hint_patterns, start=1):
-            if pat.search(desc_upper):
-                current_semester = s_idx
-                break
-        component = cells[1]
-        if not component:
-            continue
-        amt_raw = row[amount_col_idx] if amount_col_idx < len(row) else None
-        try:
-            amount = float(amt_raw) if amt_raw is not None and str(amt_raw).strip() != "" else None
-        except Exception:
-            amount = None
-        if amount is None:
-            continue
-        fs = db.session.execute(
-            select(FeeStructure).filter_by(
-                program_id_fk=prog.program_id,
-                component_name=component,
-                semester=current_semester,
-            )
-        ).scalars().first()
-        if not fs:
-            fs = FeeStructure(program_id_fk=prog.program_id, component_name=component, semester=current_semester, amount=amount)
-            db.session.add(fs)
-            created += 1
-        else:
-            fs.amount = amount
-            updated += 1
-
-    db.session.commit()
-
-    # Update duration by observed max semester
-    if current_semester is not None:
-        max_sem = db.session.query(db.func.max(FeeStructure.semester)).filter(FeeStructure.program_id_fk == prog.program_id).scalar()
-        if max_sem and isinstance(max_sem, int):
-            years = (max_sem + 1) // 2
-            try:
-                prog.program_duration_years = max(1, years)
-            except Exception:
-                pass
-        db.session.commit()
-
-    return created, updated
+    return _upsert_fee_rows(_fee_rows(rows, {amount_col_idx: prog.program_id}), [prog.program_id], chunk_size=chunk_size)
 
 
-def import_fee_structure(path: str) -> Tuple[int, int]:
+def import_fee_structure(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[int, int]:
     """Import fee structures from an Excel that may contain multiple sheets.
 
-    - If a sheet is wide-format (programs across columns), use _import_wide_sheet.
-    - Else treat it as single-program vertical format and use _import_single_program_sheet.
+    Each sheet is streamed once: rows are read up to the 'Sr No | Description'
+    header, which decides the layout.
+
+    - If programs follow Description across columns (wide format), each of those
+      columns is a program's amount.
+    - Else the sheet is one program listed vertically (named by the sheet title).
     """
-    wb = load_workbook(filename=path, data_only=True)
     total_created = 0
     total_updated = 0
-    for ws in wb.worksheets:
-        # Heuristic: check if header row has programs across columns
-        is_wide = False
-        for i, row in enumerate(ws.iter_rows(values_only=True), start=1):
-            cells = [cell_to_str(c) for c in row]
-            if len(cells) >= 2 and cells[0].upper() in ("SR NO", "SRNO", "S.NO") and cells[1].upper() == "DESCRIPTION":
-                # consider wide if there are at least one non-empty header after col 2
-                after = [cell_to_str(c) for c in cells[2:]]
-                non_empty_headers = [h for h in after if h]
-                is_wide = len(non_empty_headers) >= 1
-                break
-        try:
-            if is_wide:
-                c, u = _import_wide_sheet(ws)
-            else:
-                c, u = _import_single_program_sheet(ws, ws.title)
-            total_created += c
-            total_updated += u
-        except Exception as e:
-            # Continue with other sheets but report the issue
-            print(f"Sheet '{ws.title}': skipped due to error: {e}")
-            continue
+    with open_workbook(path) as sheets:
+        for sheet in sheets:
+            rows = _sheet_rows(sheet)
+            header = None
+            scanned = []
+            for row in rows:
+                cells = [cell_to_str(c) for c in row]
+                if _is_header(cells):
+                    header = cells
+                    break
+                scanned.append(row)
+            try:
+                if header is not None and any(cell_to_str(c) for c in header[2:]):
+                    c, u = _import_wide_sheet(header, rows, chunk_size=chunk_size)
+                elif header is not None:
+                    c, u = _import_single_program_sheet(header, rows, sheet.title, chunk_size=chunk_size)
+                else:
+                    # Fallback: try first row as header if it looks like text labels
+                    first = [cell_to_str(c) for c in scanned[0]] if scanned else []
+                    if len(first) < 2:
+                        raise RuntimeError("Could not locate header row with 'Sr No' and 'Description'.")
+                    c, u = _import_single_program_sheet(first, iter(scanned[1:]), sheet.title, chunk_size=chunk_size)
+                total_created += c
+                total_updated += u
+            except Exception as e:
+                # Continue with other sheets but report the issue
+                db.session.rollback()
+                print(f"Sheet '{sheet.title}': skipped due to error: {e}")
+                continue
 
     return total_created, total_updated
 
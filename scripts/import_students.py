@@ -2,15 +2,8 @@ import re
 import sys
 import os
 import csv
-from datetime import datetime
 from typing import Dict, List
-from sqlalchemy import select
-from werkzeug.security import generate_password_hash
-from sqlalchemy.exc import OperationalError
-
-from openpyxl import load_workbook
-from openpyxl.utils.exceptions import InvalidFileException
-import xlrd
+from sqlalchemy import delete, func, select, update
 
 # Ensure project root is on sys.path when running from scripts/
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -18,7 +11,9 @@ if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
 from cms_app import create_app, db
-from cms_app.models import Program, Division, Student, User, ProgramDivisionPlan, Institute
+from cms_app.import_pipeline import DEFAULT_CHUNK_SIZE, iter_chunks, open_sheet, parse_date, prefetch_in, process_in_chunks, row_dict
+from cms_app.models import Program, Division, Student, ProgramDivisionPlan, Institute
+from cms_app.user_provisioning import provision_users, student_credentials
 
 
 HEADER_MAP: Dict[str, List[str]] = {
@@ -184,6 +179,19 @@ def to_int(val):
         return None
 
 
+def _student_user_spec(enrollment_no, mobile, program_id, trust_id=None):
+    username, password_raw, mobile_digits = student_credentials(enrollment_no, mobile)
+    return {
+        "username": username,
+        "password": password_raw,
+        "role": "student",
+        "program_id": program_id,
+        "trust_id": trust_id,
+        "mobile": mobile_digits,
+        "must_change_password": True,
+    }
+
+
 def ensure_student_user(enrollment_no, mobile, program_id, trust_id=None):
     """
     Ensures a User account exists for the student.
@@ -192,75 +200,112 @@ def ensure_student_user(enrollment_no, mobile, program_id, trust_id=None):
       - Password: Mobile (if >= 10 digits) else Enrollment No
       - Force Password Change: True
     Returns: user_id
+
+    Single-row wrapper over ``provision_users``; imports collect specs and
+    provision the whole sheet at once instead.
     """
-    mobile_digits = "".join(ch for ch in str(mobile) if ch.isdigit()) if mobile else ""
+    spec = _student_user_spec(enrollment_no, mobile, program_id, trust_id=trust_id)
+    try:
+        return provision_users([spec])["user_ids"].get(spec["username"])
+    except Exception as e:
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+        print(f"Error ensuring user for student {enrollment_no}: {e}")
+        return None
 
-    if len(mobile_digits) >= 10:
-        username = mobile_digits
-        password_raw = mobile_digits
-    else:
-        username = str(enrollment_no)
-        password_raw = str(enrollment_no)
 
-    attempts = 0
-    while True:
-        attempts += 1
-        try:
-            user = db.session.execute(select(User).filter_by(username=username)).scalars().first()
-            if user:
-                try:
-                    if hasattr(user, "is_active") and not user.is_active:
-                        user.is_active = True
-                except Exception:
-                    pass
-            if not user:
-                user = User(
-                    username=username,
-                    password_hash=generate_password_hash(password_raw),
-                    role="student",
-                    program_id_fk=program_id,
-                    mobile=mobile_digits,
-                    must_change_password=True,
-                    is_active=True,
-                    trust_id_fk=trust_id,
-                )
-                db.session.add(user)
-                db.session.flush()
-            else:
-                try:
-                    if hasattr(user, "program_id_fk") and program_id:
-                        user.program_id_fk = program_id
-                except Exception:
-                    pass
-                try:
-                    if trust_id and hasattr(user, "trust_id_fk"):
-                        user.trust_id_fk = trust_id
-                except Exception:
-                    pass
-            return user.user_id
-        except OperationalError as e:
-            msg = str(e).lower()
-            try:
-                db.session.rollback()
-            except Exception:
-                pass
-            if "database is locked" in msg and attempts < 6:
-                import time
-                time.sleep(0.2 * attempts)
-                continue
-            print(f"Error ensuring user for student {enrollment_no}: {e}")
-            return None
-        except Exception as e:
-            try:
-                db.session.rollback()
-            except Exception:
-                pass
-            print(f"Error ensuring user for student {enrollment_no}: {e}")
-            return None
+MEDIUM_MAP = {
+    "": "",
+    "general": "General",
+    "eng": "English",
+    "english": "English",
+    "e": "English",
+    "guj": "Gujarati",
+    "gujarati": "Gujarati",
+    "g": "Gujarati",
+}
 
 
+def _parse_student_row(row_no, data, semester, allowed_mediums, default_medium, program_name, errors):
+    """Validate one sheet row into a field dict; ``None`` for rows to skip."""
+    enrollment_no = cell_to_str(data.get("enrollment_no"))
+    if not enrollment_no:
+        return None
+
+    gender = cell_to_str(data.get("gender")).capitalize()
+    if gender not in ("Male", "Female", "Other", ""):
+        gender = ""
+
+    # Optional medium parsing
+    medium_tag = MEDIUM_MAP.get(cell_to_str(data.get("medium_tag")).strip().lower(), "")
+    if not medium_tag:
+        medium_tag = default_medium
+    if allowed_mediums and medium_tag and medium_tag not in allowed_mediums:
+        errors.append(f"Row {row_no}: medium '{medium_tag}' not allowed for {program_name}")
+        medium_tag = default_medium
+
+    return {
+        "enrollment_no": enrollment_no,
+        "division_code": cell_to_str(data.get("division_code")) or "A",
+        "surname": cell_to_str(data.get("last_name")),
+        "student_name": cell_to_str(data.get("first_name")),
+        "mobile": cell_to_str(data.get("mobile")),
+        "father_name": cell_to_str(data.get("father_name")),
+        "gender": gender,
+        "photo_url": cell_to_str(data.get("photo_url")),
+        "permanent_address": cell_to_str(data.get("permanent_address")),
+        "medium_tag": medium_tag,
+        "date_of_birth": parse_date(data.get("date_of_birth")),
+        "current_semester": semester or to_int(data.get("current_semester")),
+        "roll_no": cell_to_str(data.get("roll_no")),
+        "aadhar_no": cell_to_str(data.get("aadhar_no")),
+        "category": cell_to_str(data.get("category")),
+    }
 
-def import_excel(path: str, program_id: int = None, trust_id: int = None, program_name: str = None, semester_hint: int = None, dry_run: bool = False):
+
+# Columns that keep their stored value when the sheet leaves them blank
+_STUDENT_KEEP_IF_BLANK = (
+    "surname",
+    "student_name",
+    "mobile",
+    "father_name",
+    "date_of_birth",
+    "gender",
+    "photo_url",
+    "permanent_address",
+    "current_semester",
+    "roll_no",
+    "aadhar_no",
+    "category",
+    "medium_tag",
+)
+
+
+def _student_changes(rec, current):
+    """Column values to apply to an existing student (``current`` maps column -> value)."""
+    changes = {k: (rec[k] or current.get(k) or None) for k in _STUDENT_KEEP_IF_BLANK}
+    changes["is_active"] = True
+    changes["program_id_fk"] = rec["program_id_fk"]
+    changes["division_id_fk"] = rec["division_id_fk"]
+    if rec.get("trust_id_fk"):
+        changes["trust_id_fk"] = rec["trust_id_fk"]
+    return changes
+
+
+def import_excel(path: str, program_id: int = None, trust_id: int = None, program_name: str = None, semester_hint: int = None, dry_run: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE, progress=None):
+    """Import a student sheet for one program + semester.
+
+    The sheet is streamed in chunks of ``chunk_size`` rows. Divisions and the
+    division plan are prefetched once; each chunk looks up its students with one
+    IN query, provisions their logins in bulk, bulk-inserts new students and is
+    committed (flushed when ``dry_run``) before the next chunk is read.
+    ``progress(done, total)`` is called after every chunk.
+
+    Students of this program/semester that are missing from the sheet are
+    deleted at the end (only those sharing a medium seen in the sheet).
+    """
     # Determine semester
     semester = semester_hint or find_semester_from_filename(path) or 0
 
@@ -291,402 +336,162 @@ def import_excel(path: str, program_id: int = None, trust_id: int = None, progra
             db.session.add(program)
             db.session.flush()
 
-    created = 0
-    updated = 0
-    skipped = 0
-    deleted = 0
-    divisions_created = 0
+    # Plain values survive the per-chunk commits without reloading the program
+    program_id = program.program_id
+    program_name = program.program_name or ""
+    trust_id = int(trust_id) if trust_id else None
+
+    stats = {"created": 0, "updated": 0, "skipped": 0, "deleted": 0, "divisions_created": 0, "users_created": 0}
     errors: List[str] = []
 
-    # Get all existing students for this program and semester (for potential deletion)
-    existing_q = select(Student).filter_by(program_id_fk=program.program_id, current_semester=semester)
+    # Students of this program+semester before the import (for deletion), as enrollment_no -> medium
+    existing_q = select(Student.enrollment_no, Student.medium_tag).filter_by(program_id_fk=program_id, current_semester=semester)
     if trust_id:
-        existing_q = existing_q.filter(Student.trust_id_fk == int(trust_id))
-    existing_students = db.session.execute(existing_q).scalars().all()
+        existing_q = existing_q.filter(Student.trust_id_fk == trust_id)
+    existing_mediums = {enr: medium for enr, medium in db.session.execute(existing_q).all()}
     processed_enrollments = set()
     mediums_seen = set()
 
-    cfg = load_program_mediums()
-    try:
-        # Primary path: openpyxl for .xlsx/.xlsm
-        wb = load_workbook(filename=path, data_only=True)
-        ws = wb.active
-        headers = [cell.value if cell.value is not None else "" for cell in next(ws.iter_rows(min_row=1, max_row=1))]
-        colmap = normalize_headers(headers)
-
-        for row_idx, row in enumerate(ws.iter_rows(min_row=2), start=2):
-            values = [cell.value for cell in row]
-            data = {}
-            for idx, key in colmap.items():
-                data[key] = values[idx]
-
-            enrollment_no = cell_to_str(data.get("enrollment_no"))
-            if not enrollment_no:
+    # Divisions and the division plan, prefetched once
+    divisions = {
+        d.division_code: {"division_id": d.division_id, "capacity": d.capacity}
+        for d in db.session.execute(select(Division).filter_by(program_id_fk=program_id, semester=semester)).scalars()
+    }
+    plan_cap = None
+    plan = db.session.execute(select(ProgramDivisionPlan).filter_by(program_id_fk=program_id, semester=semester)).scalars().first()
+    if plan:
+        try:
+            plan_cap = int(plan.capacity_per_division)
+        except Exception:
+            plan_cap = None
+    divisions_checked = set()
+
+    cfg_row = load_program_mediums().get(program_name) or {}
+    allowed_mediums = cfg_row.get("mediums") or []
+    default_medium = (cfg_row.get("default") or [""])[0] or ""
+
+    def division_id_for(code):
+        div = divisions.get(code)
+        if div is None:
+            # Determine capacity from ProgramDivisionPlan; fallback to BCA=67 else Division default
+            cap = plan_cap
+            if cap is None:
+                cap = 67 if program_name.upper() == "BCA" else (Division.capacity.default.arg if hasattr(Division.capacity, 'default') else 60)
+            division = Division(program_id_fk=program_id, semester=semester, division_code=code, capacity=cap)
+            db.session.add(division)
+            db.session.flush()
+            div = divisions[code] = {"division_id": division.division_id, "capacity": cap}
+            divisions_checked.add(code)
+            stats["divisions_created"] += 1
+        elif code not in divisions_checked:
+            # Align capacity with planning when available; avoid uniform forcing
+            divisions_checked.add(code)
+            if plan_cap is not None and div["capacity"] != plan_cap:
+                db.session.execute(update(Division).where(Division.division_id == div["division_id"]).values(capacity=plan_cap))
+                div["capacity"] = plan_cap
+        return div["division_id"]
+
+    def import_chunk(rows):
+        records = []
+        for row_no, values in rows:
+            data = row_dict(values, colmap)
+            rec = _parse_student_row(row_no, data, semester, allowed_mediums, default_medium, program_name, errors)
+            if rec is None:
                 try:
                     if not any(cell_to_str(v) for v in data.values()):
                         continue
                 except Exception:
                     pass
                 # skip rows without enrollment number
-                skipped += 1
-                errors.append(f"Row {row_idx}: missing enrollment_no; skipped")
+                stats["skipped"] += 1
+                errors.append(f"Row {row_no}: missing enrollment_no; skipped")
                 continue
-
-            processed_enrollments.add(enrollment_no)
-
-            # Division (respect per-program planning)
-            division_code = cell_to_str(data.get("division_code")) or "A"
-            division = db.session.execute(select(Division).filter_by(program_id_fk=program.program_id, semester=semester, division_code=division_code)).scalars().first()
-            if not division:
-                # Determine capacity from ProgramDivisionPlan; fallback to BCA=67 else Division default
-                plan = db.session.execute(select(ProgramDivisionPlan).filter_by(program_id_fk=program.program_id, semester=semester)).scalars().first()
-                cap = None
-                if plan:
-                    try:
-                        cap = int(plan.capacity_per_division)
-                    except Exception:
-                        cap = None
-                if cap is None:
-                    cap = 67 if (program.program_name or "").upper() == "BCA" else (Division.capacity.default.arg if hasattr(Division.capacity, 'default') else 60)
-                division = Division(program_id_fk=program.program_id, semester=semester, division_code=division_code, capacity=cap)
-                db.session.add(division)
-                db.session.flush()
-                divisions_created += 1
+            processed_enrollments.add(rec["enrollment_no"])
+            mediums_seen.add((rec["medium_tag"] or "").strip())
+            rec["program_id_fk"] = program_id
+            rec["trust_id_fk"] = trust_id
+            rec["division_id_fk"] = division_id_for(rec.pop("division_code"))
+            records.append(rec)
+        if not records:
+            return
+
+        trust_filter = [Student.trust_id_fk == trust_id] if trust_id else []
+        existing = prefetch_in(Student.enrollment_no, [r["enrollment_no"] for r in records], *trust_filter)
+
+        # Logins for the whole chunk in one pass
+        specs = [_student_user_spec(r["enrollment_no"], r["mobile"], program_id, trust_id=trust_id) for r in records]
+        provisioned = provision_users(specs)
+        stats["users_created"] += provisioned["created"]
+        user_ids = provisioned["user_ids"]
+
+        new_rows = {}
+        for rec, spec in zip(records, specs):
+            enr = rec["enrollment_no"]
+            user_id = user_ids.get(spec["username"])
+            student = existing.get(enr)
+            if student is not None:
+                for key, value in _student_changes(rec, {k: getattr(student, k) for k in _STUDENT_KEEP_IF_BLANK}).items():
+                    setattr(student, key, value)
+                if not student.user_id_fk:
+                    student.user_id_fk = user_id
+                stats["updated"] += 1
+            elif enr in new_rows:
+                # Repeated enrollment within the chunk: merge like an update
+                new_rows[enr].update(_student_changes(rec, new_rows[enr]))
+                stats["updated"] += 1
             else:
-                # Align capacity with planning when available; avoid uniform forcing
-                plan = db.session.execute(select(ProgramDivisionPlan).filter_by(program_id_fk=program.program_id, semester=semester)).scalars().first()
-                if plan:
-                    try:
-                        cap = int(plan.capacity_per_division)
-                        if division.capacity != cap:
-                            division.capacity = cap
-                    except Exception:
-                        pass
-
-            # Student fields (use only provided columns; no composition)
-            surname = cell_to_str(data.get("last_name"))
-            student_name = cell_to_str(data.get("first_name"))
-            mobile = cell_to_str(data.get("mobile"))
-            father_name = cell_to_str(data.get("father_name"))
-            gender = cell_to_str(data.get("gender")).capitalize()
-            if gender not in ("Male", "Female", "Other", ""):
-                gender = ""
-            photo_url = cell_to_str(data.get("photo_url"))
-            permanent_address = cell_to_str(data.get("permanent_address"))
-            # Optional medium parsing
-            medium_raw = cell_to_str(data.get("medium_tag")).strip().lower()
-            medium_map = {
-                "": "",
-                "general": "General",
-                "eng": "English",
-                "english": "English",
-                "e": "English",
-                "guj": "Gujarati",
-                "gujarati": "Gujarati",
-                "g": "Gujarati",
-            }
-            medium_tag = medium_map.get(medium_raw, "")
-            allowed = []
-            default_m = ""
-            try:
-                cfg_row = cfg.get(program.program_name or "") or {}
-                allowed = cfg_row.get("mediums") or []
-                default_list = cfg_row.get("default") or []
-                default_m = default_list[0] if default_list else ""
-            except Exception:
-                allowed = []
-                default_m = ""
-            if not medium_tag:
-                medium_tag = default_m
-            if allowed and medium_tag and medium_tag not in allowed:
-                errors.append(f"Row {row_idx}: medium '{medium_tag}' not allowed for {program.program_name}")
-                medium_tag = default_m
-            mediums_seen.add((medium_tag or "").strip())
-
-            dob_val = data.get("date_of_birth")
-            dob = None
-            if isinstance(dob_val, datetime):
-                dob = dob_val.date()
-            elif isinstance(dob_val, str):
-                for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%m/%d/%Y"):
-                    try:
-                        dob = datetime.strptime(dob_val.strip(), fmt).date()
-                        break
-                    except Exception:
-                        pass
-
-            current_semester = semester or to_int(data.get("current_semester"))
-            roll_no = cell_to_str(data.get("roll_no"))
-            aadhar_no = cell_to_str(data.get("aadhar_no"))
-            category = cell_to_str(data.get("category"))
-
-            # Ensure User exists
-            user_id = ensure_student_user(enrollment_no, mobile, program.program_id, trust_id=trust_id)
-
-            st_q = select(Student).filter_by(enrollment_no=enrollment_no)
-            if trust_id:
-                st_q = st_q.filter(Student.trust_id_fk == int(trust_id))
-            student = db.session.execute(st_q).scalars().first()
-            if not student:
-                student = Student(
-                    enrollment_no=enrollment_no,
-                    user_id_fk=user_id,
-                    program_id_fk=program.program_id,
-                    division_id_fk=division.division_id,
+                row = {k: (rec[k] or None) for k in _STUDENT_KEEP_IF_BLANK}
+                row.update(
+                    enrollment_no=enr,
+                    program_id_fk=program_id,
+                    division_id_fk=rec["division_id_fk"],
                     trust_id_fk=trust_id,
-                    last_name=surname,
-                    first_name=student_name,
-                    father_name=father_name,
-                    mobile=mobile,
-                    date_of_birth=dob,
-                    gender=gender,
-                    medium_tag=None,
-                    photo_url=photo_url,
-                    permanent_address=permanent_address,
-                    current_semester=current_semester,
-                    roll_no=roll_no,
-                    aadhar_no=aadhar_no or None,
-                    category=category or None,
-                    is_active=True,
-                )
-                db.session.add(student)
-                created += 1
-            else:
-                try:
-                    student.is_active = True
-                except Exception:
-                    pass
-                try:
-                    if trust_id and hasattr(student, "trust_id_fk"):
-                        student.trust_id_fk = trust_id
-                except Exception:
-                    pass
-                student.program_id_fk = program.program_id
-                student.division_id_fk = division.division_id
-                if not student.user_id_fk and user_id:
-                    student.user_id_fk = user_id
-                student.last_name = surname or student.last_name
-                student.first_name = student_name or student.first_name
-                student.mobile = mobile or student.mobile
-                student.father_name = father_name or student.father_name
-                student.date_of_birth = dob or student.date_of_birth
-                student.gender = gender or student.gender
-                student.photo_url = photo_url or student.photo_url
-                student.permanent_address = permanent_address or student.permanent_address
-                student.current_semester = current_semester or student.current_semester
-                if aadhar_no:
-                    student.aadhar_no = aadhar_no
-                if category:
-                    student.category = category
-                if roll_no:
-                    student.roll_no = roll_no
-                updated += 1
-            # Assign medium with BCom defaulting to General when absent
-            try:
-                student.medium_tag = medium_tag or (student.medium_tag or None)
-            except Exception:
-                student.medium_tag = medium_tag or (student.medium_tag or None)
-                errors.append(f"Row {row_idx}: failed to compute medium_tag due to data format")
-
-    except InvalidFileException:
-        # Fallback path: xlrd for legacy .xls or malformed files
-        book = xlrd.open_workbook(path)
-        sheet = book.sheet_by_index(0)
-        headers = [sheet.cell_value(0, col) for col in range(sheet.ncols)]
-        colmap = normalize_headers(headers)
-
-        for r in range(1, sheet.nrows):
-            data = {}
-            for c in range(sheet.ncols):
-                key = colmap.get(c)
-                if not key:
-                    continue
-                val = sheet.cell_value(r, c)
-                # Convert Excel serial date
-                if key == "date_of_birth" and sheet.cell_type(r, c) == xlrd.XL_CELL_DATE:
-                    try:
-                        val = xlrd.xldate_as_datetime(val, book.datemode).date()
-                    except Exception:
-                        pass
-                data[key] = val
-
-            enrollment_no = cell_to_str(data.get("enrollment_no"))
-            if not enrollment_no:
-                try:
-                    if not any(cell_to_str(v) for v in data.values()):
-                        continue
-                except Exception:
-                    pass
-                skipped += 1
-                errors.append(f"Row {r+1}: missing enrollment_no; skipped")
-                continue
-            
-            processed_enrollments.add(enrollment_no)
-
-            division_code = cell_to_str(data.get("division_code")) or "A"
-            division = db.session.execute(select(Division).filter_by(program_id_fk=program.program_id, semester=semester, division_code=division_code)).scalars().first()
-            if not division:
-                plan = db.session.execute(select(ProgramDivisionPlan).filter_by(program_id_fk=program.program_id, semester=semester)).scalars().first()
-                cap = None
-                if plan:
-                    try:
-                        cap = int(plan.capacity_per_division)
-                    except Exception:
-                        cap = None
-                if cap is None:
-                    cap = 67 if (program.program_name or "").upper() == "BCA" else (Division.capacity.default.arg if hasattr(Division.capacity, 'default') else 60)
-                division = Division(program_id_fk=program.program_id, semester=semester, division_code=division_code, capacity=cap)
-                db.session.add(division)
-                db.session.flush()
-                divisions_created += 1
-
-            surname = cell_to_str(data.get("last_name"))
-            student_name = cell_to_str(data.get("first_name"))
-            mobile = cell_to_str(data.get("mobile"))
-            father_name = cell_to_str(data.get("father_name"))
-            gender = cell_to_str(data.get("gender")).capitalize()
-            if gender not in ("Male", "Female", "Other", ""):
-                gender = ""
-            photo_url = cell_to_str(data.get("photo_url"))
-            permanent_address = cell_to_str(data.get("permanent_address"))
-            # Optional medium parsing
-            medium_raw = cell_to_str(data.get("medium_tag")).strip().lower()
-            medium_map = {
-                "": "",
-                "general": "General",
-                "eng": "English",
-                "english": "English",
-                "e": "English",
-                "guj": "Gujarati",
-                "gujarati": "Gujarati",
-                "g": "Gujarati",
-            }
-            medium_tag = medium_map.get(medium_raw, "")
-            allowed = []
-            default_m = ""
-            try:
-                cfg_row = cfg.get(program.program_name or "") or {}
-                allowed = cfg_row.get("mediums") or []
-                default_list = cfg_row.get("default") or []
-                default_m = default_list[0] if default_list else ""
-            except Exception:
-                allowed = []
-                default_m = ""
-            if not medium_tag:
-                medium_tag = default_m
-            if allowed and medium_tag and medium_tag not in allowed:
-                errors.append(f"Row {r+1}: medium '{medium_tag}' not allowed for {program.program_name}")
-                medium_tag = default_m
-            mediums_seen.add((medium_tag or "").strip())
-
-            dob_val = data.get("date_of_birth")
-            dob = None
-            if isinstance(dob_val, datetime):
-                dob = dob_val
-            elif isinstance(dob_val, str):
-                for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%m/%d/%Y"):
-                    try:
-                        dob = datetime.strptime(dob_val.strip(), fmt).date()
-                        break
-                    except Exception:
-                        pass
-
-            current_semester = semester or to_int(data.get("current_semester"))
-            aadhar_no = cell_to_str(data.get("aadhar_no"))
-            category = cell_to_str(data.get("category"))
-
-            # Ensure User exists
-            user_id = ensure_student_user(enrollment_no, mobile, program.program_id)
-
-            student = db.session.execute(select(Student).filter_by(enrollment_no=enrollment_no)).scalars().first()
-            if not student:
-                student = Student(
-                    enrollment_no=enrollment_no,
                     user_id_fk=user_id,
-                    program_id_fk=program.program_id,
-                    division_id_fk=division.division_id,
-                    surname=surname,
-                    student_name=student_name,
-                    father_name=father_name,
-                    mobile=mobile,
-                    date_of_birth=dob,
-                    gender=gender,
-                    medium_tag=None,
-                    photo_url=photo_url,
-                    permanent_address=permanent_address,
-                    current_semester=current_semester,
-                    aadhar_no=aadhar_no or None,
-                    category=category or None,
                     is_active=True,
                 )
-                db.session.add(student)
-                created += 1
-            else:
-                try:
-                    student.is_active = True
-                except Exception:
-                    pass
-                student.program_id_fk = program.program_id
-                student.division_id_fk = division.division_id
-                if not student.user_id_fk and user_id:
-                    student.user_id_fk = user_id
-                student.surname = surname or student.surname
-                student.student_name = student_name or student.student_name
-                student.mobile = mobile or student.mobile
-                student.father_name = father_name or student.father_name
-                student.date_of_birth = dob or student.date_of_birth
-                student.gender = gender or student.gender
-                student.photo_url = photo_url or student.photo_url
-                student.permanent_address = permanent_address or student.permanent_address
-                student.current_semester = current_semester or student.current_semester
-                updated += 1
-            # Assign medium with BCom defaulting to General when absent
-            try:
-                student.medium_tag = medium_tag or (student.medium_tag or None)
-            except Exception:
-                student.medium_tag = medium_tag or (student.medium_tag or None)
-                errors.append(f"Row {r+1}: failed to compute medium_tag due to data format")
+                new_rows[enr] = row
+                stats["created"] += 1
+        if new_rows:
+            db.session.bulk_insert_mappings(Student, list(new_rows.values()))
+
+    with open_sheet(path) as sheet:
+        colmap = normalize_headers(sheet.headers)
+        process_in_chunks(sheet, import_chunk, chunk_size=chunk_size, dry_run=dry_run, total=sheet.total, progress=progress)
 
     # Delete students that are in DB for this Program+Semester but NOT in the Excel file.
     # For multi-medium programs like B.Com, only delete students that share the same medium(s)
     # as rows present in this import, so importing English does not delete Gujarati, and vice versa.
     if mediums_seen:
         normalized_mediums = {m.strip() for m in mediums_seen}
-        for existing in existing_students:
-            enr = existing.enrollment_no
-            if not enr or enr in processed_enrollments:
-                continue
-            existing_medium = (existing.medium_tag or "").strip()
-            if existing_medium in normalized_mediums:
-                db.session.delete(existing)
-                deleted += 1
+        to_delete = [
+            enr for enr, medium in existing_mediums.items()
+            if enr and enr not in processed_enrollments and (medium or "").strip() in normalized_mediums
+        ]
     else:
         # Fallback: no medium information, keep legacy behavior (program+semester full replacement)
-        existing_enrollments = {s.enrollment_no for s in existing_students}
-        students_to_delete = existing_enrollments - processed_enrollments
-        for enr in students_to_delete:
-            if enr:
-                s_to_del = db.session.execute(select(Student).filter_by(enrollment_no=enr)).scalars().first()
-                if s_to_del:
-                    db.session.delete(s_to_del)
-                    deleted += 1
+        to_delete = [enr for enr in existing_mediums if enr and enr not in processed_enrollments]
+    for chunk in iter_chunks(to_delete, chunk_size):
+        stats["deleted"] += db.session.execute(
+            delete(Student).where(Student.enrollment_no.in_(chunk)).execution_options(synchronize_session=False)
+        ).rowcount or 0
 
     if not dry_run:
         db.session.commit()
     else:
         db.session.rollback()
-    print(f"Imported from {path}: created={created}, updated={updated}, skipped={skipped}, deleted={deleted}, divisions_created={divisions_created}, errors={len(errors)}")
+    print(f"Imported from {path}: created={stats['created']}, updated={stats['updated']}, skipped={stats['skipped']}, deleted={stats['deleted']}, divisions_created={stats['divisions_created']}, errors={len(errors)}")
     # Return a detailed report for UI display
     return {
-        "created": created,
-        "updated": updated,
-        "skipped": skipped,
-        "deleted": deleted,
+        "created": stats["created"],
+        "updated": stats["updated"],
+        "skipped": stats["skipped"],
+        "deleted": stats["deleted"],
         "errors_count": len(errors),
         "errors": errors,
-        "divisions_created": divisions_created,
-        "program_name": program.program_name,
-        "program_id": program.program_id,
+        "divisions_created": stats["divisions_created"],
+        "users_created": stats["users_created"],
+        "program_name": program_name,
+        "program_id": program_id,
         "semester": semester,
         "path": path,
     }
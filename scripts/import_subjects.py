@@ -2,12 +2,10 @@ import re
 import sys
 from typing import Dict, List, Tuple, Any
 
-from openpyxl import load_workbook
-from openpyxl.utils.exceptions import InvalidFileException
-import xlrd
 from sqlalchemy import select
 
 from cms_app import create_app, db
+from cms_app.import_pipeline import DEFAULT_CHUNK_SIZE, open_sheet, prefetch_in, process_in_chunks, row_dict
 from cms_app.models import Program, SubjectType, Subject, CreditStructure
 
 
@@ -139,13 +137,30 @@ def get_or_create_subject_type(code: str) -> SubjectType:
     code_norm = (code or "MAJOR").strip().upper()
     st = db.session.execute(select(SubjectType).filter_by(type_code=code_norm)).scalars().first()
     if not st:
-        st = SubjectType(type_code=code_norm, description=None)
+        st = SubjectType(type_name=code_norm, type_code=code_norm, description=None)
         db.session.add(st)
         db.session.flush()  # get type_id
     return st
 
 
-def upsert_subjects(program_name: str, path: str, default_semester: int, force_default_semester: bool = False, dry_run: bool = False):
+def to_int_safe(x: Any) -> int:
+    s = cell_to_str(x).strip()
+    if not s:
+        return 0
+    try:
+        return int(float(s))
+    except Exception:
+        return 0
+
+
+def upsert_subjects(program_name: str, path: str, default_semester: int, force_default_semester: bool = False, dry_run: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE, progress=None):
+    """Upsert the subjects (and credit structures) listed in ``path`` for a program.
+
+    Subjects are matched on program + subject_code, falling back to name +
+    semester. The program's subjects and subject types are prefetched once; rows
+    are streamed and committed in chunks (flushed when ``dry_run``).
+    Returns ``(created, updated, program_id)``.
+    """
     program = db.session.execute(select(Program).filter_by(program_name=program_name)).scalars().first()
     if not program:
         program = Program(program_name=program_name, program_duration_years=3)
@@ -154,207 +169,106 @@ def upsert_subjects(program_name: str, path: str, default_semester: int, force_d
             db.session.flush()
         else:
             db.session.commit()
-
-    created = 0
-    updated = 0
-
-    try:
-        wb = load_workbook(filename=path, data_only=True)
-        ws = wb.active
-        headers = [cell.value if cell.value is not None else "" for cell in next(ws.iter_rows(min_row=1, max_row=1))]
-        colmap = normalize_headers(headers)
-
-        for row in ws.iter_rows(min_row=2):
-            values = [cell.value for cell in row]
-            data = {}
-            for idx, key in colmap.items():
-                data[key] = values[idx] if idx < len(values) else None
-
+    program_id = program.program_id
+
+    stats = {"created": 0, "updated": 0}
+
+    # Lookup maps: type code -> type_id, subject_code / (name, semester) -> subject_id
+    type_ids = {code: type_id for type_id, code in db.session.execute(select(SubjectType.type_id, SubjectType.type_code)).all()}
+    by_code: Dict[str, int] = {}
+    by_name: Dict[Tuple[str, int], int] = {}
+    for subject_id, code, name, sem in db.session.execute(
+        select(Subject.subject_id, Subject.subject_code, Subject.subject_name, Subject.semester)
+        .filter_by(program_id_fk=program_id)
+        .order_by(Subject.subject_id.asc())
+    ).all():
+        if code:
+            by_code.setdefault(code, subject_id)
+        by_name.setdefault((name, sem), subject_id)
+
+    def type_id_for(code):
+        if code not in type_ids:
+            type_ids[code] = get_or_create_subject_type(code).type_id
+        return type_ids[code]
+
+    def import_chunk(rows):
+        records = []
+        for _row_no, values in rows:
+            data = row_dict(values, colmap)
             subject_name = cell_to_str(data.get("subject_name")).strip()
-            subject_code = cell_to_str(data.get("subject_code")).strip()
-            paper_code = cell_to_str(data.get("paper_code")).strip()
-            subject_type_code = cell_to_str(data.get("subject_type")).strip().upper() or "MAJOR"
-            sem_val = cell_to_str(data.get("semester")).strip()
-            semester = default_semester
-            if not force_default_semester:
-                if sem_val.isdigit():
-                    try:
-                        semester = int(sem_val)
-                    except Exception:
-                        semester = default_semester
-
             if not subject_name:
                 # Skip blank rows
                 continue
-
-            # Ensure Subject Type exists
-            st = get_or_create_subject_type(subject_type_code)
-
-            # Upsert Subject: prefer program + subject_code; fallback to name + semester
-            subj = None
-            if subject_code:
-                subj = db.session.execute(
-                    select(Subject).filter_by(
-                        program_id_fk=program.program_id,
-                        subject_code=subject_code,
-                    )
-                ).scalars().first()
-            if not subj:
-                subj = db.session.execute(
-                    select(Subject).filter_by(
-                        program_id_fk=program.program_id,
-                        subject_name=subject_name,
-                        semester=semester,
-                    )
-                ).scalars().first()
-            if not subj:
-                subj = Subject(
-                    program_id_fk=program.program_id,
-                    subject_type_id_fk=st.type_id,
-                    subject_name=subject_name,
-                    subject_code=(subject_code or None),
-                    paper_code=(paper_code or None),
-                    semester=semester,
-                )
-                db.session.add(subj)
-                db.session.flush()  # get subject_id
-                created += 1
-            else:
-                subj.subject_type_id_fk = st.type_id
-                if subject_code:
-                    subj.subject_code = subject_code
-                if paper_code:
-                    subj.paper_code = paper_code
-                if force_default_semester:
-                    subj.semester = default_semester
-                updated += 1
-
-            # Credits
-            def to_int_safe(x: Any) -> int:
-                s = cell_to_str(x).strip()
-                if not s:
-                    return 0
-                try:
-                    return int(float(s))
-                except Exception:
-                    return 0
-
-            th = to_int_safe(data.get("theory_credits"))
-            pr = to_int_safe(data.get("practical_credits"))
-            total = to_int_safe(data.get("total_credits"))
-            if not total:
-                total = th + pr
-
-            cs = db.session.execute(
-                select(CreditStructure).filter_by(subject_id_fk=subj.subject_id)
-            ).scalars().first()
-            if not cs:
-                cs = CreditStructure(subject_id_fk=subj.subject_id, theory_credits=th, practical_credits=pr, total_credits=total)
-                db.session.add(cs)
-            else:
-                cs.theory_credits = th
-                cs.practical_credits = pr
-                cs.total_credits = total
-
-    except InvalidFileException:
-        # Legacy .xls fallback
-        book = xlrd.open_workbook(path)
-        sheet = book.sheet_by_index(0)
-        headers = [sheet.cell_value(0, col) for col in range(sheet.ncols)]
-        colmap = normalize_headers(headers)
-
-        for r in range(1, sheet.nrows):
-            data = {}
-            for c in range(sheet.ncols):
-                key = colmap.get(c)
-                if not key:
-                    continue
-                data[key] = sheet.cell_value(r, c)
-
-            subject_name = cell_to_str(data.get("subject_name")).strip()
-            subject_code = cell_to_str(data.get("subject_code")).strip()
-            paper_code = cell_to_str(data.get("paper_code")).strip()
-            subject_type_code = cell_to_str(data.get("subject_type")).strip().upper() or "MAJOR"
             sem_val = cell_to_str(data.get("semester")).strip()
             semester = default_semester
-            if not force_default_semester:
-                if sem_val.isdigit():
-                    try:
-                        semester = int(sem_val)
-                    except Exception:
-                        semester = default_semester
-
-            if not subject_name:
-                continue
-
-            st = get_or_create_subject_type(subject_type_code)
-            subj = None
-            if subject_code:
-                subj = db.session.execute(
-                    select(Subject).filter_by(
-                        program_id_fk=program.program_id,
-                        subject_code=subject_code,
-                    )
-                ).scalars().first()
-            if not subj:
-                subj = db.session.execute(
-                    select(Subject).filter_by(
-                        program_id_fk=program.program_id,
-                        subject_name=subject_name,
-                        semester=semester,
-                    )
-                ).scalars().first()
-            if not subj:
+            if not force_default_semester and sem_val.isdigit():
+                semester = int(sem_val)
+            th = to_int_safe(data.get("theory_credits"))
+            pr = to_int_safe(data.get("practical_credits"))
+            records.append({
+                "subject_name": subject_name,
+                "subject_code": cell_to_str(data.get("subject_code")).strip(),
+                "paper_code": cell_to_str(data.get("paper_code")).strip(),
+                "type_id": type_id_for(cell_to_str(data.get("subject_type")).strip().upper() or "MAJOR"),
+                "semester": semester,
+                "credits": (th, pr, to_int_safe(data.get("total_credits")) or (th + pr)),
+            })
+        if not records:
+            return
+
+        def match(rec):
+            # Prefer program + subject_code; fallback to name + semester
+            return (by_code.get(rec["subject_code"]) if rec["subject_code"] else None) or by_name.get((rec["subject_name"], rec["semester"]))
+
+        subjects = prefetch_in(Subject.subject_id, [match(r) for r in records])
+        structures = prefetch_in(CreditStructure.subject_id_fk, list(subjects))
+        for rec in records:
+            subj = subjects.get(match(rec))
+            if subj is None:
                 subj = Subject(
-                    program_id_fk=program.program_id,
-                    subject_type_id_fk=st.type_id,
-                    subject_name=subject_name,
-                    subject_code=(subject_code or None),
-                    paper_code=(paper_code or None),
-                    semester=semester,
+                    program_id_fk=program_id,
+                    subject_type_id_fk=rec["type_id"],
+                    subject_name=rec["subject_name"],
+                    subject_code=(rec["subject_code"] or None),
+                    paper_code=(rec["paper_code"] or None),
+                    semester=rec["semester"],
                 )
                 db.session.add(subj)
-                db.session.flush()
-                created += 1
+                db.session.flush()  # get subject_id
+                subjects[subj.subject_id] = subj
+                stats["created"] += 1
             else:
-                subj.subject_type_id_fk = st.type_id
-                if subject_code:
-                    subj.subject_code = subject_code
-                if paper_code:
-                    subj.paper_code = paper_code
+                subj.subject_type_id_fk = rec["type_id"]
+                if rec["subject_code"]:
+                    subj.subject_code = rec["subject_code"]
+                if rec["paper_code"]:
+                    subj.paper_code = rec["paper_code"]
                 if force_default_semester:
                     subj.semester = default_semester
-                updated += 1
-
-            def to_int_safe(x: Any) -> int:
-                s = cell_to_str(x).strip()
-                if not s:
-                    return 0
-                try:
-                    return int(float(s))
-                except Exception:
-                    return 0
-
-            th = to_int_safe(data.get("theory_credits"))
-            pr = to_int_safe(data.get("practical_credits"))
-            total = to_int_safe(data.get("total_credits")) or (th + pr)
-            cs = db.session.execute(
-                select(CreditStructure).filter_by(subject_id_fk=subj.subject_id)
-            ).scalars().first()
-            if not cs:
-                cs = CreditStructure(subject_id_fk=subj.subject_id, theory_credits=th, practical_credits=pr, total_credits=total)
+                stats["updated"] += 1
+            if subj.subject_code:
+                by_code.setdefault(subj.subject_code, subj.subject_id)
+            by_name.setdefault((subj.subject_name, subj.semester), subj.subject_id)
+
+            th, pr, total = rec["credits"]
+            cs = structures.get(subj.subject_id)
+            if cs is None:
+                cs = structures[subj.subject_id] = CreditStructure(subject_id_fk=subj.subject_id)
                 db.session.add(cs)
-            else:
-                cs.theory_credits = th
-                cs.practical_credits = pr
-                cs.total_credits = total
+            cs.theory_credits = th
+            cs.practical_credits = pr
+            cs.total_credits = total
+
+    with open_sheet(path) as sheet:
+        colmap = normalize_headers(sheet.headers)
+        process_in_chunks(sheet, import_chunk, chunk_size=chunk_size, dry_run=dry_run, total=sheet.total, progress=progress)
 
     if dry_run:
         db.session.rollback()
     else:
         db.session.commit()
-    print(f"Imported subjects from {path}: created={created}, updated={updated}")
-    return created, updated, program.program_id
+    print(f"Imported subjects from {path}: created={stats['created']}, updated={stats['updated']}")
+    return stats["created"], stats["updated"], program_id
 
 
 def main():
@@ -9,6 +9,7 @@ if BASE_DIR not in sys.path:
 
 from sqlalchemy import or_, select, func, delete, update
 from cms_app import create_app, db
+from cms_app.attendance_rollups import rebuild as rebuild_attendance_rollups
 from cms_app.models import (
     Program,
     Division,
@@ -207,6 +208,7 @@ def remove_program_and_related(prog: Program):
         delete(Attendance).where(Attendance.student_id_fk.in_(student_ids))
     ).rowcount if student_ids else 0
     print(f"Deleted Attendance (sub): {deleted_att_sub}, (div): {deleted_att_div}, (stu): {deleted_att_stu}")
+    rebuild_attendance_rollups()
 
     deleted_gra_sub = db.session.execute(
         delete(Grade).where(Grade.subject_id_fk.in_(subject_ids))
@@ -7,10 +7,10 @@ if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 
 from cms_app import create_app, db
+from cms_app.attendance_rollups import delete_student_attendance
 from cms_app.models import (
     Program,
     Student,
-    Attendance,
     Grade,
     StudentCreditLog,
     FeesRecord,
@@ -51,9 +51,7 @@ def purge_students_for_program(prog: Program) -> None:
         return
 
     # Dependent tables first
-    deleted_enr = db.session.execute(
-        delete(Attendance).where(Attendance.student_id_fk.in_(student_ids))
-    ).rowcount or 0
+    deleted_enr = delete_student_attendance(student_ids)
     print(f"Deleted Attendance: {deleted_enr}")
     deleted_grade = db.session.execute(
         delete(Grade).where(Grade.student_id_fk.in_(student_ids))
@@ -0,0 +1,275 @@
+"""Benchmark harness: a synthetic tenant, logged-in clients and a ``bench`` fixture.
+
+Benchmarks are opt-in (they build a 10k-student database)::
+
+    CMS_BENCHMARK=1 python -m pytest tests/benchmarks -q
+
+Each benchmark runs a callable ``CMS_BENCH_ROUNDS`` times (20) after one
+warm-up call and records latency percentiles and the number of SQL statements
+(the ``X-DB-Queries`` header, i.e. ``g._db_queries``, for requests). Results
+are compared with ``baseline.json``: more queries than the baseline, or a
+median more than ``CMS_BENCH_TOLERANCE`` above it (1.0: twice as slow), fails
+the benchmark. The median is the gate because with 20 rounds p95 is one sample.
+Run with ``CMS_BENCH_UPDATE=1`` to write the current numbers as the new
+baseline. A report of the last run goes to ``bench_output.txt``.
+
+The generated database is kept in the temp directory keyed by its
+parameters and the academic year, so only the first run pays for it. Set
+``CMS_BENCH_STUDENTS`` / ``CMS_BENCH_LECTURES`` for a smaller or larger
+tenant (the baseline is only meaningful for the sizes it was recorded with).
+
+``test_boot.py`` times worker boot (a fresh interpreter importing ``app``,
+as gunicorn does) and needs no tenant::
+
+    CMS_BENCHMARK=1 python -m pytest tests/benchmarks/test_boot.py -q
+"""
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+
+import pytest
+from sqlalchemy import event
+
+from cms_app import cache, create_app, db, layout_cache
+from cms_app.main.routes import current_academic_year
+from cms_app.route_overrides import route_overrides_bp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "baseline.json")
+REPORT = os.path.join(HERE, "..", "..", "bench_output.txt")
+GENERATOR_VERSION = 1
+
+ENABLED = (os.environ.get("CMS_BENCHMARK") or "").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of ``samples``."""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    rank = max(1, min(len(ordered), int(round(pct / 100.0 * len(ordered) + 0.5))))
+    return ordered[rank - 1]
+
+
+def summarize(samples_ms, queries):
+    return {
+        "rounds": len(samples_ms),
+        "mean_ms": round(statistics.fmean(samples_ms), 2),
+        "p50_ms": round(percentile(samples_ms, 50), 2),
+        "p90_ms": round(percentile(samples_ms, 90), 2),
+        "p95_ms": round(percentile(samples_ms, 95), 2),
+        "p99_ms": round(percentile(samples_ms, 99), 2),
+        "max_ms": round(max(samples_ms), 2),
+        "queries": max(queries) if queries else 0,
+    }
+
+
+def regressions(name, result, baseline, tolerance):
+    """Messages describing how ``result`` is worse than ``baseline`` (empty when it is not)."""
+    base = baseline.get(name)
+    if not base:
+        return []
+    out = []
+    if result["queries"] > base["queries"]:
+        out.append(f"{name}: {result['queries']} queries, baseline {base['queries']}")
+    # A few milliseconds of slack keeps very fast endpoints from flapping
+    limit = base["p50_ms"] * (1 + tolerance) + 5.0
+    if result["p50_ms"] > limit:
+        out.append(f"{name}: median {result['p50_ms']} ms, baseline {base['p50_ms']} ms (limit {limit:.1f} ms)")
+    return out
+
+
+class Bench:
+    def __init__(self, app, session):
+        self.app = app
+        self.session = session
+
+    def __call__(self, name, fn, rounds=None, warmup=1, cold=True):
+        """Time ``fn`` and check it against the baseline.
+
+        ``fn`` returns a test client response (its ``X-DB-Queries`` header is
+        used) or anything else (statements are counted on the engine).
+        ``cold`` clears the shared cache and the layout LRU before every round
+        so cached reports are measured computing, not hitting, and every
+        round runs the same statements. Without an app (boot benchmarks)
+        nothing is cleared or counted.
+        """
+        for _ in range(warmup):
+            self._check_status(name, fn())
+        samples, queries = [], []
+        for _ in range(rounds or self.session.rounds):
+            if self.app is None:
+                start = time.perf_counter()
+                fn()
+                samples.append((time.perf_counter() - start) * 1000.0)
+                queries.append(0)
+                continue
+            if cold:
+                with self.app.app_context():
+                    cache.clear()
+                layout_cache._local.clear()
+            seen = []
+            listener = lambda *args: seen.append(1)
+            with self.app.app_context():
+                event.listen(db.engine, "before_cursor_execute", listener)
+            try:
+                start = time.perf_counter()
+                out = fn()
+                samples.append((time.perf_counter() - start) * 1000.0)
+            finally:
+                with self.app.app_context():
+                    event.remove(db.engine, "before_cursor_execute", listener)
+            self._check_status(name, out)
+            header = getattr(out, "headers", {}).get("X-DB-Queries") if hasattr(out, "headers") else None
+            queries.append(int(header) if header is not None else len(seen))
+        result = summarize(samples, queries)
+        self.session.results[name] = result
+        problems = regressions(name, result, self.session.baseline, self.session.tolerance)
+        if problems:
+            pytest.fail("; ".join(problems))
+        return result
+
+    @staticmethod
+    def _check_status(name, out):
+        status = getattr(out, "status_code", None)
+        if status is not None and status >= 400:
+            pytest.fail(f"{name}: HTTP {status}")
+
+
+class BenchSession:
+    """Baseline, tolerance and results shared by every benchmark of a run."""
+
+    def __init__(self, baseline, tolerance, rounds):
+        self.baseline = baseline
+        self.tolerance = tolerance
+        self.rounds = rounds
+        self.results = {}
+        self.tenant = None
+        self.notes = []
+
+
+@pytest.fixture(scope="session")
+def bench_tenant():
+    if not ENABLED:
+        pytest.skip("set CMS_BENCHMARK=1 to run the benchmarks")
+    from datagen import generate
+
+    params = {
+        "students": _env_int("CMS_BENCH_STUDENTS", 10000),
+        "lectures": _env_int("CMS_BENCH_LECTURES", 36),
+    }
+    tag = f"v{GENERATOR_VERSION}_{current_academic_year()}_{params['students']}s_{params['lectures']}l"
+    data_dir = os.path.join(tempfile.gettempdir(), "cms_bench")
+    os.makedirs(data_dir, exist_ok=True)
+    db_path = os.path.join(data_dir, f"bench_{tag}.db")
+    summary_path = db_path + ".json"
+
+    previous = os.environ.get("DATABASE_URL")
+    os.environ["DATABASE_URL"] = "sqlite:///" + db_path.replace("\\", "/")
+    try:
+        app = create_app()
+    finally:
+        if previous is None:
+            os.environ.pop("DATABASE_URL", None)
+        else:
+            os.environ["DATABASE_URL"] = previous
+    app.register_blueprint(route_overrides_bp)
+    app.config["TESTING"] = True
+    app.config["QUERY_BUDGET_MODE"] = "raise"
+
+    with app.app_context():
+        if not (os.path.exists(db_path) and os.path.exists(summary_path)):
+            for path in (db_path, summary_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            db.create_all()
+            started = time.perf_counter()
+            summary = generate(**params)
+            summary["generated_in_s"] = round(time.perf_counter() - started, 1)
+            with open(summary_path, "w", encoding="utf-8") as fh:
+                json.dump(summary, fh)
+        with open(summary_path, encoding="utf-8") as fh:
+            summary = json.load(fh)
+    return app, summary
+
+
+@pytest.fixture(scope="session")
+def bench_clients(bench_tenant):
+    """One logged-in test client per role of the synthetic tenant."""
+    from datagen import PASSWORD
+
+    app, summary = bench_tenant
+    clients = {}
+    for role, username in summary["users"].items():
+        client = app.test_client()
+        resp = client.post("/login", data={"username": username, "password": PASSWORD})
+        assert resp.status_code in (302, 303), f"{role} login failed"
+        client.get("/dashboard")
+        clients[role] = client
+    return clients
+
+
+@pytest.fixture(scope="session")
+def bench_session():
+    if not ENABLED:
+        pytest.skip("set CMS_BENCHMARK=1 to run the benchmarks")
+    recorded = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE, encoding="utf-8") as fh:
+            recorded = json.load(fh)
+    baseline = recorded.get("results", {})
+    update = (os.environ.get("CMS_BENCH_UPDATE") or "").strip().lower() in {"1", "true", "yes", "on"}
+    try:
+        tolerance = float(os.environ.get("CMS_BENCH_TOLERANCE") or 1.0)
+    except ValueError:
+        tolerance = 1.0
+    session = BenchSession({} if update else baseline, tolerance, _env_int("CMS_BENCH_ROUNDS", 20))
+    yield session
+
+    lines = [f"{'benchmark':<34}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}{'queries':>9}"]
+    for name, r in sorted(session.results.items()):
+        lines.append(f"{name:<34}{r['p50_ms']:>9}{r['p90_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>9}{r['queries']:>9}")
+    lines.append("")
+    if session.tenant:
+        lines.append(f"tenant: {json.dumps(session.tenant)}")
+    lines.extend(session.notes)
+    with open(REPORT, "w", encoding="utf-8") as fh:
+        fh.write("\n".join(lines) + "\n")
+    if update and session.results:
+        merged = dict(baseline)
+        merged.update(session.results)
+        with open(BASELINE, "w", encoding="utf-8") as fh:
+            json.dump(
+                {
+                    "recorded_on": platform.platform(),
+                    "python": platform.python_version(),
+                    "tenant": session.tenant or recorded.get("tenant", {}),
+                    "results": dict(sorted(merged.items())),
+                },
+                fh,
+                indent=2,
+            )
+            fh.write("\n")
+
+
+@pytest.fixture(scope="session")
+def bench(bench_tenant, bench_session):
+    app, summary = bench_tenant
+    bench_session.tenant = summary["counts"]
+    return Bench(app, bench_session)
+
+
+@pytest.fixture(scope="session")
+def bench_boot(bench_session):
+    """A ``bench`` without an app, for timing things that start their own process."""
+    return Bench(None, bench_session)
@@ -0,0 +1,276 @@
+"""Deterministic synthetic tenant for the benchmark suite.
+
+``generate()`` fills an empty database with one realistic trust: institutes,
+programs, divisions and subjects, staff with course assignments, students
+with user accounts and subject enrollments, a semester of attendance, exam
+marks, fee structures and payments, and announcements with recipients. The
+same ``seed`` and sizes always produce the same rows, so query counts are
+comparable between runs. Bulk tables are written with set-based inserts;
+derived tables (attendance rollups, fee balances, announcement inboxes) are
+then rebuilt the way the maintenance jobs do it.
+"""
+import json
+import random
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app import announcement_inbox, attendance_rollups, fee_balances
+from cms_app.main.routes import current_academic_year
+from cms_app.models import (
+    Announcement,
+    AnnouncementAudience,
+    AnnouncementRecipient,
+    Attendance,
+    CourseAssignment,
+    CreditStructure,
+    Division,
+    ExamMark,
+    ExamScheme,
+    Faculty,
+    FeePayment,
+    FeeStructure,
+    Institute,
+    Program,
+    Student,
+    StudentSubjectEnrollment,
+    Subject,
+    SubjectType,
+    Trust,
+    User,
+)
+
+PASSWORD = "bench-secret"
+SEMESTERS = (1, 3)
+SUBJECTS_PER_SEMESTER = 5
+DIVISION_SIZE = 60
+
+_FIRST = ["Aarav", "Diya", "Ishaan", "Kavya", "Meera", "Rohan", "Saanvi", "Vihaan", "Anaya", "Kabir", "Riya", "Arjun"]
+_LAST = ["Patel", "Shah", "Mehta", "Desai", "Joshi", "Trivedi", "Pandya", "Bhatt", "Parmar", "Chauhan"]
+_PROGRAMS = ["BCA", "BBA", "BCom", "BSc IT", "MCA", "MBA"]
+
+
+def _chunks(rows, size=5000):
+    for i in range(0, len(rows), size):
+        yield rows[i : i + size]
+
+
+def _bulk(model, rows):
+    for chunk in _chunks(rows):
+        db.session.execute(insert(model.__table__), chunk)
+
+
+def semester_dates(academic_year, lectures):
+    """``lectures`` teaching days (Mon/Wed/Fri) from the start of the academic year."""
+    start = date(int(academic_year[:4]), 6, 15)
+    days = []
+    day = start
+    while len(days) < lectures:
+        if day.weekday() in (0, 2, 4):
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def generate(seed=20240615, students=10000, institutes=3, programs_per_institute=2, lectures=36, announcements=20):
+    """Create the synthetic trust and return a summary of ids the benchmarks drive."""
+    rng = random.Random(seed)
+    academic_year = current_academic_year()
+    password_hash = generate_password_hash(PASSWORD)
+
+    trust = Trust(trust_name="Bench Trust", trust_code="BENCH", is_active=True)
+    db.session.add(trust)
+    db.session.flush()
+    core = SubjectType(type_name="Core", type_code="BENCH_CORE")
+    db.session.add(core)
+
+    programs = []
+    for i in range(institutes):
+        inst = Institute(trust_id_fk=trust.trust_id, institute_name=f"Bench Institute {i + 1}", institute_code=f"BI{i + 1}")
+        db.session.add(inst)
+        db.session.flush()
+        for j in range(programs_per_institute):
+            name = _PROGRAMS[(i * programs_per_institute + j) % len(_PROGRAMS)]
+            programs.append(Program(institute_id_fk=inst.institute_id, program_name=f"{name} {i + 1}"))
+    db.session.add_all(programs)
+    db.session.flush()
+
+    users = [{"username": "bench_admin", "password_hash": password_hash, "role": "admin", "trust_id_fk": trust.trust_id}]
+    for p in programs:
+        for role in ("principal", "clerk"):
+            users.append({"username": f"bench_{role}_{p.program_id}", "password_hash": password_hash, "role": role, "trust_id_fk": trust.trust_id, "program_id_fk": p.program_id})
+
+    # Students spread evenly over programs and semesters, then cut into divisions
+    n_cells = len(programs) * len(SEMESTERS)
+    divisions, subjects, cells = [], [], []
+    for p in programs:
+        for sem in SEMESTERS:
+            per_cell = max(1, students // n_cells + (len(cells) < students % n_cells))
+            cell_divs = [
+                Division(program_id_fk=p.program_id, semester=sem, division_code=chr(ord("A") + k), capacity=DIVISION_SIZE + 10)
+                for k in range(max(1, -(-per_cell // DIVISION_SIZE)))
+            ]
+            cell_subjects = [
+                Subject(program_id_fk=p.program_id, subject_type_id_fk=core.type_id, subject_name=f"{p.program_name} S{sem} Paper {k + 1}", subject_code=f"P{p.program_id}S{sem}{k + 1}", semester=sem, is_active=True)
+                for k in range(SUBJECTS_PER_SEMESTER)
+            ]
+            divisions += cell_divs
+            subjects += cell_subjects
+            cells.append((p, sem, cell_divs, cell_subjects, per_cell))
+    db.session.add_all(divisions + subjects)
+    db.session.flush()
+    _bulk(CreditStructure, [{"subject_id_fk": s.subject_id, "theory_credits": 4, "total_credits": 4} for s in subjects])
+
+    for s in subjects:
+        users.append({"username": f"bench_faculty_{s.subject_id}", "password_hash": password_hash, "role": "faculty", "trust_id_fk": trust.trust_id, "program_id_fk": s.program_id_fk})
+    student_rows = []
+    n = 0
+    for p, sem, cell_divs, _subj, per_cell in cells:
+        for k in range(per_cell):
+            n += 1
+            enr = f"BENCH{n:06d}"
+            div = cell_divs[k // DIVISION_SIZE]
+            student_rows.append({
+                "enrollment_no": enr,
+                "program_id_fk": p.program_id,
+                "division_id_fk": div.division_id,
+                "student_name": rng.choice(_FIRST),
+                "surname": rng.choice(_LAST),
+                "father_name": rng.choice(_FIRST),
+                "roll_no": str(k % DIVISION_SIZE + 1),
+                "mobile": f"9{rng.randrange(10 ** 9):09d}",
+                "current_semester": sem,
+                "medium_tag": "English",
+                "trust_id_fk": trust.trust_id,
+                "is_active": True,
+            })
+            users.append({"username": f"bench_{enr.lower()}", "password_hash": password_hash, "role": "student", "trust_id_fk": trust.trust_id, "program_id_fk": p.program_id})
+    _bulk(User, users)
+    user_ids = dict(db.session.execute(select(User.username, User.user_id).where(User.username.like("bench_%"))).all())
+    for row in student_rows:
+        row["user_id_fk"] = user_ids[f"bench_{row['enrollment_no'].lower()}"]
+    _bulk(Student, student_rows)
+
+    faculty_rows, assignments = [], []
+    for s in subjects:
+        uid = user_ids[f"bench_faculty_{s.subject_id}"]
+        faculty_rows.append({"user_id_fk": uid, "program_id_fk": s.program_id_fk, "full_name": f"{rng.choice(_FIRST)} {rng.choice(_LAST)}", "trust_id_fk": trust.trust_id, "is_active": True})
+    for p, sem, cell_divs, cell_subjects, _n in cells:
+        for s in cell_subjects:
+            for d in cell_divs:
+                assignments.append({"faculty_id_fk": user_ids[f"bench_faculty_{s.subject_id}"], "subject_id_fk": s.subject_id, "division_id_fk": d.division_id, "academic_year": academic_year, "is_active": True})
+    _bulk(Faculty, faculty_rows)
+    _bulk(CourseAssignment, assignments)
+
+    # Enrollments, a semester of attendance and exam marks per (student, subject)
+    by_cell = {}
+    for row in student_rows:
+        by_cell.setdefault((row["program_id_fk"], row["current_semester"]), []).append(row)
+    days = semester_dates(academic_year, lectures)
+    enrollments, attendance, marks, schemes = [], [], [], {}
+    for p, sem, _divs, cell_subjects, _n in cells:
+        scheme = ExamScheme(program_id_fk=p.program_id, semester=sem, academic_year=academic_year, name=f"Sem {sem} Final", max_internal_marks=30, max_external_marks=70, max_total_marks=100, is_active=True)
+        db.session.add(scheme)
+        db.session.flush()
+        schemes[(p.program_id, sem)] = scheme.scheme_id
+        for row in by_cell.get((p.program_id, sem), []):
+            enr, div_id = row["enrollment_no"], row["division_id_fk"]
+            regular = rng.random()
+            for s in cell_subjects:
+                enrollments.append({"student_id_fk": enr, "subject_id_fk": s.subject_id, "semester": sem, "division_id_fk": div_id, "academic_year": academic_year, "is_active": True, "source": "bulk"})
+                for period, day in enumerate(days):
+                    roll = rng.random()
+                    status = "P" if roll < 0.55 + 0.4 * regular else ("L" if roll < 0.6 + 0.4 * regular else "A")
+                    attendance.append({"student_id_fk": enr, "subject_id_fk": s.subject_id, "division_id_fk": div_id, "date_marked": day, "status": status, "semester": sem, "period_no": period % 6 + 1})
+                internal, external = rng.randint(8, 30), rng.randint(15, 70)
+                marks.append({"student_id_fk": enr, "subject_id_fk": s.subject_id, "division_id_fk": div_id, "scheme_id_fk": scheme.scheme_id, "semester": sem, "academic_year": academic_year, "attempt_no": 1, "internal_marks": internal, "external_marks": external, "total_marks": internal + external, "is_absent": False})
+            if len(attendance) > 200000:
+                _bulk(Attendance, attendance)
+                attendance = []
+    _bulk(StudentSubjectEnrollment, enrollments)
+    _bulk(Attendance, attendance)
+    _bulk(ExamMark, marks)
+
+    # Fees: three components per program/semester, about one and a half payments per student
+    structures = []
+    for p, sem, _divs, _subj, _n in cells:
+        for name, amount in (("Tuition", 18000.0), ("Library", 1500.0), ("Exam", 2500.0)):
+            structures.append({"program_id_fk": p.program_id, "semester": sem, "component_name": name, "amount": amount, "is_active": True, "medium_tag": "English"})
+    _bulk(FeeStructure, structures)
+    payments = []
+    for row in student_rows:
+        for _ in range(1 + (rng.random() < 0.5)):
+            status = rng.choices(["verified", "submitted", "rejected"], weights=[7, 2, 1])[0]
+            payments.append({
+                "enrollment_no": row["enrollment_no"],
+                "program_id_fk": row["program_id_fk"],
+                "semester": row["current_semester"],
+                "medium_tag": "English",
+                "amount": float(rng.choice([5000, 7500, 11000, 22000])),
+                "utr": f"UTR{len(payments):09d}",
+                "status": status,
+                "payment_mode": "upi",
+                "payment_date": days[rng.randrange(len(days))],
+                "created_at": datetime.combine(days[0], datetime.min.time()),
+            })
+    _bulk(FeePayment, payments)
+
+    attendance_rollups.rebuild()
+    fee_balances.rebuild()
+    db.session.commit()
+
+    # Announcements go through the ORM so they fan out like the real ones
+    now = datetime.now()
+    for k in range(announcements):
+        p = programs[k % len(programs)] if k % 3 else None
+        ann = Announcement(
+            title=f"Notice {k + 1}",
+            message="Synthetic announcement body. " * 8,
+            severity=rng.choice(["info", "warning"]),
+            is_active=True,
+            trust_id_fk=trust.trust_id,
+            program_id_fk=(p.program_id if p else None),
+            start_at=now - timedelta(days=k),
+            end_at=now + timedelta(days=30),
+            created_by=user_ids["bench_admin"],
+        )
+        db.session.add(ann)
+        db.session.flush()
+        if k % 4 == 1:
+            db.session.add(AnnouncementAudience(announcement_id_fk=ann.announcement_id, role="student"))
+        if k % 5 == 2 and p is not None:
+            sample = [r["enrollment_no"] for r in student_rows if r["program_id_fk"] == p.program_id][:100]
+            db.session.add_all([AnnouncementRecipient(announcement_id_fk=ann.announcement_id, student_id_fk=e) for e in sample])
+        announcement_inbox.fan_out(ann.announcement_id)
+    db.session.commit()
+
+    # What the benchmarks drive: the first program's first cell
+    p0, sem0, divs0, subjects0, _n = cells[0]
+    first = by_cell[(p0.program_id, sem0)]
+    return {
+        "academic_year": academic_year,
+        "trust_id": trust.trust_id,
+        "program_id": p0.program_id,
+        "semester": sem0,
+        "division_id": divs0[0].division_id,
+        "subject_id": subjects0[0].subject_id,
+        "scheme_id": schemes[(p0.program_id, sem0)],
+        "roster": [r["enrollment_no"] for r in first if r["division_id_fk"] == divs0[0].division_id],
+        "users": {
+            "admin": "bench_admin",
+            "principal": f"bench_principal_{p0.program_id}",
+            "clerk": f"bench_clerk_{p0.program_id}",
+            "faculty": f"bench_faculty_{subjects0[0].subject_id}",
+            "student": f"bench_{first[0]['enrollment_no'].lower()}",
+        },
+        "counts": {
+            "students": len(student_rows),
+            "attendance": len(enrollments) * len(days),
+            "exam_marks": len(marks),
+            "fee_payments": len(payments),
+        },
+        "seed": seed,
+        "params": json.dumps({"students": students, "institutes": institutes, "programs_per_institute": programs_per_institute, "lectures": lectures, "announcements": announcements}, sort_keys=True),
+    }
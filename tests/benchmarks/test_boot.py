@@ -0,0 +1,51 @@
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    (os.environ.get("CMS_BENCHMARK") or "").strip().lower() not in {"1", "true", "yes", "on"},
+    reason="set CMS_BENCHMARK=1 to run the benchmarks",
+)
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def _boot_env(tmp):
+    env = dict(os.environ)
+    env.update(
+        DATABASE_URL="sqlite:///" + os.path.join(tmp, "boot.db").replace("\\", "/"),
+        CMS_STARTUP_SCHEMA_SYNC="0",
+        CMS_JOBS_WORKER="0",
+    )
+    for name in ("CMS_INIT_MIGRATE", "PYTHONDONTWRITEBYTECODE"):
+        env.pop(name, None)
+    return env
+
+
+def _boot(env, *flags):
+    # os._exit: tearing down the mapped models costs ~0.25 s and is not part of booting
+    code = "import os, sys, app; sys.stderr.flush(); os._exit(0)"
+    return subprocess.run([sys.executable, *flags, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+
+def test_worker_boot(bench_boot, bench_session):
+    """Fresh interpreter to a ready ``app`` object, with warm bytecode caches."""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = _boot_env(tmp)
+        bench_boot("boot[worker]", lambda: _boot(env), rounds=int(os.environ.get("CMS_BENCH_BOOT_ROUNDS") or 7), cold=False)
+
+        # Where the import part of that goes, for the report
+        out = _boot(env, "-X", "importtime")
+    top = {}
+    for line in out.stderr.splitlines():
+        m = _IMPORTTIME.match(line)
+        if m and len(m.group(3)) <= 3:
+            top[m.group(4)] = int(m.group(2))
+    bench_session.notes.append("boot imports (cumulative ms):")
+    for name, us in sorted(top.items(), key=lambda kv: kv[1], reverse=True)[:12]:
+        bench_session.notes.append(f"  {name:<40}{us / 1000.0:>9.1f}")
@@ -0,0 +1,90 @@
+import os
+from datetime import date
+
+import pytest
+
+from cms_app import db
+from cms_app.exams.services import calculate_exam_results
+
+pytestmark = pytest.mark.skipif(
+    (os.environ.get("CMS_BENCHMARK") or "").strip().lower() not in {"1", "true", "yes", "on"},
+    reason="set CMS_BENCHMARK=1 to run the benchmarks",
+)
+
+
+def _csrf(client):
+    with client.session_transaction() as sess:
+        return sess.get("csrf_token")
+
+
+# /dashboard redirects faculty and students to their own landing pages
+@pytest.mark.parametrize(
+    "role,path",
+    [("admin", "/dashboard"), ("principal", "/dashboard"), ("clerk", "/dashboard"), ("faculty", "/faculty/dashboard"), ("student", "/timetable/my_timetable")],
+)
+def test_dashboard(bench, bench_clients, role, path):
+    client = bench_clients[role]
+    bench(f"dashboard[{role}]", lambda: client.get(path))
+
+
+def test_attendance_mark(bench, bench_tenant, bench_clients):
+    _app, t = bench_tenant
+    client = bench_clients["faculty"]
+    args = {
+        "subject_id": t["subject_id"],
+        "division_id": t["division_id"],
+        "academic_year": t["academic_year"],
+        "period_no": 1,
+        "date": date.today().strftime("%Y-%m-%d"),
+    }
+    bench("attendance_mark[get]", lambda: client.get("/attendance/mark", query_string=args))
+
+    form = dict(args, csrf_token=_csrf(client))
+    form.update({f"status_{enr}": ("A" if i % 7 == 0 else "P") for i, enr in enumerate(t["roster"])})
+    bench("attendance_mark[post]", lambda: client.post("/attendance/mark", data=form))
+
+
+def test_attendance_report(bench, bench_tenant, bench_clients):
+    _app, t = bench_tenant
+    client = bench_clients["admin"]
+    args = {"program_id": t["program_id"], "semester": t["semester"]}
+    bench("attendance_report", lambda: client.get("/attendance/report", query_string=args))
+
+
+def test_fee_reports(bench, bench_tenant, bench_clients):
+    _app, t = bench_tenant
+    args = {"program_id": t["program_id"], "semester": t["semester"]}
+    clerk, principal = bench_clients["clerk"], bench_clients["principal"]
+    bench("fees_payment_status", lambda: clerk.get("/fees/payment-status", query_string=args))
+    bench("api_reports_fees_program_status", lambda: principal.get("/api/reports/fees-program-status", query_string=args))
+
+
+@pytest.mark.parametrize("role", ["admin", "student"])
+def test_inbox(bench, bench_clients, role):
+    client = bench_clients[role]
+    bench(f"inbox[{role}]", lambda: client.get("/inbox"))
+
+
+def test_student_search(bench, bench_clients):
+    client = bench_clients["admin"]
+    bench("api_students_search", lambda: client.get("/api/students/search", query_string={"q": "pat"}))
+
+
+def test_exam_marks_and_results(bench, bench_tenant, bench_clients):
+    app, t = bench_tenant
+    client = bench_clients["principal"]
+    scheme_id = t["scheme_id"]
+    form = {"subject_id": t["subject_id"], "student_ids": t["roster"], "csrf_token": _csrf(client)}
+    for i, enr in enumerate(t["roster"]):
+        form[f"internal_{enr}"] = str(10 + i % 20)
+        form[f"external_{enr}"] = str(30 + i % 40)
+    bench("exam_save_marks", lambda: client.post(f"/academics/exams/{scheme_id}/save-marks", data=form))
+    bench("exam_calculate[enqueue]", lambda: client.post(f"/academics/exams/{scheme_id}/calculate", data={"csrf_token": _csrf(client)}))
+
+    def _run_job():
+        with app.app_context():
+            ok, message, _count = calculate_exam_results(scheme_id)
+            assert ok, message
+            db.session.commit()
+
+    bench("exam_calculate[job]", _run_job, rounds=5)
@@ -3,7 +3,7 @@ import tempfile
 import pytest
 
 from cms_app import create_app, db
-from cms_app.models import User
+from cms_app.models import Institute, Program, Trust, User
 from cms_app.route_overrides import route_overrides_bp
 from werkzeug.security import generate_password_hash
 
@@ -25,6 +25,7 @@ def app(temp_db_path):
     app.register_blueprint(route_overrides_bp)
     app.config["TESTING"] = True
     app.config["RATELIMIT_ENABLED"] = True
+    app.config["QUERY_BUDGET_MODE"] = "raise"
     with app.app_context():
         from cms_app import models  # ensure models are registered
         db.create_all()
@@ -44,6 +45,29 @@ def client(app):
     return app.test_client()
 
 
+@pytest.fixture()
+def seed_tenant(app):
+    """Factory for a Trust -> Institute -> Program chain named after a unique ``code``.
+
+    ``seed_tenant(code, programs=("P",))`` must run inside an app context. It
+    flushes and returns ``(trust, [program, ...])`` with programs named
+    ``f"{name}_{code}"``; the test adds its own rows and commits.
+    """
+    def _seed(code, programs=("P",)):
+        t = Trust(trust_name=f"T_{code}", trust_code=f"T_{code}", is_active=True)
+        db.session.add(t)
+        db.session.flush()
+        inst = Institute(trust_id_fk=t.trust_id, institute_name=f"I_{code}", institute_code=f"I_{code}")
+        db.session.add(inst)
+        db.session.flush()
+        progs = [Program(institute_id_fk=inst.institute_id, program_name=f"{name}_{code}") for name in programs]
+        db.session.add_all(progs)
+        db.session.flush()
+        return t, progs
+
+    return _seed
+
+
 @pytest.fixture(autouse=True)
 def patch_cache_app(app):
     from cms_app import cache
@@ -0,0 +1,116 @@
+from sqlalchemy import event, select
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app.announcement_inbox import fan_out, inbox_counts, set_read, unread_count
+from cms_app.models import (
+    Announcement,
+    AnnouncementAudience,
+    AnnouncementInbox,
+    AnnouncementRecipient,
+    Student,
+    User,
+)
+
+
+def _login(client, username, password="secret"):
+    client.post("/login", data={"username": username, "password": password})
+    with client.session_transaction() as sess:
+        return sess.get("csrf_token")
+
+
+def _seed(seed_tenant, code):
+    t, (pa, pb) = seed_tenant(code, programs=("PA", "PB"))
+    users = {}
+    for name, role, pid in [
+        ("admin", "admin", None),
+        ("principal", "principal", pa.program_id),
+        ("faculty", "faculty", pa.program_id),
+        ("s1", "student", pa.program_id),
+        ("s2", "student", pa.program_id),
+        ("s3", "student", pb.program_id),
+    ]:
+        u = User(username=f"{name}_{code.lower()}", password_hash=generate_password_hash("secret"), role=role, program_id_fk=pid, trust_id_fk=t.trust_id)
+        db.session.add(u)
+        users[name] = u
+    db.session.flush()
+    db.session.add(Student(enrollment_no=f"{code}_S1", program_id_fk=pa.program_id, trust_id_fk=t.trust_id, user_id_fk=users["s1"].user_id, is_active=True))
+    db.session.commit()
+    return t.trust_id, pa.program_id, pb.program_id, {k: u.user_id for k, u in users.items()}
+
+
+def _announce(trust_id, title, program_id=None, roles=(), recipients=()):
+    a = Announcement(title=title, message="m", severity="info", is_active=True, trust_id_fk=trust_id, program_id_fk=program_id)
+    db.session.add(a)
+    db.session.flush()
+    for r in roles:
+        db.session.add(AnnouncementAudience(announcement_id_fk=a.announcement_id, role=r))
+    for enr in recipients:
+        db.session.add(AnnouncementRecipient(announcement_id_fk=a.announcement_id, student_id_fk=enr))
+    fan_out(a.announcement_id)
+    db.session.commit()
+    return a.announcement_id
+
+
+def _addressed(announcement_id, users):
+    ids = set(db.session.execute(select(AnnouncementInbox.user_id_fk).filter_by(announcement_id_fk=announcement_id)).scalars())
+    return {name for name, uid in users.items() if uid in ids}
+
+
+def test_fan_out_resolves_audience_and_follows_changes(app, seed_tenant):
+    with app.app_context():
+        trust_id, pa, pb, users = _seed(seed_tenant, "FAN")
+        everyone = _announce(trust_id, "Everyone")
+        students_a = _announce(trust_id, "Students A", program_id=pa, roles=["student"])
+        personal = _announce(trust_id, "Personal", recipients=["FAN_S1"])
+        assert _addressed(everyone, users) == set(users)
+        assert _addressed(students_a, users) == {"s1", "s2"}
+        assert _addressed(personal, users) == {"principal", "s1"}
+
+        # Moving a student to another program re-resolves their rows
+        db.session.get(User, users["s2"]).program_id_fk = pb
+        db.session.commit()
+        assert _addressed(students_a, users) == {"s1"}
+
+        # Re-resolving after an edit keeps read state of users still addressed
+        set_read(users["s1"], [students_a])
+        db.session.commit()
+        db.session.add(AnnouncementAudience(announcement_id_fk=students_a, role="faculty"))
+        fan_out(students_a)
+        db.session.commit()
+        assert _addressed(students_a, users) == {"s1", "faculty"}
+        assert unread_count(users["s1"], trust_id) == 2
+        assert inbox_counts(users["s1"], trust_id) == (3, 2)
+
+        db.session.get(Announcement, everyone).is_active = False
+        db.session.commit()
+        assert inbox_counts(users["s1"], trust_id) == (2, 1)
+
+
+def test_inbox_pages_read_from_inbox_rows(client, app, seed_tenant):
+    with app.app_context():
+        trust_id, pa, _pb, users = _seed(seed_tenant, "INBX")
+        ann_id = _announce(trust_id, "Exam schedule", program_id=pa, roles=["student"])
+        _announce(trust_id, "Fee reminder", recipients=["INBX_S1"])
+
+    csrf = _login(client, "s1_inbx")
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        html = client.get("/inbox").get_data(as_text=True)
+    finally:
+        with app.app_context():
+            event.remove(db.engine, "before_cursor_execute", listener)
+    assert "Exam schedule" in html and "Fee reminder" in html
+    assert sum(1 for s in statements if "announcement" in s.lower()) <= 4
+
+    client.post(f"/inbox/announcements/{ann_id}/read", data={"csrf_token": csrf})
+    with app.app_context():
+        assert unread_count(users["s1"], trust_id) == 1
+    assert "Exam schedule" not in client.get("/inbox").get_data(as_text=True)
+    assert "Exam schedule" in client.get("/notice-board").get_data(as_text=True)
+    client.post("/inbox/mark-all-read", data={"csrf_token": csrf})
+    with app.app_context():
+        assert inbox_counts(users["s1"], trust_id) == (2, 0)
@@ -0,0 +1,68 @@
+import os
+from io import BytesIO
+
+from werkzeug.datastructures import FileStorage
+
+from cms_app import db
+from cms_app.attachments import absolute_path, for_owners, release, store, subject_storage_bytes
+from cms_app.models import Announcement, Subject, SubjectType
+
+
+def _upload(data, name):
+    return FileStorage(stream=BytesIO(data), filename=name, content_type="application/pdf")
+
+
+def test_identical_uploads_share_one_blob(app, monkeypatch, tmp_path, seed_tenant):
+    monkeypatch.setattr(app, "static_folder", str(tmp_path))
+    with app.app_context():
+        t, (prog,) = seed_tenant("ATT")
+        stype = SubjectType(type_name="Core ATT", type_code="CORE_ATT")
+        db.session.add(stype)
+        db.session.flush()
+        s1 = Subject(program_id_fk=prog.program_id, subject_type_id_fk=stype.type_id, subject_name="Maths", semester=1)
+        s2 = Subject(program_id_fk=prog.program_id, subject_type_id_fk=stype.type_id, subject_name="Physics", semester=1)
+        db.session.add_all([s1, s2])
+        db.session.flush()
+
+        pdf = b"%PDF-1.4 syllabus" * 100
+        a = store(_upload(pdf, "syllabus.pdf"), "material", 9001, subject_id=s1.subject_id)
+        b = store(_upload(pdf, "Syllabus Copy.pdf"), "material", 9002, subject_id=s2.subject_id)
+        store(_upload(b"notes", "notes.pdf"), "material", 9001, subject_id=s1.subject_id)
+        db.session.commit()
+
+        assert a.storage_path == b.storage_path and a.sha256 == b.sha256
+        assert b.file_name == "Syllabus_Copy.pdf" and a.mime_type == "application/pdf"
+        blobs = [f for _d, _s, files in os.walk(tmp_path / "cas") for f in files]
+        assert len(blobs) == 2
+        assert subject_storage_bytes(s1.subject_id) == len(pdf) + 5
+        assert subject_storage_bytes(s2.subject_id) == len(pdf)
+
+        # Re-uploading a name replaces it; a shared blob survives until its last row goes
+        store(_upload(b"notes v2", "notes.pdf"), "material", 9001, subject_id=s1.subject_id)
+        db.session.commit()
+        assert [r.size_bytes for r in for_owners("material", [9001])[9001] if r.file_name == "notes.pdf"] == [8]
+        release(for_owners("material", [9001])[9001])
+        db.session.commit()
+        assert os.path.exists(absolute_path(b))
+        release([b])
+        db.session.commit()
+        assert not os.path.exists(absolute_path(b))
+        assert subject_storage_bytes(s1.subject_id) == 0
+
+
+def test_notice_board_lists_manifest_attachments(client, app, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "static_folder", str(tmp_path))
+    with app.app_context():
+        ann = Announcement(title="Holiday list", message="m", severity="info", is_active=True)
+        db.session.add(ann)
+        db.session.flush()
+        row = store(_upload(b"%PDF holidays", "holidays.pdf"), "announcement", ann.announcement_id)
+        db.session.commit()
+        url = f"/announcements/attachments/{row.attachment_id}/holidays.pdf"
+
+    html = client.get("/notice-board").get_data(as_text=True)
+    assert "Holiday list" in html and url in html
+    resp = client.get(url)
+    assert resp.status_code == 200 and resp.data == b"%PDF holidays"
+    assert resp.mimetype == "application/pdf"
+    assert client.get(url.replace("holidays.pdf", "other.pdf")).status_code == 404
@@ -0,0 +1,132 @@
+from datetime import date
+
+from sqlalchemy import select
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app.attendance_rollups import RollupTracker, academic_year_for, daily_totals, delete_student_attendance, rebuild
+from cms_app.models import (
+    Attendance,
+    AttendanceSessionRollup,
+    AttendanceStudentRollup,
+    Division,
+    Student,
+    Subject,
+    SubjectType,
+    User,
+)
+
+
+def _seed(seed_tenant, code):
+    t, (p,) = seed_tenant(code)
+    d = Division(program_id_fk=p.program_id, semester=3, division_code="A", capacity=60)
+    stype = SubjectType(type_name="Core", type_code=f"CORE_{code}")
+    db.session.add_all([d, stype])
+    db.session.flush()
+    sub = Subject(program_id_fk=p.program_id, subject_type_id_fk=stype.type_id, subject_name=f"S_{code}", subject_code=f"S_{code}", semester=3, is_active=True)
+    db.session.add(sub)
+    db.session.flush()
+    students = []
+    for i in range(3):
+        stu = Student(enrollment_no=f"E_{code}_{i}", student_name="A", surname="B", program_id_fk=p.program_id, current_semester=3, trust_id_fk=t.trust_id, is_active=True, division_id_fk=d.division_id)
+        db.session.add(stu)
+        students.append(stu)
+    db.session.flush()
+    return t, p, d, sub, students
+
+
+def _mark(tracker, sub, d, students, day, statuses, period=1):
+    rows = []
+    for stu, st in zip(students, statuses):
+        att = Attendance(student_id_fk=stu.enrollment_no, subject_id_fk=sub.subject_id, division_id_fk=d.division_id, date_marked=day, status=st, semester=3, period_no=period)
+        db.session.add(att)
+        tracker.add(att)
+        rows.append(att)
+    return rows
+
+
+def test_academic_year_starts_in_june():
+    assert academic_year_for(date(2025, 6, 1)) == "2025-26"
+    assert academic_year_for(date(2026, 5, 31)) == "2025-26"
+
+
+def test_tracker_refresh_follows_remarking(app, seed_tenant):
+    with app.app_context():
+        t, p, d, sub, students = _seed(seed_tenant, "ROLL1")
+        day = date(2025, 9, 1)
+        tracker = RollupTracker()
+        rows = _mark(tracker, sub, d, students, day, ["P", "A", "L"])
+        _mark(tracker, sub, d, students, day, ["P", "P", "P"], period=2)
+        tracker.flush()
+        db.session.commit()
+
+        sessions = db.session.execute(select(AttendanceSessionRollup).filter_by(subject_id_fk=sub.subject_id).order_by(AttendanceSessionRollup.period_no)).scalars().all()
+        assert [(s.period_no, s.present_count, s.absent_count, s.late_count, s.total_count) for s in sessions] == [(1, 1, 1, 1, 3), (2, 3, 0, 0, 3)]
+
+        rows[0].status = "A"
+        tracker.add(rows[0])
+        tracker.flush()
+        db.session.commit()
+        totals = daily_totals(day, day, subject_ids=[sub.subject_id])
+        assert totals[day] == {"P": 3, "A": 2, "L": 1, "total": 6}
+
+        counters = db.session.execute(select(AttendanceStudentRollup).filter_by(student_id_fk=students[0].enrollment_no)).scalars().one()
+        assert (counters.academic_year, counters.present_count, counters.absent_count, counters.total_count) == ("2025-26", 1, 1, 2)
+        assert daily_totals(day, day, trust_id=t.trust_id)[day]["total"] == 6
+
+
+def test_rebuild_and_student_delete_keep_rollups_consistent(app, seed_tenant):
+    with app.app_context():
+        t, p, d, sub, students = _seed(seed_tenant, "ROLL2")
+        day = date(2025, 10, 2)
+        for i, stu in enumerate(students):
+            db.session.add(Attendance(student_id_fk=stu.enrollment_no, subject_id_fk=sub.subject_id, division_id_fk=d.division_id, date_marked=day, status=("P" if i else "A"), semester=3, period_no=1))
+        db.session.flush()
+        rebuild()
+        db.session.commit()
+        assert daily_totals(day, day, subject_ids=[sub.subject_id])[day] == {"P": 2, "A": 1, "L": 0, "total": 3}
+
+        assert delete_student_attendance([students[0].enrollment_no]) == 1
+        db.session.commit()
+        assert daily_totals(day, day, subject_ids=[sub.subject_id])[day] == {"P": 2, "A": 0, "L": 0, "total": 2}
+        assert db.session.execute(select(AttendanceStudentRollup).filter_by(student_id_fk=students[0].enrollment_no)).first() is None
+
+
+def test_attendance_summary_api_reads_rollups(client, app, seed_tenant):
+    with app.app_context():
+        t, p, d, sub, students = _seed(seed_tenant, "ROLL3")
+        tracker = RollupTracker()
+        _mark(tracker, sub, d, students, date(2025, 11, 3), ["P", "P", "A"])
+        tracker.flush()
+        db.session.add(User(username="principal_rollups", password_hash=generate_password_hash("secret"), role="principal", trust_id_fk=t.trust_id, program_id_fk=p.program_id))
+        db.session.commit()
+        subject_id = sub.subject_id
+        program_id = p.program_id
+    client.post("/login", data={"username": "principal_rollups", "password": "secret"}, follow_redirects=True)
+    resp = client.get(f"/api/reports/attendance-summary?program_id={program_id}")
+    assert resp.status_code == 200
+    items = {item["subject_id"]: item for item in resp.get_json()["data"]["items"]}
+    assert (items[subject_id]["present"], items[subject_id]["total"], items[subject_id]["rate"]) == (2, 3, 66.7)
+    resp = client.get(f"/attendance/report?subject_id={subject_id}")
+    assert resp.status_code == 200
+
+
+def test_lifecycle_hard_delete_purges_student_rollups(client, app, seed_tenant):
+    with app.app_context():
+        t, p, d, sub, students = _seed(seed_tenant, "ROLL4")
+        day = date(2025, 12, 1)
+        tracker = RollupTracker()
+        _mark(tracker, sub, d, students, day, ["P", "A", "P"])
+        tracker.flush()
+        db.session.add(User(username="principal_purge", password_hash=generate_password_hash("secret"), role="principal", trust_id_fk=t.trust_id, program_id_fk=p.program_id))
+        db.session.commit()
+        subject_id = sub.subject_id
+        enrollments = [stu.enrollment_no for stu in students]
+    client.post("/login", data={"username": "principal_purge", "password": "secret"}, follow_redirects=True)
+    form = {"semester": "all", "include_inactive": "1"}
+    assert client.post("/admin/student-lifecycle", data=dict(form, action="backup")).status_code == 200
+    client.post("/admin/student-lifecycle", data=dict(form, action="hard_delete", confirm="DELETE"))
+    with app.app_context():
+        assert db.session.execute(select(Student).filter(Student.enrollment_no.in_(enrollments))).first() is None
+        assert db.session.execute(select(AttendanceStudentRollup).filter(AttendanceStudentRollup.student_id_fk.in_(enrollments))).first() is None
+        assert daily_totals(day, day, subject_ids=[subject_id]).get(day, {}).get("total", 0) == 0
@@ -0,0 +1,166 @@
+import io
+import zipfile
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook
+from sqlalchemy import select
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app.jobs.services import _due_job_ids, cancel_job, claim, enqueue, execute, job_handler, job_result, requeue_stale
+from cms_app.models import BackgroundJob, FeeStructure, Student, User
+
+_calls = {"flaky": 0}
+
+
+@job_handler("test_flaky", max_attempts=2)
+def _flaky_job(ctx, value):
+    _calls["flaky"] += 1
+    ctx.progress(50, "half way")
+    if ctx.attempt == 1:
+        raise RuntimeError("transient")
+    return {"message": f"echo {value}"}
+
+
+@job_handler("test_self_cancel")
+def _self_cancel_job(ctx):
+    cancel_job(ctx.job_id)
+    ctx.progress(10, "checkpoint")
+    return {"message": "unreachable"}
+
+
+def _run(job_id):
+    assert claim(job_id, "pytest")
+    execute(job_id)
+    db.session.expire_all()
+    return db.session.get(BackgroundJob, job_id)
+
+
+def _login(client, username, password="secret"):
+    client.post("/login", data={"username": username, "password": password}, follow_redirects=True)
+
+
+def test_job_retry_cancel_and_stale_recovery(app):
+    with app.app_context():
+        job = enqueue("test_flaky", {"value": 7})
+        job = _run(job.job_id)
+        assert (job.status, job.attempts, job.error) == ("queued", 1, "RuntimeError: transient")
+        assert job.run_after > datetime.utcnow()
+        assert job.job_id not in _due_job_ids(limit=1000)
+
+        job.run_after = None
+        db.session.commit()
+        job = _run(job.job_id)
+        assert (job.status, job.attempts, job.progress) == ("succeeded", 2, 100)
+        assert job_result(job) == {"message": "echo 7"}
+        assert _calls["flaky"] == 2
+
+        queued = enqueue("test_flaky", {"value": 1})
+        assert cancel_job(queued.job_id) is True
+        assert claim(queued.job_id, "pytest") is False
+        assert db.session.get(BackgroundJob, queued.job_id).status == "cancelled"
+
+        running = _run(enqueue("test_self_cancel").job_id)
+        assert running.status == "cancelled"
+
+        stale = enqueue("test_flaky", {"value": 2})
+        assert claim(stale.job_id, "dead-worker")
+        stale.heartbeat_at = datetime.utcnow() - timedelta(hours=2)
+        db.session.commit()
+        assert requeue_stale(60) >= 1
+        db.session.expire_all()
+        assert db.session.get(BackgroundJob, stale.job_id).status == "queued"
+        cancel_job(stale.job_id)
+
+
+def test_fee_import_route_enqueues_and_job_applies_rows(client, app, seed_tenant):
+    with app.app_context():
+        t, (p,) = seed_tenant("JOBFEE")
+        db.session.add(User(username="clerk_jobfee", password_hash=generate_password_hash("secret"), role="clerk", trust_id_fk=t.trust_id, program_id_fk=p.program_id))
+        db.session.commit()
+        program_id = p.program_id
+    _login(client, "clerk_jobfee")
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["SR NO", "DESCRIPTION", "AMOUNT"])
+    ws.append([1, "Tuition Fee", 12000])
+    ws.append([2, "Library Fee", 500])
+    ws.append([3, "Mystery Fee", 10])
+    bio = io.BytesIO()
+    wb.save(bio)
+    bio.seek(0)
+    resp = client.post(
+        "/fees/import",
+        data={"program_id": str(program_id), "semester": "1", "excel_file": (bio, "fees.xlsx")},
+        content_type="multipart/form-data",
+    )
+    assert resp.status_code == 302
+    job_id = int(resp.headers["Location"].rstrip("/").rsplit("/", 1)[-1])
+    status = client.get(f"/api/jobs/{job_id}").get_json()["data"]
+    assert status["status"] == "queued"
+    with app.app_context():
+        assert db.session.execute(select(FeeStructure).filter_by(program_id_fk=program_id)).first() is None
+        job = _run(job_id)
+        assert job.status == "succeeded", job.error
+        amounts = {f.component_name: f.amount for f in db.session.execute(select(FeeStructure).filter_by(program_id_fk=program_id, semester=1)).scalars()}
+        assert amounts == {"Tuition Fee": 12000.0, "Library Fee": 500.0}
+    page = client.get(f"/jobs/{job_id}")
+    assert b"skipped unknown heads: Mystery Fee" in page.data
+
+
+def test_purge_requires_downloaded_backup_job(client, app, tmp_path, monkeypatch, seed_tenant):
+    monkeypatch.setitem(app.config, "JOBS_ARTIFACT_DIR", str(tmp_path))
+    with app.app_context():
+        t, (p,) = seed_tenant("JOBPURGE")
+        db.session.add(Student(enrollment_no="E_JOBPURGE_1", student_name="A", surname="B", program_id_fk=p.program_id, current_semester=1, trust_id_fk=t.trust_id, is_active=True))
+        db.session.add(User(username="super_jobpurge", password_hash=generate_password_hash("secret"), role="admin", is_super_admin=True))
+        db.session.commit()
+        trust_id, program_id = t.trust_id, p.program_id
+    _login(client, "super_jobpurge")
+    scope = {"trust_id": str(trust_id), "program_id": str(program_id), "semester": "all"}
+
+    resp = client.post("/super-admin/students/purge", data=dict(scope, action="purge_all", confirm="PURGE"))
+    assert resp.status_code == 302
+    resp = client.post("/super-admin/students/purge", data=dict(scope, action="backup"))
+    job_id = int(resp.headers["Location"].rstrip("/").rsplit("/", 1)[-1])
+    with app.app_context():
+        job = _run(job_id)
+        assert job.status == "succeeded", job.error
+        assert db.session.get(Student, "E_JOBPURGE_1") is not None
+
+    # Backup alone is not enough: it has to be downloaded first.
+    client.post("/super-admin/students/purge", data=dict(scope, action="purge_all", confirm="PURGE"))
+    with app.app_context():
+        assert db.session.get(Student, "E_JOBPURGE_1") is not None
+
+    download = client.get(f"/jobs/{job_id}/download")
+    assert download.status_code == 200
+    names = zipfile.ZipFile(io.BytesIO(download.data)).namelist()
+    assert "students.csv" in names and "attendance.csv" in names
+    assert b"E_JOBPURGE_1" in zipfile.ZipFile(io.BytesIO(download.data)).read("students.csv")
+
+    client.post("/super-admin/students/purge", data=dict(scope, action="purge_all", confirm="PURGE"))
+    with app.app_context():
+        assert db.session.get(Student, "E_JOBPURGE_1") is None
+
+
+def test_semester_promotion_is_not_retried_after_committing(app, monkeypatch, seed_tenant):
+    import cms_app.main.routes as main_routes
+
+    def _broken_rebalance(program, semester):
+        raise RuntimeError("rebalance failed")
+
+    monkeypatch.setattr(main_routes, "_rebalance_program_divisions_for_semester", _broken_rebalance)
+    with app.app_context():
+        t, (p,) = seed_tenant("JPR")
+        for i, sem in enumerate((2, 3)):
+            db.session.add(Student(enrollment_no=f"E_JPR_{i}", student_name="A", surname="B", program_id_fk=p.program_id, current_semester=sem, trust_id_fk=t.trust_id, is_active=True))
+        db.session.commit()
+
+        job = enqueue("semester_promotion", {"program_id": p.program_id, "from_semester": 2, "to_semester": 3, "trust_id": t.trust_id})
+        assert job.max_attempts == 1
+        job = _run(job.job_id)
+        assert job.status == "succeeded"
+        assert job_result(job)["warnings"] == ["Divisions for Sem 3 were not rebalanced: rebalance failed"]
+        semesters = dict(db.session.execute(select(Student.enrollment_no, Student.current_semester).filter(Student.program_id_fk == p.program_id)).all())
+        assert semesters == {"E_JPR_0": 3, "E_JPR_1": 3}
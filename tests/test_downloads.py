@@ -0,0 +1,155 @@
+from io import BytesIO
+
+from sqlalchemy import func, select
+from werkzeug.datastructures import FileStorage
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app.announcement_inbox import fan_out
+from cms_app.attachments import store
+from cms_app.downloads import flush_downloads
+from cms_app.fee_balances import BalanceTracker
+from cms_app.main.routes import current_academic_year
+from cms_app.models import (
+    Announcement,
+    AnnouncementRecipient,
+    FeePayment,
+    Student,
+    StudentSubjectEnrollment,
+    Subject,
+    SubjectMaterial,
+    SubjectMaterialLog,
+    SubjectType,
+    Trust,
+    User,
+)
+
+PDF = b"%PDF-1.4 " + bytes(range(256)) * 40
+
+
+def _seed(seed_tenant, code):
+    t, (prog,) = seed_tenant(code)
+    stype = SubjectType(type_name=f"Core {code}", type_code=f"CORE_{code}")
+    db.session.add(stype)
+    db.session.flush()
+    subj = Subject(program_id_fk=prog.program_id, subject_type_id_fk=stype.type_id, subject_name="Maths", semester=1)
+    db.session.add(subj)
+    db.session.flush()
+    for name in ("in", "out"):
+        u = User(username=f"{name}_{code.lower()}", password_hash=generate_password_hash("secret"), role="student", trust_id_fk=t.trust_id)
+        db.session.add(u)
+        db.session.flush()
+        db.session.add(Student(enrollment_no=f"{code}_{name}", program_id_fk=prog.program_id, trust_id_fk=t.trust_id, user_id_fk=u.user_id, is_active=True))
+    db.session.flush()
+    db.session.add(StudentSubjectEnrollment(student_id_fk=f"{code}_in", subject_id_fk=subj.subject_id, academic_year=current_academic_year(), is_active=True))
+    m = SubjectMaterial(subject_id_fk=subj.subject_id, title="Unit 1", kind="file", is_published=True, is_flagged=False)
+    db.session.add(m)
+    db.session.flush()
+    row = store(FileStorage(stream=BytesIO(PDF), filename="unit1.pdf"), "material", m.material_id, subject_id=subj.subject_id)
+    m.file_path = row.storage_path
+    db.session.commit()
+    return m.material_id, row.storage_path, prog.program_id
+
+
+def _login(client, username):
+    client.post("/login", data={"username": username, "password": "secret"})
+
+
+def test_material_download_streams_ranges_and_logs_in_batches(client, app, monkeypatch, tmp_path, seed_tenant):
+    monkeypatch.setattr(app, "static_folder", str(tmp_path))
+    monkeypatch.setitem(app.config, "DOWNLOAD_LOG_BATCH", 3)
+    monkeypatch.setitem(app.config, "DOWNLOAD_LOG_INTERVAL", 3600)
+    with app.app_context():
+        flush_downloads()
+        material_id, storage_path, _pid = _seed(seed_tenant, "DLA")
+    url = f"/materials/{material_id}/download"
+
+    _login(client, "out_dla")
+    assert client.get(url).status_code == 403
+    client.get("/logout")
+
+    _login(client, "in_dla")
+    resp = client.get(url)
+    assert resp.status_code == 200 and resp.data == PDF
+    assert resp.mimetype == "application/pdf" and "unit1.pdf" in resp.headers["Content-Disposition"]
+    assert "private" in resp.headers["Cache-Control"]
+    etag = resp.headers["ETag"]
+
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    part = client.get(url, headers={"Range": "bytes=0-99"})
+    assert part.status_code == 206 and part.data == PDF[:100]
+    assert client.get(f"/static/{storage_path}").status_code == 404
+    sub_dir, rest = storage_path.split("/", 1)
+    for path in (f"./{storage_path}", f"/{storage_path}", f"x/../{storage_path}", f"{sub_dir}//{rest}", f"{sub_dir.upper()}/{rest}"):
+        resp = client.get(f"/static/{path}", follow_redirects=True)
+        assert resp.status_code == 404 and resp.data != PDF, path
+    assert client.get(url).status_code == 200
+
+    with app.app_context():
+        logged = lambda: db.session.scalar(
+            select(func.count()).select_from(SubjectMaterialLog).filter_by(material_id_fk=material_id, action="download")
+        )
+        # Four downloads so far: one batch of three written, one still buffered
+        assert logged() == 3
+        db.session.commit()
+        flush_downloads()
+        assert logged() == 4
+
+
+def test_offloaded_downloads_and_payment_proofs(client, app, monkeypatch, tmp_path, seed_tenant):
+    monkeypatch.setattr(app, "static_folder", str(tmp_path))
+    monkeypatch.setitem(app.config, "DOWNLOAD_OFFLOAD", "x-accel-redirect")
+    with app.app_context():
+        material_id, storage_path, program_id = _seed(seed_tenant, "DLB")
+        proof_dir = tmp_path / "uploads" / "payment_proofs"
+        proof_dir.mkdir(parents=True)
+        (proof_dir / "proof.png").write_bytes(b"png")
+        pay = FeePayment(enrollment_no="DLB_in", program_id_fk=program_id, semester=1, amount=100, status="submitted", proof_image_path="uploads/payment_proofs/proof.png")
+        db.session.add(pay)
+        balances = BalanceTracker()
+        balances.add(pay)
+        balances.flush()
+        db.session.commit()
+        payment_id = pay.payment_id
+
+    _login(client, "in_dlb")
+    resp = client.get(f"/materials/{material_id}/download")
+    assert resp.status_code == 200 and resp.data == b""
+    assert resp.headers["X-Accel-Redirect"] == f"/protected/{storage_path}"
+    assert resp.headers["Content-Disposition"].endswith("unit1.pdf")
+    assert client.get(f"/fees/payments/{payment_id}/proof").headers["X-Accel-Redirect"] == "/protected/uploads/payment_proofs/proof.png"
+    client.get("/logout")
+
+    _login(client, "out_dlb")
+    assert client.get(f"/fees/payments/{payment_id}/proof").status_code == 403
+    for path in ("./uploads/payment_proofs/proof.png", "uploads//payment_proofs/proof.png", "uploads/./payment_proofs/proof.png"):
+        assert client.get(f"/static/{path}", follow_redirects=True).status_code == 404, path
+    with app.app_context():
+        assert flush_downloads() == 1
+
+
+def test_announcement_attachments_follow_the_audience(client, app, monkeypatch, tmp_path, seed_tenant):
+    monkeypatch.setattr(app, "static_folder", str(tmp_path))
+    with app.app_context():
+        _seed(seed_tenant, "DLN")
+        trust_id = db.session.execute(select(Trust.trust_id).filter_by(trust_code="T_DLN")).scalar()
+        db.session.add(User(username="admin_dln", password_hash=generate_password_hash("secret"), role="admin", trust_id_fk=trust_id))
+        ann = Announcement(title="Fee circular", message="m", severity="info", is_active=True, trust_id_fk=trust_id)
+        db.session.add(ann)
+        db.session.flush()
+        db.session.add(AnnouncementRecipient(announcement_id_fk=ann.announcement_id, student_id_fk="DLN_in"))
+        row = store(FileStorage(stream=BytesIO(PDF), filename="circular.pdf"), "announcement", ann.announcement_id)
+        fan_out(ann.announcement_id)
+        db.session.commit()
+        url = f"/announcements/attachments/{row.attachment_id}/circular.pdf"
+
+    resp = client.get(url)
+    assert resp.status_code == 302 and "/login" in resp.headers["Location"]
+    _login(client, "out_dln")
+    assert client.get(url).status_code == 404
+    client.get("/logout")
+    _login(client, "in_dln")
+    assert client.get(url).data == PDF
+    client.get("/logout")
+    _login(client, "admin_dln")
+    assert client.get(url).status_code == 200
@@ -0,0 +1,138 @@
+import socket
+from datetime import timedelta
+
+from sqlalchemy import delete, select
+from werkzeug.security import generate_password_hash
+
+from cms_app import db, email_utils
+from cms_app.email_utils import _now, deliver_pending, outbox_status, send_email
+from cms_app.jobs.services import run_periodic
+from cms_app.mail_sink import MailSink
+from cms_app.models import EmailOutbox, Faculty, User
+
+
+def _mail_config(monkeypatch, app, port):
+    for key, value in {
+        "MAIL_HOST": "127.0.0.1",
+        "MAIL_PORT": port,
+        "MAIL_USER": "mailer",
+        "MAIL_PASSWORD": "secret",
+        "MAIL_FROM": "cms@example.com",
+        "MAIL_USE_TLS": False,
+        "MAIL_USE_SSL": False,
+        "MAIL_TIMEOUT": 5,
+        "MAIL_RATE_PER_SECOND": 0,
+    }.items():
+        monkeypatch.setitem(app.config, key, value)
+    monkeypatch.setattr(email_utils, "_pool", None)
+
+
+def test_outbox_reuses_one_connection_and_retries(app, monkeypatch):
+    with MailSink() as sink, app.app_context():
+        _mail_config(monkeypatch, app, sink.port)
+        db.session.execute(delete(EmailOutbox))
+        db.session.commit()
+        sink.reject = {"gone@example.com": (550, "5.1.1 No such user"), "busy@example.com": (451, "4.3.0 Try later")}
+
+        for i in range(3):
+            assert send_email(f"Notice {i}", f"user{i}@example.com", f"Body {i}", category="test")
+        assert send_email("Bounce", "gone@example.com", "x")
+        assert send_email("Later", "busy@example.com", "y")
+        assert send_email("After", "user9@example.com", "z")
+        assert sink.connections == 0  # queued only; nothing sent inside the request
+
+        counts = deliver_pending()
+        assert counts == {"sent": 4, "retrying": 1, "failed": 1}
+        assert sink.connections == 1 and sink.logins == 1
+        assert [m["message"]["Subject"] for m in sink.messages] == ["Notice 0", "Notice 1", "Notice 2", "After"]
+        assert sink.messages[0]["message"]["From"] == "cms@example.com"
+
+        rows = {r.to_address: r for r in db.session.execute(select(EmailOutbox)).scalars()}
+        assert rows["gone@example.com"].status == "failed" and "550" in rows["gone@example.com"].last_error
+        busy = rows["busy@example.com"]
+        assert busy.status == "queued" and busy.attempts == 1 and busy.next_attempt_at > _now()
+
+        # Due again: goes out over the pooled connection, no new login
+        sink.reject = {}
+        busy.next_attempt_at = _now() - timedelta(seconds=1)
+        db.session.commit()
+        assert run_periodic({}, force=True) >= 1
+        assert sink.connections == 1 and sink.logins == 1
+        db.session.refresh(busy)
+        assert busy.status == "sent" and busy.sent_at is not None
+
+        status = outbox_status()
+        assert status["by_status"]["sent"] == 5 and status["by_status"]["failed"] == 1
+        assert status["recent_failures"][0]["to_address"] == "gone@example.com"
+        email_utils.smtp_pool().close_all()
+
+
+def test_unreachable_relay_keeps_batch_queued(app, monkeypatch):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        closed_port = s.getsockname()[1]
+    with app.app_context():
+        monkeypatch.setitem(app.config, "MAIL_HOST", None)
+        assert send_email("Skipped", "a@example.com", "x") is False
+
+        _mail_config(monkeypatch, app, closed_port)
+        db.session.execute(delete(EmailOutbox))
+        db.session.commit()
+        for i in range(3):
+            send_email(f"Queued {i}", f"q{i}@example.com", "x")
+        counts = deliver_pending()
+        assert counts == {"sent": 0, "retrying": 1, "failed": 0}
+        rows = db.session.execute(select(EmailOutbox).order_by(EmailOutbox.email_id)).scalars().all()
+        assert [(r.status, r.attempts) for r in rows] == [("queued", 1), ("queued", 0), ("queued", 0)]
+        assert rows[0].next_attempt_at > _now() and rows[1].next_attempt_at is None
+
+
+def test_queueing_leaves_commit_to_caller_and_codes_expire(app, monkeypatch):
+    with MailSink() as sink, app.app_context():
+        _mail_config(monkeypatch, app, sink.port)
+        db.session.execute(delete(EmailOutbox))
+        db.session.commit()
+
+        assert send_email("Dropped", "gone@example.com", "x")
+        db.session.rollback()
+        assert db.session.execute(select(EmailOutbox)).first() is None
+
+        assert send_email("Code", "otp@example.com", "123456", category="password_2fa")
+        assert send_email("Notice", "late@example.com", "x", category="test")
+        db.session.commit()
+        for row in db.session.execute(select(EmailOutbox)).scalars():
+            row.created_at = _now() - timedelta(minutes=11)
+        db.session.commit()
+
+        assert deliver_pending() == {"sent": 1, "retrying": 0, "failed": 1}
+        assert [m["message"]["Subject"] for m in sink.messages] == ["Notice"]
+        code = db.session.execute(select(EmailOutbox).filter_by(to_address="otp@example.com")).scalars().one()
+        assert (code.status, code.attempts, code.last_error) == ("failed", 0, "Expired before delivery")
+        email_utils.smtp_pool().close_all()
+
+
+def test_faculty_notice_is_not_reported_queued_without_mail(client, app, monkeypatch, seed_tenant):
+    with app.app_context():
+        t, (p,) = seed_tenant("MAILN")
+        faculty = Faculty(full_name="Prof N", email="prof_n@example.com", program_id_fk=p.program_id, trust_id_fk=t.trust_id, is_active=True)
+        db.session.add(faculty)
+        db.session.add(User(username="admin_mailn", password_hash=generate_password_hash("secret"), role="admin", trust_id_fk=t.trust_id))
+        db.session.commit()
+        faculty_id, trust_id = faculty.faculty_id, t.trust_id
+    client.post("/login", data={"username": "admin_mailn", "password": "secret"})
+    with client.session_transaction() as sess:
+        csrf = sess.get("csrf_token")
+    queued = lambda: db.session.execute(select(EmailOutbox).filter_by(to_address="prof_n@example.com")).scalars().all()
+    form = {"faculty_id": faculty_id, "type": "warning", "csrf_token": csrf}
+
+    monkeypatch.setitem(app.config, "MAIL_HOST", "")
+    resp = client.post("/analytics/notify", data=form, follow_redirects=True)
+    assert b"email is not configured" in resp.data and b"Warning queued" not in resp.data
+    with app.app_context():
+        assert queued() == []
+
+    monkeypatch.setitem(app.config, "MAIL_HOST", "127.0.0.1")
+    resp = client.post("/analytics/notify", data=form, follow_redirects=True)
+    assert b"Warning queued for Prof N" in resp.data
+    with app.app_context():
+        assert [(r.category, r.trust_id_fk) for r in queued()] == [("analytics_warning", trust_id)]
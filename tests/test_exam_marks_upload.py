@@ -0,0 +1,154 @@
+import io
+
+from sqlalchemy import event, select
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app.exams.services import _upsert_new_marks, ingest_marks
+from cms_app.models import DataAuditLog, Division, ExamMark, ExamScheme, Student, Subject, SubjectType, User
+
+
+def _login(client, username, password="secret"):
+    client.post("/login", data={"username": username, "password": password}, follow_redirects=True)
+    with client.session_transaction() as sess:
+        return sess.get("csrf_token")
+
+
+def test_marks_upload_api_bulk_upserts_json_and_csv(client, app, seed_tenant):
+    with app.app_context():
+        t, (p,) = seed_tenant("UPL")
+        d = Division(program_id_fk=p.program_id, semester=2, division_code="A", capacity=60)
+        stype = SubjectType(type_name="Core", type_code="CORE_UPL")
+        db.session.add_all([d, stype])
+        db.session.flush()
+        sub = Subject(program_id_fk=p.program_id, subject_type_id_fk=stype.type_id, subject_name="S_UPL", subject_code="S_UPL", semester=2, is_active=True)
+        db.session.add(sub)
+        db.session.flush()
+        for i in range(40):
+            db.session.add(Student(enrollment_no=f"E_UPL_{i:02d}", student_name="A", surname="B", program_id_fk=p.program_id, current_semester=2, trust_id_fk=t.trust_id, is_active=True, division_id_fk=d.division_id))
+        scheme = ExamScheme(program_id_fk=p.program_id, semester=2, academic_year="2025-26", name="Sem2", max_internal_marks=30.0, max_external_marks=70.0, min_total_marks=40.0, max_total_marks=100.0, is_active=True)
+        db.session.add(scheme)
+        db.session.add(User(username="clerk_upl", password_hash=generate_password_hash("secret"), role="clerk", trust_id_fk=t.trust_id, program_id_fk=p.program_id))
+        db.session.commit()
+        scheme_id, subject_id, program_id = scheme.scheme_id, sub.subject_id, p.program_id
+
+    csrf = _login(client, "clerk_upl")
+    marks = [{"student_id": f"E_UPL_{i:02d}", "internal": 20, "external": 40} for i in range(40)]
+    marks.append({"student_id": "E_UPL_00", "internal": 99, "external": 10})
+    marks.append({"student_id": "NOPE", "internal": 10, "external": 10})
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        resp = client.post(f"/api/exams/{scheme_id}/marks", json={"subject_id": subject_id, "marks": marks}, headers={"X-CSRF-Token": csrf})
+    finally:
+        with app.app_context():
+            event.remove(db.engine, "before_cursor_execute", listener)
+    assert resp.status_code == 200
+    data = resp.get_json()["data"]
+    assert (data["inserts"], data["updates"]) == (40, 0)
+    assert {e["student_id"] for e in data["errors"]} == {"E_UPL_00", "NOPE"}
+    assert len([s for s in statements if "exam_marks" in s.lower()]) < 10
+
+    csv_body = "Enrollment_No,Internal,External,Absent\nE_UPL_01,25,50,\nE_UPL_02,,,yes\nE_UPL_03,abc,10,\n"
+    resp = client.post(
+        f"/api/exams/{scheme_id}/marks",
+        data={"subject_id": str(subject_id), "csrf_token": csrf, "file": (io.BytesIO(csv_body.encode()), "marks.csv")},
+        content_type="multipart/form-data",
+    )
+    assert resp.status_code == 200
+    data = resp.get_json()["data"]
+    assert (data["inserts"], data["updates"]) == (0, 2)
+    assert data["errors"] == [{"student_id": "E_UPL_03", "error": "internal is not a number"}]
+
+    with app.app_context():
+        rows = {m.student_id_fk: m for m in db.session.execute(select(ExamMark).filter_by(scheme_id_fk=scheme_id)).scalars()}
+        assert len(rows) == 40
+        assert rows["E_UPL_01"].total_marks == 75.0
+        assert rows["E_UPL_02"].is_absent is True and rows["E_UPL_02"].total_marks == 0
+        saves = db.session.execute(select(DataAuditLog).where(DataAuditLog.action == "exam_marks_save", DataAuditLog.program_id_fk == program_id)).scalars().all()
+        assert len(saves) == 2
+
+
+def test_marks_upload_is_scoped_and_keeps_other_schemes_marks(client, app, seed_tenant):
+    with app.app_context():
+        ids = {}
+        for code in ("MKA", "MKB"):
+            t, (p,) = seed_tenant(code)
+            stype = SubjectType(type_name="Core", type_code=f"CORE_{code}")
+            db.session.add(stype)
+            db.session.flush()
+            sub = Subject(program_id_fk=p.program_id, subject_type_id_fk=stype.type_id, subject_name=f"S_{code}", subject_code=f"S_{code}", semester=2, is_active=True)
+            db.session.add(sub)
+            db.session.add(Student(enrollment_no=f"E_{code}", student_name="A", surname="B", program_id_fk=p.program_id, current_semester=2, trust_id_fk=t.trust_id, is_active=True))
+            schemes = [
+                ExamScheme(program_id_fk=p.program_id, semester=2, academic_year="2025-26", name=name, max_internal_marks=30.0, max_external_marks=70.0, is_active=True)
+                for name in ("Mid", "Final")
+            ]
+            db.session.add_all(schemes)
+            db.session.add(User(username=f"clerk_{code.lower()}", password_hash=generate_password_hash("secret"), role="clerk", trust_id_fk=t.trust_id, program_id_fk=p.program_id))
+            db.session.flush()
+            ids[code] = (schemes[0].scheme_id, schemes[1], sub.subject_id)
+        db.session.commit()
+
+        # A second scheme hitting the same attempt is reported, not written over the first one's marks
+        mid_id, final, sub_a = ids["MKA"]
+        ingest_marks(db.session.get(ExamScheme, mid_id), sub_a, [{"student_id": "E_MKA", "internal": 10, "external": 20}])
+        stats = ingest_marks(final, sub_a, [{"student_id": "E_MKA", "internal": 15, "external": 25}])
+        db.session.commit()
+        assert (stats["inserts"], stats["updates"], stats["conflicts"]) == (0, 0, ["E_MKA"])
+        row = db.session.execute(select(ExamMark).filter_by(student_id_fk="E_MKA", subject_id_fk=sub_a)).scalars().one()
+        assert (row.scheme_id_fk, row.internal_marks, row.external_marks, row.total_marks) == (mid_id, 10.0, 20.0, 30.0)
+
+        # Even when the row appears between the prefetch and the insert
+        _upsert_new_marks([{
+            "scheme_id_fk": final.scheme_id, "subject_id_fk": sub_a, "student_id_fk": "E_MKA", "semester": 2,
+            "academic_year": "2025-26", "attempt_no": 1, "internal_marks": 1.0, "external_marks": 1.0,
+            "total_marks": 2.0, "is_absent": False,
+        }])
+        db.session.commit()
+        db.session.refresh(row)
+        assert (row.scheme_id_fk, row.total_marks) == (mid_id, 30.0)
+
+    csrf = _login(client, "clerk_mkb")
+    body = {"subject_id": sub_a, "marks": [{"student_id": "E_MKA", "internal": 1, "external": 1}]}
+    assert client.post(f"/api/exams/{mid_id}/marks", json=body, headers={"X-CSRF-Token": csrf}).status_code == 404
+
+    scheme_b, _, sub_b = ids["MKB"]
+    resp = client.post(f"/api/exams/{scheme_b}/marks", json=dict(body, subject_id=sub_a), headers={"X-CSRF-Token": csrf})
+    assert resp.status_code == 404
+    body = {"subject_id": sub_b, "marks": [{"student_id": "E_MKA", "internal": 1, "external": 1}, {"student_id": "E_MKB", "internal": 5, "external": 5}]}
+    resp = client.post(f"/api/exams/{scheme_b}/marks", json=body, headers={"X-CSRF-Token": csrf})
+    assert resp.status_code == 200
+    data = resp.get_json()["data"]
+    assert data["inserts"] == 1
+    assert data["errors"] == [{"student_id": "E_MKA", "error": "unknown student"}]
+
+
+def test_marks_upload_rejects_malformed_json(client, app, seed_tenant):
+    with app.app_context():
+        t, (p,) = seed_tenant("MKJ")
+        stype = SubjectType(type_name="Core", type_code="CORE_MKJ")
+        db.session.add(stype)
+        db.session.flush()
+        sub = Subject(program_id_fk=p.program_id, subject_type_id_fk=stype.type_id, subject_name="S_MKJ", subject_code="S_MKJ", semester=2, is_active=True)
+        db.session.add(sub)
+        db.session.add(Student(enrollment_no="E_MKJ", student_name="A", surname="B", program_id_fk=p.program_id, current_semester=2, trust_id_fk=t.trust_id, is_active=True))
+        scheme = ExamScheme(program_id_fk=p.program_id, semester=2, academic_year="2025-26", name="Sem2", max_internal_marks=30.0, max_external_marks=70.0, is_active=True)
+        db.session.add(scheme)
+        db.session.add(User(username="clerk_mkj", password_hash=generate_password_hash("secret"), role="clerk", trust_id_fk=t.trust_id, program_id_fk=p.program_id))
+        db.session.commit()
+        scheme_id, subject_id = scheme.scheme_id, sub.subject_id
+
+    csrf = _login(client, "clerk_mkj")
+    headers = {"X-CSRF-Token": csrf}
+    for body in ("marks", 42, None):
+        resp = client.post(f"/api/exams/{scheme_id}/marks", json=body, headers=headers)
+        assert resp.status_code == 400 and resp.get_json()["error"]["code"] == "invalid"
+    resp = client.post(f"/api/exams/{scheme_id}/marks", json=[{"student_id": "E_MKJ"}], headers=headers)
+    assert resp.status_code == 400
+
+    resp = client.post(f"/api/exams/{scheme_id}/marks?subject_id={subject_id}", json=[{"student_id": "E_MKJ", "internal": 10, "external": 30}], headers=headers)
+    assert resp.status_code == 200 and resp.get_json()["data"]["inserts"] == 1
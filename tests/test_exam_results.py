@@ -0,0 +1,76 @@
+import json
+import random
+
+from sqlalchemy import event, select
+
+from cms_app import db
+from cms_app.exams.services import GradeTable, calculate_exam_results, get_grade_point, resolve_exam_limits
+from cms_app.models import CreditStructure, Division, ExamMark, ExamScheme, Student, StudentSemesterResult, Subject, SubjectType
+
+
+def test_grade_table_matches_linear_grade_lookup():
+    bands = [{"min": 85, "grade": "O", "gp": 10}, {"min": 55, "grade": "B", "gp": 6}, {"min": 45, "grade": "P", "gp": 4}]
+    table = GradeTable(sorted(bands, key=lambda x: x["min"], reverse=True))
+    default = GradeTable()
+    rng = random.Random(7)
+    for _ in range(500):
+        out_of = rng.choice([0, 50, 75, 100])
+        got = round(rng.uniform(0, 100), 1)
+        assert table.grade_many([got], [out_of]) == tuple([x] for x in get_grade_point(got, out_of, bands))
+        assert default.grade_many([got], [out_of]) == tuple([x] for x in get_grade_point(got, out_of))
+
+
+def test_calculate_exam_results_in_bulk(app, seed_tenant):
+    with app.app_context():
+        t, (p,) = seed_tenant("RES")
+        d = Division(program_id_fk=p.program_id, semester=1, division_code="A", capacity=60)
+        core = SubjectType(type_name="Core", type_code="CORE_RES")
+        lab = SubjectType(type_name="Lab", type_code="LAB_RES")
+        db.session.add_all([d, core, lab])
+        db.session.flush()
+        s1 = Subject(program_id_fk=p.program_id, subject_type_id_fk=core.type_id, subject_name="S_RES_1", subject_code="S_RES_1", semester=1, is_active=True)
+        s2 = Subject(program_id_fk=p.program_id, subject_type_id_fk=lab.type_id, subject_name="S_RES_2", subject_code="S_RES_2", semester=1, is_active=True)
+        db.session.add_all([s1, s2])
+        db.session.flush()
+        db.session.add_all([
+            CreditStructure(subject_id_fk=s1.subject_id, total_credits=4),
+            CreditStructure(subject_id_fk=s2.subject_id, total_credits=2),
+        ])
+        scheme = ExamScheme(
+            program_id_fk=p.program_id, semester=1, academic_year="2025-26", name="Sem1 Final",
+            max_total_marks=100.0, is_active=True,
+            credit_rules_json=json.dumps([{"credit": 2, "type": "Lab", "max_int": 20, "max_ext": 30, "max_tot": 50}]),
+        )
+        db.session.add(scheme)
+        db.session.flush()
+        for i, (m1, m2, absent2) in enumerate([(95, 45, False), (35, 30, False), (70, 0, True)]):
+            enr = f"E_RES_{i}"
+            db.session.add(Student(enrollment_no=enr, student_name="A", surname="B", program_id_fk=p.program_id, current_semester=1, trust_id_fk=t.trust_id, is_active=True, division_id_fk=d.division_id))
+            db.session.flush()
+            db.session.add(ExamMark(student_id_fk=enr, subject_id_fk=s1.subject_id, scheme_id_fk=scheme.scheme_id, semester=1, academic_year="2025-26", attempt_no=1, total_marks=m1, is_absent=False))
+            db.session.add(ExamMark(student_id_fk=enr, subject_id_fk=s2.subject_id, scheme_id_fk=scheme.scheme_id, semester=1, academic_year="2025-26", attempt_no=1, total_marks=m2, is_absent=absent2))
+        db.session.add(StudentSemesterResult(student_id_fk="E_RES_0", program_id_fk=p.program_id, scheme_id_fk=scheme.scheme_id, semester=1, academic_year="2025-26", attempt_no=1, sgpa=0.0))
+        db.session.commit()
+        scheme_id = scheme.scheme_id
+        assert resolve_exam_limits(scheme, s2)["max_total"] == 50.0
+        assert resolve_exam_limits(scheme, s1)["max_total"] == 100.0
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            ok, message, count = calculate_exam_results(scheme_id)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+        assert ok, message
+        assert count == 3
+        assert len(statements) <= 10
+
+        marks = {(m.student_id_fk, m.subject_id_fk): m for m in db.session.execute(select(ExamMark).filter_by(scheme_id_fk=scheme_id)).scalars()}
+        assert (marks[("E_RES_0", s2.subject_id)].grade_point, marks[("E_RES_0", s2.subject_id)].grade_letter) == (10.0, "O")
+        assert marks[("E_RES_1", s1.subject_id)].grade_letter == "F"
+        results = {r.student_id_fk: r for r in db.session.execute(select(StudentSemesterResult).filter_by(scheme_id_fk=scheme_id)).scalars()}
+        assert len(results) == 3
+        assert (results["E_RES_0"].sgpa, results["E_RES_0"].total_credits_earned) == (10.0, 6)
+        assert (results["E_RES_1"].sgpa, results["E_RES_1"].total_credits_earned, results["E_RES_1"].total_credits_registered) == (2.33, 2, 6)
+        assert (results["E_RES_2"].sgpa, results["E_RES_2"].total_credits_earned) == (5.33, 4)
@@ -0,0 +1,90 @@
+from sqlalchemy import select, update
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app.fee_balances import BalanceTracker, find_drift, status_counts
+from cms_app.jobs.services import claim, execute
+from cms_app.models import BackgroundJob, FeePayment, Student, StudentFeeBalance, User
+
+
+def _login(client, username, password="secret"):
+    client.post("/login", data={"username": username, "password": password}, follow_redirects=True)
+    with client.session_transaction() as sess:
+        return sess.get("csrf_token")
+
+
+def _seed(seed_tenant, code):
+    t, (p,) = seed_tenant(code)
+    db.session.add(Student(enrollment_no=f"{code}_1", program_id_fk=p.program_id, trust_id_fk=t.trust_id, current_semester=1, is_active=True))
+    db.session.add(User(username=f"admin_{code.lower()}", password_hash=generate_password_hash("secret"), role="admin", trust_id_fk=t.trust_id))
+    db.session.flush()
+    balances = BalanceTracker()
+    payments = [
+        FeePayment(enrollment_no=f"{code}_1", program_id_fk=p.program_id, semester=1, amount=700, utr=f"{code}U1", status="submitted"),
+        FeePayment(enrollment_no=f"{code}_1", program_id_fk=p.program_id, semester=1, amount=300, utr=f"{code}U2", status="submitted", medium_tag="English"),
+    ]
+    for fp in payments:
+        db.session.add(fp)
+        balances.add(fp)
+    balances.flush()
+    db.session.commit()
+    return t.trust_id, p.program_id, [fp.payment_id for fp in payments]
+
+
+def _balances(enrollment_no):
+    rows = db.session.execute(select(StudentFeeBalance).filter_by(enrollment_no=enrollment_no)).scalars().all()
+    return {r.medium_tag: (r.verified_total, r.submitted_total, r.verified_count, r.submitted_count, r.rejected_count) for r in rows}
+
+
+def test_balances_follow_verify_and_reject(client, app, seed_tenant):
+    with app.app_context():
+        trust_id, _pid, (first, second) = _seed(seed_tenant, "BAL")
+        assert _balances("BAL_1") == {"": (0.0, 700.0, 0, 1, 0), "English": (0.0, 300.0, 0, 1, 0)}
+        assert status_counts(trust_id) == (2, 0)
+    csrf = _login(client, "admin_bal")
+
+    client.post(f"/fees/verification-queue/{first}/verify", data={"csrf_token": csrf})
+    client.post(f"/fees/payments/{second}/reject", data={"csrf_token": csrf, "remarks": "blurry"})
+    with app.app_context():
+        assert _balances("BAL_1") == {"": (700.0, 0.0, 1, 0, 0), "English": (0.0, 0.0, 0, 0, 1)}
+        assert status_counts(trust_id) == (0, 1)
+        assert find_drift() == []
+
+
+def test_reconcile_job_reports_and_repairs_drift(client, app, seed_tenant):
+    with app.app_context():
+        _trust_id, pid, (first, _second) = _seed(seed_tenant, "BALR")
+        # Writes that bypass the tracker leave the projection stale
+        db.session.execute(update(FeePayment).where(FeePayment.payment_id == first).values(status="verified"))
+        db.session.execute(update(StudentFeeBalance).where(StudentFeeBalance.enrollment_no == "BALR_1", StudentFeeBalance.medium_tag == "English").values(medium_tag="Gujarati"))
+        db.session.commit()
+        kinds = sorted(d["kind"] for d in find_drift(pid))
+        assert kinds == ["missing", "orphan", "stale"]
+    csrf = _login(client, "admin_balr")
+
+    resp = client.post("/fees/balances/reconcile", data={"csrf_token": csrf, "program_id": str(pid)})
+    assert resp.status_code == 302
+    job_id = int(resp.headers["Location"].rstrip("/").split("/")[-1])
+    with app.app_context():
+        assert claim(job_id, "pytest")
+        execute(job_id)
+        db.session.expire_all()
+        job = db.session.get(BackgroundJob, job_id)
+        assert job.status == "succeeded", job.error
+        assert "Drift repaired in 3 balance rows" in job.result_json
+        assert find_drift(pid) == []
+        assert _balances("BALR_1") == {"": (700.0, 0.0, 1, 0, 0), "English": (0.0, 300.0, 0, 1, 0)}
+
+
+def test_student_purge_drops_fee_balances(client, app, seed_tenant):
+    with app.app_context():
+        trust_id, pid, _payments = _seed(seed_tenant, "BALP")
+        assert status_counts(trust_id) == (2, 0)
+    _login(client, "admin_balp")
+    form = {"program_id": str(pid), "semester": "all", "include_inactive": "1"}
+    assert client.post("/admin/student-lifecycle", data=dict(form, action="backup")).status_code == 200
+    client.post("/admin/student-lifecycle", data=dict(form, action="hard_delete", confirm="DELETE"))
+    with app.app_context():
+        assert db.session.get(Student, "BALP_1") is None
+        assert _balances("BALP_1") == {}
+        assert status_counts(trust_id) == (0, 0)
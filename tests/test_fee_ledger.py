@@ -0,0 +1,108 @@
+from datetime import date
+
+from sqlalchemy import delete, event, select
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app.fee_balances import refresh_students
+from cms_app.fee_ledger import classify, collected_by_program, program_ledger
+from cms_app.models import FeePayment, FeeStructure, FeesRecord, Student, User
+
+
+def _seed(seed_tenant, code, extra_students=0):
+    t, (p,) = seed_tenant(code)
+    pid = p.program_id
+    db.session.add_all([
+        FeeStructure(program_id_fk=pid, semester=1, component_name="Tuition", amount=1000),
+        FeeStructure(program_id_fk=pid, semester=None, component_name="Library", amount=200),
+        FeeStructure(program_id_fk=pid, semester=1, component_name="Lab", amount=300, medium_tag="English"),
+        FeeStructure(program_id_fk=pid, semester=2, component_name="Tuition", amount=5000),
+    ])
+    students = [
+        ("FULL", "English"), ("PART", "Gujarati"), ("NONE", "English"), ("PEND", "Gujarati"),
+    ] + [(f"X{i:03d}", "English") for i in range(extra_students)]
+    for suffix, medium in students:
+        db.session.add(Student(enrollment_no=f"{code}_{suffix}", program_id_fk=pid, trust_id_fk=t.trust_id, current_semester=1, medium_tag=medium, student_name=suffix, is_active=True))
+    db.session.flush()
+    db.session.add_all([
+        FeePayment(enrollment_no=f"{code}_FULL", program_id_fk=pid, semester=1, amount=1000, status="verified"),
+        FeePayment(enrollment_no=f"{code}_FULL", program_id_fk=pid, semester=1, amount=500, status="Verified", medium_tag="English"),
+        FeePayment(enrollment_no=f"{code}_PART", program_id_fk=pid, semester=1, amount=400, status="verified"),
+        FeePayment(enrollment_no=f"{code}_PART", program_id_fk=pid, semester=1, amount=50, status="rejected"),
+        FeePayment(enrollment_no=f"{code}_PEND", program_id_fk=pid, semester=1, amount=1200, status="submitted"),
+        FeePayment(enrollment_no=f"{code}_NONE", program_id_fk=pid, semester=2, amount=999, status="verified"),
+        FeesRecord(student_id_fk=f"{code}_FULL", amount_paid=700, date_paid=date.today()),
+    ])
+    db.session.flush()
+    refresh_students([s.enrollment_no for s in db.session.execute(select(Student).filter_by(program_id_fk=pid)).scalars()])
+    db.session.commit()
+    return t.trust_id, pid
+
+
+def test_program_ledger_buckets(app, seed_tenant):
+    with app.app_context():
+        _trust_id, pid = _seed(seed_tenant, "LEDG")
+        stmt = select(Student.enrollment_no, Student.medium_tag).where(Student.program_id_fk == pid).order_by(Student.enrollment_no)
+
+        ledger = program_ledger(stmt, pid, 1)
+        by_enr = {e["enrollment_no"]: e for e in ledger["entries"]}
+        assert (ledger["common_sum"], ledger["medium_sums"]) == (1200.0, {"English": 300.0})
+        assert {k: (e["bucket"], e["paid"], e["due_total"]) for k, e in by_enr.items()} == {
+            "LEDG_FULL": ("full", 1500.0, 1500.0),
+            "LEDG_NONE": ("none", 0.0, 1500.0),
+            "LEDG_PART": ("partial", 400.0, 1200.0),
+            "LEDG_PEND": ("none", 0.0, 1200.0),
+        }
+        assert ledger["totals"]["partial"] == {"count": 1, "paid_sum": 400.0, "due_sum": 800.0}
+
+        with_submitted = program_ledger(stmt, pid, 1, medium="English", include_submitted=True)
+        assert with_submitted["due_base"] == 1500.0
+        assert {e["enrollment_no"]: e["bucket"] for e in with_submitted["entries"]}["LEDG_PEND"] == "full"
+
+        # Without any structure the first FeesRecord supplies the due
+        db.session.execute(delete(FeeStructure).where(FeeStructure.program_id_fk == pid, FeeStructure.semester.is_(None)))
+        db.session.add(FeesRecord(student_id_fk="LEDG_PART", amount_due=600, semester=3))
+        db.session.add(FeesRecord(student_id_fk="LEDG_PART", amount_due=900, semester=3))
+        db.session.commit()
+        fallback = {e["enrollment_no"]: e for e in program_ledger(stmt, pid, 3)["entries"]}
+        assert (fallback["LEDG_PART"]["due_total"], fallback["LEDG_PART"]["bucket"]) == (600.0, "none")
+
+        assert classify(0.0, 0.0) == "none" and classify(0.0, 5.0) == "partial" and classify(100.0, 99.995) == "full"
+        assert collected_by_program(_trust_id, date(2000, 1, 1), date(2100, 1, 1)) == {pid: 700.0}
+
+
+def test_fee_reports_use_constant_queries(client, app, seed_tenant):
+    with app.app_context():
+        trust_id, pid = _seed(seed_tenant, "LEDQ", extra_students=30)
+        db.session.add(User(username="admin_ledq", password_hash=generate_password_hash("secret"), role="admin", trust_id_fk=trust_id))
+        db.session.commit()
+        engine = db.engine
+    client.post("/login", data={"username": "admin_ledq", "password": "secret"}, follow_redirects=True)
+
+    statements = []
+
+    def _count(conn, cursor, statement, *args):
+        if "fee_payments" in statement or "fees_records" in statement or "student_fee_balance" in statement:
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        resp = client.get(f"/api/reports/fees-program-status?program_id={pid}&semester=1")
+        api_queries = len(statements)
+        statements.clear()
+        csv_resp = client.get(f"/fees/program-status/export.csv?program_id={pid}&semester=1")
+        csv_queries = len(statements)
+        status_resp = client.get(f"/fees/payment-status?program_id={pid}&semester=1&format=csv")
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+
+    assert resp.status_code == 200
+    data = resp.get_json()["data"]
+    assert data["summary"]["counts"] == {"full": 1, "partial": 1, "none": 32}
+    assert api_queries == 1  # one grouped payment query; no FeesRecord fallback needed
+    assert csv_queries == 1
+    csv_text = csv_resp.get_data(as_text=True)
+    assert "LEDQ_PART,PART,P_LEDQ,1,Gujarati,400.0,800.0,partial" in csv_text
+    assert "Full: 1 / Paid: 1500.0 / Outstanding: 0.0" in csv_text
+    assert status_resp.status_code == 200
+    assert "LEDQ_PEND" in status_resp.get_data(as_text=True)
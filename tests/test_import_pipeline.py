@@ -0,0 +1,108 @@
+from openpyxl import Workbook
+from sqlalchemy import select
+from werkzeug.security import check_password_hash
+
+from cms_app import db
+from cms_app.models import CreditStructure, Division, Faculty, FeeStructure, Program, ProgramDivisionPlan, Student, Subject, User
+from scripts.import_faculty import upsert_faculty
+from scripts.import_fee_structure import import_fee_structure
+from scripts.import_students import import_excel
+from scripts.import_subjects import upsert_subjects
+
+
+def _workbook(path, rows, title=None):
+    wb = Workbook()
+    ws = wb.active
+    if title:
+        ws.title = title
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+    return str(path)
+
+
+def _seed_program(seed_tenant, code):
+    t, (p,) = seed_tenant(code)
+    db.session.commit()
+    return t.trust_id, p.program_id
+
+
+def test_student_import_streams_chunks(app, tmp_path, seed_tenant):
+    with app.app_context():
+        trust_id, program_id = _seed_program(seed_tenant, "PIPE_STU")
+        db.session.add(ProgramDivisionPlan(program_id_fk=program_id, semester=1, num_divisions=2, capacity_per_division=40))
+        db.session.add(Division(program_id_fk=program_id, semester=1, division_code="A", capacity=60))
+        db.session.add(Student(enrollment_no="PS_OLD", program_id_fk=program_id, current_semester=1, trust_id_fk=trust_id, student_name="Gone"))
+        db.session.add(Student(enrollment_no="PS_KEEP", program_id_fk=program_id, current_semester=1, trust_id_fk=trust_id, student_name="Old", mobile="9000000001"))
+        db.session.commit()
+
+        rows = [["Enrollment No", "Student Name", "Surname", "Mobile", "Division", "DOB"]]
+        rows += [[f"PS_{i:03d}", f"S{i}", "X", "", "A" if i % 2 else "B", "01/02/2005"] for i in range(7)]
+        rows += [["PS_KEEP", "", "Kept", "", "A", None], [None, None, None, None, None, None], [None, "No enrollment", "", "", "", None]]
+        path = _workbook(tmp_path / "students.xlsx", rows)
+
+        calls = []
+        report = import_excel(path, program_id=program_id, trust_id=trust_id, semester_hint=1, chunk_size=3, progress=lambda done, total: calls.append((done, total)))
+
+        assert (report["created"], report["updated"], report["skipped"], report["deleted"]) == (7, 1, 1, 1)
+        assert (report["divisions_created"], report["users_created"]) == (1, 8)
+        assert [done for done, _total in calls] == [3, 6, 9, 10]
+        assert calls[-1][1] == 10
+
+        capacities = {d.division_code: d.capacity for d in db.session.execute(select(Division).filter_by(program_id_fk=program_id, semester=1)).scalars()}
+        assert capacities == {"A": 40, "B": 40}
+        assert db.session.get(Student, "PS_OLD") is None
+        kept = db.session.get(Student, "PS_KEEP")
+        assert (kept.student_name, kept.surname, kept.mobile, kept.is_active) == ("Old", "Kept", "9000000001", True)
+        new = db.session.get(Student, "PS_004")
+        assert new.date_of_birth.isoformat() == "2005-02-01"
+        user = db.session.get(User, new.user_id_fk)
+        assert user.username == "PS_004" and check_password_hash(user.password_hash, "PS_004")
+
+        dry = import_excel(path, program_id=program_id, trust_id=trust_id, semester_hint=1, chunk_size=3, dry_run=True)
+        assert (dry["created"], dry["updated"]) == (0, 8)
+
+
+def test_subject_faculty_and_fee_imports(app, tmp_path, seed_tenant):
+    with app.app_context():
+        _trust_id, program_id = _seed_program(seed_tenant, "PIPE_SUB")
+        program_name = db.session.get(Program, program_id).program_name
+
+        path = _workbook(tmp_path / "subjects.xlsx", [
+            ["Subject Code", "Subject Name", "Type", "Theory Credits", "Practical Credits"],
+            ["PX101", "Programming", "major", 3, 1],
+            ["PX102", "Maths", "", 4, None],
+            ["PX101", "Programming I", "major", 2, 2],
+        ])
+        created, updated, pid = upsert_subjects(program_name, path, 1, chunk_size=2)
+        assert (created, updated, pid) == (2, 1, program_id)
+        subj = db.session.execute(select(Subject).filter_by(program_id_fk=program_id, subject_code="PX101")).scalars().one()
+        cs = db.session.execute(select(CreditStructure).filter_by(subject_id_fk=subj.subject_id)).scalars().one()
+        assert (cs.theory_credits, cs.practical_credits, cs.total_credits) == (2, 2, 4)
+
+        path = _workbook(tmp_path / "faculty.xlsx", [
+            ["Name", "Email", "Mobile", "Designation"],
+            ["Asha Rao", "asha.pipe@example.com", "9000000002", "Lecturer"],
+            ["", "ravi.pipe@example.com", "", ""],
+        ])
+        assert upsert_faculty(program_name, path, chunk_size=1) == (2, 0)
+        assert upsert_faculty(program_name, path) == (0, 2)
+        fac = db.session.execute(select(Faculty).filter_by(email="ravi.pipe@example.com")).scalars().one()
+        assert fac.full_name == "Ravi Pipe"
+        user = db.session.get(User, fac.user_id_fk)
+        assert user.role == "Faculty" and check_password_hash(user.password_hash, "Password123")
+
+        wb = Workbook()
+        ws = wb.active
+        ws.title = "Wide"
+        for row in [["FEE PATRAK"], ["SR NO", "DESCRIPTION", program_name], [1, "Tuition Fee", 1000], [2, "Sem 2 Tuition", 1100], [3, "TOTAL", 2100]]:
+            ws.append(row)
+        single = wb.create_sheet("P_PIPE_FEE")
+        for row in [["SR NO", "DESCRIPTION", "", "AMOUNT"], [1, "Exam Fee", "", 300]]:
+            single.append(row)
+        fee_path = str(tmp_path / "fees.xlsx")
+        wb.save(fee_path)
+        assert import_fee_structure(fee_path, chunk_size=1) == (3, 0)
+        assert import_fee_structure(fee_path) == (0, 3)
+        fees = {(f.component_name, f.semester): f.amount for f in db.session.execute(select(FeeStructure).filter_by(program_id_fk=program_id)).scalars()}
+        assert fees == {("Tuition Fee", 1): 1000.0, ("Sem 2 Tuition", 2): 1100.0}
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from cms_app import cache, db
+from cms_app.announcement_inbox import fan_out, set_read
+from cms_app.inbox_counters import badge_count, counter_key, recount, window_changes
+from cms_app.models import (
+    Announcement,
+    AnnouncementAudience,
+    Notification,
+    Student,
+    SystemMessage,
+    SystemMessageRead,
+    User,
+)
+
+
+def _seed(seed_tenant, code):
+    t, (p,) = seed_tenant(code)
+    u = User(username=f"stu_{code.lower()}", password_hash=generate_password_hash("secret"), role="student", program_id_fk=p.program_id, trust_id_fk=t.trust_id)
+    db.session.add(u)
+    db.session.flush()
+    db.session.add(Student(enrollment_no=f"{code}_S1", program_id_fk=p.program_id, trust_id_fk=t.trust_id, user_id_fk=u.user_id, is_active=True))
+    db.session.commit()
+    return t.trust_id, p.program_id, u
+
+
+def _announce(trust_id, title, **kw):
+    a = Announcement(title=title, message="m", severity="info", is_active=True, trust_id_fk=trust_id, **kw)
+    db.session.add(a)
+    db.session.flush()
+    db.session.add(AnnouncementAudience(announcement_id_fk=a.announcement_id, role="student"))
+    fan_out(a.announcement_id)
+    db.session.commit()
+    return a.announcement_id
+
+
+def test_counter_follows_writes_without_recounting(app, seed_tenant):
+    with app.app_context():
+        trust_id, _pid, user = _seed(seed_tenant, "CNT")
+        ann_id = _announce(trust_id, "Timetable")
+        assert badge_count(user) == 1
+
+        key = counter_key(user.user_id)
+        db.session.add(Notification(student_id_fk="CNT_S1", kind="fee_due", title="Fee due"))
+        msg = SystemMessage(title="Holiday", content="c", target_role="student", target_trust_id=trust_id, is_active=True)
+        db.session.add(msg)
+        db.session.commit()
+        _announce(trust_id, "Exam")
+        assert cache.get(key) == 4
+
+        # Rolled back writes never reach the counter
+        db.session.add(Notification(student_id_fk="CNT_S1", kind="fee_due", title="Discarded"))
+        db.session.flush()
+        db.session.rollback()
+        assert cache.get(key) == 4
+
+        db.session.add(SystemMessageRead(message_id_fk=msg.message_id, user_id_fk=user.user_id))
+        set_read(user.user_id, [ann_id])
+        db.session.commit()
+        set_read(user.user_id, [ann_id])  # already read: no change
+        db.session.commit()
+        n = db.session.query(Notification).filter_by(student_id_fk="CNT_S1").one()
+        n.is_read = True
+        db.session.commit()
+        assert cache.get(key) == 1 == recount(user, trust_id)
+
+        # Changes to who sees what drop the counter instead of guessing
+        db.session.get(Announcement, ann_id).is_active = False
+        db.session.commit()
+        assert cache.get(key) is None
+        assert badge_count(user) == 1
+
+
+def test_window_changes_and_badge_route(client, app, seed_tenant):
+    with app.app_context():
+        trust_id, _pid, user = _seed(seed_tenant, "WIN")
+        now = datetime.now()
+        _announce(trust_id, "Later", start_at=now + timedelta(hours=13))
+        assert badge_count(user) == 0
+        assert user.user_id in window_changes(now, now + timedelta(hours=2))
+        assert user.user_id not in window_changes(now - timedelta(hours=2), now)
+
+        cache.set(counter_key(user.user_id), 7)
+        user.role = "faculty"
+        db.session.commit()
+        assert cache.get(counter_key(user.user_id)) is None
+        user.role = "student"
+        db.session.commit()
+        user_id = user.user_id
+
+    client.post("/login", data={"username": "stu_win", "password": "secret"})
+    client.get("/inbox")
+    with app.app_context():
+        assert cache.get(counter_key(user_id)) == 0
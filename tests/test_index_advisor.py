@@ -0,0 +1,56 @@
+from flask import g
+from sqlalchemy import inspect
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app.index_advisor import _full_scan_tables, advise, explain, record_statement
+from cms_app.models import User
+
+
+def test_attendance_composite_indexes_exist(app):
+    with app.app_context():
+        names = {ix["name"] for ix in inspect(db.engine).get_indexes("attendance")}
+        assert "ix_attendance_subject_date_period_student" in names
+        assert "ix_attendance_date_division" in names
+
+
+def test_full_scan_detection_for_sqlite_and_postgres_plans():
+    assert _full_scan_tables("sqlite", ["SCAN attendance", "SEARCH students USING INDEX sqlite_autoindex_students_1 (enrollment_no=?)"]) == ["attendance"]
+    assert _full_scan_tables("sqlite", ["SCAN TABLE fee_payments"]) == ["fee_payments"]
+    assert _full_scan_tables("sqlite", ["SCAN attendance USING COVERING INDEX ix_attendance_date_division"]) == []
+    assert _full_scan_tables("postgresql", ["Seq Scan on attendance  (cost=0.00..1.01 rows=1 width=4)"]) == ["attendance"]
+
+
+def test_equal_timings_with_dict_parameters_do_not_compare(app):
+    sql = "SELECT * FROM students WHERE enrollment_no = :id"
+    with app.test_request_context():
+        for i in range(8):
+            record_statement(sql, {"id": i}, 2.0)
+        assert len(g._slow_statements) == 5
+
+
+def test_explain_uses_index_for_attendance_mark_lookup(app):
+    with app.app_context():
+        plan, scans = explain(
+            "SELECT attendance_id FROM attendance WHERE subject_id_fk = ? AND date_marked = ? AND period_no = ?",
+            (1, "2026-01-05", 1),
+        )
+        assert plan
+        assert "attendance" not in scans
+
+
+def test_slow_requests_are_sampled_for_advisor(client, app, monkeypatch):
+    with app.app_context():
+        if not User.query.filter_by(username="admin_advisor").first():
+            db.session.add(User(username="admin_advisor", password_hash=generate_password_hash("secret"), role="admin"))
+            db.session.commit()
+    monkeypatch.setenv("CMS_SLOW_REQUEST_MS", "0")
+    client.post("/login", data={"username": "admin_advisor", "password": "secret"}, follow_redirects=True)
+    app.extensions.pop("slow_request_samples", None)
+    assert client.get("/admin/system-status").status_code == 200
+    with app.app_context():
+        report = advise(app)
+    assert any(item["endpoint"] == "main.admin_system_status" for item in report)
+    resp = client.get("/admin/index-advisor")
+    assert resp.status_code == 200
+    assert b"Index Advisor" in resp.data
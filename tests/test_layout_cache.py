@@ -0,0 +1,88 @@
+import json
+
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app import layout_cache
+from cms_app.models import SystemConfig, Trust, User
+
+
+def test_local_lru_is_bounded_and_dropped_by_peer_messages(app):
+    lru = layout_cache.LocalLRU(maxsize=2)
+    lru.set("a:1", 1, 60)
+    lru.set("a:2", 2, 60)
+    lru.get("a:1")
+    lru.set("b:1", 3, 60)
+    assert lru.get("a:2") == (False, None) and lru.get("a:1") == (True, 1)
+    lru.set("b:2", 4, 0)
+    assert lru.get("b:2") == (False, None)
+
+    with app.test_request_context():
+        calls = []
+        load = lambda: calls.append(1) or {"n": len(calls)}
+        before = layout_cache.stats()
+        assert layout_cache.cached("lc_test", 1, load) == {"n": 1}
+        assert layout_cache.cached("lc_test", 1, load) == {"n": 1}
+        after = layout_cache.stats()
+        assert after["misses"] == before["misses"] + 1 and after["local_hits"] == before["local_hits"] + 1
+
+        # Another worker invalidated the group: the local copy goes, the next read reloads
+        layout_cache._receive(json.dumps({"node": "other", "group": "lc_test", "gen": 7}))
+        layout_cache._receive(json.dumps({"node": "other", "group": "lc_test", "keys": ["1"]}))
+        assert layout_cache.cached("lc_test", 1, load) == {"n": 2}
+        assert layout_cache.stats()["received"] == after["received"] + 2
+
+
+def test_maintenance_and_suspension_apply_on_commit(client, app):
+    with app.app_context():
+        t = Trust(trust_name="T_LCA", trust_code="T_LCA", is_active=True)
+        db.session.add(t)
+        db.session.flush()
+        db.session.add(User(username="admin_lca", password_hash=generate_password_hash("secret"), role="admin", trust_id_fk=t.trust_id))
+        db.session.commit()
+        trust_id = t.trust_id
+
+    client.post("/login", data={"username": "admin_lca", "password": "secret"})
+    assert client.get("/dashboard").status_code == 200
+
+    with app.app_context():
+        db.session.get(Trust, trust_id).is_active = False
+        db.session.commit()
+    assert client.get("/dashboard").status_code == 403
+
+    with app.app_context():
+        db.session.get(Trust, trust_id).is_active = True
+        conf = db.session.get(SystemConfig, "maintenance_mode") or SystemConfig(config_key="maintenance_mode")
+        conf.config_value = "true"
+        db.session.add(conf)
+        db.session.commit()
+    try:
+        assert client.get("/dashboard").status_code == 503
+    finally:
+        with app.app_context():
+            db.session.get(SystemConfig, "maintenance_mode").config_value = "false"
+            db.session.commit()
+    assert client.get("/dashboard").status_code == 200
+
+
+def test_super_admin_suspension_applies_at_once(client, app):
+    with app.app_context():
+        t = Trust(trust_name="T_LCB", trust_code="T_LCB", is_active=True)
+        db.session.add(t)
+        db.session.flush()
+        db.session.add(User(username="admin_lcb", password_hash=generate_password_hash("secret"), role="admin", trust_id_fk=t.trust_id))
+        db.session.add(User(username="super_lcb", password_hash=generate_password_hash("secret"), role="admin", is_super_admin=True))
+        db.session.commit()
+        trust_id = t.trust_id
+
+    client.post("/login", data={"username": "admin_lcb", "password": "secret"})
+    assert client.get("/dashboard").status_code == 200
+
+    # The super admin routes write through the reflected trusts table, not the ORM
+    super_client = app.test_client()
+    super_client.post("/login", data={"username": "super_lcb", "password": "secret"})
+    assert super_client.post(f"/super-admin/trusts/{trust_id}/toggle").status_code == 302
+    assert client.get("/dashboard").status_code == 403
+
+    assert super_client.post(f"/super-admin/trusts/{trust_id}/toggle").status_code == 302
+    assert client.get("/dashboard").status_code == 200
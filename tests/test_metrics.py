@@ -0,0 +1,65 @@
+import json
+
+from werkzeug.security import generate_password_hash
+
+from cms_app import cache, db, metrics
+from cms_app.models import User
+
+
+def test_key_prefixes_and_multiprocess_render(app, tmp_path, monkeypatch):
+    assert metrics.key_prefix("rc:dashboard:t1:u5:/dashboard?") == "rc:dashboard"
+    assert metrics.key_prefix("lc:trust_access:g0:3") == "lc:trust_access"
+    assert metrics.key_prefix("inbox_unread_42") == "inbox_unread"
+    assert metrics.key_prefix("scope_trust_3_g0") == "scope_trust"
+    assert metrics.key_prefix("fees_bank_details_admin") == "fees_bank_details_admin"
+
+    monkeypatch.setitem(metrics._settings, "dir", str(tmp_path))
+    monkeypatch.setitem(metrics._settings, "lock_wait_ms", 0.0)
+    # Another worker's registry, as flushed to the shared directory
+    other = [
+        ["cms_rate_limited_total", [["endpoint", "main.login"]], 3.0],
+        ["cms_http_request_duration_seconds", [["endpoint", "main.login"], ["method", "POST"], ["status", "4xx"]], [0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0.02, 1]],
+    ]
+    (tmp_path / "cms_99999_abcd1234.json").write_text(json.dumps({"pid": 99999, "series": other}))
+
+    metrics.observe_request("main.login", "POST", 429, 30.0, 2, 1.5)
+    with app.app_context():
+        cache.set("inbox_unread_7", 1)
+        cache.get("inbox_unread_7")
+        cache.get("inbox_unread_8")
+        db.session.add(User(username="metrics_lock_probe", password_hash="x", role="clerk"))
+        db.session.commit()
+        text = metrics.render()
+    metrics.flush()
+
+    assert 'cms_rate_limited_total{endpoint="main.login"} 4' in text
+    assert 'cms_http_request_duration_seconds_bucket{endpoint="main.login",method="POST",status="4xx",le="0.025"} 1' in text
+    assert 'cms_http_request_duration_seconds_bucket{endpoint="main.login",method="POST",status="4xx",le="0.05"} 2' in text
+    assert 'cms_http_request_duration_seconds_count{endpoint="main.login",method="POST",status="4xx"} 2' in text
+    assert 'cms_cache_requests_total{prefix="inbox_unread",result="hit"}' in text
+    assert 'cms_cache_requests_total{prefix="inbox_unread",result="miss"}' in text
+    assert "cms_sqlite_lock_waits_total " in text
+    assert 'cms_jobs{status="queued"} ' in text
+    assert len(list(tmp_path.glob("cms_*.json"))) == 2
+
+
+def test_metrics_endpoint_requires_token_or_admin(client, app, monkeypatch):
+    with app.app_context():
+        if not User.query.filter_by(username="admin_metrics").first():
+            db.session.add(User(username="admin_metrics", password_hash=generate_password_hash("secret"), role="admin"))
+            db.session.commit()
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", "scrape-me")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    resp = client.get("/metrics", headers={"Authorization": "Bearer scrape-me"})
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/plain"
+    assert "# TYPE cms_http_request_duration_seconds histogram" in resp.get_data(as_text=True)
+
+    client.post("/login", data={"username": "admin_metrics", "password": "secret"}, follow_redirects=True)
+    client.get("/dashboard")
+    assert client.get("/metrics").status_code == 200
+    resp = client.get("/admin/system-status")
+    assert resp.status_code == 200
+    assert b"Metrics" in resp.data
+    assert b"main.dashboard" in resp.data
@@ -0,0 +1,47 @@
+import pytest
+from flask import Response
+from sqlalchemy import select
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app.models import User
+from cms_app.query_budget import QueryBudgetExceeded, fingerprint, finish_request, hotspots, query_budget
+
+
+def test_fingerprint_collapses_literals_and_parameter_lists():
+    a = fingerprint("SELECT * FROM fee_payments WHERE student_id_fk = 12 AND status = 'paid'")
+    b = fingerprint("SELECT *  FROM fee_payments\n WHERE student_id_fk = ? AND status = 'unpaid'")
+    assert a == b == "SELECT * FROM fee_payments WHERE student_id_fk = ? AND status = ?"
+    assert fingerprint("SELECT 1 FROM t WHERE id IN (?, ?, ?)") == fingerprint("SELECT 1 FROM t WHERE id IN (?)")
+    assert fingerprint("INSERT INTO t (a, b) VALUES (?, ?), (?, ?)") == "INSERT INTO t (a, b) VALUES (?)"
+    assert fingerprint("SELECT anon_1.x FROM t1 AS anon_1") == "SELECT anon_1.x FROM t1 AS anon_1"
+
+
+def test_repeated_statements_are_flagged_and_budgets_enforced(client, app, monkeypatch):
+    with app.app_context():
+        if not User.query.filter_by(username="admin_hotspots").first():
+            db.session.add(User(username="admin_hotspots", password_hash=generate_password_hash("secret"), role="admin"))
+            db.session.commit()
+    app.extensions.pop("query_hotspots", None)
+    endpoint = "main.admin_query_hotspots"
+    monkeypatch.setitem(app.view_functions, endpoint, query_budget(queries=5)(app.view_functions[endpoint]))
+
+    with app.test_request_context("/admin/query-hotspots"):
+        app.preprocess_request()
+        for user_id in range(1, 13):
+            db.session.execute(select(User).where(User.user_id == user_id)).first()
+        with pytest.raises(QueryBudgetExceeded):
+            finish_request(app, Response())
+
+    shapes, violations = hotspots(app)
+    assert shapes[0]["endpoint"] == endpoint
+    assert shapes[0]["max_repeats"] == 12
+    assert shapes[0]["sql"].endswith("FROM users WHERE users.user_id = ?")
+    assert violations[0]["endpoint"] == endpoint
+
+    monkeypatch.setitem(app.config, "QUERY_BUDGET_MODE", "log")
+    client.post("/login", data={"username": "admin_hotspots", "password": "secret"}, follow_redirects=True)
+    resp = client.get("/admin/query-hotspots")
+    assert resp.status_code == 200
+    assert b"Query Hotspots" in resp.data
+    assert b"FROM users" in resp.data
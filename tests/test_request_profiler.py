@@ -0,0 +1,52 @@
+from collections import Counter
+
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app.models import User
+from cms_app.request_profiler import endpoint_profile, record, summary
+
+
+def test_profile_store_is_bounded(app, monkeypatch):
+    app.extensions.pop("request_profiles", None)
+    monkeypatch.setitem(app.config, "PROFILER_MAX_STACKS", 2)
+    monkeypatch.setitem(app.config, "PROFILER_MAX_ENDPOINTS", 2)
+    record(app, "main.a", "GET", "/a", 900.0, Counter({"view;x": 3, "view;y": 2}))
+    record(app, "main.a", "GET", "/a", 1100.0, Counter({"view;x": 1, "view;z": 4}))
+    assert endpoint_profile(app, "main.a") == Counter({"view;x": 4, "view;y": 2, "[other]": 4})
+
+    record(app, "main.b", "GET", "/b", 50.0, Counter({"b": 1}))
+    record(app, "main.c", "GET", "/c", 50.0, Counter({"c": 20}))
+    endpoints, captured = summary(app)
+    assert [e["endpoint"] for e in endpoints] == ["main.c", "main.a"]
+    assert endpoints[1]["requests"] == 2 and endpoints[1]["avg_ms"] == 1000.0
+    assert captured[0]["endpoint"] == "main.c"
+
+
+def test_slow_requests_are_profiled_and_downloadable(client, app, monkeypatch):
+    with app.app_context():
+        if not User.query.filter_by(username="admin_profiler").first():
+            db.session.add(User(username="admin_profiler", password_hash=generate_password_hash("secret"), role="admin"))
+            db.session.commit()
+    client.post("/login", data={"username": "admin_profiler", "password": "secret"}, follow_redirects=True)
+    app.extensions.pop("request_profiles", None)
+    monkeypatch.setenv("CMS_SLOW_REQUEST_MS", "0")
+    monkeypatch.setitem(app.config, "PROFILER_MODE", "slow")
+    monkeypatch.setitem(app.config, "PROFILER_INTERVAL_MS", 1)
+    # A fast request can finish between two samples; keep going until one is caught
+    for _ in range(50):
+        assert client.get("/admin/system-status").status_code == 200
+        if endpoint_profile(app, "main.admin_system_status"):
+            break
+    monkeypatch.setitem(app.config, "PROFILER_MODE", "off")
+
+    resp = client.get("/admin/profiles")
+    assert resp.status_code == 200
+    assert b"main.admin_system_status" in resp.data
+    resp = client.get("/admin/profiles/download", query_string={"view": "main.admin_system_status"})
+    assert resp.status_code == 200
+    assert "attachment" in resp.headers["Content-Disposition"]
+    first = resp.get_data(as_text=True).splitlines()[0]
+    assert first.startswith("full_dispatch_request (")
+    assert int(first.rsplit(" ", 1)[1]) >= 1
+    assert client.get("/admin/profiles/download", query_string={"view": "main.nope"}).status_code == 404
@@ -0,0 +1,92 @@
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app.jobs.services import claim, enqueue, execute
+from cms_app.models import Student, User
+from cms_app.result_cache import stats
+
+
+def _seed(seed_tenant, code):
+    t, (prog,) = seed_tenant(code)
+    for role in ("principal", "clerk", "admin"):
+        db.session.add(User(
+            username=f"{role}_{code.lower()}",
+            password_hash=generate_password_hash("secret"),
+            role=role,
+            trust_id_fk=t.trust_id,
+            program_id_fk=(prog.program_id if role != "admin" else None),
+        ))
+    db.session.add(Student(enrollment_no=f"{code}_1", program_id_fk=prog.program_id, trust_id_fk=t.trust_id, current_semester=1, is_active=True))
+    db.session.commit()
+    return t.trust_id, prog.program_id
+
+
+def _counts(name):
+    for r in stats()["results"]:
+        if r["name"] == name:
+            return r
+    return {"hits": 0, "misses": 0, "stale": 0, "stores": 0}
+
+
+def _total(client, url):
+    resp = client.get(url)
+    assert resp.status_code == 200
+    return resp.get_json()["data"]["total"]
+
+
+def test_report_is_shared_by_viewer_scope_and_dropped_on_commit(client, app, seed_tenant):
+    with app.app_context():
+        trust_id, program_id = _seed(seed_tenant, "RCA")
+    url = f"/api/reports/enrollment-summary?program_id={program_id}"
+
+    client.post("/login", data={"username": "principal_rca", "password": "secret"})
+    with app.test_request_context():
+        before = _counts("reports_enrollment_summary")
+    assert _total(client, url) == 1
+    client.get("/logout")
+
+    # The clerk of the same program is served the principal's result
+    client.post("/login", data={"username": "clerk_rca", "password": "secret"})
+    assert _total(client, url) == 1
+    with app.test_request_context():
+        after = _counts("reports_enrollment_summary")
+    assert after["hits"] == before["hits"] + 1 and after["stores"] == before["stores"] + 1
+
+    with app.app_context():
+        # A rolled back write keeps the result
+        db.session.add(Student(enrollment_no="RCA_2", program_id_fk=program_id, trust_id_fk=trust_id, current_semester=1, is_active=True))
+        db.session.flush()
+        db.session.rollback()
+    assert _total(client, url) == 1
+
+    with app.app_context():
+        db.session.add(Student(enrollment_no="RCA_2", program_id_fk=program_id, trust_id_fk=trust_id, current_semester=1, is_active=True))
+        db.session.commit()
+    assert _total(client, url) == 2
+    with app.test_request_context():
+        assert _counts("reports_enrollment_summary")["stale"] == after["stale"] + 1
+
+
+def test_cache_stats_page(client, app, seed_tenant):
+    with app.app_context():
+        _trust_id, program_id = _seed(seed_tenant, "RCB")
+    client.post("/login", data={"username": "admin_rcb", "password": "secret"})
+    _total(client, f"/api/reports/enrollment-summary?program_id={program_id}")
+    resp = client.get("/admin/cache-stats")
+    assert resp.status_code == 200
+    assert b"Cache Stats" in resp.data and b"reports_enrollment_summary" in resp.data
+
+
+def test_reflected_table_writes_drop_results(client, app, seed_tenant):
+    with app.app_context():
+        _trust_id, program_id = _seed(seed_tenant, "RCC")
+    url = f"/api/reports/enrollment-summary?program_id={program_id}&semester=1"
+    client.post("/login", data={"username": "principal_rcc", "password": "secret"})
+    assert _total(client, url) == 1
+
+    # Promotion updates students through the reflected table, not the ORM
+    with app.app_context():
+        job = enqueue("semester_promotion", {"program_id": program_id, "from_semester": 1, "to_semester": 2})
+        assert claim(job.job_id, "pytest")
+        execute(job.job_id)
+    assert _total(client, url) == 0
@@ -0,0 +1,24 @@
+from cms_app import db, schema_registry
+
+
+def test_reflected_table_is_cached_per_process(app):
+    with app.app_context():
+        schema_registry.invalidate()
+        first = schema_registry.reflected_table("students")
+        second = schema_registry.reflected_table("students")
+        assert first is second
+        assert "enrollment_no" in schema_registry.table_columns("students")
+
+
+def test_invalidate_forces_fresh_reflection(app):
+    with app.app_context():
+        first = schema_registry.reflected_table("students")
+        schema_registry.invalidate(table_name="students", engine=db.engine)
+        second = schema_registry.reflected_table("students")
+        assert first is not second
+
+
+def test_table_columns_missing_table_is_not_cached(app):
+    with app.app_context():
+        assert schema_registry.table_columns("no_such_table_xyz") == frozenset()
+        assert ((str(db.engine.url), "no_such_table_xyz") not in schema_registry._columns)
@@ -0,0 +1,79 @@
+from flask_login import login_user
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app.models import Division, Program, User
+from cms_app.scope import current_scope, division_ids_for, program_ids_for, reset_scope
+
+
+def _seed(seed_tenant, code):
+    t, progs = seed_tenant(code, programs=("BCA", "BBA"))
+    div = Division(program_id_fk=progs[0].program_id, semester=1, division_code="A", capacity=60)
+    db.session.add(div)
+    db.session.flush()
+    return t.trust_id, progs[0].institute_id_fk, [p.program_id for p in progs], div.division_id
+
+
+def _count_queries():
+    seen = []
+
+    def _on_execute(conn, cursor, statement, params, context, executemany):
+        seen.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", _on_execute)
+    return seen, lambda: event.remove(db.engine, "before_cursor_execute", _on_execute)
+
+
+def test_scope_is_resolved_once_and_follows_structure_changes(app, seed_tenant):
+    with app.app_context():
+        trust_id, inst_id, program_ids, division_id = _seed(seed_tenant, "SCA")
+        _other_trust, _i, other_programs, _d = _seed(seed_tenant, "SCB")
+        u = User(username="principal_sca", password_hash=generate_password_hash("secret"), role="principal", trust_id_fk=trust_id, program_id_fk=program_ids[0])
+        db.session.add(u)
+        db.session.commit()
+
+        with app.test_request_context("/"):
+            login_user(u)
+            scope = current_scope()
+            assert scope is current_scope()
+            assert scope.trust_id == trust_id and scope.principal_program_id == program_ids[0]
+            assert scope.program_ids == sorted(program_ids) and scope.division_ids == [division_id]
+            assert [p.program_name for p in scope.programs()] == ["BBA_SCA", "BCA_SCA"]
+            assert set(program_ids_for(_other_trust)) == set(other_programs)
+
+            # Later lookups in the request (and in the next one) come from the scope and the cache
+            seen, stop = _count_queries()
+            try:
+                program_ids_for(trust_id), division_ids_for(trust_id), scope.programs()
+                reset_scope()
+                assert current_scope().program_ids == sorted(program_ids)
+            finally:
+                stop()
+            assert seen == []
+
+            # Committing a new program invalidates the cached lists
+            p = Program(institute_id_fk=inst_id, program_name="MCA_SCA")
+            db.session.add(p)
+            db.session.commit()
+            assert p.program_id in current_scope().program_ids
+            assert p.program_id not in program_ids_for(_other_trust)
+
+
+def test_timetable_settings_reject_other_trust_program(client, app, seed_tenant):
+    with app.app_context():
+        trust_id, _inst, program_ids, _div = _seed(seed_tenant, "SCC")
+        _t, _i, other_programs, _d = _seed(seed_tenant, "SCD")
+        db.session.add(User(username="admin_scc", password_hash=generate_password_hash("secret"), role="admin", trust_id_fk=trust_id))
+        db.session.commit()
+
+    client.post("/login", data={"username": "admin_scc", "password": "secret"})
+    with client.session_transaction() as sess:
+        csrf = sess.get("csrf_token")
+    resp = client.post(
+        "/timetable/settings",
+        data={"program_id": other_programs[0], "academic_year": "2025-2026", "csrf_token": csrf},
+        headers={"Referer": "/timetable/manage"},
+        follow_redirects=True,
+    )
+    assert b"Unauthorized program access" in resp.data
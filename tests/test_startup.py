@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+from flask import url_for
+from werkzeug.routing import Map
+
+from cms_app.routing import LazyBuilderRule
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_url_builders_compile_on_first_use(app):
+    assert app.url_rule_class is LazyBuilderRule
+    # Flask adds its static rule in the constructor, before create_app() can swap the class
+    assert all(isinstance(r, LazyBuilderRule) for r in app.url_map.iter_rules() if r.endpoint != "static")
+    rule = LazyBuilderRule("/admin/profiles/download", endpoint="profiles")
+    adapter = Map([rule]).bind("localhost")
+    # Binding the rule must have gone through the override, or nothing is deferred
+    stub = rule._build_unknown
+    assert stub.__func__.__qualname__.startswith("LazyBuilderRule.")
+    assert adapter.build("profiles", {"view": "main.a"}) == "/admin/profiles/download?view=main.a"
+    assert adapter.build("profiles", {"view": "main.b"}) == "/admin/profiles/download?view=main.b"
+    assert rule._build_unknown is not stub
+    assert not rule._build_unknown.__func__.__qualname__.startswith("LazyBuilderRule.")
+    with app.test_request_context():
+        assert url_for("main.admin_profile_download", view="x") == "/admin/profiles/download?view=x"
+
+
+def test_worker_boot_skips_cli_only_imports(tmp_path):
+    env = dict(os.environ)
+    env.update(
+        DATABASE_URL="sqlite:///" + str(tmp_path / "boot.db").replace("\\", "/"),
+        CMS_STARTUP_SCHEMA_SYNC="0",
+        CMS_JOBS_WORKER="0",
+    )
+    env.pop("CMS_INIT_MIGRATE", None)
+    code = "import sys, app; print(' '.join(m for m in ('alembic', 'flask_migrate', 'openpyxl') if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == ""
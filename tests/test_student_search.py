@@ -0,0 +1,60 @@
+from sqlalchemy import delete, select, update
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app.models import Student, User
+from cms_app.student_search import apply_search, search_available
+
+
+def _seed(seed_tenant, code):
+    t, (p,) = seed_tenant(code)
+    db.session.add_all([
+        Student(enrollment_no=f"{code}2024001", program_id_fk=p.program_id, trust_id_fk=t.trust_id, student_name="Kavya", surname="Mehta", father_name="Rajesh", mobile="9876501234", roll_no="11", is_active=True),
+        Student(enrollment_no=f"{code}2024002", program_id_fk=p.program_id, trust_id_fk=t.trust_id, student_name="Rajesh", surname="Kavathia", father_name="Kavyesh", mobile="9123400000", is_active=True),
+        Student(enrollment_no=f"{code}2024003", program_id_fk=p.program_id, trust_id_fk=t.trust_id, student_name="Nisha", surname="Patel", is_active=True),
+    ])
+    db.session.commit()
+    return t.trust_id, p.program_id
+
+
+def _search(q, program_id):
+    query, rank = apply_search(select(Student.enrollment_no).where(Student.program_id_fk == program_id), q)
+    order = [rank] if rank is not None else []
+    return db.session.execute(query.order_by(*order, Student.enrollment_no)).scalars().all()
+
+
+def test_search_index_prefix_ranking_and_sync(app, seed_tenant):
+    with app.app_context():
+        _trust_id, program_id = _seed(seed_tenant, "FTS")
+        assert search_available()
+
+        # Prefix match on any indexed column; name hits outrank father's-name hits
+        assert sorted(_search("kav", program_id)) == ["FTS2024001", "FTS2024002"]
+        assert _search("Rajesh", program_id) == ["FTS2024002", "FTS2024001"]
+        assert _search("98765", program_id) == ["FTS2024001"]
+        assert _search("fts2024003", program_id) == ["FTS2024003"]
+        assert _search("kavya mehta", program_id) == ["FTS2024001"]
+        assert _search("zzz", program_id) == []
+
+        # Core updates, bulk inserts and deletes keep the index in sync
+        db.session.execute(update(Student).where(Student.enrollment_no == "FTS2024003").values(surname="Shah"))
+        db.session.bulk_insert_mappings(Student, [{"enrollment_no": "FTS-9", "program_id_fk": program_id, "student_name": "Shaan", "is_active": True}])
+        db.session.execute(delete(Student).where(Student.enrollment_no == "FTS2024002"))
+        db.session.commit()
+        assert _search("patel", program_id) == []
+        assert _search("sha", program_id) == ["FTS-9", "FTS2024003"]
+        assert _search("rajesh", program_id) == ["FTS2024001"]
+
+
+def test_students_search_api_uses_index(client, app, seed_tenant):
+    with app.app_context():
+        trust_id, _program_id = _seed(seed_tenant, "FTSAPI")
+        db.session.add(User(username="admin_fts", password_hash=generate_password_hash("secret"), role="admin", trust_id_fk=trust_id))
+        db.session.commit()
+    client.post("/login", data={"username": "admin_fts", "password": "secret"}, follow_redirects=True)
+
+    resp = client.get("/api/students/search?q=raj")
+    assert resp.status_code == 200
+    items = resp.get_json()["data"]["items"]
+    assert [i["enrollment_no"] for i in items] == ["FTSAPI2024002", "FTSAPI2024001"]
+    assert items[0]["name"] == "Kavathia Rajesh" and items[0]["program_name"] == "P_FTSAPI"
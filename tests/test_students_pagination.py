@@ -0,0 +1,84 @@
+import re
+
+from sqlalchemy import func, select
+from werkzeug.security import generate_password_hash
+
+from cms_app import db
+from cms_app.models import Student, User
+from cms_app.pagination import cached_count, decode_cursor, encode_cursor, keyset_page
+
+
+def _seed(seed_tenant, code, n):
+    t, (p,) = seed_tenant(code)
+    for i in range(n):
+        db.session.add(Student(
+            enrollment_no=f"{code}_{i:03d}",
+            program_id_fk=p.program_id,
+            trust_id_fk=t.trust_id,
+            student_name=f"N{i % 4}",
+            surname=None if i % 5 == 0 else f"S{i % 3}",
+            roll_no=None if i % 7 == 0 else str(n - i),
+            current_semester=1 + i % 3,
+            is_active=True,
+        ))
+    db.session.commit()
+    return t.trust_id, p.program_id
+
+
+def test_keyset_page_walks_mixed_orders_both_ways(app, seed_tenant):
+    with app.app_context():
+        _trust_id, program_id = _seed(seed_tenant, "KSET", 23)
+        query = select(Student.enrollment_no).where(Student.program_id_fk == program_id)
+        orders = [
+            [(func.coalesce(Student.current_semester, 0), True), (Student.enrollment_no, False)],
+            [(func.coalesce(Student.surname, ""), False), (func.coalesce(Student.student_name, ""), False), (Student.enrollment_no, False)],
+        ]
+        for keys in orders:
+            expected = db.session.execute(query.order_by(*[(e.desc() if d else e.asc()) for e, d in keys])).scalars().all()
+            pages, cursor = [], None
+            while True:
+                rows, cursor, prev = keyset_page(query, keys, 5, after=cursor)
+                assert (prev is None) == (not pages)
+                pages.append([r.enrollment_no for r in rows])
+                if cursor is None:
+                    break
+            assert [e for page in pages for e in page] == expected
+            assert [len(p) for p in pages] == [5, 5, 5, 5, 3]
+
+            # Walk back from the last page using "before" cursors
+            rows, _next, prev = keyset_page(query, keys, 5, offset=20)
+            for page in reversed(pages[:-1]):
+                rows, _next, prev = keyset_page(query, keys, 5, before=prev)
+                assert [r.enrollment_no for r in rows] == page
+            assert prev is None
+
+        assert cached_count(query, prefix="test_count") == 23
+        db.session.add(Student(enrollment_no="KSET_999", program_id_fk=program_id, is_active=True))
+        db.session.commit()
+        assert cached_count(query, prefix="test_count") == 23
+        assert decode_cursor(encode_cursor([3, "a"]), 2) == [3, "a"]
+        assert decode_cursor("not-a-cursor", 2) is None
+
+
+def test_students_page_follows_cursors(client, app, seed_tenant):
+    with app.app_context():
+        trust_id, program_id = _seed(seed_tenant, "KLIST", 12)
+        db.session.add(User(username="admin_klist", password_hash=generate_password_hash("secret"), role="admin", trust_id_fk=trust_id))
+        db.session.commit()
+    client.post("/login", data={"username": "admin_klist", "password": "secret"}, follow_redirects=True)
+
+    seen = []
+    url = f"/students?program_id={program_id}&sort_by=enrollment&limit=5&medium=all"
+    for page in (1, 2, 3):
+        resp = client.get(url)
+        assert resp.status_code == 200
+        html = resp.get_data(as_text=True)
+        seen += sorted(set(re.findall(r"KLIST_\d{3}", html)))
+        assert "of 12" in html
+        match = re.search(r'href="([^"]*after=[^"]*)"', html)
+        if page < 3:
+            url = match.group(1).replace("&amp;", "&")
+            assert f"page={page + 1}" in url
+        else:
+            assert match is None
+    assert seen == [f"KLIST_{i:03d}" for i in range(12)]
@@ -0,0 +1,55 @@
+from sqlalchemy import event, select
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from cms_app import db
+from cms_app.models import User
+from cms_app.user_provisioning import hash_passwords, provision_users, student_credentials
+
+
+def test_student_credentials_prefers_mobile():
+    assert student_credentials("E1", "+91 98765-43210") == ("919876543210", "919876543210", "919876543210")
+    assert student_credentials("E1", "12345") == ("E1", "E1", "12345")
+    assert student_credentials("E1", None) == ("E1", "E1", "")
+
+
+def test_hash_passwords_parallel_keeps_order():
+    passwords = [f"pw{i}" for i in range(20)]
+    hashes = hash_passwords(passwords, workers=4)
+    assert all(check_password_hash(h, p) for h, p in zip(hashes, passwords))
+
+
+def test_provision_users_bulk_creates_and_refreshes(app):
+    with app.app_context():
+        db.session.add(User(username="prov_existing", password_hash=generate_password_hash("old"), role="student", is_active=False))
+        db.session.commit()
+
+        specs = [{"username": f"prov_new_{i}", "password": f"pw{i}", "mobile": f"90000000{i:02d}"} for i in range(30)]
+        specs.append({"username": "prov_existing", "password": "ignored", "mobile": "9111111111"})
+        specs.append({"username": "prov_new_0", "password": "duplicate"})
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            result = provision_users(specs, chunk_size=20)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+        db.session.commit()
+
+        assert (result["created"], result["updated"]) == (30, 1)
+        assert len(result["user_ids"]) == 31
+        # prefetch (2 chunks) + update + 2 x (insert + id lookup)
+        assert len(statements) <= 8
+
+        new_user = db.session.execute(select(User).filter_by(username="prov_new_0")).scalars().one()
+        assert new_user.user_id == result["user_ids"]["prov_new_0"]
+        assert check_password_hash(new_user.password_hash, "pw0")
+        assert (new_user.role, new_user.must_change_password, new_user.mobile) == ("student", True, "9000000000")
+
+        existing = db.session.execute(select(User).filter_by(username="prov_existing")).scalars().one()
+        assert existing.is_active and existing.mobile == "9111111111"
+        assert check_password_hash(existing.password_hash, "old")
+
+        provision_users([{"username": "prov_existing", "password": "fresh", "role": "student"}], reset_password=True)
+        db.session.commit()
+        assert check_password_hash(db.session.get(User, existing.user_id).password_hash, "fresh")